@@ -33,6 +33,9 @@ setup(
     },
     install_requires=['biopython', 'colorlog', 'Jinja2', 'lxml',
                       'pandas>=0.21.0'],
+    extras_require={
+        'arrow': ['pyarrow'],
+    },
     classifiers=[
         'Development Status :: 5 - Production/Stable',
         'Environment :: Console',
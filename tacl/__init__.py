@@ -1,14 +1,20 @@
 from . import constants
+from .batch import BatchQueryRunner
 from .catalogue import Catalogue
 from .corpus import Corpus
 from .data_store import DataStore
 from .highlighter import NgramHighlightReport
 from .highlighter import ResultsHighlightReport
 from .jitc import JitCReport
+from .profiler import QueryProfiler
 from .results import Results
 from .sequence import SequenceReport
+from .server import QueryClient
+from .server import QueryServer
+from .sketch import NGramSketch
 from .statistics_report import StatisticsReport
 from .stripper import Stripper
+from .suffix_array import SuffixArray
 from .tei_corpus import TEICorpusCBETAGitHub
 from .text import FilteredWitnessText
 from .text import Text
@@ -0,0 +1,234 @@
+"""Module containing the BatchQueryRunner class."""
+
+import json
+import logging
+import multiprocessing
+import os.path
+
+from . import constants
+from .catalogue import Catalogue
+from .data_store import DataStore
+from .exceptions import MalformedManifestError, TACLError
+
+
+class BatchQueryRunner:
+
+    """Runs the queries listed in a manifest against a single
+    `DataStore`.
+
+    Each catalogue named in the manifest is loaded once, and each
+    witness labelled in any of them is validated once, before any
+    query is run. Run serially, all of the queries share the one
+    database connection, and with it its cache and prepared
+    statements.
+
+    """
+
+    # Arguments that each type of query must be given in the
+    # manifest, beyond its type and output path.
+    _REQUIRED_ARGUMENTS = {
+        constants.QUERY_COUNTS: ['catalogue'],
+        constants.QUERY_DIFF: ['catalogue'],
+        constants.QUERY_INTERSECT: ['catalogue'],
+        constants.QUERY_SEARCH: ['catalogue', 'ngrams'],
+        constants.QUERY_SUPPLIED_DIFF: ['labels', 'supplied'],
+        constants.QUERY_SUPPLIED_INTERSECT: ['labels', 'supplied'],
+    }
+
+    # Arguments that each type of query may be given in the manifest,
+    # beyond its required arguments.
+    _QUERY_ARGUMENTS = ('min_size', 'max_size', 'sort') + \
+        constants.NGRAM_LIMIT_ARGUMENTS + constants.LABEL_COUNT_ARGUMENTS
+    _OPTIONAL_ARGUMENTS = {
+        constants.QUERY_COUNTS: (),
+        constants.QUERY_DIFF: _QUERY_ARGUMENTS + ('asymmetric',),
+        constants.QUERY_INTERSECT: _QUERY_ARGUMENTS + ('engine',),
+        constants.QUERY_SEARCH: _QUERY_ARGUMENTS + ('patterns',),
+        constants.QUERY_SUPPLIED_DIFF: _QUERY_ARGUMENTS,
+        constants.QUERY_SUPPLIED_INTERSECT: _QUERY_ARGUMENTS,
+    }
+
+    def __init__(self, store, corpus, tokenizer):
+        self._logger = logging.getLogger(__name__)
+        self._store = store
+        self._corpus = corpus
+        self._tokenizer = tokenizer
+
+    def load(self, path):
+        """Returns the queries listed in the manifest at `path`.
+
+        Relative paths in the manifest are made relative to the
+        directory containing it, and the catalogues and n-grams it
+        names are loaded.
+
+        :param path: path to manifest
+        :type path: `str`
+        :rtype: `list` of `dict`
+
+        """
+        with open(path, encoding='utf-8') as fh:
+            try:
+                manifest = json.load(fh)
+            except ValueError:
+                raise MalformedManifestError(
+                    constants.MANIFEST_NOT_LIST_ERROR)
+        if not isinstance(manifest, list) or \
+           not all(isinstance(query, dict) for query in manifest):
+            raise MalformedManifestError(constants.MANIFEST_NOT_LIST_ERROR)
+        base_dir = os.path.dirname(os.path.abspath(path))
+        catalogues = {}
+        queries = []
+        for number, query in enumerate(manifest, 1):
+            query_type = query.get('type')
+            if query_type not in self._REQUIRED_ARGUMENTS:
+                raise MalformedManifestError(
+                    constants.MANIFEST_UNKNOWN_QUERY_ERROR.format(
+                        number, query_type))
+            required = ['output'] + self._REQUIRED_ARGUMENTS[query_type]
+            for argument in required:
+                if argument not in query:
+                    raise MalformedManifestError(
+                        constants.MANIFEST_MISSING_ARGUMENT_ERROR.format(
+                            number, argument))
+            # An argument that is misspelt, or named as for the
+            # command line, would otherwise be silently ignored.
+            allowed = set(['type'] + required +
+                          list(self._OPTIONAL_ARGUMENTS[query_type]))
+            for argument in sorted(query):
+                if argument not in allowed:
+                    raise MalformedManifestError(
+                        constants.MANIFEST_UNKNOWN_ARGUMENT_ERROR.format(
+                            number, argument))
+            query = dict(query)
+            query['output'] = os.path.join(base_dir, query['output'])
+            if 'catalogue' in query:
+                catalogue_path = os.path.join(base_dir, query['catalogue'])
+                if catalogue_path not in catalogues:
+                    catalogue = Catalogue()
+                    catalogue.load(catalogue_path)
+                    catalogues[catalogue_path] = catalogue
+                query['catalogue'] = catalogues[catalogue_path]
+            if 'ngrams' in query:
+                ngrams_path = os.path.join(base_dir, query['ngrams'])
+                with open(ngrams_path, encoding='utf-8') as fh:
+                    query['ngrams'] = [ngram.strip() for ngram in fh]
+            if 'supplied' in query:
+                query['supplied'] = [os.path.join(base_dir, results_path)
+                                     for results_path in query['supplied']]
+            queries.append(query)
+        return queries
+
+    def run(self, queries, validate=True, jobs=1):
+        """Runs `queries`, writing the results of each to its output
+        file.
+
+        If `jobs` is greater than 1, that many queries are run at
+        once, each in a worker process with its own read-only
+        connection to the database.
+
+        :param queries: queries to run
+        :type queries: `list` of `dict`
+        :param validate: whether to validate the labelled witnesses
+                         against the corpus
+        :type validate: `bool`
+        :param jobs: number of queries to run at once
+        :type jobs: `int`
+
+        """
+        if jobs > 1 and not self._store._read_only:
+            raise TACLError(constants.JOBS_READ_ONLY_ERROR)
+        if validate:
+            self._validate(queries)
+        if jobs > 1:
+            self._logger.info('Running {} queries in {} processes'.format(
+                len(queries), jobs))
+            with multiprocessing.Pool(
+                    jobs, _initialise_worker,
+                    (self._store._db_name, self._store._results_format,
+                     self._tokenizer)) as pool:
+                for output in pool.imap_unordered(_run_worker_query,
+                                                  queries):
+                    self._logger.info('Wrote {}'.format(output))
+        else:
+            for query in queries:
+                output = _run_query(self._store, self._tokenizer, query)
+                self._logger.info('Wrote {}'.format(output))
+
+    def _validate(self, queries):
+        """Validates each witness labelled in any of `queries` against
+        the corpus, once."""
+        catalogue = Catalogue()
+        for query in queries:
+            catalogue.update(query.get('catalogue', {}))
+        self._store.validate(self._corpus, catalogue)
+
+
+# The DataStore and Tokenizer used by a worker process of
+# `BatchQueryRunner.run`.
+_worker_store = None
+_worker_tokenizer = None
+
+
+def _initialise_worker(db_name, results_format, tokenizer):
+    global _worker_store, _worker_tokenizer
+    _worker_store = DataStore(db_name, read_only=True,
+                              results_format=results_format)
+    _worker_tokenizer = tokenizer
+
+
+def _run_worker_query(query):
+    return _run_query(_worker_store, _worker_tokenizer, query)
+
+
+def _run_query(store, tokenizer, query):
+    """Runs `query` against `store`, and returns the path of the file
+    its results are written to.
+
+    :param store: data store to query
+    :type store: `DataStore`
+    :param tokenizer: tokenizer for the n-grams
+    :type tokenizer: `Tokenizer`
+    :param query: query to run
+    :type query: `dict`
+    :rtype: `str`
+
+    """
+    query_type = query['type']
+    catalogue = query.get('catalogue')
+    minimum = query.get('min_size')
+    maximum = query.get('max_size')
+    # Keyword arguments to every type of query but counts.
+    arguments = {name: query.get(name)
+                 for name in constants.NGRAM_LIMIT_ARGUMENTS}
+    arguments.update((name, query.get(name, False))
+                     for name in constants.LABEL_COUNT_ARGUMENTS)
+    arguments['sort'] = query.get('sort', False)
+    if store._results_format == constants.RESULTS_FORMAT_CSV:
+        fh = open(query['output'], 'w', encoding='utf-8', newline='')
+    else:
+        fh = open(query['output'], 'wb')
+    with fh:
+        if query_type == constants.QUERY_COUNTS:
+            store.counts(catalogue, fh)
+        elif query_type == constants.QUERY_DIFF:
+            if query.get('asymmetric'):
+                store.diff_asymmetric(catalogue, query['asymmetric'],
+                                      tokenizer, fh, minimum, maximum,
+                                      **arguments)
+            else:
+                store.diff(catalogue, tokenizer, fh, minimum, maximum,
+                           **arguments)
+        elif query_type == constants.QUERY_INTERSECT:
+            engine = query.get('engine', constants.INTERSECT_ENGINE_NESTED)
+            store.intersection(catalogue, fh, minimum, maximum, engine,
+                               **arguments)
+        elif query_type == constants.QUERY_SEARCH:
+            store.search(catalogue, query['ngrams'], fh, minimum, maximum,
+                         query.get('patterns', False), **arguments)
+        elif query_type == constants.QUERY_SUPPLIED_DIFF:
+            store.diff_supplied(query['supplied'], query['labels'],
+                                tokenizer, fh, minimum, maximum, **arguments)
+        elif query_type == constants.QUERY_SUPPLIED_INTERSECT:
+            store.intersection_supplied(query['supplied'], query['labels'],
+                                        fh, minimum, maximum, **arguments)
+    return query['output']
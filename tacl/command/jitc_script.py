@@ -26,7 +26,8 @@ def main():
     catalogue = utils.get_catalogue(args)
     tokenizer = utils.get_tokenizer(args)
     check_catalogue(catalogue, args.label)
-    store.validate(corpus, catalogue)
+    if not args.no_validate:
+        store.validate(corpus, catalogue)
     output_dir = os.path.abspath(args.output)
     if os.path.exists(output_dir):
         logger.warning('Output directory already exists; any results therein '
@@ -53,6 +54,9 @@ def generate_parser():
     utils.add_db_arguments(parser)
     utils.add_corpus_arguments(parser)
     utils.add_query_arguments(parser)
+    utils.add_cache_argument(parser)
+    utils.add_read_only_argument(parser)
+    utils.add_validate_argument(parser)
     parser.add_argument('label', help=constants.JITC_LABEL_HELP,
                         metavar='LABEL')
     parser.add_argument('output', help=constants.REPORT_OUTPUT_HELP,
@@ -2,7 +2,6 @@
 texts."""
 
 import argparse
-import io
 import os
 import sys
 
@@ -31,11 +30,7 @@ def main():
 
 
 def align_results(args, parser):
-    if args.results == '-':
-        results = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8',
-                                   newline='')
-    else:
-        results = open(args.results, 'r', encoding='utf-8', newline='')
+    results = utils.get_results_input(args.results)
     tokenizer = utils.get_tokenizer(args)
     corpus = tacl.Corpus(args.corpus, tokenizer)
     report = tacl.SequenceReport(corpus, tokenizer, results)
@@ -78,20 +73,24 @@ def generate_parser():
         formatter_class=ParagraphFormatter)
     subparsers = parser.add_subparsers(title='subcommands')
     generate_align_subparser(subparsers)
+    generate_batch_subparser(subparsers)
     generate_catalogue_subparser(subparsers)
     generate_counts_subparser(subparsers)
     generate_diff_subparser(subparsers)
     generate_excise_subparser(subparsers)
     generate_highlight_subparser(subparsers)
     generate_intersect_subparser(subparsers)
+    generate_ngram_stats_subparser(subparsers)
     generate_ngrams_subparser(subparsers)
     generate_prepare_subparser(subparsers)
     generate_results_subparser(subparsers)
     generate_supplied_diff_subparser(subparsers)
     generate_search_subparser(subparsers)
+    generate_serve_subparser(subparsers)
     generate_supplied_intersect_subparser(subparsers)
     generate_statistics_subparser(subparsers)
     generate_strip_subparser(subparsers)
+    generate_upgrade_subparser(subparsers)
     return parser
 
 
@@ -113,6 +112,28 @@ def generate_align_subparser(subparsers):
                         metavar='RESULTS')
 
 
+def generate_batch_subparser(subparsers):
+    """Adds a sub-command parser to `subparsers` to run the queries
+    listed in a manifest."""
+    parser = subparsers.add_parser(
+        'batch', description=constants.BATCH_DESCRIPTION,
+        epilog=constants.BATCH_EPILOG, formatter_class=ParagraphFormatter,
+        help=constants.BATCH_HELP)
+    parser.set_defaults(func=run_batch)
+    utils.add_common_arguments(parser)
+    parser.add_argument('-j', '--jobs', default=1, dest='jobs',
+                        help=constants.BATCH_JOBS_HELP, metavar='JOBS',
+                        type=int)
+    utils.add_db_arguments(parser)
+    utils.add_corpus_arguments(parser)
+    utils.add_cache_argument(parser)
+    utils.add_read_only_argument(parser)
+    utils.add_results_format_argument(parser)
+    utils.add_validate_argument(parser)
+    parser.add_argument('manifest', help=constants.BATCH_MANIFEST_HELP,
+                        metavar='MANIFEST')
+
+
 def generate_catalogue(args, parser):
     """Generates and saves a catalogue file."""
     catalogue = tacl.Catalogue()
@@ -148,6 +169,11 @@ def generate_counts_subparser(subparsers):
     utils.add_db_arguments(parser)
     utils.add_corpus_arguments(parser)
     utils.add_query_arguments(parser)
+    utils.add_profile_argument(parser)
+    utils.add_read_only_argument(parser)
+    utils.add_results_format_argument(parser)
+    utils.add_server_argument(parser)
+    utils.add_validate_argument(parser)
 
 
 def generate_diff_subparser(subparsers):
@@ -161,10 +187,23 @@ def generate_diff_subparser(subparsers):
     group = parser.add_mutually_exclusive_group()
     group.add_argument('-a', '--asymmetric', help=constants.ASYMMETRIC_HELP,
                        metavar='LABEL')
+    group.add_argument('--asymmetric-all', help=constants.ASYMMETRIC_ALL_HELP,
+                       metavar='DIRECTORY')
     utils.add_common_arguments(parser)
+    utils.add_size_arguments(parser)
+    utils.add_query_jobs_argument(parser)
+    utils.add_ngram_limit_arguments(parser)
+    utils.add_label_count_arguments(parser)
     utils.add_db_arguments(parser)
     utils.add_corpus_arguments(parser)
     utils.add_query_arguments(parser)
+    utils.add_cache_argument(parser)
+    utils.add_profile_argument(parser)
+    utils.add_read_only_argument(parser)
+    utils.add_results_format_argument(parser)
+    utils.add_server_argument(parser)
+    utils.add_sort_argument(parser)
+    utils.add_validate_argument(parser)
 
 
 def generate_excise_subparser(subparsers):
@@ -220,9 +259,43 @@ def generate_intersect_subparser(subparsers):
         help=constants.INTERSECT_HELP)
     parser.set_defaults(func=ngram_intersection)
     utils.add_common_arguments(parser)
+    parser.add_argument('--engine', choices=constants.INTERSECT_ENGINE_CHOICES,
+                        default=constants.INTERSECT_ENGINE_NESTED,
+                        help=constants.INTERSECT_ENGINE_HELP)
+    utils.add_size_arguments(parser)
+    utils.add_query_jobs_argument(parser)
+    utils.add_ngram_limit_arguments(parser)
+    utils.add_label_count_arguments(parser)
     utils.add_db_arguments(parser)
     utils.add_corpus_arguments(parser)
     utils.add_query_arguments(parser)
+    utils.add_cache_argument(parser)
+    utils.add_profile_argument(parser)
+    utils.add_read_only_argument(parser)
+    utils.add_results_format_argument(parser)
+    utils.add_server_argument(parser)
+    utils.add_sort_argument(parser)
+    utils.add_validate_argument(parser)
+
+
+def generate_ngram_stats_subparser(subparsers):
+    """Adds a sub-command parser to `subparsers` to list the
+    corpus-wide statistics of each n-gram."""
+    parser = subparsers.add_parser(
+        'ngram-stats', description=constants.NGRAM_STATS_DESCRIPTION,
+        epilog=constants.NGRAM_STATS_EPILOG,
+        formatter_class=ParagraphFormatter, help=constants.NGRAM_STATS_HELP)
+    parser.set_defaults(func=ngram_stats)
+    utils.add_common_arguments(parser)
+    utils.add_db_arguments(parser)
+    parser.add_argument('--min-size', dest='min_size',
+                        help=constants.NGRAM_STATS_MINIMUM_SIZE_HELP,
+                        metavar='SIZE', type=int)
+    parser.add_argument('--max-size', dest='max_size',
+                        help=constants.NGRAM_STATS_MAXIMUM_SIZE_HELP,
+                        metavar='SIZE', type=int)
+    utils.add_read_only_argument(parser)
+    utils.add_results_format_argument(parser)
 
 
 def generate_ngrams(args, parser):
@@ -233,7 +306,9 @@ def generate_ngrams(args, parser):
         catalogue = utils.get_catalogue(args)
     else:
         catalogue = None
-    store.add_ngrams(corpus, args.min_size, args.max_size, catalogue)
+    store.add_ngrams(corpus, args.min_size, args.max_size, catalogue,
+                     args.jobs, args.batch_size, args.layout, args.index,
+                     args.pattern_index)
 
 
 def generate_ngrams_subparser(subparsers):
@@ -245,9 +320,25 @@ def generate_ngrams_subparser(subparsers):
         help=constants.NGRAMS_HELP)
     parser.set_defaults(func=generate_ngrams)
     utils.add_common_arguments(parser)
+    parser.add_argument('-b', '--batch-size', dest='batch_size',
+                        default=constants.NGRAMS_BATCH_SIZE,
+                        help=constants.NGRAMS_BATCH_SIZE_HELP,
+                        metavar='BATCH_SIZE', type=int)
     parser.add_argument('-c', '--catalogue', dest='catalogue',
                         help=constants.NGRAMS_CATALOGUE_HELP,
                         metavar='CATALOGUE')
+    parser.add_argument('--index', choices=constants.INDEX_CHOICES,
+                        default=constants.INDEX_NGRAM,
+                        help=constants.NGRAMS_INDEX_HELP)
+    parser.add_argument('-j', '--jobs', default=1, dest='jobs',
+                        help=constants.NGRAMS_JOBS_HELP, metavar='JOBS',
+                        type=int)
+    parser.add_argument('--layout', choices=constants.LAYOUT_CHOICES,
+                        default=constants.LAYOUT_HEAP,
+                        help=constants.NGRAMS_LAYOUT_HELP)
+    parser.add_argument('--pattern-index', action='store_true',
+                        dest='pattern_index',
+                        help=constants.NGRAMS_PATTERN_INDEX_HELP)
     utils.add_db_arguments(parser)
     utils.add_corpus_arguments(parser)
     parser.add_argument('min_size', help=constants.NGRAMS_MINIMUM_HELP,
@@ -296,6 +387,7 @@ def generate_results_subparser(subparsers):
                         help=constants.RESULTS_EXTEND_HELP, metavar='CORPUS')
     parser.add_argument('--excise', help=constants.RESULTS_EXCISE_HELP,
                         metavar='NGRAM', type=str)
+    utils.add_results_format_argument(parser)
     parser.add_argument('--min-count', dest='min_count',
                         help=constants.RESULTS_MINIMUM_COUNT_HELP,
                         metavar='COUNT', type=int)
@@ -360,13 +452,42 @@ def generate_search_subparser(subparsers):
         formatter_class=ParagraphFormatter, help=constants.SEARCH_HELP)
     parser.set_defaults(func=search_texts)
     utils.add_common_arguments(parser)
+    parser.add_argument('--patterns', action='store_true',
+                        help=constants.SEARCH_PATTERNS_HELP)
+    utils.add_size_arguments(parser)
+    utils.add_ngram_limit_arguments(parser)
+    utils.add_label_count_arguments(parser)
     utils.add_db_arguments(parser)
     utils.add_corpus_arguments(parser)
     utils.add_query_arguments(parser)
+    utils.add_profile_argument(parser)
+    utils.add_read_only_argument(parser)
+    utils.add_results_format_argument(parser)
+    utils.add_server_argument(parser)
+    utils.add_sort_argument(parser)
+    utils.add_validate_argument(parser)
     parser.add_argument('ngrams', help=constants.SEARCH_NGRAMS_HELP,
                         metavar='NGRAMS')
 
 
+def generate_serve_subparser(subparsers):
+    """Adds a sub-command parser to `subparsers` to run queries
+    against a database kept open."""
+    parser = subparsers.add_parser(
+        'serve', description=constants.SERVE_DESCRIPTION,
+        epilog=constants.SERVE_EPILOG, formatter_class=ParagraphFormatter,
+        help=constants.SERVE_HELP)
+    parser.set_defaults(func=serve_queries)
+    utils.add_common_arguments(parser)
+    parser.add_argument('-p', '--port', default=constants.SERVE_DEFAULT_PORT,
+                        help=constants.SERVE_PORT_HELP, type=int)
+    utils.add_db_arguments(parser)
+    utils.add_corpus_arguments(parser)
+    utils.add_cache_argument(parser)
+    utils.add_read_only_argument(parser)
+    utils.add_validate_argument(parser)
+
+
 def generate_statistics(args, parser):
     corpus = utils.get_corpus(args)
     tokenizer = utils.get_tokenizer(args)
@@ -413,8 +534,15 @@ def generate_supplied_diff_subparser(subparsers):
     parser.set_defaults(func=supplied_diff)
     utils.add_common_arguments(parser)
     utils.add_tokenizer_argument(parser)
+    utils.add_size_arguments(parser)
+    utils.add_ngram_limit_arguments(parser)
+    utils.add_label_count_arguments(parser)
     utils.add_db_arguments(parser, True)
     utils.add_supplied_query_arguments(parser)
+    utils.add_profile_argument(parser)
+    utils.add_read_only_argument(parser)
+    utils.add_results_format_argument(parser)
+    utils.add_sort_argument(parser)
 
 
 def generate_supplied_intersect_subparser(subparsers):
@@ -427,8 +555,27 @@ def generate_supplied_intersect_subparser(subparsers):
         help=constants.SUPPLIED_INTERSECT_HELP)
     parser.set_defaults(func=supplied_intersect)
     utils.add_common_arguments(parser)
+    utils.add_size_arguments(parser)
+    utils.add_ngram_limit_arguments(parser)
+    utils.add_label_count_arguments(parser)
     utils.add_db_arguments(parser, True)
     utils.add_supplied_query_arguments(parser)
+    utils.add_profile_argument(parser)
+    utils.add_read_only_argument(parser)
+    utils.add_results_format_argument(parser)
+    utils.add_sort_argument(parser)
+
+
+def generate_upgrade_subparser(subparsers):
+    """Adds a sub-command parser to `subparsers` to upgrade a
+    database to the current schema."""
+    parser = subparsers.add_parser(
+        'upgrade', description=constants.UPGRADE_DESCRIPTION,
+        epilog=constants.UPGRADE_EPILOG, formatter_class=ParagraphFormatter,
+        help=constants.UPGRADE_HELP)
+    parser.set_defaults(func=upgrade_database)
+    utils.add_common_arguments(parser)
+    utils.add_db_arguments(parser)
 
 
 def highlight_text(args, parser):
@@ -460,34 +607,96 @@ def highlight_text(args, parser):
 
 def ngram_counts(args, parser):
     """Outputs the results of performing a counts query."""
+    catalogue = utils.get_catalogue(args)
+    if args.server:
+        client = utils.get_query_client(args)
+        client.query(constants.QUERY_COUNTS, args.db, catalogue,
+                     sys.stdout, validate=not args.no_validate)
+        return
     store = utils.get_data_store(args)
     corpus = utils.get_corpus(args)
-    catalogue = utils.get_catalogue(args)
-    store.validate(corpus, catalogue)
-    store.counts(catalogue, sys.stdout)
+    if not args.no_validate:
+        store.validate(corpus, catalogue)
+    store.counts(catalogue, utils.get_results_output(args))
+    utils.write_profile(args, store)
+
+
+def ngram_stats(args, parser):
+    """Outputs the corpus-wide statistics of each n-gram."""
+    store = utils.get_data_store(args)
+    store.ngram_stats(utils.get_results_output(args), args.min_size,
+                      args.max_size)
 
 
 def ngram_diff(args, parser):
     """Outputs the results of performing a diff query."""
+    catalogue = utils.get_catalogue(args)
+    if args.server:
+        if args.asymmetric_all:
+            raise TACLError(constants.SERVER_ASYMMETRIC_ALL_ERROR)
+        client = utils.get_query_client(args)
+        client.query(constants.QUERY_DIFF, args.db, catalogue,
+                     sys.stdout, validate=not args.no_validate,
+                     tokenizer=args.tokenizer, asymmetric=args.asymmetric,
+                     min_size=args.min_size, max_size=args.max_size,
+                     jobs=args.jobs, sort=args.sort,
+                     **utils.get_ngram_limits(args),
+                     **utils.get_label_counts(args))
+        return
     store = utils.get_data_store(args)
     corpus = utils.get_corpus(args)
-    catalogue = utils.get_catalogue(args)
     tokenizer = utils.get_tokenizer(args)
-    store.validate(corpus, catalogue)
+    if not args.no_validate:
+        store.validate(corpus, catalogue)
+    limits = utils.get_ngram_limits(args)
+    label_counts = utils.get_label_counts(args)
+    if args.asymmetric_all:
+        output_fhs = utils.get_label_results_outputs(
+            args, args.asymmetric_all, catalogue.labels)
+        try:
+            store.diff_asymmetric_all(catalogue, tokenizer, output_fhs,
+                                      args.min_size, args.max_size,
+                                      args.jobs, sort=args.sort, **limits,
+                                      **label_counts)
+        finally:
+            for output_fh in output_fhs.values():
+                output_fh.close()
+        utils.write_profile(args, store)
+        return
+    output_fh = utils.get_results_output(args)
     if args.asymmetric:
         store.diff_asymmetric(catalogue, args.asymmetric, tokenizer,
-                              sys.stdout)
+                              output_fh, args.min_size, args.max_size,
+                              args.jobs, sort=args.sort, **limits,
+                              **label_counts)
     else:
-        store.diff(catalogue, tokenizer, sys.stdout)
+        store.diff(catalogue, tokenizer, output_fh, args.min_size,
+                   args.max_size, args.jobs, sort=args.sort, **limits,
+                   **label_counts)
+    utils.write_profile(args, store)
 
 
 def ngram_intersection(args, parser):
     """Outputs the results of performing an intersection query."""
+    catalogue = utils.get_catalogue(args)
+    if args.server:
+        client = utils.get_query_client(args)
+        client.query(constants.QUERY_INTERSECT, args.db, catalogue,
+                     sys.stdout, validate=not args.no_validate,
+                     engine=args.engine, min_size=args.min_size,
+                     max_size=args.max_size, jobs=args.jobs,
+                     sort=args.sort, **utils.get_ngram_limits(args),
+                     **utils.get_label_counts(args))
+        return
     store = utils.get_data_store(args)
     corpus = utils.get_corpus(args)
-    catalogue = utils.get_catalogue(args)
-    store.validate(corpus, catalogue)
-    store.intersection(catalogue, sys.stdout)
+    if not args.no_validate:
+        store.validate(corpus, catalogue)
+    store.intersection(catalogue, utils.get_results_output(args),
+                       args.min_size, args.max_size, args.engine, args.jobs,
+                       sort=args.sort, **utils.get_ngram_limits(args),
+                       **utils.get_label_counts(args))
+    utils.write_profile(args, store)
 
 
 def prepare_xml(args, parser):
@@ -506,11 +715,7 @@ def prepare_xml(args, parser):
 
 
 def results(args, parser):
-    if args.results == '-':
-        results_fh = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8',
-                                      newline='')
-    else:
-        results_fh = open(args.results, 'r', encoding='utf-8', newline='')
+    results_fh = utils.get_results_input(args.results)
     tokenizer = utils.get_tokenizer(args)
     results = tacl.Results(results_fh, tokenizer)
     if args.extend:
@@ -561,17 +766,57 @@ def results(args, parser):
         results.group_by_witness()
     if args.collapse_witnesses:
         results.collapse_witnesses()
-    results.csv(sys.stdout)
+    results.write(utils.get_results_output(args), args.results_format)
 
 
-def search_texts(args, parser):
-    """Searches texts for presence of n-grams."""
+def run_batch(args, parser):
+    """Runs the queries listed in a manifest."""
     store = utils.get_data_store(args)
     corpus = utils.get_corpus(args)
+    tokenizer = utils.get_tokenizer(args)
+    runner = tacl.BatchQueryRunner(store, corpus, tokenizer)
+    queries = runner.load(args.manifest)
+    runner.run(queries, not args.no_validate, args.jobs)
+
+
+def search_texts(args, parser):
+    """Searches texts for presence of n-grams."""
     catalogue = utils.get_catalogue(args)
-    store.validate(corpus, catalogue)
     ngrams = utils.get_ngrams(args.ngrams)
-    store.search(catalogue, ngrams, sys.stdout)
+    if args.server:
+        client = utils.get_query_client(args)
+        client.query(constants.QUERY_SEARCH, args.db, catalogue,
+                     sys.stdout, validate=not args.no_validate,
+                     ngrams=ngrams, min_size=args.min_size,
+                     max_size=args.max_size, patterns=args.patterns,
+                     sort=args.sort, **utils.get_ngram_limits(args),
+                     **utils.get_label_counts(args))
+        return
+    store = utils.get_data_store(args)
+    corpus = utils.get_corpus(args)
+    if not args.no_validate:
+        store.validate(corpus, catalogue)
+    store.search(catalogue, ngrams, utils.get_results_output(args),
+                 args.min_size, args.max_size, args.patterns,
+                 sort=args.sort, **utils.get_ngram_limits(args),
+                 **utils.get_label_counts(args))
+    utils.write_profile(args, store)
+
+
+def serve_queries(args, parser):
+    """Runs queries against a database kept open, until interrupted."""
+    store = utils.get_data_store(args)
+    corpus = None
+    if not args.no_validate:
+        corpus = utils.get_corpus(args)
+    server = tacl.QueryServer((constants.SERVE_HOST, args.port), store,
+                              corpus)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
 
 
 def strip_files(args, parser):
@@ -586,11 +831,27 @@ def supplied_diff(args, parser):
     results = args.supplied
     store = utils.get_data_store(args)
     tokenizer = utils.get_tokenizer(args)
-    store.diff_supplied(results, labels, tokenizer, sys.stdout)
+    store.diff_supplied(results, labels, tokenizer,
+                        utils.get_results_output(args), args.min_size,
+                        args.max_size, sort=args.sort,
+                        **utils.get_ngram_limits(args),
+                        **utils.get_label_counts(args))
+    utils.write_profile(args, store)
 
 
 def supplied_intersect(args, parser):
     labels = args.labels
     results = args.supplied
     store = utils.get_data_store(args)
-    store.intersection_supplied(results, labels, sys.stdout)
+    store.intersection_supplied(results, labels,
+                                utils.get_results_output(args),
+                                args.min_size, args.max_size,
+                                sort=args.sort,
+                                **utils.get_ngram_limits(args),
+                                **utils.get_label_counts(args))
+    utils.write_profile(args, store)
+
+
+def upgrade_database(args, parser):
+    store = utils.get_data_store(args)
+    store.upgrade()
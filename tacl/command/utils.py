@@ -1,12 +1,23 @@
 """Functions useful when writing command-line scripts that interact
 with tacl."""
 
+import json
 import logging
+import os
+import sys
 
 import colorlog
 
 import tacl
 from tacl import constants
+from tacl.exceptions import TACLError
+
+
+def add_cache_argument(parser):
+    """Adds an argument to cache the n-grams of each label in the
+    database to `parser`."""
+    parser.add_argument('--cache', action='store_true',
+                        help=constants.DB_CACHE_HELP)
 
 
 def add_common_arguments(parser):
@@ -47,12 +58,97 @@ def add_db_arguments(parser, db_option=False):
                             metavar='DATABASE')
 
 
+def add_label_count_arguments(parser):
+    """Adds arguments to add the label count and label work count
+    columns to the results to `parser`."""
+    parser.add_argument('--add-label-count', action='store_true',
+                        dest='label_count', help=constants.DB_LABEL_COUNT_HELP)
+    parser.add_argument('--add-label-work-count', action='store_true',
+                        dest='label_work_count',
+                        help=constants.DB_LABEL_WORK_COUNT_HELP)
+
+
+def add_ngram_limit_arguments(parser):
+    """Adds arguments to limit the number of works and the total count
+    of the n-grams in the results to `parser`.
+
+    These limits are applied as by the arguments of the same names to
+    the results command.
+
+    """
+    parser.add_argument('--min-count', dest='min_count',
+                        help=constants.RESULTS_MINIMUM_COUNT_HELP,
+                        metavar='COUNT', type=int)
+    parser.add_argument('--max-count', dest='max_count',
+                        help=constants.RESULTS_MAXIMUM_COUNT_HELP,
+                        metavar='COUNT', type=int)
+    parser.add_argument('--min-works', dest='min_works',
+                        help=constants.RESULTS_MINIMUM_WORK_HELP,
+                        metavar='COUNT', type=int)
+    parser.add_argument('--max-works', dest='max_works',
+                        help=constants.RESULTS_MAXIMUM_WORK_HELP,
+                        metavar='COUNT', type=int)
+
+
+def add_profile_argument(parser):
+    """Adds an argument to write a profile of the query to `parser`."""
+    parser.add_argument('--profile', help=constants.DB_PROFILE_HELP,
+                        metavar='PATH')
+
+
+def add_query_jobs_argument(parser):
+    """Adds an argument to run the query in multiple processes to
+    `parser`."""
+    parser.add_argument('-j', '--jobs', default=1, dest='jobs',
+                        help=constants.DB_JOBS_HELP, metavar='JOBS',
+                        type=int)
+
+
 def add_query_arguments(parser):
     """Adds common arguments for query sub-commonads to `parser`."""
     parser.add_argument('catalogue', help=constants.CATALOGUE_CATALOGUE_HELP,
                         metavar='CATALOGUE')
 
 
+def add_read_only_argument(parser):
+    """Adds an argument to open the database read only to `parser`."""
+    parser.add_argument('--read-only', action='store_true',
+                        dest='read_only', help=constants.DB_READ_ONLY_HELP)
+
+
+def add_results_format_argument(parser):
+    """Adds an argument to choose the format results are output in to
+    `parser`."""
+    parser.add_argument('--format', choices=constants.RESULTS_FORMAT_CHOICES,
+                        default=constants.RESULTS_FORMAT_CSV,
+                        dest='results_format',
+                        help=constants.RESULTS_FORMAT_HELP)
+
+
+def add_server_argument(parser):
+    """Adds an argument to forward the query to a query server to
+    `parser`."""
+    parser.add_argument('--server', help=constants.SERVER_URL_HELP,
+                        metavar='URL')
+
+
+def add_size_arguments(parser):
+    """Adds arguments to limit the sizes of n-grams queried to
+    `parser`."""
+    parser.add_argument('--min-size', dest='min_size',
+                        help=constants.DB_MINIMUM_SIZE_HELP, metavar='SIZE',
+                        type=int)
+    parser.add_argument('--max-size', dest='max_size',
+                        help=constants.DB_MAXIMUM_SIZE_HELP, metavar='SIZE',
+                        type=int)
+
+
+def add_sort_argument(parser):
+    """Adds an argument to sort the results of the query to `parser`."""
+    parser.add_argument('--sort', action='store_true',
+                        help=constants.DB_SORT_HELP)
+
+
 def add_supplied_query_arguments(parser):
     """Adds common arguments for supplied query sub-commands to
     `parser`."""
@@ -70,6 +166,13 @@ def add_tokenizer_argument(parser):
                         help=constants.DB_TOKENIZER_HELP)
 
 
+def add_validate_argument(parser):
+    """Adds an argument to skip validating the corpus against the
+    database to `parser`."""
+    parser.add_argument('--no-validate', '--trust-db', action='store_true',
+                        dest='no_validate', help=constants.DB_NO_VALIDATE_HELP)
+
+
 def configure_logging(verbose, logger):
     """Configures the logging used."""
     if not verbose:
@@ -102,7 +205,53 @@ def get_corpus(args):
 
 def get_data_store(args):
     """Returns a `tacl.DataStore`."""
-    return tacl.DataStore(args.db, args.memory, args.ram)
+    # Only the query commands that can make use of the cache, or that
+    # do not write to the database, have these arguments.
+    cache = getattr(args, 'cache', False)
+    read_only = getattr(args, 'read_only', False)
+    results_format = getattr(args, 'results_format',
+                             constants.RESULTS_FORMAT_CSV)
+    profile = getattr(args, 'profile', None) is not None
+    return tacl.DataStore(args.db, args.memory, args.ram, cache, read_only,
+                          results_format, profile)
+
+
+def get_query_client(args):
+    """Returns a `tacl.QueryClient`."""
+    if args.results_format != constants.RESULTS_FORMAT_CSV:
+        raise TACLError(constants.SERVER_RESULTS_FORMAT_ERROR)
+    if args.profile is not None:
+        raise TACLError(constants.SERVER_PROFILE_ERROR)
+    return tacl.QueryClient(args.server)
+
+
+def get_label_counts(args):
+    """Returns whether to add the label count and label work count
+    columns in `args`, as keyword arguments to a query."""
+    return {name: getattr(args, name)
+            for name in constants.LABEL_COUNT_ARGUMENTS}
+
+
+def get_label_results_outputs(args, output_dir, labels):
+    """Returns a dictionary of files, opened for writing results to,
+    in `output_dir` keyed by each of `labels`, and named after it."""
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = {}
+    for label in labels:
+        path = os.path.join(output_dir, '{}.{}'.format(
+            label, args.results_format))
+        if args.results_format == constants.RESULTS_FORMAT_CSV:
+            outputs[label] = open(path, 'w', encoding='utf-8', newline='')
+        else:
+            outputs[label] = open(path, 'wb')
+    return outputs
+
+
+def get_ngram_limits(args):
+    """Returns the limits on the works and total count of n-grams in
+    `args`, as keyword arguments to a query."""
+    return {name: getattr(args, name)
+            for name in constants.NGRAM_LIMIT_ARGUMENTS}
 
 
 def get_ngrams(path):
@@ -112,5 +261,35 @@ def get_ngrams(path):
     return ngrams
 
 
+def get_results_input(path):
+    """Returns a binary file object of the results at `path`, which
+    may be - for stdin.
+
+    The results are opened in binary mode so that their format can be
+    detected.
+
+    """
+    if path == '-':
+        return sys.stdin.buffer
+    return open(path, 'rb')
+
+
+def get_results_output(args):
+    """Returns stdout, as a binary file object if the results are to
+    be output in a binary format."""
+    if args.results_format == constants.RESULTS_FORMAT_CSV:
+        return sys.stdout
+    return sys.stdout.buffer
+
+
 def get_tokenizer(args):
     return tacl.Tokenizer(*constants.TOKENIZERS[args.tokenizer])
+
+
+def write_profile(args, store):
+    """Writes the profile of the queries run on `store` as JSON to
+    the path given in `args`, if any."""
+    if args.profile is None:
+        return
+    with open(args.profile, 'w', encoding='utf-8') as fh:
+        json.dump(store.get_profile(), fh, indent=2)
@@ -1,5 +1,61 @@
 """Module containing constants."""
 
+# Physical layouts of the TextNGram table. The heap layout has an
+# index on (text, ngram); the covering layout instead has an index
+# that includes every column, so that queries need not read the
+# table; and the clustered layout stores the table itself in (text,
+# ngram) order, without a separate index. The partitioned layout
+# replaces TextNGram with one table (and index) per n-gram size.
+LAYOUT_CLUSTERED = 'clustered'
+LAYOUT_COVERING = 'covering'
+LAYOUT_HEAP = 'heap'
+LAYOUT_PARTITIONED = 'partitioned'
+LAYOUT_CHOICES = [LAYOUT_HEAP, LAYOUT_COVERING, LAYOUT_CLUSTERED,
+                  LAYOUT_PARTITIONED]
+
+# Kinds of index of the witnesses in a database. The n-gram index
+# stores every n-gram of each size; the suffix index stores a suffix
+# array of each witness, from which n-grams of any size are derived
+# when queried.
+INDEX_NGRAM = 'ngram'
+INDEX_SUFFIX = 'suffix'
+INDEX_CHOICES = [INDEX_NGRAM, INDEX_SUFFIX]
+
+# Ways of running an intersection query. The nested engine nests one
+# subquery per label, the label with the fewest tokens innermost; the
+# grouped engine groups the n-grams of every label in a single pass
+# and keeps those found under every label.
+INTERSECT_ENGINE_GROUPED = 'grouped'
+INTERSECT_ENGINE_NESTED = 'nested'
+INTERSECT_ENGINE_CHOICES = [INTERSECT_ENGINE_NESTED,
+                            INTERSECT_ENGINE_GROUPED]
+
+# Host that a query server listens on, and the port it listens on by
+# default.
+SERVE_DEFAULT_PORT = 8318
+SERVE_HOST = 'localhost'
+
+# Formats that results may be read and written in. CSV is always
+# available; the Parquet and Feather formats are binary and columnar,
+# and require pyarrow. The format of results being read is detected
+# from the bytes that start them, and binary results are written a
+# batch of rows at a time.
+RESULTS_FORMAT_CSV = 'csv'
+RESULTS_FORMAT_FEATHER = 'feather'
+RESULTS_FORMAT_PARQUET = 'parquet'
+RESULTS_FORMAT_CHOICES = [RESULTS_FORMAT_CSV, RESULTS_FORMAT_PARQUET,
+                          RESULTS_FORMAT_FEATHER]
+RESULTS_FORMAT_MAGIC = {
+    b'ARROW1': RESULTS_FORMAT_FEATHER,
+    b'PAR1': RESULTS_FORMAT_PARQUET,
+}
+RESULTS_FORMAT_BATCH_SIZE = 100000
+# Number of rows of results held in memory when sorting them, beyond
+# which sorted runs of rows are spilled to temporary files, and the
+# number of rows of a spilled run read back at a time.
+RESULTS_SORT_BUFFER_SIZE = 250000
+RESULTS_SORT_CHUNK_SIZE = 10000
+
 TEI_SOURCE_CBETA_GITHUB = 'cbeta-github'
 TEI_SOURCE_CHOICES = [TEI_SOURCE_CBETA_GITHUB]
 
@@ -67,12 +123,15 @@ UNIQUE_NGRAMS_FIELDNAME = 'unique ngrams'
 WITNESSES_FIELDNAME = 'witnesses'
 WORK_FIELDNAME = 'work'
 WORK_COUNTS_FIELDNAME = 'work counts'
+WORKS_FIELDNAME = 'works'
 
 QUERY_FIELDNAMES = (NGRAM_FIELDNAME, SIZE_FIELDNAME, WORK_FIELDNAME,
                     SIGLUM_FIELDNAME, COUNT_FIELDNAME, LABEL_FIELDNAME)
 COUNTS_FIELDNAMES = (WORK_FIELDNAME, SIGLUM_FIELDNAME, SIZE_FIELDNAME,
                      UNIQUE_NGRAMS_FIELDNAME, TOTAL_NGRAMS_FIELDNAME,
                      TOTAL_TOKENS_FIELDNAME, LABEL_FIELDNAME)
+NGRAM_STATS_FIELDNAMES = (NGRAM_FIELDNAME, SIZE_FIELDNAME, WORKS_FIELDNAME,
+                          WITNESSES_FIELDNAME, TOTAL_COUNT_FIELDNAME)
 STATISTICS_FIELDNAMES = (WORK_FIELDNAME, SIGLUM_FIELDNAME,
                          COUNT_TOKENS_FIELDNAME, TOTAL_TOKENS_FIELDNAME,
                          PERCENTAGE_FIELDNAME, LABEL_FIELDNAME)
@@ -95,8 +154,64 @@ ALIGN_HELP = 'Show aligned sets of matches between two witnesses side by side.'
 ALIGN_MINIMUM_SIZE_HELP = 'Minimum size of n-gram to base sequences around.'
 ALIGN_OUTPUT_HELP = 'Directory to output alignment files to.'
 
+ASYMMETRIC_ALL_HELP = '''\
+    Directory to output the results restricted to each sub-corpus to,
+    in a file named after its label, as if by an asymmetric diff for
+    each label. This is quicker than running an asymmetric diff for
+    each label in turn, the more so the more labels there are.'''
 ASYMMETRIC_HELP = 'Label of sub-corpus to restrict results to.'
 
+BATCH_DESCRIPTION = '''\
+    Run each of the queries listed in a manifest, writing the results
+    of each to its own file. The database is opened, and each witness
+    labelled in any of the queries validated, only once.'''
+BATCH_EPILOG = '''\
+    The manifest is a JSON file containing a list of queries, each an
+    object giving the type of the query (one of "counts", "diff",
+    "intersect", "search", "sdiff" and "sintersect") and the path of
+    the file to write its results to ("output"), along with its
+    arguments. For example:
+
+        [{"type": "intersect", "catalogue": "cat.txt",
+          "output": "intersect.csv", "min_size": 2,
+          "engine": "grouped"},
+         {"type": "diff", "catalogue": "cat.txt",
+          "output": "diff.csv", "asymmetric": "A"},
+         {"type": "search", "catalogue": "cat.txt",
+          "ngrams": "ngrams.txt", "output": "search.csv"},
+         {"type": "sdiff", "labels": ["A", "B"],
+          "supplied": ["a.csv", "b.csv"], "output": "sdiff.csv"}]
+
+    The arguments of each type of query are:
+
+      counts: "catalogue"
+
+      diff: "catalogue"; optionally "asymmetric" and the common
+      arguments below
+
+      intersect: "catalogue"; optionally "engine" and the common
+      arguments below
+
+      search: "catalogue" and "ngrams"; optionally "patterns" and the
+      common arguments below
+
+      sdiff and sintersect: "labels" and "supplied"; optionally the
+      common arguments below
+
+    The common optional arguments are "min_size", "max_size",
+    "min_works", "max_works", "min_count", "max_count", "label_count",
+    "label_work_count" and "sort", which correspond to the options of
+    the command of the same name (--min-size, --add-label-count and
+    so on). A query with any other argument is rejected.
+
+    Relative paths are relative to the directory containing the
+    manifest.'''
+BATCH_HELP = 'Run the queries listed in a manifest.'
+BATCH_JOBS_HELP = '''\
+    Number of queries to run at once, each in its own process with
+    its own connection to the database. Requires --read-only.'''
+BATCH_MANIFEST_HELP = 'Path to JSON manifest of queries.'
+
 CATALOGUE_CATALOGUE_HELP = 'Path to catalogue file.'
 CATALOGUE_DESCRIPTION = 'Generate a catalogue file.'
 CATALOGUE_EPILOG = '''\
@@ -111,12 +226,57 @@ COUNTS_HELP = 'List counts of n-grams in each labelled witness.'
 
 DB_CORPUS_HELP = 'Path to corpus.'
 DB_DATABASE_HELP = 'Path to database file.'
+DB_CACHE_HELP = '''\
+    Keep the distinct n-grams of each labelled set of witnesses in the
+    database, and reuse them in later queries with the same set of
+    witnesses under a label. The cached n-grams of a set are discarded
+    when n-grams are added to or changed for any of its witnesses.'''
 DB_MEMORY_HELP = '''\
     Use RAM for temporary database storage.
 
     This may cause an out of memory error, in which case run the
     command without this switch.'''
+DB_NO_VALIDATE_HELP = '''\
+    Do not check that the labelled witnesses are unchanged since their
+    n-grams were added to the database. Use this only when the corpus
+    is known to match the database, such as on a machine that only
+    queries a copy of it.'''
+DB_JOBS_HELP = '''\
+    Number of processes to run the query in. The n-grams are split
+    into this many partitions, each queried on its own read-only
+    connection to the database, and the results combined. Requires
+    --read-only; has no effect with a suffix index.'''
+DB_LABEL_COUNT_HELP = '''\
+    Add a "{}" column to the results, as the --add-label-count
+    option to the results command does, computed as part of the
+    query.'''.format(LABEL_COUNT_FIELDNAME)
+DB_LABEL_WORK_COUNT_HELP = '''\
+    Add a "{}" column to the results, as the
+    --add-label-work-count option to the results command does,
+    computed as part of the query.'''.format(LABEL_WORK_COUNT_FIELDNAME)
+DB_MAXIMUM_SIZE_HELP = 'Maximum size of n-grams to query.'
+DB_MINIMUM_SIZE_HELP = '''\
+    Minimum size of n-grams to query. The diff query still reads the
+    smaller n-grams, since they are needed to remove filler results.'''
+DB_PROFILE_HELP = '''\
+    Write a JSON profile of the query to PATH, giving the wall time,
+    rows output, SQL statements run and SQLite page cache hits and
+    misses of each phase of the query (validation, labelling, the
+    query, and output of the results), the peak memory used, and the
+    query plans. Rows are read from the database as they are output,
+    so much of the work of the query may fall in the output phase.'''
 DB_RAM_HELP = 'Number of gigabytes of RAM to use.'
+DB_READ_ONLY_HELP = '''\
+    Open the database read only. Witnesses are labelled in a temporary
+    table rather than in the database, so any number of queries can
+    be run against the database at once. The --cache option has no
+    effect, and validation does not record the unchanged size and
+    modification time of witness files.'''
+DB_SORT_HELP = '''\
+    Sort the results as the --sort option to the results command
+    does. The results are sorted as they are output, with no more
+    than a fixed number of rows held in memory; the rest are spilled
+    to temporary files.'''
 DB_TOKENIZER_HELP = '''\
     Type of tokenizer to use. The "cbeta" tokenizer is suitable for
     the Chinese CBETA corpus (tokens are single characters or
@@ -152,6 +312,13 @@ DIFF_EPILOG = '''\
       Make an asymmetrical diff query against a CBETA corpus.
         tacl diff -a Dhr cbeta2-10.db corpus/cbeta/ dhr-vs-rest.txt > output.csv
 
+      Make an asymmetrical diff query for every label at once, writing
+      the results for each label to a file such as output/Dhr.csv.
+        tacl diff --asymmetric-all output cbeta2-10.db corpus/cbeta/ dhr-vs-rest.txt
+
+      Make a diff query of only 4- to 6-grams against a CBETA corpus.
+        tacl diff --min-size 4 --max-size 6 cbeta2-10.db corpus/cbeta/ dhr-vs-rest.txt > output.csv
+
       Make a diff query against a Pagel corpus.
         tacl diff -t pagel pagel1-7.db corpus/pagel/ by-author.txt > output.csv
 
@@ -217,7 +384,7 @@ HIGHLIGHT_NGRAMS_HELP = '''\
     Path to file containing n-grams (one per line) to highlight. This
     option may be specified multiple times; the n-grams in each file
     will be displayed in a distinct colour.'''
-HIGHLIGHT_RESULTS_HELP = 'Path to CSV results; creates heatmap highlighting.'
+HIGHLIGHT_RESULTS_HELP = 'Path to results; creates heatmap highlighting.'
 
 
 INTERSECT_DESCRIPTION = '''\
@@ -229,10 +396,23 @@ INTERSECT_EPILOG = '''\
       Make an intersect query against a CBETA corpus.
         tacl intersect cbeta2-10.db corpus/cbeta/ dhr-vs-rest.txt > output.csv
 
+      Make an intersect query of only 4- to 6-grams against a CBETA corpus.
+        tacl intersect --min-size 4 --max-size 6 cbeta2-10.db corpus/cbeta/ dhr-vs-rest.txt > output.csv
+
+      Make an intersect query with many labels, grouping the n-grams
+      of all of the labels in one pass.
+        tacl intersect --engine grouped cbeta2-10.db corpus/cbeta/ by-dynasty.txt > output.csv
+
       Make an intersect query against a Pagel corpus.
         tacl intersect -t pagel pagel1-7.db corpus/pagel/ by-author.txt > output.csv
 
 ''' + ENCODING_EPILOG
+INTERSECT_ENGINE_HELP = '''\
+    How to find the n-grams common to all labels. "nested" filters
+    the n-grams of each label by those of the next, which suits few
+    labels. "grouped" groups the n-grams of all labels at once and
+    keeps those found under every label, which avoids deeply nested
+    queries when there are many labels.'''
 INTERSECT_HELP = 'List n-grams common to all sub-corpora.'
 
 JITC_DESCRIPTION = '''\
@@ -241,6 +421,35 @@ JITC_DESCRIPTION = '''\
     set of works.'''
 JITC_LABEL_HELP = 'Label of works to compare with each other'
 
+NGRAM_STATS_DESCRIPTION = '''\
+    List the number of works and witnesses each n-gram in the
+    database occurs in, and its total count across all of the
+    witnesses.'''
+NGRAM_STATS_EPILOG = '''\
+    These statistics are kept up to date by the ngrams command, and
+    cover the whole corpus in the database rather than the works of a
+    catalogue. They are not available for a database with a suffix
+    index.
+
+    examples:
+
+      List the statistics of every n-gram.
+        tacl ngram-stats cbeta2-10.db > ngram-stats.csv
+
+      List the statistics of every 4-gram.
+        tacl ngram-stats --min-size 4 --max-size 4 cbeta2-10.db
+
+'''
+NGRAM_STATS_HELP = 'List corpus-wide statistics of each n-gram.'
+NGRAM_STATS_MAXIMUM_SIZE_HELP = 'Maximum size of n-grams to list.'
+NGRAM_STATS_MINIMUM_SIZE_HELP = 'Minimum size of n-grams to list.'
+
+NGRAMS_BATCH_SIZE_HELP = '''\
+    Maximum number of n-grams to hold in memory at once, including
+    those being generated by parallel jobs. The n-grams of witnesses
+    that would need more are counted in a temporary table instead,
+    which is slower, and which is only held in memory if the memory
+    option is used.'''
 NGRAMS_CATALOGUE_HELP = '''\
     Path to a catalogue file used to restrict which works in the
     corpus are added.'''
@@ -270,10 +479,54 @@ NGRAMS_EPILOG = '''\
       Create a database of 1 to 7-grams from a subset of the CBETA corpus.
         tacl ngrams -c dhr-texts.txt cbeta-dhr1-7.db corpus/cbeta/ 1 7
 
+      Create a database of 2 to 10-grams using 8 processes.
+        tacl ngrams -j 8 cbeta2-10.db corpus/cbeta/ 2 10
+
+      Create a database of 2 to 10-grams optimised for querying.
+        tacl ngrams --layout clustered cbeta2-10.db corpus/cbeta/ 2 10
+
+      Create a database of suffix arrays, queried by default for 2 to
+      10-grams.
+        tacl ngrams --index suffix cbeta-sa.db corpus/cbeta/ 2 10
+
 '''
 NGRAMS_HELP = 'Generate n-grams from a corpus.'
+NGRAMS_INDEX_HELP = '''\
+    Kind of index of the witnesses in a new database. "ngram" stores
+    every n-gram of each size from MINIMUM to MAXIMUM. "suffix" stores
+    only a suffix array of the tokens of each witness, making for a
+    much smaller database, and derives the n-grams of the labelled
+    witnesses when each query is run; MINIMUM and MAXIMUM then only
+    give the default sizes of n-grams to query, and queries may ask
+    for any other sizes with --min-size and --max-size. The derived
+    n-grams are held in temporary tables, which take about as much
+    space as an n-gram index of the labelled witnesses and of the
+    sizes queried (a search only derives the sizes of the n-grams
+    searched for), in RAM if --memory is given to the query; they are
+    kept for later queries of the same witnesses run on the same
+    connection, as by the batch and serve commands. The layout is
+    ignored for a suffix index. Has no effect on an existing
+    database.'''
+NGRAMS_JOBS_HELP = '''\
+    Number of processes to use to generate n-grams; the database is
+    still written to by a single process.'''
+NGRAMS_LAYOUT_HELP = '''\
+    Physical layout of the n-gram data in a new database. "heap" is
+    the most compact. "covering" adds an index holding a copy of the
+    n-gram data, which speeds up queries at the cost of a larger
+    database. "clustered" stores the n-gram data in index order, which
+    speeds up queries without a copy, but makes adding n-grams to an
+    existing database slower. "partitioned" stores the n-gram data of
+    each size separately, so that queries limited to some sizes read
+    only the data of those sizes. Has no effect on an existing
+    database.'''
 NGRAMS_MAXIMUM_HELP = 'Maximum size of n-gram to generate (integer).'
 NGRAMS_MINIMUM_HELP = 'Minimum size of n-gram to generate (integer).'
+NGRAMS_PATTERN_INDEX_HELP = '''\
+    Add a trigram index of the n-grams (kept up to date by later runs
+    of this command), which lets search --patterns quickly find the
+    n-grams matching a pattern that starts with a wildcard. Requires
+    SQLite with the FTS5 extension, and an n-gram index.'''
 
 PREPARE_DESCRIPTION = '''\
     Convert CBETA TEI XML files (which may have multiple files per
@@ -378,6 +631,11 @@ RESULTS_EPILOG = '''\
         tacl results --reduce -t pagel output.csv > mod-output.csv
 
 ''' + ENCODING_EPILOG
+RESULTS_FORMAT_HELP = '''\
+    Format to output results in. The binary parquet and feather formats
+    are much quicker to write and to read than CSV, and are detected
+    automatically wherever results are read, but require pyarrow to be
+    installed.'''
 RESULTS_GROUP_BY_NGRAM_HELP = '''\
     Group results by n-gram, providing summary information of the
     works each n-gram appears in. Results are sorted by n-gram and
@@ -411,7 +669,7 @@ RESULTS_RECIPROCAL_HELP = '''\
     intersection results.'''
 RESULTS_REDUCE_HELP = 'Remove n-grams that are contained in larger n-grams.'
 RESULTS_REMOVE_HELP = 'Remove labelled results.'
-RESULTS_RESULTS_HELP = 'Path to CSV results; use - for stdin.'
+RESULTS_RESULTS_HELP = 'Path to results; use - for stdin.'
 RESULTS_SORT_HELP = 'Sort the results.'
 RESULTS_UNSAFE_GROUP_TITLE = 'format changing arguments'
 RESULTS_UNSAFE_GROUP_DESCRIPTION = '''\
@@ -431,6 +689,33 @@ SEARCH_MODE_HELP = 'The mode or organising principle of the search results.'
 SEARCH_NGRAMS_HELP = '''\
     Path to file containing list of n-grams to search for, with one
     n-gram per line.'''
+SEARCH_PATTERNS_HELP = '''\
+    Treat each line of NGRAMS as a pattern rather than an n-gram: "*"
+    matches any characters, "?" any one character, and "[...]" any
+    one of the enclosed characters. Patterns that start with literal
+    characters are matched using the n-gram index; other patterns are
+    matched quickly only if the database has a pattern index (see
+    ngrams --pattern-index).'''
+
+SERVE_DESCRIPTION = '''\
+    Keep a database open and run queries against it on behalf of the
+    counts, diff, intersect and search commands given the --server
+    option. Since the database's cache persists from one query to the
+    next, queries run after the first need read little of the
+    database from disk.'''
+SERVE_EPILOG = '''\
+    The server listens only on the local machine, and runs one query
+    at a time. Stop it with Ctrl-C.
+
+    Queries are checked against the corpus given to this command,
+    rather than any given to the command forwarding the query.'''
+SERVE_HELP = 'Run queries against a database kept open.'
+SERVE_PORT_HELP = 'Port to listen on.'
+SERVER_URL_HELP = '''\
+    Forward the query to a server started with "tacl serve" at URL
+    (such as http://localhost:{}/), rather than opening the database.
+    The server must have the same database open.'''.format(
+        SERVE_DEFAULT_PORT)
 
 STATISTICS_DESCRIPTION = '''\
     Generate summary statistics for a set of results. This gives, for
@@ -438,7 +723,7 @@ STATISTICS_DESCRIPTION = '''\
     tokens, and derived from these the percentage of the witness that
     is encompassed by the matches.'''
 STATISTICS_HELP = 'Generate summary statistics for a set of results.'
-STATISTICS_RESULTS_HELP = 'Path to CSV results.'
+STATISTICS_RESULTS_HELP = 'Path to results.'
 
 STRIP_DESCRIPTION = '''\
     Preprocess a corpus by stripping unwanted material from each
@@ -474,6 +759,20 @@ SUPPLIED_LABELS_HELP = (
     'Labels to be assigned in order to the supplied results.')
 SUPPLIED_RESULTS_HELP = 'Paths to results files to be used in the query.'
 
+UPGRADE_DESCRIPTION = '''\
+    Upgrade a database generated by an earlier version of tacl to the
+    current schema.'''
+UPGRADE_EPILOG = '''\
+    Databases must be upgraded before they can be queried or have
+    n-grams added to them. Upgrading a large database may take a long
+    time and requires free disk space roughly equal to the size of the
+    database.
+
+    examples:
+
+        tacl upgrade cbeta2-10.db'''
+UPGRADE_HELP = 'Upgrade a database to the current schema.'
+
 TACL_DESCRIPTION = 'Analyse the text of corpora in various simple ways.'
 
 VERBOSE_HELP = '''\
@@ -481,6 +780,9 @@ VERBOSE_HELP = '''\
 
 
 # Error messages.
+JOBS_READ_ONLY_ERROR = (
+    'Running queries in multiple processes requires the database to be '
+    'opened read only')
 CATALOGUE_WORK_RELABELLED_ERROR = 'Catalogue file labels "{}" more than once'
 EXCISE_OVERWRITE_WORK_WARNING = ('Output work directory "{}" already exists;'
                                  'existing files may be overwritten.')
@@ -488,26 +790,222 @@ INSUFFICIENT_LABELS_QUERY_ERROR = (
     'Not running query with less than two defined labels')
 LABEL_NOT_IN_CATALOGUE_ERROR = (
     'Supplied label is not present in the supplied catalogue')
+LABEL_OUTPUTS_MISMATCH_ERROR = (
+    'The outputs supplied do not match the labels in the supplied catalogue')
 SUPPLIED_ARGS_LENGTH_MISMATCH_ERROR = (
     'The number of labels supplied does not match the number of results files.'
 )
+MANIFEST_MISSING_ARGUMENT_ERROR = (
+    'Query {} in the manifest lacks required argument "{}"')
+MANIFEST_NOT_LIST_ERROR = 'The manifest is not a JSON list of queries'
+MANIFEST_UNKNOWN_ARGUMENT_ERROR = (
+    'Query {} in the manifest has unknown argument "{}"')
+MANIFEST_UNKNOWN_QUERY_ERROR = 'Query {} in the manifest has unknown type "{}"'
+NGRAM_STATS_UNAVAILABLE_ERROR = (
+    'N-gram statistics are not kept for a database with a suffix index')
+OUTDATED_DATABASE_ERROR = (
+    'The database uses an older schema (version {}) than this version of '
+    'tacl (version {}); run "tacl upgrade" on it first.')
 MISSING_REQUIRED_COLUMNS_ERROR = (
     'Results file is missing required column(s) {}')
-
+PATTERN_INDEX_UNAVAILABLE_ERROR = (
+    'A pattern index requires SQLite with the FTS5 extension: {}')
+PARALLEL_QUERY_WORKER_ERROR = (
+    'A process running part of the query ended without its results')
+RESULTS_FORMAT_UNAVAILABLE_ERROR = (
+    'Reading or writing results in {} format requires pyarrow to be '
+    'installed')
+SERVER_ASYMMETRIC_ALL_ERROR = (
+    'A query server cannot output the results of each label separately')
+SERVER_CONNECTION_ERROR = 'Could not connect to query server at {}: {}'
+SERVER_DATABASE_MISMATCH_ERROR = (
+    'Query is for database "{}", but the server has "{}" open')
+SERVER_MALFORMED_REQUEST_ERROR = 'Query parameters are not valid JSON'
+SERVER_MISSING_CATALOGUE_ERROR = 'Query parameters lack a valid catalogue'
+SERVER_PROFILE_ERROR = 'A query run by a query server cannot be profiled'
+SERVER_QUERY_ERROR = 'Query failed on the server: {}'
+SERVER_RESPONSE_ERROR = 'Query server at {} did not respond properly: {}'
+SERVER_RESULTS_FORMAT_ERROR = 'A query server only outputs results as CSV'
+SERVER_UNKNOWN_QUERY_ERROR = 'Unknown query "{}"'
+SERVER_UNKNOWN_TOKENIZER_ERROR = 'Unknown tokenizer "{}"'
+
+
+# Version of the database schema, stored in the database's
+# user_version pragma. Databases created before the schema was
+# versioned have a version of 0.
+DATABASE_VERSION = 5
+
+# Names of the settings recording the layout of the TextNGram table,
+# the kind of index, and, for a suffix index, the default range of
+# n-gram sizes to query and the string joining tokens into n-grams.
+INDEX_SETTING = 'index'
+JOINER_SETTING = 'joiner'
+LAYOUT_SETTING = 'layout'
+MAXIMUM_SIZE_SETTING = 'maximum_size'
+MINIMUM_SIZE_SETTING = 'minimum_size'
+# Name of the setting recording that the database has a pattern
+# (trigram) index of its n-grams.
+PATTERN_INDEX_SETTING = 'pattern_index'
+
+# Pattern matching the wildcards of a GLOB pattern; what lies between
+# them is matched literally. The trigram pattern index can only find
+# the n-grams matching a pattern that has a run of at least
+# PATTERN_INDEX_MINIMUM_LITERAL literal characters.
+GLOB_WILDCARD_PATTERN = r'\*|\?|\[[^]]*\]'
+PATTERN_INDEX_MINIMUM_LITERAL = 3
+
+# Pattern matching references to the TextNGram table in SQL, which
+# are replaced with the partition for a single size in a database
+# with the partitioned layout.
+TEXTNGRAM_TABLE_PATTERN = r'\bTextNGram\b'
+TEXTNGRAM_PARTITION_TABLE = 'TextNGram{}'
+
+# URI for opening a database read only, given the file URI of the
+# database.
+READ_ONLY_DATABASE_URI = '{}?mode=ro'
+
+# Names of the queries that may be given in a batch manifest, the
+# first four of which a query server also runs, each requested at
+# the path of the same name.
+QUERY_COUNTS = 'counts'
+QUERY_DIFF = 'diff'
+QUERY_INTERSECT = 'intersect'
+QUERY_SEARCH = 'search'
+QUERY_SUPPLIED_DIFF = 'sdiff'
+QUERY_SUPPLIED_INTERSECT = 'sintersect'
+
+# Number of result rows sent at a time from each process running a
+# partition of a query in parallel.
+PARALLEL_QUERY_CHUNK_SIZE = 10000
+
+# Names of the phases of a query that are profiled.
+PROFILE_PHASE_LABELS = 'labels'
+PROFILE_PHASE_OUTPUT = 'output'
+PROFILE_PHASE_QUERY = 'query'
+PROFILE_PHASE_REDUCE = 'reduce'
+PROFILE_PHASE_RESULTS = 'results'
+PROFILE_PHASE_VALIDATE = 'validate'
+
+# Operations of sqlite3_db_status giving the number of page cache
+# hits and misses of a connection.
+SQLITE_DBSTATUS_CACHE_HIT = 7
+SQLITE_DBSTATUS_CACHE_MISS = 8
+# Versions of CPython (from the first up to but not including the
+# second) in whose pysqlite_Connection struct the sqlite3 database
+# handle immediately follows PyObject_HEAD.
+SQLITE_CONNECTION_LAYOUT_VERSIONS = ((3, 5), (3, 14))
+
+# Conditions on the works and total count of an n-gram, being the
+# number of works with the n-gram and the sum of its maximum count
+# in each work, as used by Results.prune_by_work_count and
+# Results.prune_by_ngram_count.
+LIMIT_HAS_WORKS_SQL = 'SUM(count > 0) > 0'
+LIMIT_MAXIMUM_COUNT_SQL = 'SUM(count) <= ?'
+LIMIT_MAXIMUM_WORKS_SQL = 'SUM(count > 0) <= ?'
+LIMIT_MINIMUM_COUNT_SQL = 'SUM(count) >= ?'
+LIMIT_MINIMUM_WORKS_SQL = 'SUM(count > 0) >= ?'
+# Conditions on the corpus-wide statistics of an n-gram.
+LIMIT_STATS_MINIMUM_COUNT_SQL = 'count >= ?'
+LIMIT_STATS_MINIMUM_WORKS_SQL = 'works >= ?'
+# Names of the arguments to the queries that limit the works and
+# total count of the n-grams in their results.
+NGRAM_LIMIT_ARGUMENTS = ('min_works', 'max_works', 'min_count', 'max_count')
+# Names of the arguments to the queries that add the label count and
+# label work count columns to their results.
+LABEL_COUNT_ARGUMENTS = ('label_count', 'label_work_count')
+
+# Default maximum number of n-grams of a witness to hold in memory
+# when adding them to the database.
+NGRAMS_BATCH_SIZE = 1000000
 
 # SQL statements.
 ANALYSE_SQL = 'ANALYZE {}'
+BEGIN_TRANSACTION_SQL = 'BEGIN'
 CREATE_INDEX_INPUT_RESULTS_SQL = (
     'CREATE INDEX IF NOT EXISTS temp.InputResultsLabel '
     'ON InputResults (ngram)')
+CREATE_INDEX_STAGED_NGRAMS_SQL = (
+    'CREATE INDEX temp.StagedNGramIndex '
+    'ON StagedNGram (size, ngram, position)')
+CREATE_INDEX_TEMPORARY_DERIVED_TEXTNGRAM_SQL = (
+    'CREATE INDEX temp.TextNGramIndexTextNGram ON TextNGram (text, ngram)')
+CREATE_INDEX_TEMPORARY_LABELLED_TEXT_SQL = (
+    'CREATE INDEX temp.LabelledTextIndexLabel ON LabelledText (label)')
 CREATE_INDEX_TEXT_SQL = (
     'CREATE INDEX IF NOT EXISTS TextIndexLabel ON Text (label)')
+CREATE_INDEX_LABELNGRAMSETTEXT_SQL = (
+    'CREATE INDEX IF NOT EXISTS LabelNGramSetTextIndexText '
+    'ON LabelNGramSetText (text)')
 CREATE_INDEX_TEXTHASNGRAM_SQL = (
     'CREATE UNIQUE INDEX IF NOT EXISTS TextHasNGramIndex '
     'ON TextHasNGram (text, size)')
+CREATE_INDEX_TEXTNGRAM_COVERING_SQL = (
+    'CREATE INDEX IF NOT EXISTS TextNGramIndexCovering '
+    'ON TextNGram (text, ngram, size, count)')
+CREATE_INDEX_TEXTNGRAM_PARTITION_SQL = (
+    'CREATE INDEX IF NOT EXISTS TextNGram{0}IndexTextNGram '
+    'ON TextNGram{0} (text, ngram)')
 CREATE_INDEX_TEXTNGRAM_SQL = (
     'CREATE INDEX IF NOT EXISTS TextNGramIndexTextNGram '
     'ON TextNGram (text, ngram)')
+CREATE_TABLE_LABELNGRAM_SQL = (
+    'CREATE TABLE IF NOT EXISTS LabelNGram ('
+    'label_set INTEGER NOT NULL REFERENCES LabelNGramSet (id), '
+    'ngram INTEGER NOT NULL REFERENCES NGram (id), '
+    'size INTEGER NOT NULL, '
+    'PRIMARY KEY (label_set, ngram)) WITHOUT ROWID')
+CREATE_TABLE_LABELNGRAMSET_SQL = (
+    'CREATE TABLE IF NOT EXISTS LabelNGramSet ('
+    'id INTEGER PRIMARY KEY ASC, '
+    'texts TEXT NOT NULL UNIQUE)')
+CREATE_TABLE_LABELNGRAMSETTEXT_SQL = (
+    'CREATE TABLE IF NOT EXISTS LabelNGramSetText ('
+    'label_set INTEGER NOT NULL REFERENCES LabelNGramSet (id), '
+    'text INTEGER NOT NULL REFERENCES Text (id))')
+# Corpus-wide statistics of each n-gram: the number of works and of
+# witnesses it occurs in, and its total count in those witnesses.
+# The witnesses (and sizes) whose n-grams have been added but not
+# yet counted in the statistics are recorded in NGramStatsPending.
+CREATE_TABLE_NGRAMSTATS_SQL = (
+    'CREATE TABLE IF NOT EXISTS NGramStats ('
+    'ngram INTEGER PRIMARY KEY REFERENCES NGram (id), '
+    'works INTEGER NOT NULL, '
+    'witnesses INTEGER NOT NULL, '
+    'count INTEGER NOT NULL)')
+CREATE_TABLE_NGRAMSTATSPENDING_SQL = (
+    'CREATE TABLE IF NOT EXISTS NGramStatsPending ('
+    'text INTEGER NOT NULL REFERENCES Text (id), '
+    'size INTEGER NOT NULL, '
+    'PRIMARY KEY (text, size)) WITHOUT ROWID')
+CREATE_TABLE_NGRAM_SQL = (
+    'CREATE TABLE IF NOT EXISTS NGram ('
+    'id INTEGER PRIMARY KEY ASC, '
+    'ngram TEXT NOT NULL UNIQUE, '
+    'size INTEGER NOT NULL)')
+# The pattern index is a trigram full-text index of NGram, which
+# takes its content from NGram rather than storing another copy.
+CREATE_TABLE_NGRAMPATTERN_SQL = (
+    'CREATE VIRTUAL TABLE IF NOT EXISTS NGramPattern USING fts5('
+    'ngram, content=NGram, content_rowid=id, '
+    "tokenize='trigram case_sensitive 1', detail=none)")
+CREATE_TABLE_SETTING_SQL = (
+    'CREATE TABLE IF NOT EXISTS Setting ('
+    'name TEXT PRIMARY KEY, '
+    'value TEXT NOT NULL)')
+CREATE_TABLE_TEXTSKETCH_SQL = (
+    'CREATE TABLE IF NOT EXISTS TextSketch ('
+    'text INTEGER PRIMARY KEY REFERENCES Text (id), '
+    'sketch BLOB NOT NULL)')
+CREATE_TABLE_TEXTSUFFIXARRAY_SQL = (
+    'CREATE TABLE IF NOT EXISTS TextSuffixArray ('
+    'text INTEGER PRIMARY KEY REFERENCES Text (id), '
+    'tokens BLOB NOT NULL, '
+    'suffixes BLOB NOT NULL, '
+    'lcp BLOB NOT NULL)')
+CREATE_TABLE_TOKEN_SQL = (
+    'CREATE TABLE IF NOT EXISTS Token ('
+    'id INTEGER PRIMARY KEY ASC, '
+    'token TEXT NOT NULL UNIQUE)')
 CREATE_TABLE_TEXT_SQL = (
     'CREATE TABLE IF NOT EXISTS Text ('
     'id INTEGER PRIMARY KEY ASC, '
@@ -516,11 +1014,26 @@ CREATE_TABLE_TEXT_SQL = (
     'checksum TEXT NOT NULL, '
     'token_count INTEGER NOT NULL, '
     'label TEXT NOT NULL, '
+    'file_size INTEGER, '
+    'mtime INTEGER, '
     'UNIQUE (work, siglum))')
 CREATE_TABLE_TEXTNGRAM_SQL = (
     'CREATE TABLE IF NOT EXISTS TextNGram ('
     'text INTEGER NOT NULL REFERENCES Text (id), '
-    'ngram TEXT NOT NULL, '
+    'ngram INTEGER NOT NULL REFERENCES NGram (id), '
+    'size INTEGER NOT NULL, '
+    'count INTEGER NOT NULL)')
+CREATE_TABLE_TEXTNGRAM_CLUSTERED_SQL = (
+    'CREATE TABLE IF NOT EXISTS TextNGram ('
+    'text INTEGER NOT NULL REFERENCES Text (id), '
+    'ngram INTEGER NOT NULL REFERENCES NGram (id), '
+    'size INTEGER NOT NULL, '
+    'count INTEGER NOT NULL, '
+    'PRIMARY KEY (text, ngram)) WITHOUT ROWID')
+CREATE_TABLE_TEXTNGRAM_PARTITION_SQL = (
+    'CREATE TABLE IF NOT EXISTS TextNGram{} ('
+    'text INTEGER NOT NULL REFERENCES Text (id), '
+    'ngram INTEGER NOT NULL REFERENCES NGram (id), '
     'size INTEGER NOT NULL, '
     'count INTEGER NOT NULL)')
 CREATE_TABLE_TEXTHASNGRAM_SQL = (
@@ -528,8 +1041,54 @@ CREATE_TABLE_TEXTHASNGRAM_SQL = (
     'text INTEGER NOT NULL REFERENCES Text (id), '
     'size INTEGER NOT NULL, '
     'count INTEGER NOT NULL)')
+CREATE_TEMPORARY_CATALOGUE_TABLE_SQL = (
+    'CREATE TEMPORARY TABLE Catalogue ('
+    'work TEXT PRIMARY KEY, '
+    'label TEXT NOT NULL)')
+CREATE_TEMPORARY_DERIVED_NGRAM_TABLE_SQL = (
+    'CREATE TEMPORARY TABLE NGram ('
+    'id INTEGER PRIMARY KEY ASC, '
+    'ngram TEXT NOT NULL UNIQUE, '
+    'size INTEGER NOT NULL)')
+CREATE_TEMPORARY_DERIVED_TEXTHASNGRAM_TABLE_SQL = (
+    'CREATE TEMPORARY TABLE TextHasNGram ('
+    'text INTEGER NOT NULL, '
+    'size INTEGER NOT NULL, '
+    'count INTEGER NOT NULL)')
+CREATE_TEMPORARY_DERIVED_TEXTNGRAM_TABLE_SQL = (
+    'CREATE TEMPORARY TABLE TextNGram ('
+    'text INTEGER NOT NULL, '
+    'ngram INTEGER NOT NULL, '
+    'size INTEGER NOT NULL, '
+    'count INTEGER NOT NULL)')
+CREATE_TEMPORARY_LABELLED_TEXT_TABLE_SQL = (
+    'CREATE TEMPORARY TABLE LabelledText ('
+    'id INTEGER PRIMARY KEY, '
+    'work TEXT NOT NULL, '
+    'siglum TEXT NOT NULL, '
+    'token_count INTEGER NOT NULL, '
+    'label TEXT NOT NULL)')
+# A view of the n-grams of one partition of TextNGram (or of one of
+# its size partitions), split by n-gram ID, which shadows the table.
+CREATE_TEMPORARY_TEXTNGRAM_HASH_VIEW_SQL = (
+    'CREATE TEMPORARY VIEW {0} AS SELECT * FROM main.{0} '
+    'WHERE ngram % {1} = {2}')
 CREATE_TEMPORARY_NGRAMS_TABLE_SQL = (
-    'CREATE TEMPORARY TABLE InputNGram (ngram TEXT)')
+    'CREATE TEMPORARY TABLE InputNGram (ngram TEXT PRIMARY KEY) '
+    'WITHOUT ROWID')
+CREATE_TEMPORARY_SEARCH_NGRAMS_TABLE_SQL = (
+    'CREATE TEMPORARY TABLE SearchNGram ('
+    'id INTEGER PRIMARY KEY, '
+    'size INTEGER NOT NULL)')
+CREATE_TEMPORARY_STAGED_NGRAM_COUNTS_TABLE_SQL = (
+    'CREATE TEMPORARY TABLE StagedNGramCount ('
+    'ngram TEXT NOT NULL, '
+    'count INTEGER NOT NULL)')
+CREATE_TEMPORARY_STAGED_NGRAMS_TABLE_SQL = (
+    'CREATE TEMPORARY TABLE StagedNGram ('
+    'size INTEGER NOT NULL, '
+    'position INTEGER NOT NULL, '
+    'ngram TEXT NOT NULL)')
 CREATE_TEMPORARY_RESULTS_TABLE_SQL = (
     'CREATE TEMPORARY TABLE InputResults ('
     'ngram TEXT NOT NULL, '
@@ -538,59 +1097,194 @@ CREATE_TEMPORARY_RESULTS_TABLE_SQL = (
     'siglum TEXT NOT NULL, '
     'count INTEGER NOT NULL, '
     'label TEXT NOT NULL)')
+DELETE_LABEL_NGRAM_SET_SQL = 'DELETE FROM LabelNGramSet WHERE id = ?'
+DELETE_LABEL_NGRAM_SET_TEXTS_SQL = (
+    'DELETE FROM LabelNGramSetText WHERE label_set = ?')
+DELETE_LABEL_NGRAMS_SQL = 'DELETE FROM LabelNGram WHERE label_set = ?'
+DELETE_NGRAM_STATS_ALL_PENDING_SQL = 'DELETE FROM NGramStatsPending'
+DELETE_NGRAM_STATS_PENDING_SQL = (
+    'DELETE FROM NGramStatsPending WHERE text = ? AND size = ?')
+DELETE_NGRAM_STATS_UNUSED_SQL = (
+    'DELETE FROM NGramStats WHERE witnesses = 0 '
+    'AND ngram IN (SELECT ngram FROM TextNGram WHERE text = ?)')
+DELETE_STAGED_NGRAM_COUNTS_SQL = 'DELETE FROM temp.StagedNGramCount'
+DELETE_TEMPORARY_LABELLED_TEXT_SQL = (
+    'DELETE FROM temp.LabelledText WHERE id = ?')
 DELETE_TEXT_HAS_NGRAMS_SQL = 'DELETE FROM TextHasNGram WHERE text = ?'
 DELETE_TEXT_NGRAMS_SQL = 'DELETE FROM TextNGram WHERE text = ?'
+DELETE_TEXT_NGRAM_STATS_PENDING_SQL = (
+    'DELETE FROM NGramStatsPending WHERE text = ?')
+DELETE_TEXT_SKETCH_SQL = 'DELETE FROM TextSketch WHERE text = ?'
+DELETE_TEXT_SUFFIX_ARRAY_SQL = 'DELETE FROM TextSuffixArray WHERE text = ?'
+DROP_TEMPORARY_CATALOGUE_TABLE_SQL = 'DROP TABLE IF EXISTS temp.Catalogue'
+DROP_TEMPORARY_DERIVED_NGRAM_TABLE_SQL = 'DROP TABLE IF EXISTS temp.NGram'
+DROP_TEMPORARY_DERIVED_TEXTHASNGRAM_TABLE_SQL = (
+    'DROP TABLE IF EXISTS temp.TextHasNGram')
+DROP_TEMPORARY_DERIVED_TEXTNGRAM_TABLE_SQL = (
+    'DROP TABLE IF EXISTS temp.TextNGram')
+DROP_TEMPORARY_LABELLED_TEXT_TABLE_SQL = (
+    'DROP TABLE IF EXISTS temp.LabelledText')
 DROP_TEMPORARY_NGRAMS_TABLE_SQL = 'DROP TABLE IF EXISTS InputNGram'
 DROP_TEMPORARY_RESULTS_TABLE_SQL = 'DROP TABLE IF EXISTS InputResults'
+DROP_TEMPORARY_SEARCH_NGRAMS_TABLE_SQL = (
+    'DROP TABLE IF EXISTS temp.SearchNGram')
+DROP_TEMPORARY_STAGED_NGRAM_COUNTS_TABLE_SQL = (
+    'DROP TABLE IF EXISTS temp.StagedNGramCount')
+DROP_TEMPORARY_STAGED_NGRAMS_TABLE_SQL = (
+    'DROP TABLE IF EXISTS temp.StagedNGram')
+DROP_TEXTNGRAM_COVERING_INDEX_SQL = (
+    'DROP INDEX IF EXISTS TextNGramIndexCovering')
 DROP_TEXTNGRAM_INDEX_SQL = 'DROP INDEX IF EXISTS TextNGramIndexTextNGram'
-INSERT_NGRAM_SQL = (
-    'INSERT INTO TextNGram (text, ngram, size, count) VALUES (?, ?, ?, ?)')
+DROP_TEXTNGRAM_PARTITION_INDEX_SQL = (
+    'DROP INDEX IF EXISTS TextNGram{}IndexTextNGram')
+INSERT_LABEL_NGRAM_SET_SQL = 'INSERT INTO LabelNGramSet (texts) VALUES (?)'
+INSERT_LABEL_NGRAM_SET_TEXT_SQL = (
+    'INSERT INTO LabelNGramSetText (label_set, text) VALUES (?, ?)')
+INSERT_LABEL_NGRAMS_SQL = (
+    'INSERT OR IGNORE INTO LabelNGram (label_set, ngram, size) '
+    'SELECT ?, TextNGram.ngram, TextNGram.size FROM LabelledText, TextNGram '
+    'WHERE LabelledText.label = ? AND LabelledText.id = TextNGram.text')
+INSERT_NGRAM_SQL = 'INSERT OR IGNORE INTO NGram (ngram, size) VALUES (?, ?)'
+INSERT_NGRAM_STATS_ALL_SQL = (
+    'INSERT INTO NGramStats (ngram, works, witnesses, count) '
+    'SELECT TextNGram.ngram, COUNT(DISTINCT Text.work), COUNT(*), '
+    'SUM(TextNGram.count) '
+    'FROM Text, TextNGram WHERE Text.id = TextNGram.text '
+    'GROUP BY TextNGram.ngram')
+INSERT_NGRAM_STATS_PENDING_SQL = (
+    'INSERT OR IGNORE INTO NGramStatsPending (text, size) VALUES (?, ?)')
+INSERT_NGRAM_STATS_SQL = (
+    'INSERT OR IGNORE INTO NGramStats (ngram, works, witnesses, count) '
+    'SELECT ngram, 0, 0, 0 FROM TextNGram WHERE text = ? AND size = ?')
+INSERT_NGRAM_STAGED_SQL = (
+    'INSERT OR IGNORE INTO NGram (ngram, size) '
+    'SELECT ngram, ? FROM temp.StagedNGramCount ORDER BY rowid')
+INSERT_SETTING_SQL = (
+    'INSERT OR REPLACE INTO Setting (name, value) VALUES (?, ?)')
+INSERT_STAGED_NGRAM_COUNTS_SQL = (
+    'INSERT INTO temp.StagedNGramCount (ngram, count) '
+    'SELECT ngram, COUNT(*) FROM temp.StagedNGram WHERE size = ? '
+    'GROUP BY ngram ORDER BY MIN(position)')
+INSERT_STAGED_NGRAM_SQL = (
+    'INSERT INTO temp.StagedNGram (size, position, ngram) VALUES (?, ?, ?)')
+INSERT_TEXT_SKETCH_SQL = (
+    'INSERT OR REPLACE INTO TextSketch (text, sketch) VALUES (?, ?)')
 INSERT_TEXT_HAS_NGRAM_SQL = (
     'INSERT INTO TextHasNGram (text, size, count) VALUES (?, ?, ?)')
+INSERT_TEXT_NGRAM_SQL = (
+    'INSERT INTO TextNGram (text, ngram, size, count) '
+    'SELECT ?, id, size, ? FROM NGram WHERE ngram = ?')
+INSERT_TEXT_NGRAM_STAGED_SQL = (
+    'INSERT INTO TextNGram (text, ngram, size, count) '
+    'SELECT ?, NGram.id, NGram.size, StagedNGramCount.count '
+    'FROM temp.StagedNGramCount CROSS JOIN NGram '
+    'ON NGram.ngram = StagedNGramCount.ngram '
+    'ORDER BY StagedNGramCount.rowid')
+INSERT_TEXT_SUFFIX_ARRAY_SQL = (
+    'INSERT INTO TextSuffixArray (text, tokens, suffixes, lcp) '
+    'VALUES (?, ?, ?, ?)')
 INSERT_TEXT_SQL = (
-    'INSERT INTO Text (work, siglum, checksum, token_count, label) '
+    'INSERT INTO Text '
+    '(work, siglum, checksum, token_count, label, file_size, mtime) '
+    'VALUES (?, ?, ?, ?, ?, ?, ?)')
+INSERT_TEMPORARY_CATALOGUE_SQL = (
+    'INSERT INTO temp.Catalogue (work, label) VALUES (?, ?)')
+INSERT_TEMPORARY_LABELLED_TEXT_SQL = (
+    'INSERT INTO temp.LabelledText (id, work, siglum, token_count, label) '
     'VALUES (?, ?, ?, ?, ?)')
-INSERT_TEMPORARY_NGRAM_SQL = 'INSERT INTO temp.InputNGram (ngram) VALUES (?)'
+INSERT_TEMPORARY_LABELLED_TEXTS_SQL = (
+    'INSERT INTO temp.LabelledText (id, work, siglum, token_count, label) '
+    'SELECT Text.id, Text.work, Text.siglum, Text.token_count, '
+    'Catalogue.label '
+    'FROM temp.Catalogue, Text WHERE Text.work = Catalogue.work')
+INSERT_TEMPORARY_NGRAM_SQL = (
+    'INSERT OR IGNORE INTO temp.InputNGram (ngram) VALUES (?)')
+INSERT_SEARCH_NGRAMS_SQL = (
+    'INSERT OR IGNORE INTO temp.SearchNGram (id, size) '
+    'SELECT NGram.id, NGram.size FROM temp.InputNGram, NGram '
+    'WHERE NGram.ngram = InputNGram.ngram')
+INSERT_SEARCH_NGRAMS_GLOB_SQL = (
+    'INSERT OR IGNORE INTO temp.SearchNGram (id, size) '
+    'SELECT id, size FROM NGram WHERE ngram GLOB ?')
+INSERT_SEARCH_NGRAMS_PATTERN_SQL = (
+    'INSERT OR IGNORE INTO temp.SearchNGram (id, size) '
+    'SELECT NGram.id, NGram.size FROM NGramPattern, NGram '
+    'WHERE NGramPattern.ngram GLOB ? AND NGram.id = NGramPattern.rowid')
+INSERT_TOKEN_SQL = 'INSERT INTO Token (token) VALUES (?)'
 INSERT_TEMPORARY_RESULTS_SQL = (
     'INSERT INTO temp.InputResults '
     '(ngram, size, work, siglum, count, label) '
     'VALUES (?, ?, ?, ?, ?, ?)')
 PRAGMA_CACHE_SIZE_SQL = 'PRAGMA cache_size={}'
 PRAGMA_COUNT_CHANGES_SQL = 'PRAGMA count_changes=OFF'
+PRAGMA_DATABASE_LIST_SQL = 'PRAGMA database_list'
 PRAGMA_FOREIGN_KEYS_SQL = 'PRAGMA foreign_keys=ON'
 PRAGMA_LOCKING_MODE_SQL = 'PRAGMA locking_mode=EXCLUSIVE'
+PRAGMA_SET_USER_VERSION_SQL = 'PRAGMA user_version={}'
 PRAGMA_SYNCHRONOUS_SQL = 'PRAGMA synchronous=OFF'
 PRAGMA_TEMP_STORE_SQL = 'PRAGMA temp_store=MEMORY'
+PRAGMA_USER_VERSION_SQL = 'PRAGMA user_version'
+REBUILD_NGRAMPATTERN_SQL = (
+    "INSERT INTO NGramPattern (NGramPattern) VALUES ('rebuild')")
+
 SELECT_COUNTS_SQL = (
-    'SELECT Text.work, Text.siglum, '
+    'SELECT LabelledText.work, LabelledText.siglum, '
     'TextHasNGram.size, TextHasNGram.count AS "%s", '
-    'Text.token_count + 1 - TextHasNGram.size AS "%s", '
-    'Text.token_count AS "%s", Text.label '
-    'FROM Text, TextHasNGram '
-    'WHERE Text.id = TextHasNGram.text AND Text.label IN ({}) '
-    'ORDER BY Text.work, TextHasNGram.size' % (
+    'LabelledText.token_count + 1 - TextHasNGram.size AS "%s", '
+    'LabelledText.token_count AS "%s", LabelledText.label '
+    'FROM LabelledText, TextHasNGram '
+    'WHERE LabelledText.id = TextHasNGram.text AND LabelledText.label IN ({}) '
+    'ORDER BY LabelledText.work, TextHasNGram.size' % (
         UNIQUE_NGRAMS_FIELDNAME, TOTAL_NGRAMS_FIELDNAME,
         TOTAL_TOKENS_FIELDNAME))
+# In each diff query, the unary + stops TextNGram.ngram IN (...) from
+# being used to look up each of the (typically very many) n-grams in
+# the subquery in the index for every labelled witness; instead the
+# n-grams of each witness are read once and checked against them.
 SELECT_DIFF_ASYMMETRIC_SQL = (
-    'SELECT TextNGram.ngram, TextNGram.size, '
-    'Text.work, Text.siglum, TextNGram.count, Text.label '
-    'FROM Text, TextNGram '
-    'WHERE Text.label = ? AND Text.id = TextNGram.text '
-    'AND TextNGram.ngram IN ('
-    'SELECT TextNGram.ngram FROM Text, TextNGram '
-    'WHERE Text.id = TextNGram.text AND Text.label = ? '
+    'SELECT NGram.ngram, TextNGram.size, '
+    'LabelledText.work, LabelledText.siglum, TextNGram.count, '
+    'LabelledText.label '
+    'FROM LabelledText, TextNGram, NGram '
+    'WHERE LabelledText.label = ? AND LabelledText.id = TextNGram.text '
+    'AND NGram.id = TextNGram.ngram '
+    'AND +TextNGram.ngram IN ('
+    'SELECT TextNGram.ngram FROM LabelledText, TextNGram '
+    'WHERE LabelledText.id = TextNGram.text AND LabelledText.label = ? '
     'EXCEPT '
-    'SELECT TextNGram.ngram FROM Text, TextNGram '
-    'WHERE Text.id = TextNGram.text AND Text.label IN ({}))')
+    'SELECT TextNGram.ngram FROM LabelledText, TextNGram '
+    'WHERE LabelledText.id = TextNGram.text AND LabelledText.label IN ({}))')
+SELECT_DIFF_ASYMMETRIC_CACHED_SQL = (
+    'SELECT NGram.ngram, TextNGram.size, '
+    'LabelledText.work, LabelledText.siglum, TextNGram.count, '
+    'LabelledText.label '
+    'FROM LabelledText, TextNGram, NGram '
+    'WHERE LabelledText.label = ? AND LabelledText.id = TextNGram.text '
+    'AND NGram.id = TextNGram.ngram '
+    'AND +TextNGram.ngram IN ('
+    'SELECT ngram FROM LabelNGram WHERE label_set = ? '
+    'EXCEPT '
+    'SELECT ngram FROM LabelNGram WHERE label_set IN ({}))')
+SELECT_DIFF_CACHED_SQL = (
+    'SELECT NGram.ngram, TextNGram.size, LabelledText.work, '
+    'LabelledText.siglum, TextNGram.count, LabelledText.label '
+    'FROM LabelledText, TextNGram, NGram '
+    'WHERE LabelledText.label IN ({}) AND LabelledText.id = TextNGram.text '
+    'AND NGram.id = TextNGram.ngram '
+    'AND +TextNGram.ngram IN ('
+    'SELECT ngram FROM LabelNGram WHERE label_set IN ({}) '
+    'GROUP BY ngram HAVING COUNT(*) = 1)')
 SELECT_DIFF_SQL = (
-    'SELECT TextNGram.ngram, TextNGram.size, Text.work, Text.siglum, '
-    'TextNGram.count, Text.label '
-    'FROM Text, TextNGram '
-    'WHERE Text.label IN ({}) AND Text.id = TextNGram.text '
-    'AND TextNGram.ngram IN ('
-    'SELECT TextNGram.ngram FROM Text, TextNGram '
-    'WHERE Text.id = TextNGram.text AND Text.label IN ({}) '
-    'GROUP BY TextNGram.ngram HAVING COUNT(DISTINCT Text.label) = 1)')
+    'SELECT NGram.ngram, TextNGram.size, LabelledText.work, '
+    'LabelledText.siglum, TextNGram.count, LabelledText.label '
+    'FROM LabelledText, TextNGram, NGram '
+    'WHERE LabelledText.label IN ({}) AND LabelledText.id = TextNGram.text '
+    'AND NGram.id = TextNGram.ngram '
+    'AND +TextNGram.ngram IN ('
+    'SELECT TextNGram.ngram FROM LabelledText, TextNGram '
+    'WHERE LabelledText.id = TextNGram.text AND LabelledText.label IN ({}) '
+    'GROUP BY TextNGram.ngram '
+    'HAVING MIN(LabelledText.label) = MAX(LabelledText.label))')
 SELECT_DIFF_SUPPLIED_SQL = (
     'SELECT ngram, size, work, siglum, count, label '
     'FROM temp.InputResults '
@@ -599,17 +1293,34 @@ SELECT_DIFF_SUPPLIED_SQL = (
     'GROUP BY ngram HAVING COUNT(DISTINCT label) = 1)')
 SELECT_HAS_NGRAMS_SQL = (
     'SELECT text FROM TextHasNGram WHERE text = ? AND size = ?')
+SELECT_HAS_NGRAM_STATS_SQL = 'SELECT ngram FROM NGramStats LIMIT 1'
+SELECT_HAS_NGRAM_STATS_PENDING_SQL = (
+    'SELECT text FROM NGramStatsPending LIMIT 1')
+SELECT_HAS_SUFFIX_ARRAY_SQL = (
+    'SELECT text FROM TextSuffixArray WHERE text = ?')
+SELECT_INTERSECT_CACHED_SUB_EXTRA_SQL = ' AND ngram IN ({})'
+SELECT_INTERSECT_CACHED_SUB_SQL = (
+    'SELECT ngram FROM LabelNGram WHERE label_set = ?')
+SELECT_INTERSECT_GROUPED_CACHED_SUB_SQL = (
+    'SELECT ngram FROM LabelNGram WHERE label_set IN ({}) '
+    'GROUP BY ngram HAVING COUNT(*) = ?')
+SELECT_INTERSECT_GROUPED_SUB_SQL = (
+    'SELECT TextNGram.ngram FROM LabelledText, TextNGram '
+    'WHERE LabelledText.id = TextNGram.text AND LabelledText.label IN ({}) '
+    'GROUP BY TextNGram.ngram HAVING COUNT(DISTINCT LabelledText.label) = ?')
 SELECT_INTERSECT_SQL = (
-    'SELECT TextNGram.ngram, TextNGram.size, '
-    'Text.work, Text.siglum, TextNGram.count, Text.label '
-    'FROM Text, TextNGram '
-    'WHERE Text.label IN ({}) AND Text.id = TextNGram.text '
+    'SELECT NGram.ngram, TextNGram.size, '
+    'LabelledText.work, LabelledText.siglum, TextNGram.count, '
+    'LabelledText.label '
+    'FROM LabelledText, TextNGram, NGram '
+    'WHERE LabelledText.label IN ({}) AND LabelledText.id = TextNGram.text '
+    'AND NGram.id = TextNGram.ngram '
     'AND TextNGram.ngram IN ({})')
 SELECT_INTERSECT_SUB_EXTRA_SQL = ' AND TextNGram.ngram IN ({})'
 SELECT_INTERSECT_SUB_SQL = (
     'SELECT TextNGram.ngram '
-    'FROM Text, TextNGram '
-    'WHERE Text.label = ? AND Text.id = TextNGram.text')
+    'FROM LabelledText, TextNGram '
+    'WHERE LabelledText.label = ? AND LabelledText.id = TextNGram.text')
 SELECT_INTERSECT_SUPPLIED_SQL = (
     'SELECT ngram, size, work, siglum, count, label '
     'FROM temp.InputResults '
@@ -617,15 +1328,163 @@ SELECT_INTERSECT_SUPPLIED_SQL = (
     'SELECT ngram FROM temp.InputResults '
     'GROUP BY ngram HAVING COUNT(DISTINCT label) = ?)')
 SELECT_SEARCH_SQL = (
-    'SELECT TextNGram.ngram, TextNGram.size, Text.work, Text.siglum, '
-    'TextNGram.count, Text.label '
-    'FROM Text, TextNGram '
-    'WHERE Text.label IN ({}) AND Text.id = TextNGram.text '
-    'AND TextNGram.ngram IN (SELECT ngram FROM temp.InputNGram)')
-SELECT_TEXT_TOKEN_COUNT_SQL = (
-    'SELECT Text.token_count FROM Text WHERE Text.work = ?')
-SELECT_TEXT_SQL = 'SELECT id, checksum FROM Text WHERE work = ? AND siglum = ?'
-UPDATE_LABEL_SQL = 'UPDATE Text SET label = ? WHERE work = ?'
-UPDATE_LABELS_SQL = 'UPDATE Text SET label = ?'
-UPDATE_TEXT_SQL = 'UPDATE Text SET checksum = ?, token_count = ? WHERE id = ?'
+    'SELECT NGram.ngram, TextNGram.size, LabelledText.work, '
+    'LabelledText.siglum, TextNGram.count, LabelledText.label '
+    'FROM LabelledText, TextNGram, NGram, temp.SearchNGram '
+    'WHERE LabelledText.label IN ({}) AND LabelledText.id = TextNGram.text '
+    'AND NGram.id = TextNGram.ngram AND SearchNGram.id = TextNGram.ngram')
+SELECT_SEARCH_NGRAM_SIZES_SQL = (
+    'SELECT MIN(size) AS minimum, MAX(size) AS maximum '
+    'FROM temp.SearchNGram')
+SELECT_LABEL_NGRAM_SET_SQL = 'SELECT id FROM LabelNGramSet WHERE texts = ?'
+SELECT_LABEL_TEXTS_SQL = (
+    'SELECT id FROM LabelledText WHERE label = ? ORDER BY id')
+SELECT_LABELLED_SKETCHES_SQL = (
+    'SELECT LabelledText.id, LabelledText.label, TextSketch.sketch '
+    'FROM LabelledText LEFT JOIN TextSketch '
+    'ON LabelledText.id = TextSketch.text '
+    'WHERE LabelledText.label IN ({})')
+SELECT_LABELLED_SUFFIX_ARRAY_TEXTS_SQL = (
+    'SELECT TextSuffixArray.text, Text.checksum '
+    'FROM LabelledText, TextSuffixArray, Text '
+    'WHERE LabelledText.id = TextSuffixArray.text '
+    'AND Text.id = TextSuffixArray.text')
+# Adds columns to the results of a query giving, for the n-gram and
+# label of each row, the sum of the maximum count of the n-gram in
+# each work with that label (the label count), and the number of
+# those works with a non-zero count (the label work count), as used
+# by Results.add_label_count and Results.add_label_work_count.
+SELECT_LABEL_COUNTS_SQL = (
+    'WITH LabelResult AS ({}) '
+    'SELECT LabelResult.*{} FROM LabelResult, ('
+    'SELECT label, ngram, SUM(count) AS label_count, '
+    'SUM(count > 0) AS label_work_count FROM ('
+    'SELECT label, ngram, MAX(count) AS count FROM LabelResult '
+    'GROUP BY label, ngram, work) '
+    'GROUP BY label, ngram) AS LabelCount '
+    'WHERE LabelResult.label = LabelCount.label '
+    'AND LabelResult.ngram = LabelCount.ngram')
+SELECT_LABEL_COUNT_COLUMN_SQL = ', LabelCount.label_count'
+SELECT_LABEL_WORK_COUNT_COLUMN_SQL = ', LabelCount.label_work_count'
+# Restricts the results of a query to the n-grams whose rows meet
+# the conditions, each of which is on the maximum count of the
+# n-gram in each work.
+SELECT_LIMITED_NGRAMS_SQL = (
+    'WITH Result AS ({}) '
+    'SELECT Result.* FROM Result, ('
+    'SELECT ngram FROM ('
+    'SELECT ngram, MAX(count) AS count FROM Result GROUP BY ngram, work) '
+    'GROUP BY ngram HAVING {}) AS Limited '
+    'WHERE Result.ngram = Limited.ngram')
+# Restricts the results of a query to the n-grams whose corpus-wide
+# statistics meet the conditions, as a cheap prefilter for limits on
+# the works and total count of the n-grams in the results, which
+# can never be greater than those in the whole corpus.
+SELECT_NGRAM_STATS_LIMIT_SQL = (
+    ' AND TextNGram.ngram IN (SELECT ngram FROM NGramStats WHERE {})')
+SELECT_NGRAM_STATS_PENDING_SQL = (
+    'SELECT text, size FROM NGramStatsPending ORDER BY text, size')
+SELECT_NGRAM_STATS_SIZE_MAXIMUM_SQL = ' AND NGram.size <= ?'
+SELECT_NGRAM_STATS_SIZE_MINIMUM_SQL = ' AND NGram.size >= ?'
+SELECT_NGRAM_STATS_SQL = (
+    'SELECT NGram.ngram, NGram.size, NGramStats.works, '
+    'NGramStats.witnesses, NGramStats.count '
+    'FROM NGram, NGramStats WHERE NGram.id = NGramStats.ngram')
+SELECT_SETTING_SQL = 'SELECT value FROM Setting WHERE name = ?'
+SELECT_SIZES_SQL = 'SELECT DISTINCT size FROM TextHasNGram ORDER BY size'
+SELECT_SIZE_MAXIMUM_SQL = ' AND TextNGram.size <= ?'
+SELECT_SIZE_MINIMUM_SQL = ' AND TextNGram.size >= ?'
+SELECT_STAGED_NGRAM_COUNTS_SQL = 'SELECT COUNT(*) FROM temp.StagedNGramCount'
+SELECT_STAGED_NGRAMS_SQL = 'SELECT ngram FROM temp.StagedNGramCount'
+SELECT_SUFFIX_ARRAY_SQL = (
+    'SELECT tokens, suffixes, lcp FROM TextSuffixArray WHERE text = ?')
+SELECT_SUPPLIED_SIZE_MAXIMUM_SQL = ' AND size <= ?'
+SELECT_SUPPLIED_SIZE_MINIMUM_SQL = ' AND size >= ?'
+SELECT_SUPPLIED_WITNESS_SIZE_ORDER_SQL = ' ORDER BY work, siglum, size'
+# The token count of each work is that of its first witness.
+SELECT_TEMPORARY_LABEL_TOKEN_COUNTS_SQL = (
+    'SELECT Catalogue.label, SUM(Text.token_count) AS token_count '
+    'FROM temp.Catalogue, Text '
+    'WHERE Text.id = (SELECT MIN(id) FROM Text WHERE work = Catalogue.work) '
+    'GROUP BY Catalogue.label')
+SELECT_TEXT_LABEL_NGRAM_SETS_SQL = (
+    'SELECT label_set FROM LabelNGramSetText WHERE text = ?')
+SELECT_TEXT_SKETCH_SQL = (
+    'SELECT Text.token_count, TextSketch.sketch '
+    'FROM Text LEFT JOIN TextSketch ON Text.id = TextSketch.text '
+    'WHERE Text.id = ?')
+SELECT_TEMPORARY_LABELLED_TEXTS_SQL = (
+    'SELECT id, work, siglum, token_count, label FROM temp.LabelledText')
+SELECT_TEXTNGRAM_TABLES_SQL = (
+    "SELECT name FROM main.sqlite_master WHERE type = 'table' "
+    "AND (name = 'TextNGram' OR name GLOB 'TextNGram[0-9]*')")
+SELECT_TEXT_TABLE_SQL = (
+    "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'Text'")
+SELECT_TEXT_SIZES_SQL = (
+    'SELECT Text.work, Text.siglum, Text.checksum, TextHasNGram.size '
+    'FROM Text LEFT JOIN TextHasNGram ON Text.id = TextHasNGram.text')
+SELECT_TEXT_SQL = (
+    'SELECT id, checksum, file_size, mtime FROM Text '
+    'WHERE work = ? AND siglum = ?')
+SELECT_TOKENS_SQL = 'SELECT id, token FROM Token'
+SELECT_WITNESS_SIZE_ORDER_SQL = (
+    ' ORDER BY LabelledText.work, LabelledText.siglum, TextNGram.size')
+# Whether a witness other than that with ID ?1, of the same work and
+# with its n-grams counted in the statistics, has the n-gram of the
+# NGramStats row being updated.
+NGRAM_STATS_OTHER_WITNESS_SQL = (
+    'EXISTS (SELECT 1 FROM Text AS Witness, Text AS Other, '
+    'TextNGram AS OtherNGram '
+    'WHERE Witness.id = ?1 AND Other.work = Witness.work '
+    'AND Other.id != ?1 AND OtherNGram.text = Other.id '
+    'AND OtherNGram.ngram = NGramStats.ngram '
+    'AND NOT EXISTS (SELECT 1 FROM NGramStatsPending '
+    'WHERE NGramStatsPending.text = Other.id '
+    'AND NGramStatsPending.size = OtherNGram.size))')
+UPDATE_NGRAM_STATS_ADD_SQL = (
+    'UPDATE NGramStats SET witnesses = witnesses + 1, '
+    'count = count + (SELECT TextNGram.count FROM TextNGram '
+    'WHERE TextNGram.text = ?1 AND TextNGram.ngram = NGramStats.ngram), '
+    'works = works + (NOT {}) '
+    'WHERE ngram IN ('
+    'SELECT ngram FROM TextNGram WHERE text = ?1 AND size = ?2)'.format(
+        NGRAM_STATS_OTHER_WITNESS_SQL))
+# Removes the witness with ID ?1 from the statistics of its n-grams
+# of those sizes that have been counted.
+UPDATE_NGRAM_STATS_REMOVE_SQL = (
+    'UPDATE NGramStats SET witnesses = witnesses - 1, '
+    'count = count - (SELECT TextNGram.count FROM TextNGram '
+    'WHERE TextNGram.text = ?1 AND TextNGram.ngram = NGramStats.ngram), '
+    'works = works - (NOT {}) '
+    'WHERE ngram IN ('
+    'SELECT TextNGram.ngram FROM TextNGram WHERE TextNGram.text = ?1 '
+    'AND NOT EXISTS (SELECT 1 FROM NGramStatsPending '
+    'WHERE NGramStatsPending.text = ?1 '
+    'AND NGramStatsPending.size = TextNGram.size))'.format(
+        NGRAM_STATS_OTHER_WITNESS_SQL))
+UPDATE_TEXT_FILE_STAT_SQL = (
+    'UPDATE Text SET file_size = ?, mtime = ? WHERE id = ?')
+UPDATE_TEXT_SQL = (
+    'UPDATE Text SET checksum = ?, token_count = ?, file_size = ?, '
+    'mtime = ? WHERE id = ?')
+UPGRADE_0_COPY_NGRAMS_SQL = (
+    'INSERT INTO NGram (ngram, size) '
+    'SELECT DISTINCT ngram, size FROM OldTextNGram')
+UPGRADE_0_COPY_TEXT_NGRAMS_SQL = (
+    'INSERT INTO TextNGram (text, ngram, size, count) '
+    'SELECT OldTextNGram.text, NGram.id, OldTextNGram.size, '
+    'OldTextNGram.count '
+    'FROM OldTextNGram, NGram WHERE NGram.ngram = OldTextNGram.ngram '
+    'ORDER BY OldTextNGram.rowid')
+UPGRADE_0_DROP_TEXTNGRAM_SQL = 'DROP TABLE OldTextNGram'
+UPGRADE_0_RENAME_TEXTNGRAM_SQL = (
+    'ALTER TABLE TextNGram RENAME TO OldTextNGram')
+UPGRADE_1_ADD_TEXT_FILE_SIZE_SQL = (
+    'ALTER TABLE Text ADD COLUMN file_size INTEGER')
+UPGRADE_1_ADD_TEXT_MTIME_SQL = 'ALTER TABLE Text ADD COLUMN mtime INTEGER'
+UPGRADE_3_SELECT_NGRAMS_SQL = (
+    'SELECT TextNGram.text, NGram.ngram FROM TextNGram, NGram '
+    'WHERE NGram.id = TextNGram.ngram')
+UPGRADE_3_SELECT_TEXT_NGRAM_COUNTS_SQL = (
+    'SELECT text, SUM(count) AS count FROM TextHasNGram GROUP BY text')
 VACUUM_SQL = 'VACUUM'
@@ -32,6 +32,14 @@ class Corpus:
         return [os.path.splitext(os.path.basename(path))[0]
                 for path in glob.glob(os.path.join(self._path, work, '*.txt'))]
 
+    def get_tokenizer(self):
+        """Returns the tokenizer used by this corpus.
+
+        :rtype: `Tokenizer`
+
+        """
+        return self._tokenizer
+
     def get_witness(self, work, siglum, text_class=WitnessText):
         """Returns a `WitnessText` representing the file associated with
         `work` and `siglum`.
@@ -49,20 +57,53 @@ class Corpus:
         filename = os.path.join(work, siglum + '.txt')
         self._logger.debug('Creating WitnessText object from {}'.format(
             filename))
+        # The file is statted before it is read, so that a change made
+        # while reading it is detected as a change later on.
+        file_stat = self.get_witness_file_stat(work, siglum)
         with open(os.path.join(self._path, filename), encoding='utf-8') \
                 as fh:
             content = fh.read()
-        return text_class(work, siglum, content, self._tokenizer)
+        return text_class(work, siglum, content, self._tokenizer,
+                          file_stat=file_stat)
 
-    def get_witnesses(self, name='*'):
-        """Returns a generator supplying `WitnessText` objects for each file
-        in the corpus.
+    def get_witness_file_stat(self, work, siglum):
+        """Returns the size and modification time of the file associated
+        with `work` and `siglum`.
 
-        :rtype: `generator` of `WitnessText`
+        The modification time is given in nanoseconds, so that it may
+        be compared exactly with a previously recorded value.
+
+        :param work: name of work
+        :type work: `str`
+        :param siglum: siglum of witness
+        :type siglum: `str`
+        :rtype: `tuple` of `int`
+
+        """
+        stat = os.stat(os.path.join(self._path, work, siglum + '.txt'))
+        return stat.st_size, stat.st_mtime_ns
+
+    def get_witness_names(self, name='*'):
+        """Returns a generator supplying the work name and siglum of each
+        witness file in the corpus.
+
+        Unlike `get_witnesses`, this does not read the files.
+
+        :rtype: `generator` of `tuple`
 
         """
         for filepath in glob.glob(os.path.join(self._path, name, '*.txt')):
             if os.path.isfile(filepath):
                 name = os.path.split(os.path.split(filepath)[0])[1]
                 siglum = os.path.splitext(os.path.basename(filepath))[0]
-                yield self.get_witness(name, siglum)
+                yield name, siglum
+
+    def get_witnesses(self, name='*'):
+        """Returns a generator supplying `WitnessText` objects for each file
+        in the corpus.
+
+        :rtype: `generator` of `WitnessText`
+
+        """
+        for work, siglum in self.get_witness_names(name):
+            yield self.get_witness(work, siglum)
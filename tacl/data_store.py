@@ -1,16 +1,29 @@
 """Module containing the DataStore class."""
 
+import collections
 import csv
+import heapq
+import io
+import itertools
 import logging
+import multiprocessing
+import multiprocessing.connection
+import operator
 import os.path
+import pathlib
+import re
 import sqlite3
-import sys
-import tempfile
-
-import pandas as pd
+import time
 
 from . import constants
-from .exceptions import MalformedQueryError
+from .exceptions import MalformedQueryError, OutdatedDataStoreError, \
+    TACLError
+from .profiler import QueryProfiler
+from .results_io import detect_format, get_label_results_writer, \
+    get_results_writer, read_results
+from .sketch import NGramSketch
+from .suffix_array import SuffixArray
+from .text import WitnessText
 
 
 class DataStore:
@@ -22,13 +35,39 @@ class DataStore:
 
     """
 
-    def __init__(self, db_name, use_memory=True, ram=0):
+    # Positions of fields in a row of n-gram query results.
+    _NGRAM_INDEX = constants.QUERY_FIELDNAMES.index(constants.NGRAM_FIELDNAME)
+    _SIZE_INDEX = constants.QUERY_FIELDNAMES.index(constants.SIZE_FIELDNAME)
+    _WORK_INDEX = constants.QUERY_FIELDNAMES.index(constants.WORK_FIELDNAME)
+    _SIGLUM_INDEX = constants.QUERY_FIELDNAMES.index(
+        constants.SIGLUM_FIELDNAME)
+    _COUNT_INDEX = constants.QUERY_FIELDNAMES.index(constants.COUNT_FIELDNAME)
+    _LABEL_INDEX = constants.QUERY_FIELDNAMES.index(constants.LABEL_FIELDNAME)
+    # Key by which diff results are ordered: work, siglum and size.
+    _witness_size_key = operator.itemgetter(_WORK_INDEX, _SIGLUM_INDEX,
+                                            _SIZE_INDEX)
+
+    def __init__(self, db_name, use_memory=True, ram=0, cache=False,
+                 read_only=False, results_format=constants.RESULTS_FORMAT_CSV,
+                 profile=False):
         self._logger = logging.getLogger(__name__)
+        self._cache = cache
+        self._results_format = results_format
         if db_name == ':memory:':
             self._db_name = db_name
+            read_only = False
         else:
             self._db_name = os.path.abspath(db_name)
-        self._conn = sqlite3.connect(self._db_name)
+        self._read_only = read_only
+        if read_only:
+            # Queries only write to temporary tables, so a read-only
+            # database can be queried by any number of processes at
+            # once.
+            uri = constants.READ_ONLY_DATABASE_URI.format(
+                pathlib.Path(self._db_name).as_uri())
+            self._conn = sqlite3.connect(uri, uri=True)
+        else:
+            self._conn = sqlite3.connect(self._db_name)
         self._conn.row_factory = sqlite3.Row
         if use_memory:
             self._conn.execute(constants.PRAGMA_TEMP_STORE_SQL)
@@ -38,18 +77,224 @@ class DataStore:
                     cache_size))
         self._conn.execute(constants.PRAGMA_COUNT_CHANGES_SQL)
         self._conn.execute(constants.PRAGMA_FOREIGN_KEYS_SQL)
-        self._conn.execute(constants.PRAGMA_LOCKING_MODE_SQL)
-        self._conn.execute(constants.PRAGMA_SYNCHRONOUS_SQL)
+        if not read_only:
+            self._conn.execute(constants.PRAGMA_LOCKING_MODE_SQL)
+            self._conn.execute(constants.PRAGMA_SYNCHRONOUS_SQL)
+        # The sizes of the n-grams of each witness, keyed by its ID
+        # and checksum, derived from a suffix index into the
+        # temporary tables of this connection.
+        self._derived_sizes = None
+        self._profiler = None
+        if profile:
+            self._profiler = QueryProfiler(self._conn)
 
     def _add_indices(self):
-        """Adds the database indices relating to n-grams."""
+        """Adds the database indices relating to n-grams.
+
+        The indices depend on the layout of the database; the
+        clustered layout needs none, and the partitioned layout needs
+        one for each partition. A database with a suffix index has no
+        n-gram tables to index.
+
+        """
+        if self._get_setting(constants.INDEX_SETTING) == \
+                constants.INDEX_SUFFIX:
+            return
         self._logger.info('Adding database indices')
-        self._conn.execute(constants.CREATE_INDEX_TEXTNGRAM_SQL)
+        layout = self._get_setting(constants.LAYOUT_SETTING)
+        if layout == constants.LAYOUT_COVERING:
+            self._conn.execute(constants.CREATE_INDEX_TEXTNGRAM_COVERING_SQL)
+        elif layout == constants.LAYOUT_PARTITIONED:
+            for size in self._get_sizes():
+                self._conn.execute(
+                    constants.CREATE_INDEX_TEXTNGRAM_PARTITION_SQL.format(
+                        size))
+        elif layout != constants.LAYOUT_CLUSTERED:
+            self._conn.execute(constants.CREATE_INDEX_TEXTNGRAM_SQL)
         self._logger.info('Indices added')
 
-    def add_ngrams(self, corpus, minimum, maximum, catalogue=None):
+    def _add_all_ngram_stats(self):
+        """Adds the statistics of every n-gram, aggregated from
+        TextNGram, to an empty NGramStats table."""
+        self._logger.info('Adding the statistics of each n-gram')
+        if self._get_setting(constants.LAYOUT_SETTING) == \
+                constants.LAYOUT_PARTITIONED:
+            sizes = self._get_sizes()
+        else:
+            sizes = [None]
+        for size in sizes:
+            self._conn.execute(self._get_partition_sql(
+                constants.INSERT_NGRAM_STATS_ALL_SQL, size))
+
+    def _add_derived_ngrams(self, minimum=None, maximum=None, sizes=None):
+        """Adds the n-grams (`minimum` <= n <= `maximum`, or of
+        `sizes`) of the labelled witnesses, derived from their suffix
+        arrays, to temporary NGram, TextNGram and TextHasNGram tables,
+        if the database has a suffix index.
+
+        The temporary tables take the place of the tables of a
+        database with an n-gram index, so the same queries can be run
+        against either. If `minimum` or `maximum` is not supplied, the
+        size given when the suffix arrays were added is used.
+
+        The derived n-grams are kept for later queries on this
+        connection, and only those of witnesses and sizes not already
+        derived are added. If a witness that is no longer labelled
+        (or has since changed) was derived, the tables are instead
+        rebuilt, so that they hold no more than the n-grams of the
+        labelled witnesses.
+
+        :param minimum: minimum n-gram size
+        :type minimum: `int`
+        :param maximum: maximum n-gram size
+        :type maximum: `int`
+        :param sizes: sizes of n-grams, in place of a range
+        :type sizes: `set` of `int`
+
+        """
+        if self._get_setting(constants.INDEX_SETTING) != \
+                constants.INDEX_SUFFIX:
+            return
+        if sizes is None:
+            if minimum is None:
+                minimum = int(self._get_setting(
+                    constants.MINIMUM_SIZE_SETTING))
+            if maximum is None:
+                maximum = int(self._get_setting(
+                    constants.MAXIMUM_SIZE_SETTING))
+            sizes = set(range(minimum, maximum + 1))
+        texts = [(row['text'], row['checksum']) for row in self._conn.execute(
+            constants.SELECT_LABELLED_SUFFIX_ARRAY_TEXTS_SQL)]
+        rebuild = self._derived_sizes is None or \
+            not set(self._derived_sizes).issubset(texts)
+        if rebuild:
+            for sql in (
+                    constants.DROP_TEMPORARY_DERIVED_NGRAM_TABLE_SQL,
+                    constants.DROP_TEMPORARY_DERIVED_TEXTNGRAM_TABLE_SQL,
+                    constants.DROP_TEMPORARY_DERIVED_TEXTHASNGRAM_TABLE_SQL,
+                    constants.CREATE_TEMPORARY_DERIVED_NGRAM_TABLE_SQL,
+                    constants.CREATE_TEMPORARY_DERIVED_TEXTNGRAM_TABLE_SQL,
+                    constants.CREATE_TEMPORARY_DERIVED_TEXTHASNGRAM_TABLE_SQL):
+                self._conn.execute(sql)
+            self._derived_sizes = {}
+        missing = []
+        for text in texts:
+            text_sizes = sizes - self._derived_sizes.get(text, set())
+            if text_sizes:
+                missing.append((text, sorted(text_sizes)))
+        if not (missing or rebuild):
+            return
+        self._logger.info(
+            'Deriving n-grams of sizes {} of {} witnesses from suffix '
+            'arrays'.format(', '.join(str(size) for size in sorted(sizes)),
+                            len(missing)))
+        joiner = self._get_setting(constants.JOINER_SETTING)
+        tokens = {row['id']: row['token'] for row in
+                  self._conn.execute(constants.SELECT_TOKENS_SQL)}
+        for text, text_sizes in missing:
+            text_id = text[0]
+            row = self._conn.execute(constants.SELECT_SUFFIX_ARRAY_SQL,
+                                     [text_id]).fetchone()
+            suffix_array = SuffixArray.from_bytes(
+                row['tokens'], row['suffixes'], row['lcp'])
+            text_tokens = [tokens[token_id] for token_id in
+                           suffix_array.get_tokens()]
+            for size in text_sizes:
+                ngrams = {}
+                for position, count in suffix_array.get_ngram_counts(size):
+                    ngrams[joiner.join(
+                        text_tokens[position:position + size])] = count
+                self._add_text_size_ngrams(text_id, size, ngrams)
+            self._derived_sizes.setdefault(text, set()).update(text_sizes)
+        if rebuild:
+            # Adding the index once the tables are populated is
+            # quicker than maintaining it; later additions maintain
+            # it.
+            self._conn.execute(
+                constants.CREATE_INDEX_TEMPORARY_DERIVED_TEXTNGRAM_SQL)
+        self._analyse('temp.TextNGram')
+
+    @staticmethod
+    def _add_label_counts(query, label_counts):
+        """Returns `query` with the columns specified by
+        `label_counts` added to its results.
+
+        As in `Results.add_label_count`, the label count of a row is
+        the sum of the maximum count of its n-gram in each work with
+        its label; as in `Results.add_label_work_count`, the label
+        work count is the number of those works with a non-zero count.
+
+        :param query: query selecting n-gram results
+        :type query: `str`
+        :param label_counts: whether to add the label count and the
+                             label work count columns, or None
+        :type label_counts: `tuple` of `bool`
+        :rtype: `str`
+
+        """
+        if label_counts is None or not any(label_counts):
+            return query
+        label_count, label_work_count = label_counts
+        columns = ''
+        if label_count:
+            columns += constants.SELECT_LABEL_COUNT_COLUMN_SQL
+        if label_work_count:
+            columns += constants.SELECT_LABEL_WORK_COUNT_COLUMN_SQL
+        return constants.SELECT_LABEL_COUNTS_SQL.format(query, columns)
+
+    def _add_label_counts_to_rows(self, rows, label_counts):
+        """Returns `rows` with the columns specified by `label_counts`
+        added to each, as `_add_label_counts` does in SQL.
+
+        :param rows: rows of results
+        :type rows: `list` of `sqlite3.Row`
+        :param label_counts: whether to add the label count and the
+                             label work count columns
+        :type label_counts: `tuple` of `bool`
+        :rtype: `list` of `tuple`
+
+        """
+        label_count, label_work_count = label_counts
+        ngram_index = self._NGRAM_INDEX
+        label_index = self._LABEL_INDEX
+        work_index = self._WORK_INDEX
+        count_index = self._COUNT_INDEX
+        work_counts = collections.defaultdict(dict)
+        for row in rows:
+            counts = work_counts[(row[label_index], row[ngram_index])]
+            work = row[work_index]
+            counts[work] = max(counts.get(work, 0), row[count_index])
+        columns = {}
+        for key, counts in work_counts.items():
+            column = ()
+            if label_count:
+                column += (sum(counts.values()),)
+            if label_work_count:
+                column += (len([count for count in counts.values()
+                                if count > 0]),)
+            columns[key] = column
+        return [tuple(row) + columns[(row[label_index], row[ngram_index])]
+                for row in rows]
+
+    def add_ngrams(self, corpus, minimum, maximum, catalogue=None, jobs=1,
+                   batch_size=constants.NGRAMS_BATCH_SIZE,
+                   layout=constants.LAYOUT_HEAP, index=constants.INDEX_NGRAM,
+                   pattern_index=False):
         """Adds n-gram data from `corpus` to the data store.
 
+        If `jobs` is greater than 1, the witnesses are read, tokenized
+        and counted in that many worker processes, while all writes to
+        the database are still made from this process.
+
+        No more than `batch_size` n-grams are held in memory at once.
+        The n-grams of a witness that would need more are not counted
+        in memory, but are instead added in batches of up to
+        `batch_size` n-grams to a temporary table and counted there.
+
+        Once the n-grams have been added and indexed, the corpus-wide
+        statistics of each n-gram are updated with those of the added
+        witnesses.
+
         :param corpus: corpus of works
         :type corpus: `Corpus`
         :param minimum: minimum n-gram size
@@ -58,15 +303,207 @@ class DataStore:
         :type maximum: `int`
         :param catalogue: optional catalogue to limit corpus to
         :type catalogue: `Catalogue`
+        :param jobs: number of processes to generate n-grams with
+        :type jobs: `int`
+        :param batch_size: maximum number of n-grams to hold in memory
+        :type batch_size: `int`
+        :param layout: layout of the TextNGram table, if the database
+                       is new
+        :type layout: `str`
+        :param index: kind of index, if the database is new
+        :type index: `str`
+        :param pattern_index: whether to add a pattern index of the
+                              n-grams, if the database has none
+        :type pattern_index: `bool`
 
         """
-        self._initialise_database()
+        self._check_database_version()
+        self._initialise_database(layout, index)
+        has_suffix_index = self._get_setting(constants.INDEX_SETTING) == \
+            constants.INDEX_SUFFIX
+        if has_suffix_index:
+            self._add_suffix_arrays(corpus, minimum, maximum, catalogue)
+        elif jobs > 1:
+            self._add_ngrams_parallel(corpus, minimum, maximum, catalogue,
+                                      jobs, batch_size)
+        else:
+            for witness in corpus.get_witnesses():
+                if catalogue and not catalogue.get(witness.get_names()[0]):
+                    continue
+                self._add_text_ngrams(witness, minimum, maximum,
+                                      batch_size=batch_size)
+        self._add_indices()
+        if not has_suffix_index:
+            self._update_ngram_stats()
+        if has_suffix_index:
+            # There is no NGram table to index.
+            if pattern_index:
+                self._logger.info(
+                    'Database has the suffix index; ignoring the pattern '
+                    'index')
+        elif pattern_index or self._get_setting(
+                constants.PATTERN_INDEX_SETTING):
+            # An existing pattern index is rebuilt to include any new
+            # n-grams.
+            self._add_pattern_index()
+        self._analyse()
+
+    def _add_ngrams_parallel(self, corpus, minimum, maximum, catalogue,
+                             jobs, batch_size):
+        """Adds n-gram data from `corpus` to the data store, generating
+        the n-grams in a pool of `jobs` worker processes.
+
+        Witnesses are added in the same order as in a serial run, so
+        that the resulting database is identical. Since the workers
+        return the n-grams of every size of a witness at once, a
+        witness with more than `batch_size` n-grams is instead staged
+        by this process, and no more witnesses are generated at once
+        than could have `batch_size` n-grams between them.
+
+        :param corpus: corpus of works
+        :type corpus: `Corpus`
+        :param minimum: minimum n-gram size
+        :type minimum: `int`
+        :param maximum: maximum n-gram size
+        :type maximum: `int`
+        :param catalogue: optional catalogue to limit corpus to
+        :type catalogue: `Catalogue`
+        :param jobs: number of processes to generate n-grams with
+        :type jobs: `int`
+        :param batch_size: maximum number of n-grams to hold in memory
+        :type batch_size: `int`
+
+        """
+        self._logger.info('Generating n-grams with {} processes'.format(jobs))
+        # Workers use this snapshot of the database to avoid generating
+        # n-grams that will be skipped. Since only this process writes
+        # to the database, the snapshot cannot become stale.
+        records = {}
+        for row in self._conn.execute(constants.SELECT_TEXT_SIZES_SQL):
+            checksum, sizes = records.setdefault(
+                (row['work'], row['siglum']), (row['checksum'], []))
+            if row['size'] is not None:
+                sizes.append(row['size'])
+        # Results that have been requested but not yet added, with an
+        # upper bound on the number of n-grams of each. A witness has
+        # no more tokens than its file has bytes, and no witness with
+        # more than batch_size n-grams has them generated by a worker.
+        pending = collections.deque()
+        pending_size = 0
+        with multiprocessing.Pool(jobs) as pool:
+            for work, siglum in corpus.get_witness_names():
+                if catalogue and not catalogue.get(work):
+                    continue
+                file_size = corpus.get_witness_file_stat(work, siglum)[0]
+                ngrams_size = min(file_size * (maximum - minimum + 1),
+                                  batch_size)
+                while pending and (
+                        len(pending) > jobs * 2 or
+                        pending_size + ngrams_size > batch_size):
+                    result, result_size = pending.popleft()
+                    pending_size -= result_size
+                    witness, ngrams = result.get()
+                    self._add_text_ngrams(witness, minimum, maximum, ngrams,
+                                          batch_size)
+                checksum, sizes = records.get((work, siglum), (None, []))
+                pending.append((pool.apply_async(
+                    _generate_witness_ngrams,
+                    (corpus, work, siglum, minimum, maximum, checksum,
+                     sizes, batch_size)), ngrams_size))
+                pending_size += ngrams_size
+            while pending:
+                result, result_size = pending.popleft()
+                witness, ngrams = result.get()
+                self._add_text_ngrams(witness, minimum, maximum, ngrams,
+                                      batch_size)
+
+    def _add_pattern_index(self):
+        """Adds a trigram index of the n-grams in NGram, or rebuilds
+        it if it exists, for finding the n-grams that match a
+        pattern."""
+        self._logger.info('Adding pattern index')
+        try:
+            self._conn.execute(constants.CREATE_TABLE_NGRAMPATTERN_SQL)
+        except sqlite3.OperationalError as err:
+            raise TACLError(
+                constants.PATTERN_INDEX_UNAVAILABLE_ERROR.format(err))
+        with self._conn:
+            self._conn.execute(constants.REBUILD_NGRAMPATTERN_SQL)
+            self._set_setting(constants.PATTERN_INDEX_SETTING, '1')
+
+    def _add_search_ngrams(self, ngrams, patterns=False):
+        """Adds the IDs and sizes of the n-grams in `ngrams`, or of
+        the n-grams matching the patterns in `ngrams`, to a temporary
+        SearchNGram table, and returns the range of their sizes.
+
+        A pattern that starts with literal characters is matched
+        using the index of NGram. Any other pattern is matched using
+        the pattern index, if there is one and the pattern has enough
+        literal characters in a row, and otherwise by a scan of
+        NGram.
+
+        :param ngrams: n-grams or GLOB patterns to search for
+        :type ngrams: `list` of `str`
+        :param patterns: whether `ngrams` are patterns
+        :type patterns: `bool`
+        :rtype: `tuple` of `int`
+
+        """
+        self._conn.execute(constants.DROP_TEMPORARY_SEARCH_NGRAMS_TABLE_SQL)
+        self._conn.execute(
+            constants.CREATE_TEMPORARY_SEARCH_NGRAMS_TABLE_SQL)
+        if not patterns:
+            self._add_temporary_ngrams(ngrams)
+            self._conn.execute(constants.INSERT_SEARCH_NGRAMS_SQL)
+        else:
+            # The n-grams of a suffix index are derived into a
+            # temporary NGram table, which has no pattern index.
+            has_pattern_index = self._get_setting(
+                constants.PATTERN_INDEX_SETTING) and self._get_setting(
+                    constants.INDEX_SETTING) != constants.INDEX_SUFFIX
+            for pattern in ngrams:
+                if has_pattern_index and self._uses_pattern_index(pattern):
+                    sql = constants.INSERT_SEARCH_NGRAMS_PATTERN_SQL
+                else:
+                    sql = constants.INSERT_SEARCH_NGRAMS_GLOB_SQL
+                self._conn.execute(sql, [pattern])
+        self._analyse('temp.SearchNGram')
+        row = self._conn.execute(
+            constants.SELECT_SEARCH_NGRAM_SIZES_SQL).fetchone()
+        return row['minimum'], row['maximum']
+
+    def _add_suffix_arrays(self, corpus, minimum, maximum, catalogue):
+        """Adds a suffix array of each witness in `corpus` to the data
+        store, and widens the default range of n-gram sizes to query
+        to include `minimum` and `maximum`.
+
+        :param corpus: corpus of works
+        :type corpus: `Corpus`
+        :param minimum: minimum n-gram size
+        :type minimum: `int`
+        :param maximum: maximum n-gram size
+        :type maximum: `int`
+        :param catalogue: optional catalogue to limit corpus to
+        :type catalogue: `Catalogue`
+
+        """
+        token_ids = {row['token']: row['id'] for row in
+                     self._conn.execute(constants.SELECT_TOKENS_SQL)}
         for witness in corpus.get_witnesses():
             if catalogue and not catalogue.get(witness.get_names()[0]):
                 continue
-            self._add_text_ngrams(witness, minimum, maximum)
-        self._add_indices()
-        self._analyse()
+            self._add_text_suffix_array(witness, token_ids)
+        existing_minimum = self._get_setting(constants.MINIMUM_SIZE_SETTING)
+        if existing_minimum is not None:
+            minimum = min(minimum, int(existing_minimum))
+        existing_maximum = self._get_setting(constants.MAXIMUM_SIZE_SETTING)
+        if existing_maximum is not None:
+            maximum = max(maximum, int(existing_maximum))
+        with self._conn:
+            self._set_setting(constants.MINIMUM_SIZE_SETTING, str(minimum))
+            self._set_setting(constants.MAXIMUM_SIZE_SETTING, str(maximum))
+            self._set_setting(constants.JOINER_SETTING,
+                              corpus.get_tokenizer().joiner)
 
     def _add_temporary_ngrams(self, ngrams):
         """Adds `ngrams` to a temporary table."""
@@ -82,26 +519,36 @@ class DataStore:
         if len(results_filenames) != len(labels):
             raise MalformedQueryError(
                 constants.SUPPLIED_ARGS_LENGTH_MISMATCH_ERROR)
+        self._start_phase(constants.PROFILE_PHASE_RESULTS)
         self._create_temporary_results_table()
         for results_filename, label in zip(results_filenames, labels):
-            with open(results_filename, encoding='utf-8', newline='') as fh:
+            with open(results_filename, 'rb') as fh:
                 self._add_temporary_results(fh, label)
         self._add_temporary_results_index()
         self._analyse('temp.InputResults')
+        self._start_phase(constants.PROFILE_PHASE_QUERY)
 
     def _add_temporary_results(self, results, label):
         """Adds `results` to a temporary table with `label`.
 
-        :param results: results file
+        :param results: results file, opened in binary mode
         :type results: `File`
         :param label: label to be associated with results
         :type label: `str`
 
         """
         NGRAM, SIZE, NAME, SIGLUM, COUNT, LABEL = constants.QUERY_FIELDNAMES
-        reader = csv.DictReader(results)
-        data = [(row[NGRAM], row[SIZE], row[NAME], row[SIGLUM], row[COUNT],
-                 label) for row in reader]
+        if detect_format(results) == constants.RESULTS_FORMAT_CSV:
+            reader = csv.DictReader(io.TextIOWrapper(
+                results, encoding='utf-8', newline=''))
+            data = [(row[NGRAM], row[SIZE], row[NAME], row[SIGLUM],
+                     row[COUNT], label) for row in reader]
+        else:
+            matches = read_results(results)
+            data = [(ngram, int(size), work, siglum, int(count), label)
+                    for ngram, size, work, siglum, count in zip(
+                        matches[NGRAM], matches[SIZE], matches[NAME],
+                        matches[SIGLUM], matches[COUNT])]
         self._conn.executemany(constants.INSERT_TEMPORARY_RESULTS_SQL, data)
 
     def _add_temporary_results_index(self):
@@ -109,15 +556,24 @@ class DataStore:
         self._conn.execute(constants.CREATE_INDEX_INPUT_RESULTS_SQL)
         self._logger.info('Index added')
 
-    def _add_text_ngrams(self, witness, minimum, maximum):
+    def _add_text_ngrams(self, witness, minimum, maximum, ngrams=None,
+                         batch_size=constants.NGRAMS_BATCH_SIZE):
         """Adds n-gram data from `witness` to the data store.
 
+        If `ngrams` is not supplied, the n-grams are generated from
+        `witness` one size at a time, and are staged in batches if
+        `witness` has more than `batch_size` n-grams of a single size.
+
         :param witness: witness to get n-grams from
         :type witness: `WitnessText`
         :param minimum: minimum n-gram size
         :type minimum: `int`
         :param maximum: maximum n-gram size
         :type maximum: `int`
+        :param ngrams: n-grams already generated from `witness`
+        :type ngrams: `list` of `tuple` of `int` and `collections.Counter`
+        :param batch_size: maximum number of n-grams to hold in memory
+        :type batch_size: `int`
 
         """
         text_id = self._get_text_id(witness)
@@ -129,8 +585,36 @@ class DataStore:
                 self._logger.info(
                     '{}-grams are already in the database'.format(size))
                 skip_sizes.append(size)
-        for size, ngrams in witness.get_ngrams(minimum, maximum, skip_sizes):
-            self._add_text_size_ngrams(text_id, size, ngrams)
+        sizes = maximum - minimum + 1 - len(skip_sizes)
+        # Record the sizes to be added as not yet counted in the
+        # n-gram statistics before adding them, so that they are
+        # counted by a later run if this one is interrupted.
+        if sizes:
+            with self._conn:
+                self._conn.executemany(
+                    constants.INSERT_NGRAM_STATS_PENDING_SQL,
+                    [(text_id, size) for size in range(minimum, maximum + 1)
+                     if size not in skip_sizes])
+        if ngrams is None:
+            if self._exceeds_batch_size(witness, batch_size):
+                self._delete_label_ngram_sets(text_id)
+                sketch = self._get_text_sketch(text_id, sizes)
+                self._add_text_staged_ngrams(text_id, witness, minimum,
+                                             maximum, skip_sizes, batch_size,
+                                             sketch)
+                self._set_text_sketch(text_id, sketch)
+                return
+            ngrams = witness.get_ngrams(minimum, maximum, skip_sizes)
+        sketch = None
+        for size, size_ngrams in ngrams:
+            if size not in skip_sizes:
+                if sketch is None:
+                    self._delete_label_ngram_sets(text_id)
+                    sketch = self._get_text_sketch(text_id, sizes)
+                self._add_text_size_ngrams(text_id, size, size_ngrams)
+                sketch.add(size_ngrams)
+        if sketch is not None:
+            self._set_text_sketch(text_id, sketch)
 
     def _add_text_record(self, witness):
         """Adds a Text record for `witness`.
@@ -144,12 +628,44 @@ class DataStore:
         self._logger.info('Adding record for text {}'.format(filename))
         checksum = witness.get_checksum()
         token_count = len(witness.get_tokens())
+        file_size, mtime = witness.get_file_stat()
         with self._conn:
             cursor = self._conn.execute(
                 constants.INSERT_TEXT_SQL,
-                [name, siglum, checksum, token_count, ''])
+                [name, siglum, checksum, token_count, '', file_size, mtime])
         return cursor.lastrowid
 
+    def _add_text_suffix_array(self, witness, token_ids):
+        """Adds the suffix array of `witness` to the data store, unless
+        it is already present.
+
+        Tokens not in `token_ids` are added to the data store, and to
+        `token_ids`.
+
+        :param witness: witness to add the suffix array of
+        :type witness: `WitnessText`
+        :param token_ids: database IDs of tokens
+        :type token_ids: `dict`
+
+        """
+        text_id = self._get_text_id(witness)
+        filename = witness.get_filename()
+        if self._conn.execute(constants.SELECT_HAS_SUFFIX_ARRAY_SQL,
+                              [text_id]).fetchone() is not None:
+            self._logger.info('Suffix array for {} is already in the '
+                              'database'.format(filename))
+            return
+        self._logger.info('Adding suffix array for {}'.format(filename))
+        tokens = witness.get_ngram_tokens()
+        with self._conn:
+            for token in tokens:
+                if token not in token_ids:
+                    token_ids[token] = self._conn.execute(
+                        constants.INSERT_TOKEN_SQL, [token]).lastrowid
+            suffix_array = SuffixArray([token_ids[token] for token in tokens])
+            self._conn.execute(constants.INSERT_TEXT_SUFFIX_ARRAY_SQL,
+                               [text_id] + list(suffix_array.to_bytes()))
+
     def _add_text_size_ngrams(self, text_id, size, ngrams):
         """Adds `ngrams`, that are of size `size`, to the data store.
 
@@ -166,12 +682,86 @@ class DataStore:
         unique_ngrams = len(ngrams)
         self._logger.info('Adding {} unique {}-grams'.format(
             unique_ngrams, size))
-        parameters = [[text_id, ngram, size, count]
-                      for ngram, count in ngrams.items()]
+        insert_sql = self._get_size_sql(constants.INSERT_TEXT_NGRAM_SQL, size)
+        start = time.perf_counter()
         with self._conn:
             self._conn.execute(constants.INSERT_TEXT_HAS_NGRAM_SQL,
                                [text_id, size, unique_ngrams])
-            self._conn.executemany(constants.INSERT_NGRAM_SQL, parameters)
+            self._conn.executemany(constants.INSERT_NGRAM_SQL,
+                                   ([ngram, size] for ngram in ngrams))
+            self._conn.executemany(
+                insert_sql,
+                ([text_id, count, ngram] for ngram, count in ngrams.items()))
+        self._log_insert_rate(unique_ngrams, start)
+
+    def _add_text_staged_ngrams(self, text_id, witness, minimum, maximum,
+                                skip_sizes, batch_size, sketch):
+        """Adds n-gram data from `witness` to the data store, by way of
+        a temporary table to which the n-grams are added in batches of
+        up to `batch_size` n-grams.
+
+        The n-grams are added in the same order as by
+        `_add_text_size_ngrams`.
+
+        :param text_id: database ID of text associated with `witness`
+        :type text_id: `int`
+        :param witness: witness to get n-grams from
+        :type witness: `WitnessText`
+        :param minimum: minimum n-gram size
+        :type minimum: `int`
+        :param maximum: maximum n-gram size
+        :type maximum: `int`
+        :param skip_sizes: sizes of n-grams not to add
+        :type skip_sizes: `list` of `int`
+        :param batch_size: maximum number of n-grams to hold in memory
+        :type batch_size: `int`
+        :param sketch: sketch to add the n-grams to
+        :type sketch: `NGramSketch`
+
+        """
+        self._logger.info('Staging n-grams in batches of {}'.format(
+            batch_size))
+        self._conn.execute(constants.DROP_TEMPORARY_STAGED_NGRAMS_TABLE_SQL)
+        self._conn.execute(
+            constants.DROP_TEMPORARY_STAGED_NGRAM_COUNTS_TABLE_SQL)
+        self._conn.execute(constants.CREATE_TEMPORARY_STAGED_NGRAMS_TABLE_SQL)
+        self._conn.execute(
+            constants.CREATE_TEMPORARY_STAGED_NGRAM_COUNTS_TABLE_SQL)
+        start = time.perf_counter()
+        staged_ngrams = 0
+        with self._conn:
+            for batch in witness.get_ngram_batches(minimum, maximum,
+                                                   skip_sizes, batch_size):
+                self._conn.executemany(constants.INSERT_STAGED_NGRAM_SQL,
+                                       batch)
+                staged_ngrams += len(batch)
+        self._log_insert_rate(staged_ngrams, start)
+        self._conn.execute(constants.CREATE_INDEX_STAGED_NGRAMS_SQL)
+        for size in range(minimum, maximum + 1):
+            if size in skip_sizes:
+                continue
+            insert_sql = self._get_size_sql(
+                constants.INSERT_TEXT_NGRAM_STAGED_SQL, size)
+            start = time.perf_counter()
+            with self._conn:
+                self._conn.execute(constants.DELETE_STAGED_NGRAM_COUNTS_SQL)
+                self._conn.execute(constants.INSERT_STAGED_NGRAM_COUNTS_SQL,
+                                   [size])
+                unique_ngrams = self._conn.execute(
+                    constants.SELECT_STAGED_NGRAM_COUNTS_SQL).fetchone()[0]
+                self._logger.info('Adding {} unique {}-grams'.format(
+                    unique_ngrams, size))
+                self._conn.execute(constants.INSERT_TEXT_HAS_NGRAM_SQL,
+                                   [text_id, size, unique_ngrams])
+                self._conn.execute(constants.INSERT_NGRAM_STAGED_SQL,
+                                   [size])
+                self._conn.execute(insert_sql, [text_id])
+                sketch.add(row['ngram'] for row in self._conn.execute(
+                    constants.SELECT_STAGED_NGRAMS_SQL))
+            self._log_insert_rate(unique_ngrams, start)
+        self._conn.execute(constants.DROP_TEMPORARY_STAGED_NGRAMS_TABLE_SQL)
+        self._conn.execute(
+            constants.DROP_TEMPORARY_STAGED_NGRAM_COUNTS_TABLE_SQL)
 
     def _analyse(self, table=''):
         """Analyses the database, or `table` if it is supplied.
@@ -184,14 +774,24 @@ class DataStore:
         self._conn.execute(constants.ANALYSE_SQL.format(table))
         self._logger.info('Analysis of database complete')
 
+    def _check_database_version(self):
+        """Raises `OutdatedDataStoreError` if the database uses an
+        older schema than the current one."""
+        version = self._get_database_version()
+        if version < constants.DATABASE_VERSION:
+            raise OutdatedDataStoreError(
+                constants.OUTDATED_DATABASE_ERROR.format(
+                    version, constants.DATABASE_VERSION))
+
     @staticmethod
-    def _check_diff_result(row, matches, tokenize, join):
-        """Returns `row`, possibly with its count changed to 0, depending on
-        the status of the n-grams that compose it.
+    def _check_diff_results(ngrams, counts, size, matches, tokenizer):
+        """Returns `counts`, with the count of each of `ngrams` that is
+        filler changed to 0, depending on the status of the n-grams
+        that compose it.
 
-        The n-gram represented in `row` can be decomposed into two
-        (n-1)-grams. If neither sub-n-gram is present in `matches`, do
-        not change the count since this is a new difference.
+        Each n-gram can be decomposed into two (n-1)-grams. If neither
+        sub-n-gram is present in `matches`, do not change the count
+        since this is a new difference.
 
         If both sub-n-grams are present with a positive count, do not
         change the count as it is composed entirely of sub-ngrams and
@@ -199,37 +799,72 @@ class DataStore:
 
         Otherwise, change the count to 0 as the n-gram is filler.
 
-        :param row: result row of the n-gram to check
-        :type row: pandas.Series
+        The sub-n-grams of all of `ngrams` are derived together, and
+        looked up in `matches` in bulk.
+
+        :param ngrams: n-grams to check
+        :type ngrams: `list` of `str`
+        :param counts: counts of `ngrams`
+        :type counts: `list` of `int`
+        :param size: number of tokens in each of `ngrams`
+        :type size: `int`
         :param matches: (n-1)-grams and their associated counts to check
                         against
         :type matches: `dict`
-        :param tokenize: function to tokenize a string
-        :type tokenize: `function`
-        :param join: function to join tokens into a string
-        :type join: `function`
-        :rtype: pandas.Series
-
-        """
-        ngram_tokens = tokenize(row[constants.NGRAM_FIELDNAME])
-        sub_ngram1 = join(ngram_tokens[:-1])
-        sub_ngram2 = join(ngram_tokens[1:])
-        count = constants.COUNT_FIELDNAME
-        discard = False
-        # For performance reasons, avoid searching through matches
-        # unless necessary.
-        status1 = matches.get(sub_ngram1)
-        if status1 == 0:
-            discard = True
+        :param tokenizer: tokenizer for the n-grams
+        :type tokenizer: `Tokenizer`
+        :rtype: `list` of `int`
+
+        """
+        tokenize = tokenizer.tokenize
+        join = tokenizer.joiner.join
+        # Tokenize all of the n-grams at once, relying on a newline
+        # not being part of any token. If that does not hold for the
+        # tokenizer, the number of tokens will be wrong, and each
+        # n-gram is tokenized separately.
+        tokens = tokenize('\n'.join(ngrams))
+        if len(tokens) == size * len(ngrams):
+            starts = range(0, len(tokens), size)
+            sub_ngrams1 = [join(tokens[start:start + size - 1])
+                           for start in starts]
+            sub_ngrams2 = [join(tokens[start + 1:start + size])
+                           for start in starts]
         else:
-            status2 = matches.get(sub_ngram2)
-            if status2 == 0:
-                discard = True
-            elif (status1 is None) ^ (status2 is None):
-                discard = True
-        if discard:
-            row[count] = 0
-        return row
+            token_lists = [tokenize(ngram) for ngram in ngrams]
+            sub_ngrams1 = [join(ngram_tokens[:-1])
+                           for ngram_tokens in token_lists]
+            sub_ngrams2 = [join(ngram_tokens[1:])
+                           for ngram_tokens in token_lists]
+        statuses1 = map(matches.get, sub_ngrams1)
+        statuses2 = map(matches.get, sub_ngrams2)
+        return [0 if status1 == 0 or status2 == 0 or
+                (status1 is None) ^ (status2 is None) else count
+                for count, status1, status2 in zip(counts, statuses1,
+                                                   statuses2)]
+
+    def _check_jobs(self, jobs):
+        """Returns the number of processes to run a query in, when
+        `jobs` are asked for.
+
+        A query can only be run in more than one process against a
+        read-only database, and not with a suffix index, whose
+        n-grams are derived in temporary tables of this connection.
+
+        :param jobs: number of processes asked for
+        :type jobs: `int`
+        :rtype: `int`
+
+        """
+        if jobs <= 1:
+            return 1
+        if not self._read_only:
+            raise MalformedQueryError(constants.JOBS_READ_ONLY_ERROR)
+        if self._get_setting(constants.INDEX_SETTING) == \
+                constants.INDEX_SUFFIX:
+            self._logger.info('Not running query in multiple processes '
+                              'with a suffix index')
+            return 1
+        return jobs
 
     def counts(self, catalogue, output_fh):
         """Returns `output_fh` populated with CSV results giving
@@ -242,7 +877,9 @@ class DataStore:
         :rtype: file-like object
 
         """
+        self._check_database_version()
         labels = list(self._set_labels(catalogue))
+        self._add_derived_ngrams()
         label_placeholders = self._get_placeholders(labels)
         query = constants.SELECT_COUNTS_SQL.format(label_placeholders)
         self._logger.info('Running counts query')
@@ -250,13 +887,49 @@ class DataStore:
         cursor = self._conn.execute(query, labels)
         return self._csv(cursor, constants.COUNTS_FIELDNAMES, output_fh)
 
+    def _create_temporary_label_tables(self):
+        """Creates the temporary tables of the labelled witnesses,
+        dropping any existing ones."""
+        for sql in (constants.DROP_TEMPORARY_CATALOGUE_TABLE_SQL,
+                    constants.DROP_TEMPORARY_LABELLED_TEXT_TABLE_SQL,
+                    constants.CREATE_TEMPORARY_CATALOGUE_TABLE_SQL,
+                    constants.CREATE_TEMPORARY_LABELLED_TEXT_TABLE_SQL,
+                    constants.CREATE_INDEX_TEMPORARY_LABELLED_TEXT_SQL):
+            self._conn.execute(sql)
+
     def _create_temporary_results_table(self):
         self._conn.execute(constants.DROP_TEMPORARY_RESULTS_TABLE_SQL)
         self._conn.execute(constants.CREATE_TEMPORARY_RESULTS_TABLE_SQL)
 
-    def _csv(self, cursor, fieldnames, output_fh):
-        """Writes the rows of `cursor` in CSV format to `output_fh`
-        and returns it.
+    def _create_hash_partition_views(self, partitions, partition):
+        """Creates temporary views shadowing TextNGram, and each of
+        its size partitions, with only the n-grams of `partition` out
+        of `partitions` partitions by n-gram ID.
+
+        :param partitions: number of partitions
+        :type partitions: `int`
+        :param partition: partition to view, from 0
+        :type partition: `int`
+
+        """
+        tables = [row['name'] for row in self._conn.execute(
+            constants.SELECT_TEXTNGRAM_TABLES_SQL)]
+        for table in tables:
+            self._conn.execute(
+                constants.CREATE_TEMPORARY_TEXTNGRAM_HASH_VIEW_SQL.format(
+                    table, partitions, partition))
+
+    def _create_label_ngram_tables(self):
+        """Creates the tables caching the n-grams of labelled sets of
+        witnesses, if they do not exist."""
+        self._conn.execute(constants.CREATE_TABLE_LABELNGRAMSET_SQL)
+        self._conn.execute(constants.CREATE_TABLE_LABELNGRAMSETTEXT_SQL)
+        self._conn.execute(constants.CREATE_INDEX_LABELNGRAMSETTEXT_SQL)
+        self._conn.execute(constants.CREATE_TABLE_LABELNGRAM_SQL)
+
+    def _csv(self, cursor, fieldnames, output_fh, sort=False):
+        """Writes the rows of `cursor` in the store's results format
+        to `output_fh` and returns it.
 
         :param cursor: database cursor containing data to be output
         :type cursor: `sqlite3.Cursor`
@@ -264,76 +937,87 @@ class DataStore:
         :type fieldnames: `list`
         :param output_fh: file to write data to
         :type output_fh: file object
+        :param sort: whether to sort the rows as by `Results.sort`
+        :type sort: `bool`
         :rtype: file object
 
         """
-        self._logger.info('Finished query; outputting results in CSV format')
-        # Specify a lineterminator to avoid an extra \r being added on
-        # Windows; see
-        # https://stackoverflow.com/questions/3191528/csv-in-python-adding-extra-carriage-return
-        if sys.platform in ('win32', 'cygwin') and output_fh is sys.stdout:
-            writer = csv.writer(output_fh, lineterminator='\n')
+        self._logger.info('Finished query; outputting results in {} '
+                          'format'.format(self._results_format))
+        self._start_phase(constants.PROFILE_PHASE_OUTPUT)
+        writer = get_results_writer(output_fh, fieldnames,
+                                    self._results_format, sort)
+        if self._profiler is None:
+            for row in cursor:
+                writer.writerow(row)
         else:
-            writer = csv.writer(output_fh)
-        writer.writerow(fieldnames)
-        for row in cursor:
-            writer.writerow(row)
+            rows = 0
+            for row in cursor:
+                writer.writerow(row)
+                rows += 1
+            self._profiler.add_rows(rows)
+        writer.close()
+        self._end_phase()
         self._logger.info('Finished outputting results')
         return output_fh
 
-    def _csv_temp(self, cursor, fieldnames):
-        """Writes the rows of `cursor` in CSV format to a temporary file and
-        returns the path to that file.
+    def _delete_label_ngram_sets(self, text_id):
+        """Deletes the cached sets of label n-grams that include the
+        n-grams of the text with `text_id`.
 
-        :param cursor: database cursor containing data to be output
-        :type cursor: `sqlite3.Cursor`
-        :param fieldnames: row headings
-        :type fieldnames: `list`
-        :rtype: `str`
+        :param text_id: database ID of text
+        :type text_id: `int`
 
         """
-        temp_fd, temp_path = tempfile.mkstemp(text=True)
-        with open(temp_fd, 'w', encoding='utf-8', newline='') as results_fh:
-            self._csv(cursor, fieldnames, results_fh)
-        return temp_path
+        set_ids = [(row['label_set'],) for row in self._conn.execute(
+            constants.SELECT_TEXT_LABEL_NGRAM_SETS_SQL, [text_id])]
+        if not set_ids:
+            return
+        self._logger.info('Deleting cached n-grams of {} labels'.format(
+            len(set_ids)))
+        with self._conn:
+            self._conn.executemany(constants.DELETE_LABEL_NGRAMS_SQL, set_ids)
+            self._conn.executemany(constants.DELETE_LABEL_NGRAM_SET_TEXTS_SQL,
+                                   set_ids)
+            self._conn.executemany(constants.DELETE_LABEL_NGRAM_SET_SQL,
+                                   set_ids)
 
     def _delete_text_ngrams(self, text_id):
         """Deletes all n-grams associated with `text_id` from the data
-        store.
+        store, removing them from the n-gram statistics.
 
         :param text_id: database ID of text
         :type text_id: `int`
 
         """
+        if self._get_setting(constants.INDEX_SETTING) == \
+                constants.INDEX_SUFFIX:
+            with self._conn:
+                self._conn.execute(constants.DELETE_TEXT_SUFFIX_ARRAY_SQL,
+                                   [text_id])
+            return
+        if self._get_setting(constants.LAYOUT_SETTING) == \
+                constants.LAYOUT_PARTITIONED:
+            sizes = self._get_sizes()
+        else:
+            sizes = [None]
         with self._conn:
-            self._conn.execute(constants.DELETE_TEXT_NGRAMS_SQL, [text_id])
+            for size in sizes:
+                for sql in (constants.UPDATE_NGRAM_STATS_REMOVE_SQL,
+                            constants.DELETE_NGRAM_STATS_UNUSED_SQL,
+                            constants.DELETE_TEXT_NGRAMS_SQL):
+                    self._conn.execute(self._get_partition_sql(sql, size),
+                                       [text_id])
+            self._conn.execute(constants.DELETE_TEXT_NGRAM_STATS_PENDING_SQL,
+                               [text_id])
             self._conn.execute(constants.DELETE_TEXT_HAS_NGRAMS_SQL, [text_id])
+            self._conn.execute(constants.DELETE_TEXT_SKETCH_SQL, [text_id])
+        self._delete_label_ngram_sets(text_id)
 
-    def _diff(self, cursor, tokenizer, output_fh):
-        """Returns output_fh with diff results that have been reduced.
-
-        Uses a temporary file to store the results from `cursor`
-        before being reduced, in order to not have the results stored
-        in memory twice.
-
-        :param cursor: database cursor containing raw diff data
-        :type cursor: `sqlite3.Cursor`
-        :param tokenizer: tokenizer for the n-grams
-        :type tokenizer: `Tokenizer`
-        :type output_fh: file-like object
-        :rtype: file-like object
-
-        """
-        temp_path = self._csv_temp(cursor, constants.QUERY_FIELDNAMES)
-        output_fh = self._reduce_diff_results(temp_path, tokenizer, output_fh)
-        try:
-            os.remove(temp_path)
-        except OSError as e:
-            self._logger.error('Failed to remove temporary file containing '
-                               'unreduced results: {}'.format(e))
-        return output_fh
-
-    def diff(self, catalogue, tokenizer, output_fh):
+    def diff(self, catalogue, tokenizer, output_fh, minimum=None,
+             maximum=None, jobs=1, min_works=None, max_works=None,
+             min_count=None, max_count=None, sort=False, label_count=False,
+             label_work_count=False):
         """Returns `output_fh` populated with CSV results giving the n-grams
         that are unique to the witnesses of each labelled set of works
         in `catalogue`.
@@ -342,35 +1026,87 @@ class DataStore:
         these sets, except in the case where there are only two
         labels.
 
+        N-grams smaller than `minimum` are still queried, since the
+        removal of filler results from each size depends on the
+        results of the smaller sizes, but are not output.
+
+        If `jobs` is greater than 1, the query is run in that many
+        processes; the filler results are still removed in this one.
+
+        The results are limited to the n-grams in between `min_works`
+        and `max_works` works and with a total count between
+        `min_count` and `max_count`, as by
+        `Results.prune_by_work_count` and
+        `Results.prune_by_ngram_count`. Since these depend on which
+        results are filler, they are applied once the filler results
+        have been removed.
+
+        If `sort` is True, the results are output in the order given
+        by `Results.sort`, without all of them being held in memory.
+
+        If `label_count` or `label_work_count` is True, the column
+        added by `Results.add_label_count` or
+        `Results.add_label_work_count` is added to the results, once
+        the filler results have been removed.
+
         :param catalogue: catalogue matching filenames to labels
         :type catalogue: `Catalogue`
         :param tokenizer: tokenizer for the n-grams
         :type tokenizer: `Tokenizer`
         :param output_fh: object to output results to
         :type output_fh: file-like object
+        :param minimum: minimum size of n-grams to output
+        :type minimum: `int`
+        :param maximum: maximum size of n-grams to output
+        :type maximum: `int`
+        :param jobs: number of processes to run the query in
+        :type jobs: `int`
+        :param min_works: minimum number of works with an n-gram
+        :type min_works: `int`
+        :param max_works: maximum number of works with an n-gram
+        :type max_works: `int`
+        :param min_count: minimum total count of an n-gram
+        :type min_count: `int`
+        :param max_count: maximum total count of an n-gram
+        :type max_count: `int`
+        :param sort: whether to sort the results as by `Results.sort`
+        :type sort: `bool`
+        :param label_count: whether to add the label count column
+        :type label_count: `bool`
+        :param label_work_count: whether to add the label work count
+                                 column
+        :type label_work_count: `bool`
         :rtype: file-like object
 
         """
+        self._check_database_version()
+        jobs = self._check_jobs(jobs)
         labels = self._sort_labels(self._set_labels(catalogue))
         if len(labels) < 2:
             raise MalformedQueryError(
                 constants.INSUFFICIENT_LABELS_QUERY_ERROR)
-        label_placeholders = self._get_placeholders(labels)
-        query = constants.SELECT_DIFF_SQL.format(label_placeholders,
-                                                 label_placeholders)
-        parameters = labels + labels
-        self._logger.info('Running diff query')
-        self._logger.debug('Query: {}\nLabels: {}'.format(query, labels))
-        self._log_query_plan(query, parameters)
-        cursor = self._conn.execute(query, parameters)
-        return self._diff(cursor, tokenizer, output_fh)
-
-    def diff_asymmetric(self, catalogue, prime_label, tokenizer, output_fh):
+        cursor = self._execute_diff_query(labels, maximum, jobs)
+        return self._reduce_diff_results(
+            cursor, tokenizer, output_fh, minimum,
+            (min_works, max_works, min_count, max_count), sort,
+            (label_count, label_work_count))
+
+    def diff_asymmetric(self, catalogue, prime_label, tokenizer, output_fh,
+                        minimum=None, maximum=None, jobs=1, min_works=None,
+                        max_works=None, min_count=None, max_count=None,
+                        sort=False, label_count=False,
+                        label_work_count=False):
         """Returns `output_fh` populated with CSV results giving the
         difference in n-grams between the witnesses of labelled sets
         of works in `catalogue`, limited to those works labelled with
         `prime_label`.
 
+        As with `diff`, n-grams smaller than `minimum` are still
+        queried, but are not output, the query is run in `jobs`
+        processes, the works and total count of the n-grams output
+        are limited, and the results may be sorted and have label
+        counts added.
+
         :param catalogue: catalogue matching filenames to labels
         :type catalogue: `Catalogue`
         :param prime_label: label to limit results to
@@ -379,9 +1115,32 @@ class DataStore:
         :type tokenizer: `Tokenizer`
         :param output_fh: object to output results to
         :type output_fh: file-like object
+        :param minimum: minimum size of n-grams to output
+        :type minimum: `int`
+        :param maximum: maximum size of n-grams to output
+        :type maximum: `int`
+        :param jobs: number of processes to run the query in
+        :type jobs: `int`
+        :param min_works: minimum number of works with an n-gram
+        :type min_works: `int`
+        :param max_works: maximum number of works with an n-gram
+        :type max_works: `int`
+        :param min_count: minimum total count of an n-gram
+        :type min_count: `int`
+        :param max_count: maximum total count of an n-gram
+        :type max_count: `int`
+        :param sort: whether to sort the results as by `Results.sort`
+        :type sort: `bool`
+        :param label_count: whether to add the label count column
+        :type label_count: `bool`
+        :param label_work_count: whether to add the label work count
+                                 column
+        :type label_work_count: `bool`
         :rtype: file-like object
 
         """
+        self._check_database_version()
+        jobs = self._check_jobs(jobs)
         labels = list(self._set_labels(catalogue))
         if len(labels) < 2:
             raise MalformedQueryError(
@@ -390,17 +1149,102 @@ class DataStore:
             labels.remove(prime_label)
         except ValueError:
             raise MalformedQueryError(constants.LABEL_NOT_IN_CATALOGUE_ERROR)
+        self._add_derived_ngrams(maximum=maximum)
         label_placeholders = self._get_placeholders(labels)
-        query = constants.SELECT_DIFF_ASYMMETRIC_SQL.format(label_placeholders)
-        parameters = [prime_label, prime_label] + labels
+        if self._uses_label_cache():
+            query = constants.SELECT_DIFF_ASYMMETRIC_CACHED_SQL.format(
+                label_placeholders)
+            parameters = [prime_label] + self._get_label_ngram_sets(
+                [prime_label] + labels)
+        else:
+            query = constants.SELECT_DIFF_ASYMMETRIC_SQL.format(
+                label_placeholders)
+            parameters = [prime_label, prime_label] + labels
         self._logger.info('Running asymmetric diff query')
         self._logger.debug('Query: {}\nLabels: {}\nPrime label: {}'.format(
             query, labels, prime_label))
-        self._log_query_plan(query, parameters)
-        cursor = self._conn.execute(query, parameters)
-        return self._diff(cursor, tokenizer, output_fh)
+        cursor = self._execute_ngram_query(query, parameters,
+                                           maximum=maximum, ordered=True,
+                                           jobs=jobs)
+        return self._reduce_diff_results(
+            cursor, tokenizer, output_fh, minimum,
+            (min_works, max_works, min_count, max_count), sort,
+            (label_count, label_work_count))
+
+    def diff_asymmetric_all(self, catalogue, tokenizer, output_fhs,
+                            minimum=None, maximum=None, jobs=1,
+                            min_works=None, max_works=None, min_count=None,
+                            max_count=None, sort=False, label_count=False,
+                            label_work_count=False):
+        """Returns `output_fhs` populated with CSV results giving the
+        difference in n-grams between the witnesses of labelled sets
+        of works in `catalogue`, limited for each label to the works
+        labelled with it, as by `diff_asymmetric`.
+
+        Every n-gram in the results of `diff` belongs to a single
+        label, and the filler results, the limits and the label
+        counts depend only on the witnesses of that label, so the
+        results of `diff` for each label are those of
+        `diff_asymmetric` for that label. The results for all of the
+        labels are therefore got from a single diff query, and
+        written to the object in `output_fhs` keyed by their label.
+
+        As with `diff`, n-grams smaller than `minimum` are still
+        queried, but are not output, the query is run in `jobs`
+        processes, the works and total count of the n-grams output
+        are limited, and the results may be sorted and have label
+        counts added.
+
+        :param catalogue: catalogue matching filenames to labels
+        :type catalogue: `Catalogue`
+        :param tokenizer: tokenizer for the n-grams
+        :type tokenizer: `Tokenizer`
+        :param output_fhs: objects to output results to, keyed by
+                           label
+        :type output_fhs: `dict` of file-like objects
+        :param minimum: minimum size of n-grams to output
+        :type minimum: `int`
+        :param maximum: maximum size of n-grams to output
+        :type maximum: `int`
+        :param jobs: number of processes to run the query in
+        :type jobs: `int`
+        :param min_works: minimum number of works with an n-gram
+        :type min_works: `int`
+        :param max_works: maximum number of works with an n-gram
+        :type max_works: `int`
+        :param min_count: minimum total count of an n-gram
+        :type min_count: `int`
+        :param max_count: maximum total count of an n-gram
+        :type max_count: `int`
+        :param sort: whether to sort the results as by `Results.sort`
+        :type sort: `bool`
+        :param label_count: whether to add the label count column
+        :type label_count: `bool`
+        :param label_work_count: whether to add the label work count
+                                 column
+        :type label_work_count: `bool`
+        :rtype: `dict` of file-like objects
 
-    def diff_supplied(self, results_filenames, labels, tokenizer, output_fh):
+        """
+        self._check_database_version()
+        jobs = self._check_jobs(jobs)
+        labels = self._sort_labels(self._set_labels(catalogue))
+        if len(labels) < 2:
+            raise MalformedQueryError(
+                constants.INSUFFICIENT_LABELS_QUERY_ERROR)
+        if set(output_fhs) != set(labels):
+            raise MalformedQueryError(constants.LABEL_OUTPUTS_MISMATCH_ERROR)
+        cursor = self._execute_diff_query(labels, maximum, jobs)
+        return self._reduce_diff_results(
+            cursor, tokenizer, output_fhs, minimum,
+            (min_works, max_works, min_count, max_count), sort,
+            (label_count, label_work_count))
+
+    def diff_supplied(self, results_filenames, labels, tokenizer, output_fh,
+                      minimum=None, maximum=None, min_works=None,
+                      max_works=None, min_count=None, max_count=None,
+                      sort=False, label_count=False,
+                      label_work_count=False):
         """Returns `output_fh` populated with CSV results giving the n-grams
         that are unique to the witnesses in each set of works in
         `results_sets`, using the labels in `labels`.
@@ -409,6 +1253,11 @@ class DataStore:
         these sets, except in the case where there are only two
         labels.
 
+        As with `diff`, n-grams smaller than `minimum` are still
+        queried, but are not output, the works and total count of the
+        n-grams output are limited, and the results may be sorted and
+        have label counts added.
+
         :param results_filenames: list of results filenames to be diffed
         :type results_filenames: `list` of `str`
         :param labels: labels to be applied to the results_sets
@@ -417,36 +1266,419 @@ class DataStore:
         :type tokenizer: `Tokenizer`
         :param output_fh: object to output results to
         :type output_fh: file-like object
+        :param minimum: minimum size of n-grams to output
+        :type minimum: `int`
+        :param maximum: maximum size of n-grams to output
+        :type maximum: `int`
+        :param min_works: minimum number of works with an n-gram
+        :type min_works: `int`
+        :param max_works: maximum number of works with an n-gram
+        :type max_works: `int`
+        :param min_count: minimum total count of an n-gram
+        :type min_count: `int`
+        :param max_count: maximum total count of an n-gram
+        :type max_count: `int`
+        :param sort: whether to sort the results as by `Results.sort`
+        :type sort: `bool`
+        :param label_count: whether to add the label count column
+        :type label_count: `bool`
+        :param label_work_count: whether to add the label work count
+                                 column
+        :type label_work_count: `bool`
         :rtype: file-like object
 
         """
         self._add_temporary_results_sets(results_filenames, labels)
         query = constants.SELECT_DIFF_SUPPLIED_SQL
+        parameters = []
+        if maximum:
+            query += constants.SELECT_SUPPLIED_SIZE_MAXIMUM_SQL
+            parameters.append(maximum)
+        query += constants.SELECT_SUPPLIED_WITNESS_SIZE_ORDER_SQL
         self._logger.info('Running supplied diff query')
         self._logger.debug('Query: {}'.format(query))
-        self._log_query_plan(query, [])
-        cursor = self._conn.execute(query)
-        return self._diff(cursor, tokenizer, output_fh)
+        self._log_query_plan(query, parameters)
+        cursor = self._conn.execute(query, parameters)
+        return self._reduce_diff_results(
+            cursor, tokenizer, output_fh, minimum,
+            (min_works, max_works, min_count, max_count), sort,
+            (label_count, label_work_count))
 
     def _drop_indices(self):
         """Drops the database indices relating to n-grams."""
         self._logger.info('Dropping database indices')
         self._conn.execute(constants.DROP_TEXTNGRAM_INDEX_SQL)
+        self._conn.execute(constants.DROP_TEXTNGRAM_COVERING_INDEX_SQL)
         self._logger.info('Finished dropping database indices')
 
+    def _end_phase(self):
+        """Ends the current phase of the query being profiled, if
+        any."""
+        if self._profiler is not None:
+            self._profiler.end_phase()
+
     @staticmethod
-    def _get_intersection_subquery(labels):
+    def _exceeds_batch_size(witness, batch_size, sizes=1):
+        """Returns True if `witness` may have more than `batch_size`
+        n-grams of `sizes` different sizes.
+
+        Each token of `witness` begins at most one n-gram of each
+        size.
+
+        :param witness: witness to check
+        :type witness: `WitnessText`
+        :param batch_size: maximum number of n-grams
+        :type batch_size: `int`
+        :param sizes: number of sizes of n-grams
+        :type sizes: `int`
+        :rtype: `bool`
+
+        """
+        # Every token is at least one character long, so avoid
+        # tokenizing the witness when it is short enough.
+        if len(witness.get_content()) * sizes <= batch_size:
+            return False
+        return len(witness.get_tokens()) * sizes > batch_size
+
+    def _execute_diff_query(self, labels, maximum=None, jobs=1):
+        """Returns the rows of the n-grams unique to the witnesses of
+        one of `labels`, ordered by work, siglum and size.
+
+        :param labels: labels to diff
+        :type labels: `list` of `str`
+        :param maximum: maximum n-gram size
+        :type maximum: `int`
+        :param jobs: number of processes to run the query in
+        :type jobs: `int`
+        :rtype: iterable of `sqlite3.Row`
+
+        """
+        self._add_derived_ngrams(maximum=maximum)
+        label_placeholders = self._get_placeholders(labels)
+        if self._uses_label_cache():
+            query = constants.SELECT_DIFF_CACHED_SQL.format(
+                label_placeholders, label_placeholders)
+            parameters = labels + self._get_label_ngram_sets(labels)
+        else:
+            query = constants.SELECT_DIFF_SQL.format(label_placeholders,
+                                                     label_placeholders)
+            parameters = labels + labels
+        self._logger.info('Running diff query')
+        self._logger.debug('Query: {}\nLabels: {}'.format(query, labels))
+        return self._execute_ngram_query(query, parameters, maximum=maximum,
+                                         ordered=True, jobs=jobs)
+
+    def _execute_ngram_query(self, query, parameters, minimum=None,
+                             maximum=None, ordered=False, jobs=1,
+                             limits=None, label_counts=None):
+        """Returns the rows resulting from running `query`, with
+        `parameters`, limited to n-grams whose size is between
+        `minimum` and `maximum`.
+
+        In a database with the partitioned layout, `query` is run
+        against the partition of each size in turn, so that the
+        n-grams of other sizes are not read; otherwise, the size
+        restrictions are added to the outermost query.
+
+        If `ordered` is True, the rows are ordered by work, siglum
+        and size.
+
+        If `jobs` is greater than 1, the query is split into that
+        many partitions, each run in its own process.
+
+        The rows may be limited to those of n-grams whose works and
+        total count are within `limits`, and have label count columns
+        added as specified by `label_counts`. Since these depend only
+        on the rows of each n-gram, they are applied to each partition
+        of the query separately. Ordered rows cannot be limited or
+        have label counts added. N-grams whose corpus-wide statistics
+        fall short of the minimum limits are excluded before the rows
+        of the remaining n-grams are aggregated.
+
+        :param query: query selecting n-gram results from TextNGram
+        :type query: `str`
+        :param parameters: parameters to `query`
+        :type parameters: `list`
+        :param minimum: minimum n-gram size
+        :type minimum: `int`
+        :param maximum: maximum n-gram size
+        :type maximum: `int`
+        :param ordered: whether to order the rows by witness and size
+        :type ordered: `bool`
+        :param jobs: number of processes to run the query in
+        :type jobs: `int`
+        :param limits: minimum and maximum works and total count of
+                       n-grams
+        :type limits: `tuple`
+        :param label_counts: whether to add the label count and the
+                             label work count columns
+        :type label_counts: `tuple` of `bool`
+        :rtype: iterable of `sqlite3.Row`
+
+        """
+        if jobs > 1:
+            return self._execute_parallel_query(
+                query, parameters, minimum, maximum, ordered, jobs, limits,
+                label_counts)
+        if self._get_setting(constants.LAYOUT_SETTING) == \
+                constants.LAYOUT_PARTITIONED:
+            return self._execute_partitioned_query(
+                query, parameters, self._get_sizes(minimum, maximum),
+                ordered, limits, label_counts)
+        if minimum is not None:
+            query += constants.SELECT_SIZE_MINIMUM_SQL
+            parameters = parameters + [minimum]
+        if maximum is not None:
+            query += constants.SELECT_SIZE_MAXIMUM_SQL
+            parameters = parameters + [maximum]
+        query, parameters = self._limit_ngrams_by_stats(query, parameters,
+                                                        limits)
+        query, parameters = self._limit_ngrams(query, parameters, limits)
+        query = self._add_label_counts(query, label_counts)
+        if ordered:
+            query += constants.SELECT_WITNESS_SIZE_ORDER_SQL
+        self._log_query_plan(query, parameters)
+        return self._conn.execute(query, parameters)
+
+    def _execute_parallel_query(self, query, parameters, minimum, maximum,
+                                ordered, jobs, limits=None,
+                                label_counts=None):
+        """Yields the rows resulting from running `query`, with
+        `parameters`, split by n-gram ID into `jobs` partitions, each
+        run in its own process on a read-only connection.
+
+        Whether an n-gram is in the results of an intersect or diff
+        query depends only on the rows for that n-gram, so the results
+        of the query are the union of the results for each partition.
+        If `ordered` is True, the rows of each partition are ordered
+        by witness and size, and the partitions are merged into a
+        single ordering; otherwise rows are yielded as they arrive.
+
+        :param query: query selecting n-gram results from TextNGram
+        :type query: `str`
+        :param parameters: parameters to `query`
+        :type parameters: `list`
+        :param minimum: minimum n-gram size
+        :type minimum: `int`
+        :param maximum: maximum n-gram size
+        :type maximum: `int`
+        :param ordered: whether to order the rows by witness and size
+        :type ordered: `bool`
+        :param jobs: number of processes to run the query in
+        :type jobs: `int`
+        :param limits: minimum and maximum works and total count of
+                       n-grams
+        :type limits: `tuple`
+        :param label_counts: whether to add the label count and the
+                             label work count columns
+        :type label_counts: `tuple` of `bool`
+        :rtype: `generator` of `tuple`
+
+        """
+        self._logger.info('Running query in {} processes'.format(jobs))
+        # Each process labels the same witnesses, including any
+        # pruning of them made by this connection.
+        labelled_texts = [tuple(row) for row in self._conn.execute(
+            constants.SELECT_TEMPORARY_LABELLED_TEXTS_SQL)]
+        readers = []
+        processes = []
+        try:
+            for partition in range(jobs):
+                reader, writer = multiprocessing.Pipe(False)
+                process = multiprocessing.Process(
+                    target=_execute_query_partition,
+                    args=(self._db_name, labelled_texts, query, parameters,
+                          minimum, maximum, ordered, jobs, partition,
+                          writer, limits, label_counts))
+                process.start()
+                writer.close()
+                readers.append(reader)
+                processes.append(process)
+            if ordered:
+                yield from heapq.merge(
+                    *[self._receive_rows(reader) for reader in readers],
+                    key=self._witness_size_key)
+            else:
+                while readers:
+                    for reader in multiprocessing.connection.wait(readers):
+                        rows = self._receive_chunk(reader)
+                        if rows is None:
+                            readers.remove(reader)
+                        else:
+                            yield from rows
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+
+    def _execute_partitioned_query(self, query, parameters, sizes,
+                                   ordered=False, limits=None,
+                                   label_counts=None):
+        """Yields the rows resulting from running `query`, with
+        `parameters`, against the partition of each of `sizes`.
+
+        Since an n-gram has only one size, the results of a query
+        over all of the partitions are the union of the results for
+        each partition. If `ordered` is True, the rows of each
+        partition are ordered by witness, and the partitions are
+        merged into a single ordering by witness and size.
+
+        :param query: query selecting n-gram results from TextNGram
+        :type query: `str`
+        :param parameters: parameters to `query`
+        :type parameters: `list`
+        :param sizes: sizes of n-grams to query
+        :type sizes: `list` of `int`
+        :param ordered: whether to order the rows by witness and size
+        :type ordered: `bool`
+        :param limits: minimum and maximum works and total count of
+                       n-grams
+        :type limits: `tuple`
+        :param label_counts: whether to add the label count and the
+                             label work count columns
+        :type label_counts: `tuple` of `bool`
+        :rtype: `generator` of `sqlite3.Row`
+
+        """
+        if ordered:
+            query += constants.SELECT_WITNESS_SIZE_ORDER_SQL
+        else:
+            query, parameters = self._limit_ngrams_by_stats(
+                query, parameters, limits)
+            query, parameters = self._limit_ngrams(query, parameters, limits)
+            query = self._add_label_counts(query, label_counts)
+        cursors = []
+        for size in sizes:
+            partition_query = self._get_partition_sql(query, size)
+            self._log_query_plan(partition_query, parameters)
+            if not ordered:
+                yield from self._conn.execute(partition_query, parameters)
+                continue
+            cursors.append(self._conn.execute(partition_query, parameters))
+        if cursors:
+            yield from heapq.merge(*cursors, key=self._witness_size_key)
+
+    def _get_database_version(self):
+        """Returns the version of the database schema.
+
+        A database without any tables is treated as being at the
+        current version, since that is the schema it will be given.
+
+        :rtype: `int`
+
+        """
+        version = self._conn.execute(
+            constants.PRAGMA_USER_VERSION_SQL).fetchone()[0]
+        if version == 0 and self._conn.execute(
+                constants.SELECT_TEXT_TABLE_SQL).fetchone() is None:
+            version = constants.DATABASE_VERSION
+        return version
+
+    def _get_intersection_subquery(self, labels, cached=False,
+                                   engine=constants.INTERSECT_ENGINE_NESTED):
+        """Returns the subquery selecting the n-grams common to
+        `labels`.
+
+        With the nested engine, the subquery has a placeholder for
+        each label (or cached set of its n-grams), in the order of
+        `labels`. With the grouped engine, it has those placeholders
+        followed by one for the number of labels.
+
+        :param labels: labels to intersect
+        :type labels: `list` of `str`
+        :param cached: whether to use cached sets of label n-grams
+        :type cached: `bool`
+        :param engine: intersection engine
+        :type engine: `str`
+        :rtype: `str`
+
+        """
+        if engine == constants.INTERSECT_ENGINE_GROUPED:
+            if cached:
+                sub_sql = constants.SELECT_INTERSECT_GROUPED_CACHED_SUB_SQL
+            else:
+                sub_sql = constants.SELECT_INTERSECT_GROUPED_SUB_SQL
+            return sub_sql.format(self._get_placeholders(labels))
+        if cached:
+            sub_sql = constants.SELECT_INTERSECT_CACHED_SUB_SQL
+            extra_sql = constants.SELECT_INTERSECT_CACHED_SUB_EXTRA_SQL
+        else:
+            sub_sql = constants.SELECT_INTERSECT_SUB_SQL
+            extra_sql = constants.SELECT_INTERSECT_SUB_EXTRA_SQL
         # Create nested subselects.
-        subquery = constants.SELECT_INTERSECT_SUB_SQL
+        subquery = sub_sql
         # The subqueries are nested in reverse order of 'size', so
         # that the inmost select is operating on the smallest corpus,
         # thereby minimising the result sets of outer queries the most.
         for label in labels[1:]:
-            subquery = constants.SELECT_INTERSECT_SUB_SQL + \
-                       constants.SELECT_INTERSECT_SUB_EXTRA_SQL.format(
-                           subquery)
+            subquery = sub_sql + extra_sql.format(subquery)
         return subquery
 
+    def _get_label_ngram_sets(self, labels):
+        """Returns the database IDs of the cached sets of the distinct
+        n-grams of the witnesses labelled with each of `labels`,
+        caching each set that is not already cached.
+
+        A set is identified by the witnesses in it, so that it is
+        reused for any label given to the same witnesses.
+
+        :param labels: labels to get sets of n-grams for
+        :type labels: `list` of `str`
+        :rtype: `list` of `int`
+
+        """
+        self._create_label_ngram_tables()
+        set_ids = []
+        for label in labels:
+            text_ids = [row['id'] for row in self._conn.execute(
+                constants.SELECT_LABEL_TEXTS_SQL, [label])]
+            texts = ','.join(str(text_id) for text_id in text_ids)
+            row = self._conn.execute(constants.SELECT_LABEL_NGRAM_SET_SQL,
+                                     [texts]).fetchone()
+            if row is not None:
+                self._logger.info(
+                    'Using cached n-grams for label {}'.format(label))
+                set_ids.append(row['id'])
+                continue
+            self._logger.info('Caching n-grams for label {}'.format(label))
+            if self._get_setting(constants.LAYOUT_SETTING) == \
+                    constants.LAYOUT_PARTITIONED:
+                sizes = self._get_sizes()
+            else:
+                sizes = [None]
+            with self._conn:
+                set_id = self._conn.execute(
+                    constants.INSERT_LABEL_NGRAM_SET_SQL, [texts]).lastrowid
+                self._conn.executemany(
+                    constants.INSERT_LABEL_NGRAM_SET_TEXT_SQL,
+                    [(set_id, text_id) for text_id in text_ids])
+                for size in sizes:
+                    self._conn.execute(self._get_partition_sql(
+                        constants.INSERT_LABEL_NGRAMS_SQL, size),
+                                       [set_id, label])
+            set_ids.append(set_id)
+        return set_ids
+
+    @staticmethod
+    def _get_partition_sql(sql, size):
+        """Returns `sql` with its references to the TextNGram table
+        replaced by the partition for n-grams of `size`.
+
+        If `size` is None, `sql` is returned unchanged.
+
+        :param sql: SQL statement referencing TextNGram
+        :type sql: `str`
+        :param size: size of n-grams in partition
+        :type size: `int`
+        :rtype: `str`
+
+        """
+        if size is None:
+            return sql
+        return re.sub(constants.TEXTNGRAM_TABLE_PATTERN,
+                      constants.TEXTNGRAM_PARTITION_TABLE.format(size), sql)
+
     @staticmethod
     def _get_placeholders(items):
         """Returns a string of placeholders, one for each item in
@@ -459,6 +1691,139 @@ class DataStore:
         """
         return ('?,' * len(items)).strip(',')
 
+    def get_profile(self):
+        """Returns the profile of the queries run, or None if the data
+        store was not created to profile them.
+
+        :rtype: `dict`
+
+        """
+        if self._profiler is None:
+            return None
+        return self._profiler.get_report()
+
+    @staticmethod
+    def _get_query_fieldnames(label_counts):
+        """Returns the names of the columns of query results, with the
+        label count columns specified by `label_counts`.
+
+        :param label_counts: whether to add the label count and the
+                             label work count columns, or None
+        :type label_counts: `tuple` of `bool`
+        :rtype: `tuple` of `str`
+
+        """
+        fieldnames = constants.QUERY_FIELDNAMES
+        if label_counts is not None:
+            label_count, label_work_count = label_counts
+            if label_count:
+                fieldnames += (constants.LABEL_COUNT_FIELDNAME,)
+            if label_work_count:
+                fieldnames += (constants.LABEL_WORK_COUNT_FIELDNAME,)
+        return fieldnames
+
+    def _get_setting(self, name):
+        """Returns the value of the database setting `name`, or None if
+        it is not set.
+
+        :param name: name of setting
+        :type name: `str`
+        :rtype: `str`
+
+        """
+        row = self._conn.execute(constants.SELECT_SETTING_SQL,
+                                 [name]).fetchone()
+        if row is None:
+            return None
+        return row['value']
+
+    def _get_size_sql(self, sql, size):
+        """Returns `sql`, which adds n-grams of `size` to TextNGram,
+        adapted to the layout of the database.
+
+        In a database with the partitioned layout, this creates the
+        partition for `size` if it does not exist.
+
+        :param sql: SQL statement referencing TextNGram
+        :type sql: `str`
+        :param size: size of n-grams
+        :type size: `int`
+        :rtype: `str`
+
+        """
+        if self._get_setting(constants.LAYOUT_SETTING) != \
+                constants.LAYOUT_PARTITIONED:
+            return sql
+        self._conn.execute(
+            constants.CREATE_TABLE_TEXTNGRAM_PARTITION_SQL.format(size))
+        return self._get_partition_sql(sql, size)
+
+    def _get_search_sizes(self, ngrams, minimum=None, maximum=None):
+        """Returns the sizes, between `minimum` and `maximum`, that
+        `ngrams` may have as n-grams of the tokens of the witnesses in
+        a suffix index.
+
+        Each n-gram is split into the tokens of the index (joined by
+        its joiner) in every possible way, so that only the n-grams
+        of these sizes need be derived to search for `ngrams`; an
+        n-gram that cannot be split in any way cannot occur.
+
+        :param ngrams: n-grams to search for
+        :type ngrams: `list` of `str`
+        :param minimum: minimum n-gram size
+        :type minimum: `int`
+        :param maximum: maximum n-gram size
+        :type maximum: `int`
+        :rtype: `set` of `int`
+
+        """
+        joiner = self._get_setting(constants.JOINER_SETTING)
+        tokens = set(row['token'] for row in
+                     self._conn.execute(constants.SELECT_TOKENS_SQL))
+        longest = max((len(token) for token in tokens), default=0)
+        sizes = set()
+        for ngram in ngrams:
+            # The numbers of tokens that the start of `ngram` up to
+            # each position (at which a token may start) splits into.
+            splits = {0: {0}}
+            for start in range(len(ngram)):
+                if start not in splits:
+                    continue
+                counts = {count + 1 for count in splits[start]}
+                for end in range(start + 1,
+                                 min(len(ngram), start + longest) + 1):
+                    if ngram[start:end] not in tokens:
+                        continue
+                    if end == len(ngram):
+                        sizes.update(counts)
+                    elif ngram.startswith(joiner, end):
+                        splits.setdefault(end + len(joiner), set()).update(
+                            counts)
+        return {size for size in sizes
+                if (minimum is None or size >= minimum) and
+                (maximum is None or size <= maximum)}
+
+    def _get_sizes(self, minimum=None, maximum=None):
+        """Returns the sizes of the n-grams in the database, limited
+        to those between `minimum` and `maximum`.
+
+        :param minimum: minimum n-gram size
+        :type minimum: `int`
+        :param maximum: maximum n-gram size
+        :type maximum: `int`
+        :rtype: `list` of `int`
+
+        """
+        sizes = []
+        for row in self._conn.execute(constants.SELECT_SIZES_SQL):
+            size = row['size']
+            if minimum is not None and size < minimum:
+                continue
+            if maximum is not None and size > maximum:
+                continue
+            sizes.append(size)
+        return sizes
+
     def _get_text_id(self, witness):
         """Returns the database ID of the Text record for `witness`.
 
@@ -466,7 +1831,9 @@ class DataStore:
 
         If `text`\'s checksum does not match an existing record's
         checksum, the record's checksum is updated and all associated
-        TextNGram and TextHasNGram records are deleted.
+        TextNGram and TextHasNGram records are deleted. If only the
+        size or modification time of its file has changed, those are
+        updated.
 
         :param witness: witness to add a record for
         :type witness: `WitnessText`
@@ -487,8 +1854,31 @@ class DataStore:
                 self._update_text_record(witness, text_id)
                 self._logger.info('Deleting potentially out-of-date n-grams')
                 self._delete_text_ngrams(text_id)
+            elif (text_record['file_size'], text_record['mtime']) != \
+                    witness.get_file_stat():
+                self._update_text_file_stat(text_id, witness.get_file_stat())
         return text_id
 
+    def _get_text_sketch(self, text_id, sizes):
+        """Returns the sketch of the n-grams of the text with
+        `text_id`.
+
+        If the text has no sketch, a new empty sketch is returned,
+        sized for `sizes` sizes of n-grams of the text.
+
+        :param text_id: database ID of text
+        :type text_id: `int`
+        :param sizes: number of sizes of n-grams to be added
+        :type sizes: `int`
+        :rtype: `NGramSketch`
+
+        """
+        row = self._conn.execute(constants.SELECT_TEXT_SKETCH_SQL,
+                                 [text_id]).fetchone()
+        if row['sketch'] is not None:
+            return NGramSketch(row['sketch'])
+        return NGramSketch.new(row['token_count'] * sizes)
+
     def _has_ngrams(self, text_id, size):
         """Returns True if a text has existing records for n-grams of
         size `size`.
@@ -505,81 +1895,447 @@ class DataStore:
             return False
         return True
 
-    def _initialise_database(self):
+    def _initialise_database(self, layout=constants.LAYOUT_HEAP,
+                             index=constants.INDEX_NGRAM):
         """Creates the database schema.
 
         This will not create tables or indices that already exist and
-        is safe to be called on an existing database.
+        is safe to be called on an existing database. `layout` and
+        `index` are used only if the database is new; otherwise the
+        database keeps its existing layout and index.
+
+        :param layout: layout of the TextNGram table
+        :type layout: `str`
+        :param index: kind of index
+        :type index: `str`
 
         """
         self._logger.info('Creating database schema, if necessary')
+        self._conn.execute(constants.CREATE_TABLE_SETTING_SQL)
+        existing_layout = self._get_setting(constants.LAYOUT_SETTING)
+        if existing_layout is None:
+            # The n-grams derived from a suffix index are held in
+            # temporary tables with the heap layout.
+            if index == constants.INDEX_SUFFIX:
+                layout = constants.LAYOUT_HEAP
+            self._set_setting(constants.LAYOUT_SETTING, layout)
+            self._set_setting(constants.INDEX_SETTING, index)
+        else:
+            # Databases created before the index setting was added
+            # have an n-gram index.
+            existing_index = self._get_setting(
+                constants.INDEX_SETTING) or constants.INDEX_NGRAM
+            if existing_layout != layout:
+                self._logger.info(
+                    'Database has the {} layout; ignoring the {} '
+                    'layout'.format(existing_layout, layout))
+            if existing_index != index:
+                self._logger.info(
+                    'Database has the {} index; ignoring the {} '
+                    'index'.format(existing_index, index))
+            layout = existing_layout
+            index = existing_index
         self._conn.execute(constants.CREATE_TABLE_TEXT_SQL)
-        self._conn.execute(constants.CREATE_TABLE_TEXTNGRAM_SQL)
+        self._conn.execute(constants.CREATE_INDEX_TEXT_SQL)
+        self._conn.execute(constants.PRAGMA_SET_USER_VERSION_SQL.format(
+            constants.DATABASE_VERSION))
+        if index == constants.INDEX_SUFFIX:
+            self._conn.execute(constants.CREATE_TABLE_TOKEN_SQL)
+            self._conn.execute(constants.CREATE_TABLE_TEXTSUFFIXARRAY_SQL)
+            return
+        self._conn.execute(constants.CREATE_TABLE_NGRAM_SQL)
+        # The partitions of the partitioned layout are created as
+        # n-grams of each size are added.
+        if layout == constants.LAYOUT_CLUSTERED:
+            self._conn.execute(constants.CREATE_TABLE_TEXTNGRAM_CLUSTERED_SQL)
+        elif layout != constants.LAYOUT_PARTITIONED:
+            self._conn.execute(constants.CREATE_TABLE_TEXTNGRAM_SQL)
         self._conn.execute(constants.CREATE_TABLE_TEXTHASNGRAM_SQL)
         self._conn.execute(constants.CREATE_INDEX_TEXTHASNGRAM_SQL)
-        self._conn.execute(constants.CREATE_INDEX_TEXT_SQL)
-
-    def intersection(self, catalogue, output_fh):
+        self._conn.execute(constants.CREATE_TABLE_TEXTSKETCH_SQL)
+        self._conn.execute(constants.CREATE_TABLE_NGRAMSTATS_SQL)
+        self._conn.execute(constants.CREATE_TABLE_NGRAMSTATSPENDING_SQL)
+        self._create_label_ngram_tables()
+
+    def intersection(self, catalogue, output_fh, minimum=None,
+                     maximum=None, engine=constants.INTERSECT_ENGINE_NESTED,
+                     jobs=1, min_works=None, max_works=None, min_count=None,
+                     max_count=None, sort=False, label_count=False,
+                     label_work_count=False):
         """Returns `output_fh` populated with CSV results giving the
         intersection in n-grams of the witnesses of labelled sets of
         works in `catalogue`.
 
+        The nested engine filters the n-grams of each label by those
+        of the next; the grouped engine instead groups the n-grams of
+        all of the labels in a single pass and keeps those that occur
+        under every label, which copes better with many labels.
+
+        If `jobs` is greater than 1, the query is run in that many
+        processes.
+
+        The results are limited to the n-grams in between `min_works`
+        and `max_works` works and with a total count between
+        `min_count` and `max_count`, as by
+        `Results.prune_by_work_count` and
+        `Results.prune_by_ngram_count`.
+
+        If `sort` is True, the results are output in the order given
+        by `Results.sort`, without all of them being held in memory.
+
+        If `label_count` or `label_work_count` is True, the column
+        added by `Results.add_label_count` or
+        `Results.add_label_work_count` is computed in the query and
+        added to the results.
+
         :param catalogue: catalogue matching filenames to labels
         :type catalogue: `Catalogue`
         :param output_fh: object to output results to
         :type output_fh: file-like object
+        :param minimum: minimum size of n-grams to output
+        :type minimum: `int`
+        :param maximum: maximum size of n-grams to output
+        :type maximum: `int`
+        :param engine: intersection engine
+        :type engine: `str`
+        :param jobs: number of processes to run the query in
+        :type jobs: `int`
+        :param min_works: minimum number of works with an n-gram
+        :type min_works: `int`
+        :param max_works: maximum number of works with an n-gram
+        :type max_works: `int`
+        :param min_count: minimum total count of an n-gram
+        :type min_count: `int`
+        :param max_count: maximum total count of an n-gram
+        :type max_count: `int`
+        :param sort: whether to sort the results as by `Results.sort`
+        :type sort: `bool`
+        :param label_count: whether to add the label count column
+        :type label_count: `bool`
+        :param label_work_count: whether to add the label work count
+                                 column
+        :type label_work_count: `bool`
         :rtype: file-like object
 
         """
+        self._check_database_version()
+        jobs = self._check_jobs(jobs)
         labels = self._sort_labels(self._set_labels(catalogue))
         if len(labels) < 2:
             raise MalformedQueryError(
                 constants.INSUFFICIENT_LABELS_QUERY_ERROR)
+        label_counts = (label_count, label_work_count)
+        if not self._prune_intersection(labels):
+            return self._csv([], self._get_query_fieldnames(label_counts),
+                             output_fh)
+        self._add_derived_ngrams(minimum, maximum)
         label_placeholders = self._get_placeholders(labels)
-        subquery = self._get_intersection_subquery(labels)
+        cached = self._uses_label_cache()
+        if cached:
+            parameters = labels + self._get_label_ngram_sets(labels)
+        else:
+            parameters = labels + labels
+        if engine == constants.INTERSECT_ENGINE_GROUPED:
+            parameters.append(len(labels))
+        subquery = self._get_intersection_subquery(labels, cached, engine)
         query = constants.SELECT_INTERSECT_SQL.format(label_placeholders,
                                                       subquery)
-        parameters = labels + labels
-        self._logger.info('Running intersection query')
+        self._logger.info('Running intersection query ({} engine)'.format(
+            engine))
         self._logger.debug('Query: {}\nLabels: {}'.format(query, labels))
-        self._log_query_plan(query, parameters)
-        cursor = self._conn.execute(query, parameters)
-        return self._csv(cursor, constants.QUERY_FIELDNAMES, output_fh)
-
-    def intersection_supplied(self, results_filenames, labels, output_fh):
+        cursor = self._execute_ngram_query(
+            query, parameters, minimum, maximum, jobs=jobs,
+            limits=(min_works, max_works, min_count, max_count),
+            label_counts=label_counts)
+        return self._csv(cursor, self._get_query_fieldnames(label_counts),
+                         output_fh, sort)
+
+    def intersection_supplied(self, results_filenames, labels, output_fh,
+                              minimum=None, maximum=None, min_works=None,
+                              max_works=None, min_count=None,
+                              max_count=None, sort=False, label_count=False,
+                              label_work_count=False):
         """Returns `output_fh` populated with CSV results giving the n-grams
         that are common to witnesses in every set of works in
         `results_sets`, using the labels in `labels`.
 
+        As with `intersection`, the works and total count of the
+        n-grams output are limited, and the results may be sorted and
+        have label counts added.
+
         :param results_filenames: list of results to be diffed
         :type results_filenames: `list` of `str`
         :param labels: labels to be applied to the results_sets
         :type labels: `list`
         :param output_fh: object to output results to
         :type output_fh: file-like object
+        :param minimum: minimum size of n-grams to output
+        :type minimum: `int`
+        :param maximum: maximum size of n-grams to output
+        :type maximum: `int`
+        :param min_works: minimum number of works with an n-gram
+        :type min_works: `int`
+        :param max_works: maximum number of works with an n-gram
+        :type max_works: `int`
+        :param min_count: minimum total count of an n-gram
+        :type min_count: `int`
+        :param max_count: maximum total count of an n-gram
+        :type max_count: `int`
+        :param sort: whether to sort the results as by `Results.sort`
+        :type sort: `bool`
+        :param label_count: whether to add the label count column
+        :type label_count: `bool`
+        :param label_work_count: whether to add the label work count
+                                 column
+        :type label_work_count: `bool`
         :rtype: file-like object
 
         """
         self._add_temporary_results_sets(results_filenames, labels)
         query = constants.SELECT_INTERSECT_SUPPLIED_SQL
         parameters = [len(labels)]
+        if minimum:
+            query += constants.SELECT_SUPPLIED_SIZE_MINIMUM_SQL
+            parameters.append(minimum)
+        if maximum:
+            query += constants.SELECT_SUPPLIED_SIZE_MAXIMUM_SQL
+            parameters.append(maximum)
+        query, parameters = self._limit_ngrams(
+            query, parameters, (min_works, max_works, min_count, max_count))
+        label_counts = (label_count, label_work_count)
+        query = self._add_label_counts(query, label_counts)
         self._logger.info('Running supplied intersect query')
         self._logger.debug('Query: {}\nNumber of labels: {}'.format(
-            query, parameters[0]))
+            query, len(labels)))
         self._log_query_plan(query, parameters)
         cursor = self._conn.execute(query, parameters)
-        return self._csv(cursor, constants.QUERY_FIELDNAMES, output_fh)
+        return self._csv(cursor, self._get_query_fieldnames(label_counts),
+                         output_fh, sort)
+
+    @staticmethod
+    def _limit_ngrams(query, parameters, limits):
+        """Returns `query`, and its parameters, restricted to the rows
+        of the n-grams whose works and total count are within
+        `limits`.
+
+        As in `Results.prune_by_work_count`, the works of an n-gram
+        are those with a non-zero count of it, and an n-gram in no
+        works is removed if there is any limit on its works; as in
+        `Results.prune_by_ngram_count`, the total count of an n-gram
+        is the sum of its maximum count in each work. A limit of 0 is
+        no limit.
+
+        :param query: query selecting n-gram results
+        :type query: `str`
+        :param parameters: parameters to `query`
+        :type parameters: `list`
+        :param limits: minimum and maximum works and total count of
+                       n-grams, or None
+        :type limits: `tuple`
+        :rtype: `tuple` of `str` and `list`
+
+        """
+        if limits is None or not any(limits):
+            return query, parameters
+        min_works, max_works, min_count, max_count = limits
+        conditions = []
+        limit_parameters = []
+        if min_works or max_works:
+            conditions.append(constants.LIMIT_HAS_WORKS_SQL)
+        for value, condition in (
+                (min_works, constants.LIMIT_MINIMUM_WORKS_SQL),
+                (max_works, constants.LIMIT_MAXIMUM_WORKS_SQL),
+                (min_count, constants.LIMIT_MINIMUM_COUNT_SQL),
+                (max_count, constants.LIMIT_MAXIMUM_COUNT_SQL)):
+            if value:
+                conditions.append(condition)
+                limit_parameters.append(value)
+        query = constants.SELECT_LIMITED_NGRAMS_SQL.format(
+            query, ' AND '.join(conditions))
+        return query, parameters + limit_parameters
+
+    def _limit_ngrams_by_stats(self, query, parameters, limits):
+        """Returns `query`, which selects n-gram results from
+        TextNGram, and its parameters, restricted to the n-grams whose
+        corpus-wide statistics meet the minimum works and total count
+        in `limits`.
+
+        The works and total count of an n-gram in any results cannot
+        exceed those in the whole corpus, so this removes only
+        n-grams that `_limit_ngrams` would remove, without having to
+        aggregate their rows. A database with a suffix index has no
+        statistics, and `query` is returned unchanged, as it is if any
+        witness's n-grams are not yet counted in the statistics (as
+        after an interrupted run of `add_ngrams`), since the
+        statistics may then undercount.
+
+        :param query: query selecting n-gram results from TextNGram
+        :type query: `str`
+        :param parameters: parameters to `query`
+        :type parameters: `list`
+        :param limits: minimum and maximum works and total count of
+                       n-grams, or None
+        :type limits: `tuple`
+        :rtype: `tuple` of `str` and `list`
+
+        """
+        if limits is None or not (limits[0] or limits[2]) or \
+                self._get_setting(constants.INDEX_SETTING) == \
+                constants.INDEX_SUFFIX:
+            return query, parameters
+        if self._conn.execute(
+                constants.SELECT_HAS_NGRAM_STATS_PENDING_SQL).fetchone() \
+                is not None:
+            self._logger.info('Not limiting n-grams by their statistics, '
+                              'which are not up to date')
+            return query, parameters
+        min_works, max_works, min_count, max_count = limits
+        conditions = []
+        limit_parameters = []
+        for value, condition in (
+                (min_works, constants.LIMIT_STATS_MINIMUM_WORKS_SQL),
+                (min_count, constants.LIMIT_STATS_MINIMUM_COUNT_SQL)):
+            if value:
+                conditions.append(condition)
+                limit_parameters.append(value)
+        query += constants.SELECT_NGRAM_STATS_LIMIT_SQL.format(
+            ' AND '.join(conditions))
+        return query, parameters + limit_parameters
+
+    def _limit_rows(self, rows, limits):
+        """Returns the rows of `rows` of the n-grams whose works and
+        total count are within `limits`, as `_limit_ngrams` does in
+        SQL.
+
+        :param rows: rows of results
+        :type rows: `list` of `sqlite3.Row`
+        :param limits: minimum and maximum works and total count of
+                       n-grams
+        :type limits: `tuple`
+        :rtype: `list` of `sqlite3.Row`
+
+        """
+        min_works, max_works, min_count, max_count = limits
+        ngram_index = self._NGRAM_INDEX
+        work_index = self._WORK_INDEX
+        count_index = self._COUNT_INDEX
+        work_counts = collections.defaultdict(dict)
+        for row in rows:
+            counts = work_counts[row[ngram_index]]
+            work = row[work_index]
+            counts[work] = max(counts.get(work, 0), row[count_index])
+        ngrams = set()
+        for ngram, counts in work_counts.items():
+            works = len([count for count in counts.values() if count > 0])
+            total = sum(counts.values())
+            if (min_works or max_works) and not works:
+                continue
+            if (min_works and works < min_works) or \
+                    (max_works and works > max_works) or \
+                    (min_count and total < min_count) or \
+                    (max_count and total > max_count):
+                continue
+            ngrams.add(ngram)
+        return [row for row in rows if row[ngram_index] in ngrams]
+
+    def _log_insert_rate(self, rows, start):
+        """Logs the rate at which `rows` rows were added since `start`.
+
+        :param rows: number of rows added
+        :type rows: `int`
+        :param start: time adding the rows started, from
+                      `time.perf_counter`
+        :type start: `float`
+
+        """
+        duration = time.perf_counter() - start
+        rate = rows / duration if duration > 0 else rows
+        self._logger.debug(
+            'Added {} rows in {:.2f} seconds ({:.0f} rows/second)'.format(
+                rows, duration, rate))
 
     def _log_query_plan(self, query, parameters):
-        cursor = self._conn.execute('EXPLAIN QUERY PLAN ' + query, parameters)
+        if self._profiler is None and \
+                not self._logger.isEnabledFor(logging.DEBUG):
+            return
+        plan = self._conn.execute('EXPLAIN QUERY PLAN ' + query,
+                                  parameters).fetchall()
+        if self._profiler is not None:
+            self._profiler.add_plan(query, parameters, plan)
         query_plan = 'Query plan:\n'
-        for row in cursor.fetchall():
+        for row in plan:
             query_plan += '|'.join([str(value) for value in row]) + '\n'
         self._logger.debug(query_plan)
 
-    def _reduce_diff_results(self, matches_path, tokenizer, output_fh):
+    def ngram_stats(self, output_fh, minimum=None, maximum=None):
+        """Returns `output_fh` populated with CSV results giving the
+        number of works and witnesses each n-gram occurs in, and its
+        total count across those witnesses.
+
+        :param output_fh: object to output results to
+        :type output_fh: file-like object
+        :param minimum: minimum n-gram size
+        :type minimum: `int`
+        :param maximum: maximum n-gram size
+        :type maximum: `int`
+        :rtype: file-like object
+
+        """
+        self._check_database_version()
+        if self._get_setting(constants.INDEX_SETTING) == \
+                constants.INDEX_SUFFIX:
+            raise TACLError(constants.NGRAM_STATS_UNAVAILABLE_ERROR)
+        query = constants.SELECT_NGRAM_STATS_SQL
+        parameters = []
+        if minimum is not None:
+            query += constants.SELECT_NGRAM_STATS_SIZE_MINIMUM_SQL
+            parameters.append(minimum)
+        if maximum is not None:
+            query += constants.SELECT_NGRAM_STATS_SIZE_MAXIMUM_SQL
+            parameters.append(maximum)
+        self._logger.info('Running n-gram statistics query')
+        self._log_query_plan(query, parameters)
+        cursor = self._conn.execute(query, parameters)
+        return self._csv(cursor, constants.NGRAM_STATS_FIELDNAMES, output_fh)
+
+    @staticmethod
+    def _receive_chunk(reader):
+        """Returns the next chunk of rows sent by a process running a
+        partition of a query, or None if it has sent them all.
+
+        :param reader: connection to receive from
+        :type reader: `multiprocessing.connection.Connection`
+        :rtype: `list` of `tuple`
+
+        """
+        try:
+            chunk = reader.recv()
+        except EOFError:
+            raise MalformedQueryError(constants.PARALLEL_QUERY_WORKER_ERROR)
+        if isinstance(chunk, Exception):
+            raise chunk
+        return chunk
+
+    def _receive_rows(self, reader):
+        """Yields the rows sent by a process running a partition of a
+        query.
+
+        :param reader: connection to receive from
+        :type reader: `multiprocessing.connection.Connection`
+        :rtype: `generator` of `tuple`
+
+        """
+        while True:
+            rows = self._receive_chunk(reader)
+            if rows is None:
+                return
+            yield from rows
+
+    def _reduce_diff_results(self, rows, tokenizer, output_fh,
+                             minimum=None, limits=None, sort=False,
+                             label_counts=None):
         """Returns `output_fh` populated with a reduced set of data from
-        `matches_fh`.
+        `rows`.
 
         Diff results typically contain a lot of filler results that
         serve only to hide real differences. If one text has a single
@@ -588,90 +2344,169 @@ class DataStore:
         not helpful. This method removes these filler results by
         'reducing down' the results.
 
-        :param matches_path: filepath or buffer of CSV results to be reduced
-        :type matches_path: `str` or file-like object
+        `rows` must be ordered by work, siglum and size. The rows of
+        each size of a witness are checked together and then written
+        out, and only the n-grams of the previous size of the current
+        witness are held in memory. If the n-grams output are limited
+        by their works or total count, or have label counts added,
+        which depend on every witness, the reduced rows are instead
+        all held until they are limited and counted.
+
+        :param rows: results to be reduced
+        :type rows: iterable of `sqlite3.Row`
         :param tokenizer: tokenizer for the n-grams
         :type tokenizer: `Tokenizer`
-        :param output_fh: object to write results to
-        :type output_fh: file-like object
+        :param output_fh: object to write results to, or objects to
+                          write the results of each label to, keyed
+                          by label
+        :type output_fh: file-like object or `dict`
+        :param minimum: minimum size of n-grams to output
+        :type minimum: `int`
+        :param limits: minimum and maximum works and total count of
+                       n-grams to output
+        :type limits: `tuple`
+        :param sort: whether to sort the results as by `Results.sort`
+        :type sort: `bool`
+        :param label_counts: whether to add the label count and the
+                             label work count columns
+        :type label_counts: `tuple` of `bool`
         :rtype: file-like object
 
         """
         self._logger.info('Removing filler results')
+        self._start_phase(constants.PROFILE_PHASE_REDUCE)
         # For performance, perform the attribute accesses once.
-        tokenize = tokenizer.tokenize
-        join = tokenizer.joiner.join
-        results = []
+        check = self._check_diff_results
+        ngram_index = self._NGRAM_INDEX
+        count_index = self._COUNT_INDEX
+        fieldnames = self._get_query_fieldnames(label_counts)
+        if isinstance(output_fh, dict):
+            writer = get_label_results_writer(
+                output_fh, fieldnames, self._results_format, sort)
+        else:
+            writer = get_results_writer(output_fh, fieldnames,
+                                        self._results_format, sort)
+        limited = limits is not None and any(limits)
+        counted = label_counts is not None and any(label_counts)
+        if limited or counted:
+            held_rows = []
+            writerows = held_rows.extend
+        else:
+            writerows = writer.writerows
         previous_witness = (None, None)
         previous_data = {}
-        # Calculate the index of ngram and count columns in a Pandas
-        # named tuple row, as used below. The +1 is due to the tuple
-        # having the row index as the first element.
-        ngram_index = constants.QUERY_FIELDNAMES.index(
-            constants.NGRAM_FIELDNAME) + 1
-        count_index = constants.QUERY_FIELDNAMES.index(
-            constants.COUNT_FIELDNAME) + 1
+        output_rows = 0
         # Operate over individual witnesses and sizes, so that there
         # is no possible results pollution between them.
-        grouped = pd.read_csv(matches_path, encoding='utf-8',
-                              na_filter=False).groupby(
-            [constants.WORK_FIELDNAME, constants.SIGLUM_FIELDNAME,
-             constants.SIZE_FIELDNAME])
-        for (work, siglum, size), group in grouped:
+        for (work, siglum, size), group in itertools.groupby(
+                rows, key=self._witness_size_key):
+            output = minimum is None or size >= minimum
+            group = list(group)
+            ngrams = [row[ngram_index] for row in group]
+            counts = [row[count_index] for row in group]
             if (work, siglum) != previous_witness:
-                previous_matches = group
                 previous_witness = (work, siglum)
+                if output:
+                    writerows(group)
+                    output_rows += len(group)
             else:
+                counts = check(ngrams, counts, size, previous_data,
+                               tokenizer)
+                reduced = [row for row, count in zip(group, counts) if count]
                 self._logger.debug(
-                    'Reducing down {} {}-grams for {} {}'.format(
-                        len(group.index), size, work, siglum))
-                if previous_matches.empty:
-                    reduced_count = 0
-                else:
-                    previous_matches = group.apply(
-                        self._check_diff_result, axis=1,
-                        args=(previous_data, tokenize, join))
-                    reduced_count = len(previous_matches[previous_matches[
-                                        constants.COUNT_FIELDNAME] != 0].index)
-                self._logger.debug('Reduced down to {} grams'.format(
-                    reduced_count))
-            # Put the previous matches into a form that is more
-            # performant for the lookups made in _check_diff_result.
-            previous_data = {}
-            for row in previous_matches.itertuples():
-                previous_data[row[ngram_index]] = row[count_index]
-            if not previous_matches.empty:
-                results.append(previous_matches[previous_matches[
-                    constants.COUNT_FIELDNAME] != 0])
-        reduced_results = pd.concat(results, ignore_index=True).reindex(
-            columns=constants.QUERY_FIELDNAMES)
-        reduced_results.to_csv(output_fh, encoding='utf-8', float_format='%d',
-                               index=False)
+                    'Reduced down {} {}-grams for {} {} to {}'.format(
+                        len(group), size, work, siglum, len(reduced)))
+                if output:
+                    writerows(reduced)
+                    output_rows += len(reduced)
+            previous_data = dict(zip(ngrams, counts))
+        if limited:
+            held_rows = self._limit_rows(held_rows, limits)
+            output_rows = len(held_rows)
+        if counted:
+            held_rows = self._add_label_counts_to_rows(held_rows,
+                                                       label_counts)
+        if limited or counted:
+            writer.writerows(held_rows)
+        writer.close()
+        if self._profiler is not None:
+            self._profiler.add_rows(output_rows)
+        self._end_phase()
         return output_fh
 
-    def search(self, catalogue, ngrams, output_fh):
+    def search(self, catalogue, ngrams, output_fh, minimum=None,
+               maximum=None, patterns=False, min_works=None, max_works=None,
+               min_count=None, max_count=None, sort=False,
+               label_count=False, label_work_count=False):
         """Returns `output_fh` populated with CSV results for each n-gram in
         `ngrams` that occurs within labelled witnesses in `catalogue`.
 
+        If `patterns` is True, each of `ngrams` is instead a GLOB
+        pattern, and the results are for each n-gram matching any of
+        them.
+
+        As with `intersection`, the works and total count of the
+        n-grams output are limited, and the results may be sorted and
+        have label counts added.
+
         :param catalogue: catalogue matching filenames to labels
         :type catalogue: `Catalogue`
         :param ngrams: n-grams to search for
         :type ngrams: `list`
         :param output_fh: object to write results to
         :type output_fh: file-like object
+        :param minimum: minimum size of n-grams to output
+        :type minimum: `int`
+        :param maximum: maximum size of n-grams to output
+        :type maximum: `int`
+        :param patterns: whether `ngrams` are patterns
+        :type patterns: `bool`
+        :param min_works: minimum number of works with an n-gram
+        :type min_works: `int`
+        :param max_works: maximum number of works with an n-gram
+        :type max_works: `int`
+        :param min_count: minimum total count of an n-gram
+        :type min_count: `int`
+        :param max_count: maximum total count of an n-gram
+        :type max_count: `int`
+        :param sort: whether to sort the results as by `Results.sort`
+        :type sort: `bool`
+        :param label_count: whether to add the label count column
+        :type label_count: `bool`
+        :param label_work_count: whether to add the label work count
+                                 column
+        :type label_work_count: `bool`
         :rtype: file-like object
 
         """
-        self._add_temporary_ngrams(ngrams)
+        self._check_database_version()
         labels = list(self._set_labels(catalogue))
+        if not patterns and self._get_setting(constants.INDEX_SETTING) == \
+                constants.INDEX_SUFFIX:
+            # Only derive the n-grams of the sizes of those searched
+            # for; a pattern may match n-grams of any size.
+            self._add_derived_ngrams(sizes=self._get_search_sizes(
+                ngrams, minimum, maximum))
+        else:
+            self._add_derived_ngrams(minimum, maximum)
+        # Only the sizes of the n-grams searched for need be queried.
+        found_minimum, found_maximum = self._add_search_ngrams(
+            ngrams, patterns)
+        if found_minimum is not None:
+            minimum = max(minimum or found_minimum, found_minimum)
+            maximum = min(maximum or found_maximum, found_maximum)
         label_placeholders = self._get_placeholders(labels)
         query = constants.SELECT_SEARCH_SQL.format(label_placeholders)
         self._logger.info('Running search query')
         self._logger.debug('Query: {}\nN-grams: {}'.format(
             query, ', '.join(ngrams)))
-        self._log_query_plan(query, labels)
-        cursor = self._conn.execute(query, labels)
-        return self._csv(cursor, constants.QUERY_FIELDNAMES, output_fh)
+        label_counts = (label_count, label_work_count)
+        cursor = self._execute_ngram_query(
+            query, labels, minimum, maximum,
+            limits=(min_works, max_works, min_count, max_count),
+            label_counts=label_counts)
+        return self._csv(cursor, self._get_query_fieldnames(label_counts),
+                         output_fh, sort)
 
     def search_witness(self, catalogue, ngrams, labelled_only, output_fh):
         """Returns `output_fh` populated with CSV results for each witness
@@ -704,11 +2539,13 @@ class DataStore:
 
     def _set_labels(self, catalogue):
         """Returns a dictionary of the unique labels in `catalogue` and the
-        count of all tokens associated with each, and sets the record
-        of each Text to its corresponding label.
+        count of all tokens associated with each, and sets up a
+        temporary table of the labelled witnesses and their labels.
 
-        Texts that do not have a label specified are set to the empty
-        string.
+        Queries join to the temporary LabelledText table rather than
+        to Text, so that labelling witnesses does not write to the
+        database. Witnesses whose work is not in `catalogue` are
+        unlabelled, and are not in the table.
 
         Token counts are included in the results to allow for
         semi-accurate sorting based on corpora size.
@@ -718,16 +2555,136 @@ class DataStore:
         :rtype: `dict`
 
         """
+        self._start_phase(constants.PROFILE_PHASE_LABELS)
+        self._create_temporary_label_tables()
         with self._conn:
-            self._conn.execute(constants.UPDATE_LABELS_SQL, [''])
-            labels = {}
-            for work, label in catalogue.items():
-                self._conn.execute(constants.UPDATE_LABEL_SQL, [label, work])
-                cursor = self._conn.execute(
-                    constants.SELECT_TEXT_TOKEN_COUNT_SQL, [work])
-                token_count = cursor.fetchone()['token_count']
-                labels[label] = labels.get(label, 0) + token_count
-        return labels
+            self._conn.executemany(constants.INSERT_TEMPORARY_CATALOGUE_SQL,
+                                   catalogue.items())
+            self._conn.execute(constants.INSERT_TEMPORARY_LABELLED_TEXTS_SQL)
+        cursor = self._conn.execute(
+            constants.SELECT_TEMPORARY_LABEL_TOKEN_COUNTS_SQL)
+        label_data = {row['label']: row['token_count'] for row in cursor}
+        # Everything from here until the results are output is part
+        # of running the query.
+        self._start_phase(constants.PROFILE_PHASE_QUERY)
+        return label_data
+
+    def _set_labelled_texts(self, labelled_texts):
+        """Sets up the temporary table of labelled witnesses with the
+        rows `labelled_texts`, as copied from that of another
+        connection.
+
+        :param labelled_texts: rows of id, work, siglum, token count
+                               and label
+        :type labelled_texts: `list` of `tuple`
+
+        """
+        self._create_temporary_label_tables()
+        with self._conn:
+            self._conn.executemany(
+                constants.INSERT_TEMPORARY_LABELLED_TEXT_SQL, labelled_texts)
+
+    def _prune_intersection(self, labels):
+        """Removes from the labelled witnesses those that cannot share
+        any n-gram with every other label in `labels`, and returns
+        False if the intersection between `labels` must be empty.
+
+        This is determined from the sketches of the witnesses; a
+        witness without a sketch is never removed, and a label with
+        such a witness is assumed to have every n-gram.
+
+        :param labels: labels to be intersected
+        :type labels: `list` of `str`
+        :rtype: `bool`
+
+        """
+        if self._get_setting(constants.INDEX_SETTING) == \
+                constants.INDEX_SUFFIX:
+            return True
+        query = constants.SELECT_LABELLED_SKETCHES_SQL.format(
+            self._get_placeholders(labels))
+        witnesses = {label: [] for label in labels}
+        label_sketches = {}
+        for row in self._conn.execute(query, labels):
+            label = row['label']
+            sketch = None
+            if row['sketch'] is not None:
+                sketch = NGramSketch(row['sketch'])
+            witnesses[label].append((row['id'], sketch))
+            if label not in label_sketches:
+                label_sketches[label] = sketch
+            elif sketch is None or label_sketches[label] is None:
+                label_sketches[label] = None
+            else:
+                label_sketches[label] = label_sketches[label].union(sketch)
+        pruned = []
+        for label in labels:
+            others = None
+            for other_label in labels:
+                other = label_sketches.get(other_label)
+                if other_label == label or other is None:
+                    continue
+                if others is None:
+                    others = other
+                else:
+                    others = others.intersection(other)
+            if others is None:
+                continue
+            remaining = 0
+            for text_id, sketch in witnesses[label]:
+                if sketch is not None and sketch.intersection(
+                        others).is_empty():
+                    pruned.append(text_id)
+                else:
+                    remaining += 1
+            if not remaining:
+                self._logger.info('No witness labelled {} can share n-grams '
+                                  'with every other label'.format(label))
+                return False
+        if pruned:
+            self._logger.info('Skipping {} witnesses that cannot share '
+                              'n-grams with every other label'.format(
+                                  len(pruned)))
+            with self._conn:
+                self._conn.executemany(
+                    constants.DELETE_TEMPORARY_LABELLED_TEXT_SQL,
+                    [(text_id,) for text_id in pruned])
+        if len(label_sketches) == len(labels) and \
+                None not in label_sketches.values():
+            common = None
+            for sketch in label_sketches.values():
+                if common is None:
+                    common = sketch
+                else:
+                    common = common.intersection(sketch)
+            self._logger.info('Estimated number of n-grams common to all '
+                              'labels: {}'.format(common.estimate_count()))
+        return True
+
+    def _set_setting(self, name, value):
+        """Sets the database setting `name` to `value`.
+
+        :param name: name of setting
+        :type name: `str`
+        :param value: value of setting
+        :type value: `str`
+
+        """
+        self._conn.execute(constants.INSERT_SETTING_SQL, [name, value])
+
+    def _set_text_sketch(self, text_id, sketch):
+        """Sets the sketch of the n-grams of the text with `text_id` to
+        `sketch`.
+
+        :param text_id: database ID of text
+        :type text_id: `int`
+        :param sketch: sketch of the text's n-grams
+        :type sketch: `NGramSketch`
+
+        """
+        with self._conn:
+            self._conn.execute(constants.INSERT_TEXT_SKETCH_SQL,
+                               [text_id, sketch.to_bytes()])
 
     @staticmethod
     def _sort_labels(label_data):
@@ -744,9 +2701,81 @@ class DataStore:
         labels.sort(key=label_data.get, reverse=True)
         return labels
 
+    def _start_phase(self, name):
+        """Starts the phase `name` of the query being profiled, if
+        any.
+
+        :param name: name of phase
+        :type name: `str`
+
+        """
+        if self._profiler is not None:
+            self._profiler.start_phase(name)
+
+    def _update_ngram_stats(self):
+        """Adds the n-grams of each witness and size not yet counted
+        in the n-gram statistics to them.
+
+        An n-gram's count of works is increased only if no other
+        witness of the same work that has already been counted has
+        the n-gram, which relies on TextNGram being indexed.
+
+        """
+        pending = self._conn.execute(
+            constants.SELECT_NGRAM_STATS_PENDING_SQL).fetchall()
+        if not pending:
+            return
+        if self._conn.execute(
+                constants.SELECT_HAS_NGRAM_STATS_SQL).fetchone() is None:
+            # Nothing has been counted yet, as in a new database, and
+            # aggregating all of the n-grams at once is much quicker
+            # than counting each witness in turn.
+            with self._conn:
+                self._add_all_ngram_stats()
+                self._conn.execute(
+                    constants.DELETE_NGRAM_STATS_ALL_PENDING_SQL)
+            return
+        self._logger.info('Updating n-gram statistics')
+        partitioned = self._get_setting(constants.LAYOUT_SETTING) == \
+            constants.LAYOUT_PARTITIONED
+        for text_id, size in pending:
+            with self._conn:
+                # A run interrupted before adding the n-grams of a
+                # pending size leaves nothing to count.
+                if self._has_ngrams(text_id, size):
+                    partition = size if partitioned else None
+                    for sql in (constants.INSERT_NGRAM_STATS_SQL,
+                                constants.UPDATE_NGRAM_STATS_ADD_SQL):
+                        self._conn.execute(
+                            self._get_partition_sql(sql, partition),
+                            [text_id, size])
+                self._conn.execute(constants.DELETE_NGRAM_STATS_PENDING_SQL,
+                                   [text_id, size])
+        self._logger.info('N-gram statistics updated')
+
+    def _update_text_file_stat(self, text_id, file_stat):
+        """Updates the record with `text_id` with the size and
+        modification time in `file_stat`.
+
+        In a read-only database the record is left unchanged, so the
+        witness is read again when next validated.
+
+        :param text_id: database ID of Text record
+        :type text_id: `int`
+        :param file_stat: size and modification time of file
+        :type file_stat: `tuple`
+
+        """
+        if self._read_only:
+            return
+        file_size, mtime = file_stat
+        with self._conn:
+            self._conn.execute(constants.UPDATE_TEXT_FILE_STAT_SQL,
+                               [file_size, mtime, text_id])
+
     def _update_text_record(self, witness, text_id):
-        """Updates the record with `text_id` with `witness`\'s checksum and
-        token count.
+        """Updates the record with `text_id` with `witness`\'s checksum,
+        token count, and file size and modification time.
 
         :param withness: witness to update from
         :type witness: `WitnessText`
@@ -756,14 +2785,170 @@ class DataStore:
         """
         checksum = witness.get_checksum()
         token_count = len(witness.get_tokens())
+        file_size, mtime = witness.get_file_stat()
         with self._conn:
             self._conn.execute(constants.UPDATE_TEXT_SQL,
-                               [checksum, token_count, text_id])
+                               [checksum, token_count, file_size, mtime,
+                                text_id])
+
+    def upgrade(self):
+        """Upgrades the database to the current version of the schema.
+
+        Each upgrade step is made within a transaction, and the
+        database is vacuumed afterwards to reclaim the space freed by
+        the old tables.
+
+        """
+        version = self._get_database_version()
+        if version >= constants.DATABASE_VERSION:
+            self._logger.info(
+                'Database is already at schema version {}'.format(version))
+            return
+        upgrades = [self._upgrade_from_version_0,
+                    self._upgrade_from_version_1,
+                    self._upgrade_from_version_2,
+                    self._upgrade_from_version_3,
+                    self._upgrade_from_version_4]
+        self._conn.commit()
+        self._drop_indices()
+        for from_version in range(version, constants.DATABASE_VERSION):
+            self._logger.info(
+                'Upgrading database from schema version {} to {}'.format(
+                    from_version, from_version + 1))
+            with self._conn:
+                self._conn.execute(constants.BEGIN_TRANSACTION_SQL)
+                upgrades[from_version]()
+                self._conn.execute(
+                    constants.PRAGMA_SET_USER_VERSION_SQL.format(
+                        from_version + 1))
+        self._add_indices()
+        self._analyse()
+        self._logger.info('Vacuuming database')
+        self._conn.execute(constants.VACUUM_SQL)
+        self._logger.info('Database upgraded')
+
+    def _upgrade_from_version_0(self):
+        """Upgrades the database from the unversioned schema, replacing
+        the n-gram text in each TextNGram record with the ID of an
+        NGram record."""
+        self._conn.execute(constants.UPGRADE_0_RENAME_TEXTNGRAM_SQL)
+        self._conn.execute(constants.CREATE_TABLE_NGRAM_SQL)
+        self._conn.execute(constants.CREATE_TABLE_TEXTNGRAM_SQL)
+        self._logger.info('Adding n-grams to the NGram table')
+        self._conn.execute(constants.UPGRADE_0_COPY_NGRAMS_SQL)
+        self._logger.info('Replacing n-grams with their IDs')
+        self._conn.execute(constants.UPGRADE_0_COPY_TEXT_NGRAMS_SQL)
+        self._conn.execute(constants.UPGRADE_0_DROP_TEXTNGRAM_SQL)
+
+    def _upgrade_from_version_1(self):
+        """Upgrades the database from version 1 of the schema, adding
+        columns for the size and modification time of each witness's
+        file to the Text table.
+
+        These are left empty, and are filled in when each witness is
+        next validated or has n-grams added.
+
+        """
+        self._conn.execute(constants.UPGRADE_1_ADD_TEXT_FILE_SIZE_SQL)
+        self._conn.execute(constants.UPGRADE_1_ADD_TEXT_MTIME_SQL)
+
+    def _upgrade_from_version_2(self):
+        """Upgrades the database from version 2 of the schema, adding the
+        Setting table and recording that the database has the heap
+        layout."""
+        self._conn.execute(constants.CREATE_TABLE_SETTING_SQL)
+        self._set_setting(constants.LAYOUT_SETTING, constants.LAYOUT_HEAP)
+
+    def _upgrade_from_version_3(self):
+        """Upgrades the database from version 3 of the schema, adding
+        the TextSketch table and a sketch of the n-grams of each
+        text."""
+        if self._get_setting(constants.INDEX_SETTING) == \
+                constants.INDEX_SUFFIX:
+            return
+        self._conn.execute(constants.CREATE_TABLE_TEXTSKETCH_SQL)
+        self._create_label_ngram_tables()
+        self._logger.info('Adding a sketch of the n-grams of each text')
+        sketches = {}
+        for row in self._conn.execute(
+                constants.UPGRADE_3_SELECT_TEXT_NGRAM_COUNTS_SQL):
+            sketches[row['text']] = NGramSketch.new(row['count'])
+        if self._get_setting(constants.LAYOUT_SETTING) == \
+                constants.LAYOUT_PARTITIONED:
+            sizes = self._get_sizes()
+        else:
+            sizes = [None]
+        for size in sizes:
+            for row in self._conn.execute(self._get_partition_sql(
+                    constants.UPGRADE_3_SELECT_NGRAMS_SQL, size)):
+                sketches[row['text']].add([row['ngram']])
+        self._conn.executemany(
+            constants.INSERT_TEXT_SKETCH_SQL,
+            [(text_id, sketch.to_bytes())
+             for text_id, sketch in sketches.items()])
+
+    def _upgrade_from_version_4(self):
+        """Upgrades the database from version 4 of the schema, adding
+        the NGramStats table of the corpus-wide statistics of each
+        n-gram."""
+        if self._get_setting(constants.INDEX_SETTING) == \
+                constants.INDEX_SUFFIX:
+            return
+        self._conn.execute(constants.CREATE_TABLE_NGRAMSTATS_SQL)
+        self._conn.execute(constants.CREATE_TABLE_NGRAMSTATSPENDING_SQL)
+        self._add_all_ngram_stats()
+
+    @staticmethod
+    def _uses_pattern_index(pattern):
+        """Returns True if the n-grams matching `pattern` are best found
+        using the pattern index.
+
+        A pattern that starts with literal characters is better
+        matched using the index of NGram, and the pattern index can
+        only match a pattern with a long enough run of literal
+        characters.
+
+        :param pattern: GLOB pattern
+        :type pattern: `str`
+        :rtype: `bool`
+
+        """
+        literals = re.split(constants.GLOB_WILDCARD_PATTERN, pattern)
+        if literals[0]:
+            return False
+        return max(len(literal) for literal in literals) >= \
+            constants.PATTERN_INDEX_MINIMUM_LITERAL
+
+    def _uses_label_cache(self):
+        """Returns True if queries are to use cached sets of the n-grams
+        of each label.
+
+        The cache is not used with a suffix index, since its n-grams
+        are derived afresh for each query, nor with a read-only
+        database.
+
+        :rtype: `bool`
+
+        """
+        if not self._cache:
+            return False
+        if self._read_only:
+            self._logger.info('Not caching n-grams in a read-only database')
+            return False
+        if self._get_setting(constants.INDEX_SETTING) == \
+                constants.INDEX_SUFFIX:
+            self._logger.info('Not caching n-grams with a suffix index')
+            return False
+        return True
 
     def validate(self, corpus, catalogue):
         """Returns True if all of the files labelled in `catalogue`
         are up-to-date in the database.
 
+        A file is read and its checksum compared with that in the
+        database only if its size or modification time differs from
+        that recorded for it.
+
         :param corpus: corpus of works
         :type corpus: `Corpus`
         :param catalogue: catalogue matching filenames to labels
@@ -771,23 +2956,21 @@ class DataStore:
         :rtype: `bool`
 
         """
+        self._start_phase(constants.PROFILE_PHASE_VALIDATE)
         is_valid = True
         for name in catalogue:
             count = 0
-            # It is unfortunate that this creates WitnessText objects
-            # for each work, since that involves reading the file.
-            for witness in corpus.get_witnesses(name):
+            for work, siglum in corpus.get_witness_names(name):
                 count += 1
-                name, siglum = witness.get_names()
-                filename = witness.get_filename()
+                filename = WitnessText.assemble_filename(work, siglum)
                 row = self._conn.execute(constants.SELECT_TEXT_SQL,
-                                         [name, siglum]).fetchone()
+                                         [work, siglum]).fetchone()
                 if row is None:
                     is_valid = False
                     self._logger.warning(
                         'No record (or n-grams) exists for {} in '
                         'the database'.format(filename))
-                elif row['checksum'] != witness.get_checksum():
+                elif not self._validate_witness(corpus, work, siglum, row):
                     is_valid = False
                     self._logger.warning(
                         '{} has changed since its n-grams were '
@@ -796,4 +2979,136 @@ class DataStore:
                 self._logger.error('Catalogue references work "{}" that does '
                                    'not exist in the corpus'.format(name))
                 raise FileNotFoundError
+        self._end_phase()
         return is_valid
+
+    def _validate_witness(self, corpus, work, siglum, text_record):
+        """Returns True if the witness `siglum` of `work` in `corpus`
+        matches `text_record`.
+
+        If the witness's file has a different size or modification
+        time from that recorded, but the same checksum, the record is
+        updated with the new size and modification time.
+
+        :param corpus: corpus of works
+        :type corpus: `Corpus`
+        :param work: name of work
+        :type work: `str`
+        :param siglum: siglum of witness
+        :type siglum: `str`
+        :param text_record: Text record of witness
+        :type text_record: `sqlite3.Row`
+        :rtype: `bool`
+
+        """
+        file_stat = corpus.get_witness_file_stat(work, siglum)
+        if (text_record['file_size'], text_record['mtime']) == file_stat:
+            return True
+        witness = corpus.get_witness(work, siglum)
+        if text_record['checksum'] != witness.get_checksum():
+            return False
+        self._update_text_file_stat(text_record['id'],
+                                    witness.get_file_stat())
+        return True
+
+
+def _execute_query_partition(db_name, labelled_texts, query, parameters,
+                             minimum, maximum, ordered, partitions,
+                             partition, writer, limits=None,
+                             label_counts=None):
+    """Sends the rows resulting from running `query` against the
+    n-grams of `partition` out of `partitions` to `writer`, in chunks,
+    followed by None; if the query fails, its exception is sent
+    instead.
+
+    This is run in a worker process by
+    `DataStore._execute_parallel_query`.
+
+    :param db_name: path to database
+    :type db_name: `str`
+    :param labelled_texts: rows of the labelled witnesses
+    :type labelled_texts: `list` of `tuple`
+    :param query: query selecting n-gram results from TextNGram
+    :type query: `str`
+    :param parameters: parameters to `query`
+    :type parameters: `list`
+    :param minimum: minimum n-gram size
+    :type minimum: `int`
+    :param maximum: maximum n-gram size
+    :type maximum: `int`
+    :param ordered: whether to order the rows by witness and size
+    :type ordered: `bool`
+    :param partitions: number of partitions
+    :type partitions: `int`
+    :param partition: partition to query, from 0
+    :type partition: `int`
+    :param writer: connection to send rows to
+    :type writer: `multiprocessing.connection.Connection`
+    :param limits: minimum and maximum works and total count of n-grams
+    :type limits: `tuple`
+    :param label_counts: whether to add the label count and the label
+                         work count columns
+    :type label_counts: `tuple` of `bool`
+
+    """
+    try:
+        store = DataStore(db_name, read_only=True)
+        store._set_labelled_texts(labelled_texts)
+        store._create_hash_partition_views(partitions, partition)
+        rows = store._execute_ngram_query(query, parameters, minimum,
+                                          maximum, ordered, limits=limits,
+                                          label_counts=label_counts)
+        while True:
+            chunk = [tuple(row) for row in itertools.islice(
+                rows, constants.PARALLEL_QUERY_CHUNK_SIZE)]
+            if not chunk:
+                break
+            writer.send(chunk)
+        writer.send(None)
+    except Exception as err:
+        writer.send(err)
+    finally:
+        writer.close()
+
+
+def _generate_witness_ngrams(corpus, work, siglum, minimum, maximum,
+                             checksum, skip_sizes, batch_size):
+    """Returns the witness `siglum` of `work` in `corpus` and its
+    n-grams.
+
+    The n-grams of every size are returned together, so if the
+    witness has more than `batch_size` n-grams across those sizes,
+    they are not generated, and None is returned in their place.
+
+    This is run in a worker process by
+    `DataStore._add_ngrams_parallel`.
+
+    :param corpus: corpus of works
+    :type corpus: `Corpus`
+    :param work: name of work
+    :type work: `str`
+    :param siglum: siglum of witness
+    :type siglum: `str`
+    :param minimum: minimum n-gram size
+    :type minimum: `int`
+    :param maximum: maximum n-gram size
+    :type maximum: `int`
+    :param checksum: checksum of the witness in the database
+    :type checksum: `str`
+    :param skip_sizes: sizes of n-grams in the database for the witness
+    :type skip_sizes: `list` of `int`
+    :param batch_size: maximum number of n-grams to return
+    :type batch_size: `int`
+    :rtype: `tuple` of `WitnessText` and `list`
+
+    """
+    witness = corpus.get_witness(work, siglum)
+    if witness.get_checksum() != checksum:
+        # The n-grams of a changed witness are deleted before its new
+        # n-grams are added.
+        skip_sizes = []
+    sizes = len([size for size in range(minimum, maximum + 1)
+                 if size not in skip_sizes])
+    if DataStore._exceeds_batch_size(witness, batch_size, sizes):
+        return witness, None
+    return witness, list(witness.get_ngrams(minimum, maximum, skip_sizes))
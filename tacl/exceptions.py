@@ -12,6 +12,11 @@ class MalformedCatalogueError (TACLError):
     pass
 
 
+class MalformedManifestError (TACLError):
+
+    pass
+
+
 class MalformedQueryError (TACLError):
 
     pass
@@ -20,3 +25,13 @@ class MalformedQueryError (TACLError):
 class MalformedResultsError (TACLError):
 
     pass
+
+
+class OutdatedDataStoreError (TACLError):
+
+    pass
+
+
+class QueryServerError (TACLError):
+
+    pass
@@ -4,11 +4,11 @@ import logging
 import re
 
 from lxml import etree
-import pandas as pd
 
 from . import constants
 from .colour import generate_colours
 from .report import Report
+from .results_io import read_results
 from .text import WitnessText
 
 
@@ -186,7 +186,7 @@ class ResultsHighlightReport (HighlightReport):
 
         """
         template = self._get_template()
-        matches = pd.read_csv(matches_filename)
+        matches = read_results(matches_filename)
         for siglum in self._corpus.get_sigla(work):
             subm = matches[(matches[constants.WORK_FIELDNAME] != work) |
                            (matches[constants.SIGLUM_FIELDNAME] != siglum)]
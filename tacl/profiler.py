@@ -0,0 +1,196 @@
+"""Module containing the QueryProfiler class."""
+
+import ctypes
+import sqlite3
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows.
+    resource = None
+
+from . import constants
+
+
+class QueryProfiler:
+
+    """Class recording where the time of the queries run on a
+    `DataStore`'s connection goes.
+
+    A query is divided into phases, each started when the previous
+    one ends. For each phase the wall time, the number of rows
+    output, the number of SQL statements executed and the number of
+    page cache hits and misses of the connection are recorded. The
+    query plan of each query run is also kept.
+
+    Rows are read from SQLite as they are output, so the time taken
+    to run the main query of a phase is split between the query
+    phase (up to its first row) and the output phase.
+
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._db_status = _get_db_status_function(conn)
+        self._phases = []
+        self._plans = []
+        self._current = None
+        self._statements = 0
+        self._start = time.perf_counter()
+        conn.set_trace_callback(self._trace)
+
+    def add_plan(self, query, parameters, plan):
+        """Records `plan` as the query plan of `query`.
+
+        :param query: SQL query
+        :type query: `str`
+        :param parameters: parameters to `query`
+        :type parameters: `list`
+        :param plan: rows of EXPLAIN QUERY PLAN output
+        :type plan: `list` of `sqlite3.Row`
+
+        """
+        self._plans.append({
+            'query': query,
+            'parameters': [str(parameter) for parameter in parameters],
+            'plan': [{'id': row[0], 'parent': row[1], 'detail': row[3]}
+                     for row in plan],
+        })
+
+    def add_rows(self, rows):
+        """Adds `rows` to the number of rows output in the current
+        phase.
+
+        :param rows: number of rows
+        :type rows: `int`
+
+        """
+        if self._current is not None:
+            self._current['rows'] += rows
+
+    def end_phase(self):
+        """Ends the current phase, if there is one."""
+        phase = self._current
+        if phase is None:
+            return
+        self._current = None
+        phase['wall_time'] = time.perf_counter() - phase['wall_time']
+        phase['statements'] = self._statements - phase['statements']
+        hits, misses = self._get_cache_status()
+        if hits is not None:
+            phase['cache_hits'] = hits - phase['cache_hits']
+            phase['cache_misses'] = misses - phase['cache_misses']
+        self._phases.append(phase)
+
+    def get_report(self):
+        """Returns the profile of the phases run so far, ending the
+        current phase.
+
+        :rtype: `dict`
+
+        """
+        self.end_phase()
+        return {
+            'sqlite_version': sqlite3.sqlite_version,
+            'wall_time': time.perf_counter() - self._start,
+            'peak_rss': _get_peak_rss(resource.RUSAGE_SELF)
+            if resource else None,
+            'children_peak_rss': _get_peak_rss(resource.RUSAGE_CHILDREN)
+            if resource else None,
+            'phases': self._phases,
+            'query_plans': self._plans,
+        }
+
+    def start_phase(self, name):
+        """Starts the phase `name`, ending the current phase.
+
+        :param name: name of phase
+        :type name: `str`
+
+        """
+        self.end_phase()
+        hits, misses = self._get_cache_status()
+        self._current = {
+            'name': name,
+            'wall_time': time.perf_counter(),
+            'rows': 0,
+            'statements': self._statements,
+            'cache_hits': hits,
+            'cache_misses': misses,
+        }
+
+    def _get_cache_status(self):
+        """Returns the number of page cache hits and misses of the
+        connection, or None for each if they cannot be got."""
+        if self._db_status is None:
+            return None, None
+        return (self._db_status(constants.SQLITE_DBSTATUS_CACHE_HIT),
+                self._db_status(constants.SQLITE_DBSTATUS_CACHE_MISS))
+
+    def _trace(self, statement):
+        self._statements += 1
+
+
+def _get_db_status_function(conn):
+    """Returns a function giving the value of a sqlite3_db_status
+    counter of `conn`, or None if the SQLite C API cannot be reached.
+
+    Python's sqlite3 module does not expose sqlite3_db_status, so it
+    is called through ctypes on the database handle that begins the
+    connection object in CPython. This relies on the layout of
+    CPython's private pysqlite_Connection struct, and so is only done
+    on the versions whose layout has been checked. The handle is
+    also checked against the connection's filename before it is
+    trusted.
+
+    :param conn: database connection
+    :type conn: `sqlite3.Connection`
+    :rtype: `function`
+
+    """
+    if sys.implementation.name != 'cpython':
+        return None
+    earliest, latest = constants.SQLITE_CONNECTION_LAYOUT_VERSIONS
+    if not earliest <= sys.version_info[:2] < latest:
+        return None
+    try:
+        import _sqlite3
+        library = ctypes.CDLL(_sqlite3.__file__)
+        db_status = library.sqlite3_db_status
+        db_filename = library.sqlite3_db_filename
+    except (AttributeError, ImportError, OSError):
+        return None
+    db_status.argtypes = [ctypes.c_void_p, ctypes.c_int,
+                          ctypes.POINTER(ctypes.c_int),
+                          ctypes.POINTER(ctypes.c_int), ctypes.c_int]
+    db_filename.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+    db_filename.restype = ctypes.c_char_p
+    # pysqlite_Connection begins with PyObject_HEAD followed by the
+    # sqlite3 *db member, so the handle is the pointer just past the
+    # base object header.
+    handle = ctypes.c_void_p.from_address(
+        id(conn) + object.__basicsize__).value
+    filename = conn.execute(constants.PRAGMA_DATABASE_LIST_SQL).fetchone()[2]
+    if handle is None or \
+            (db_filename(handle, b'main') or b'').decode('utf-8') != filename:
+        return None
+
+    def get_status(operation):
+        current = ctypes.c_int()
+        highwater = ctypes.c_int()
+        db_status(handle, operation, ctypes.byref(current),
+                  ctypes.byref(highwater), 0)
+        return current.value
+
+    return get_status
+
+
+def _get_peak_rss(who):
+    """Returns the peak resident set size, in bytes, of `who`."""
+    peak = resource.getrusage(who).ru_maxrss
+    if sys.platform != 'darwin':
+        # Linux and the BSDs report kilobytes.
+        peak *= 1024
+    return peak
@@ -10,6 +10,7 @@ import pandas as pd
 
 from . import constants
 from .decorators import requires_columns
+from .results_io import detect_format, read_results, write_results
 from .text import Text, FilteredWitnessText
 
 
@@ -32,11 +33,13 @@ class Results:
 
     def __init__(self, matches, tokenizer):
         self._logger = logging.getLogger(__name__)
-        self._matches = pd.read_csv(matches, encoding='utf-8', na_filter=False)
-        # Work around a problem with CSV files produced on Windows
-        # being read by pandas and creating an empty row for each
-        # actual row.
-        self._matches = self._matches.dropna(how='all')
+        results_format = detect_format(matches)
+        self._matches = read_results(matches)
+        if results_format == constants.RESULTS_FORMAT_CSV:
+            # Work around a problem with CSV files produced on Windows
+            # being read by pandas and creating an empty row for each
+            # actual row.
+            self._matches = self._matches.dropna(how='all')
         self._tokenizer = tokenizer
         if self._matches.empty:
             self._logger.info('Supplied results file is empty')
@@ -265,6 +268,25 @@ class Results:
                              index=False)
         return fh
 
+    def write(self, fh, results_format=constants.RESULTS_FORMAT_CSV):
+        """Writes the results data to `fh` in `results_format` and
+        returns `fh`.
+
+        The binary formats must be written to a file opened in binary
+        mode.
+
+        :param fh: file to write data to
+        :type fh: file object
+        :param results_format: format to write data in
+        :type results_format: `str`
+        :rtype: file object
+
+        """
+        if results_format == constants.RESULTS_FORMAT_CSV:
+            return self.csv(fh)
+        write_results(self._matches, fh, results_format)
+        return fh
+
     @requires_columns([constants.NGRAM_FIELDNAME])
     def excise(self, ngram):
         """Removes all rows whose n-gram contains `ngram`.
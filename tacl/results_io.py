@@ -0,0 +1,385 @@
+"""Module containing functions to read and write results in each of
+the supported formats.
+
+CSV results can always be read and written. The binary columnar
+formats (Parquet and Feather) require pyarrow, which is imported only
+when results in one of those formats are actually read or written.
+
+Query results may be written in the order given by `Results.sort`,
+without holding all of them in memory, by a `SortedResultsWriter`,
+and the results of each label may be written to a separate file by a
+`LabelResultsWriter`.
+
+"""
+
+import csv
+import heapq
+import io
+import itertools
+import operator
+import pickle
+import sys
+import tempfile
+
+import pandas as pd
+
+from . import constants
+from .exceptions import TACLError
+
+
+# Number of bytes at the start of a results file needed to identify
+# its format.
+_MAGIC_LENGTH = max(len(magic) for magic in constants.RESULTS_FORMAT_MAGIC)
+
+_NGRAM_INDEX = constants.QUERY_FIELDNAMES.index(constants.NGRAM_FIELDNAME)
+_SIZE_INDEX = constants.QUERY_FIELDNAMES.index(constants.SIZE_FIELDNAME)
+_WORK_INDEX = constants.QUERY_FIELDNAMES.index(constants.WORK_FIELDNAME)
+_SIGLUM_INDEX = constants.QUERY_FIELDNAMES.index(constants.SIGLUM_FIELDNAME)
+_COUNT_INDEX = constants.QUERY_FIELDNAMES.index(constants.COUNT_FIELDNAME)
+_LABEL_INDEX = constants.QUERY_FIELDNAMES.index(constants.LABEL_FIELDNAME)
+
+
+def detect_format(results):
+    """Returns the format of `results`.
+
+    A text file is always taken to be CSV. The position of a file
+    object is left unchanged.
+
+    :param results: path to, or file object of, results
+    :type results: `str` or file object
+    :rtype: `str`
+
+    """
+    if isinstance(results, str):
+        with open(results, 'rb') as fh:
+            start = fh.read(_MAGIC_LENGTH)
+    elif isinstance(results, io.TextIOBase):
+        return constants.RESULTS_FORMAT_CSV
+    elif hasattr(results, 'peek'):
+        # A buffered stream, such as stdin, can be inspected without
+        # being consumed even when it cannot seek.
+        start = results.peek(_MAGIC_LENGTH)[:_MAGIC_LENGTH]
+    else:
+        position = results.tell()
+        start = results.read(_MAGIC_LENGTH)
+        results.seek(position)
+    for magic, results_format in constants.RESULTS_FORMAT_MAGIC.items():
+        if start.startswith(magic):
+            return results_format
+    return constants.RESULTS_FORMAT_CSV
+
+
+def get_results_writer(fh, fieldnames, results_format, sort=False):
+    """Returns a writer of rows of results to `fh` in `results_format`,
+    having written (or recorded) `fieldnames` as the header.
+
+    If `sort` is True, the rows are written in the order given by
+    `Results.sort`, which requires `fieldnames` to be those of query
+    results.
+
+    The writer must be closed once all of the rows have been written
+    to it.
+
+    :param fh: file to write results to
+    :type fh: file object
+    :param fieldnames: names of the columns of the results
+    :type fieldnames: `list` of `str`
+    :param results_format: format to write results in
+    :type results_format: `str`
+    :param sort: whether to sort the rows
+    :type sort: `bool`
+    :rtype: `CSVResultsWriter`, `ArrowResultsWriter` or
+            `SortedResultsWriter`
+
+    """
+    if results_format == constants.RESULTS_FORMAT_CSV:
+        writer = CSVResultsWriter(fh, fieldnames)
+    else:
+        writer = ArrowResultsWriter(fh, fieldnames, results_format)
+    if sort:
+        writer = SortedResultsWriter(writer)
+    return writer
+
+
+def get_label_results_writer(fhs, fieldnames, results_format, sort=False):
+    """Returns a writer of rows of query results to the file in `fhs`
+    keyed by the label of each row, in `results_format`, having
+    written (or recorded) `fieldnames` as the header of each file.
+
+    If `sort` is True, the rows in each file are written in the
+    order given by `Results.sort`.
+
+    The writer must be closed once all of the rows have been written
+    to it.
+
+    :param fhs: files to write results to, keyed by label
+    :type fhs: `dict` of file objects
+    :param fieldnames: names of the columns of the results
+    :type fieldnames: `list` of `str`
+    :param results_format: format to write results in
+    :type results_format: `str`
+    :param sort: whether to sort the rows
+    :type sort: `bool`
+    :rtype: `LabelResultsWriter` or `SortedResultsWriter`
+
+    """
+    writer = LabelResultsWriter(
+        {label: get_results_writer(fh, fieldnames, results_format)
+         for label, fh in fhs.items()})
+    if sort:
+        # Splitting the sorted rows by label leaves those of each
+        # label sorted, and only one run of rows is held in memory.
+        writer = SortedResultsWriter(writer)
+    return writer
+
+
+def read_results(results):
+    """Returns a `pandas.DataFrame` of the results in `results`, in
+    whichever format they are.
+
+    :param results: path to, or file object of, results
+    :type results: `str` or file object
+    :rtype: `pandas.DataFrame`
+
+    """
+    results_format = detect_format(results)
+    if results_format == constants.RESULTS_FORMAT_CSV:
+        return pd.read_csv(results, encoding='utf-8', na_filter=False)
+    _import_pyarrow(results_format)
+    if not isinstance(results, str) and not results.seekable():
+        # Both binary formats are read from the end of the file
+        # backwards.
+        results = io.BytesIO(results.read())
+    if results_format == constants.RESULTS_FORMAT_PARQUET:
+        return pd.read_parquet(results)
+    return pd.read_feather(results)
+
+
+def write_results(matches, fh, results_format):
+    """Writes `matches` to `fh` in `results_format`.
+
+    :param matches: results to write
+    :type matches: `pandas.DataFrame`
+    :param fh: file to write results to
+    :type fh: file object
+    :param results_format: format to write results in
+    :type results_format: `str`
+
+    """
+    _import_pyarrow(results_format)
+    matches = matches.reset_index(drop=True)
+    if results_format == constants.RESULTS_FORMAT_PARQUET:
+        matches.to_parquet(fh, index=False)
+    else:
+        matches.to_feather(fh)
+
+
+def _get_sort_key(row):
+    """Returns the key of `row` of query results in the order given by
+    `Results.sort`: size (descending), n-gram, count (descending),
+    label, work, siglum."""
+    return (-row[_SIZE_INDEX], row[_NGRAM_INDEX], -row[_COUNT_INDEX],
+            row[_LABEL_INDEX], row[_WORK_INDEX], row[_SIGLUM_INDEX])
+
+
+def _import_pyarrow(results_format):
+    try:
+        import pyarrow
+    except ImportError:
+        raise TACLError(constants.RESULTS_FORMAT_UNAVAILABLE_ERROR.format(
+            results_format))
+    return pyarrow
+
+
+class CSVResultsWriter:
+
+    """Writer of rows of results in CSV format."""
+
+    def __init__(self, fh, fieldnames):
+        # Specify a lineterminator to avoid an extra \r being added
+        # on Windows; see
+        # https://stackoverflow.com/questions/3191528/csv-in-python-adding-extra-carriage-return
+        if sys.platform in ('win32', 'cygwin') and fh is sys.stdout:
+            writer = csv.writer(fh, lineterminator='\n')
+        else:
+            writer = csv.writer(fh)
+        writer.writerow(fieldnames)
+        # For performance, write straight through to the CSV writer.
+        self.writerow = writer.writerow
+        self.writerows = writer.writerows
+
+    def close(self):
+        pass
+
+
+class ArrowResultsWriter:
+
+    """Writer of rows of results in one of the binary columnar formats.
+
+    Rows are gathered into batches of `batch_size` rows, each of
+    which is converted to columns and written as a single record
+    batch (Feather) or row group (Parquet). The types of the columns
+    are those of the first batch.
+
+    """
+
+    def __init__(self, fh, fieldnames, results_format,
+                 batch_size=constants.RESULTS_FORMAT_BATCH_SIZE):
+        self._pa = _import_pyarrow(results_format)
+        self._fh = fh
+        self._fieldnames = list(fieldnames)
+        self._results_format = results_format
+        self._batch_size = batch_size
+        self._rows = []
+        self._schema = None
+        self._writer = None
+
+    def close(self):
+        """Writes out any remaining rows and the file footer."""
+        self._write_batch()
+        if self._writer is None:
+            # With no rows to take the column types from, every
+            # column is written as strings.
+            self._open(self._pa.schema(
+                [(name, self._pa.string()) for name in self._fieldnames]))
+        self._writer.close()
+
+    def writerow(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self._batch_size:
+            self._write_batch()
+
+    def writerows(self, rows):
+        self._rows.extend(rows)
+        if len(self._rows) >= self._batch_size:
+            self._write_batch()
+
+    def _open(self, schema):
+        self._schema = schema
+        if self._results_format == constants.RESULTS_FORMAT_PARQUET:
+            import pyarrow.parquet
+            self._writer = pyarrow.parquet.ParquetWriter(self._fh, schema)
+        else:
+            import pyarrow.ipc
+            self._writer = pyarrow.ipc.new_file(self._fh, schema)
+
+    def _write_batch(self):
+        if not self._rows:
+            return
+        pa = self._pa
+        rows = self._rows
+        self._rows = []
+        # Transposing with zip(*rows) is several times slower than
+        # this for batches of this size.
+        columns = [[row[index] for row in rows]
+                   for index in range(len(self._fieldnames))]
+        if self._schema is None:
+            batch = pa.RecordBatch.from_arrays(
+                [pa.array(column) for column in columns],
+                names=self._fieldnames)
+            self._open(batch.schema)
+        else:
+            batch = pa.RecordBatch.from_arrays(
+                [pa.array(column, type=field.type)
+                 for column, field in zip(columns, self._schema)],
+                schema=self._schema)
+        if self._results_format == constants.RESULTS_FORMAT_PARQUET:
+            self._writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self._writer.write_batch(batch)
+
+
+class LabelResultsWriter:
+
+    """Writer of rows of query results that passes each row on to
+    the writer for its label."""
+
+    def __init__(self, writers):
+        self._writers = writers
+
+    def close(self):
+        """Closes the writer for each label."""
+        for writer in self._writers.values():
+            writer.close()
+
+    def writerow(self, row):
+        self._writers[row[_LABEL_INDEX]].writerow(row)
+
+    def writerows(self, rows):
+        # Rows are typically grouped by witness, and so by label.
+        for label, group in itertools.groupby(
+                rows, key=operator.itemgetter(_LABEL_INDEX)):
+            self._writers[label].writerows(group)
+
+
+class SortedResultsWriter:
+
+    """Writer of rows of query results that passes them on to another
+    writer in the order given by `Results.sort`.
+
+    This is an external merge sort: rows are gathered into runs of
+    `buffer_size` rows, and each full run is sorted and spilled to a
+    temporary file. On closing, the spilled runs and the final run
+    are merged, so that no more than `buffer_size` rows (and a chunk
+    of each spilled run) are held in memory at once.
+
+    """
+
+    def __init__(self, writer,
+                 buffer_size=constants.RESULTS_SORT_BUFFER_SIZE):
+        self._writer = writer
+        self._buffer_size = buffer_size
+        self._rows = []
+        self._runs = []
+
+    def close(self):
+        """Writes the sorted rows to the underlying writer, and closes
+        it."""
+        self._rows.sort(key=_get_sort_key)
+        try:
+            if self._runs:
+                rows = heapq.merge(
+                    *[self._read_run(run) for run in self._runs],
+                    self._rows, key=_get_sort_key)
+            else:
+                rows = self._rows
+            writerow = self._writer.writerow
+            for row in rows:
+                writerow(row)
+        finally:
+            for run in self._runs:
+                run.close()
+        self._rows = []
+        self._runs = []
+        self._writer.close()
+
+    def writerow(self, row):
+        self._rows.append(tuple(row))
+        if len(self._rows) >= self._buffer_size:
+            self._spill()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    @staticmethod
+    def _read_run(run):
+        run.seek(0)
+        while True:
+            try:
+                chunk = pickle.load(run)
+            except EOFError:
+                break
+            yield from chunk
+
+    def _spill(self):
+        """Sorts the gathered rows and writes them to a temporary
+        file, in chunks that can be read back one at a time."""
+        self._rows.sort(key=_get_sort_key)
+        run = tempfile.TemporaryFile()
+        chunk_size = constants.RESULTS_SORT_CHUNK_SIZE
+        for start in range(0, len(self._rows), chunk_size):
+            pickle.dump(self._rows[start:start + chunk_size], run,
+                        pickle.HIGHEST_PROTOCOL)
+        self._runs.append(run)
+        self._rows = []
@@ -5,10 +5,10 @@ import os
 import re
 
 from Bio import pairwise2
-import pandas as pd
 
 from . import constants
 from .report import Report
+from .results_io import read_results
 from .text import Text
 
 
@@ -61,7 +61,7 @@ class SequenceReport (Report):
         self._logger = logging.getLogger(__name__)
         self._corpus = corpus
         self._tokenizer = tokenizer
-        self._matches = pd.read_csv(results, encoding='utf-8', na_filter=False)
+        self._matches = read_results(results)
         self._substitutes = {}
         self._char_code = 61440
 
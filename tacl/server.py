@@ -0,0 +1,280 @@
+"""Module containing the QueryServer and QueryClient classes, which
+allow queries to be run against a database kept open in a long-running
+process."""
+
+import http.client
+import http.server
+import io
+import json
+import logging
+import os.path
+import shutil
+import urllib.error
+import urllib.request
+
+from . import constants
+from .catalogue import Catalogue
+from .exceptions import MalformedQueryError, QueryServerError, TACLError
+from .tokenizer import Tokenizer
+
+
+class QueryServer (http.server.HTTPServer):
+
+    """HTTP server that runs queries against a `DataStore` that is
+    kept open, so that its cache remains warm between queries.
+
+    Requests are handled one at a time, on the thread that opened
+    the `DataStore`, since a SQLite connection may not be shared
+    between threads.
+
+    """
+
+    def __init__(self, server_address, store, corpus=None):
+        """Initialise the server.
+
+        :param server_address: host and port to listen on
+        :type server_address: `tuple`
+        :param store: data store to query
+        :type store: `DataStore`
+        :param corpus: corpus to validate queries against, or None to
+                       not validate
+        :type corpus: `Corpus`
+
+        """
+        super().__init__(server_address, QueryRequestHandler)
+        self._logger = logging.getLogger(__name__)
+        self._store = store
+        self._corpus = corpus
+
+    @property
+    def logger(self):
+        return self._logger
+
+    def run_query(self, query, parameters, output_fh):
+        """Runs `query` with `parameters`, writing the results to
+        `output_fh`.
+
+        :param query: name of query to run
+        :type query: `str`
+        :param parameters: parameters of the query
+        :type parameters: `dict`
+        :param output_fh: file to write results to
+        :type output_fh: file object
+
+        """
+        db_name = parameters.get('db')
+        if db_name != self._store._db_name:
+            raise MalformedQueryError(
+                constants.SERVER_DATABASE_MISMATCH_ERROR.format(
+                    db_name, self._store._db_name))
+        try:
+            catalogue = Catalogue(parameters['catalogue'])
+        except (KeyError, TypeError, ValueError):
+            raise MalformedQueryError(
+                constants.SERVER_MISSING_CATALOGUE_ERROR)
+        if parameters.get('validate') and self._corpus is not None:
+            self._store.validate(self._corpus, catalogue)
+        minimum = parameters.get('min_size')
+        maximum = parameters.get('max_size')
+        jobs = parameters.get('jobs', 1)
+        # Keyword arguments to every type of query but counts.
+        arguments = {name: parameters.get(name)
+                     for name in constants.NGRAM_LIMIT_ARGUMENTS}
+        arguments.update((name, parameters.get(name, False))
+                         for name in constants.LABEL_COUNT_ARGUMENTS)
+        arguments['sort'] = parameters.get('sort', False)
+        if query == constants.QUERY_COUNTS:
+            self._store.counts(catalogue, output_fh)
+        elif query == constants.QUERY_DIFF:
+            tokenizer = self._get_tokenizer(parameters)
+            prime_label = parameters.get('asymmetric')
+            if prime_label:
+                self._store.diff_asymmetric(
+                    catalogue, prime_label, tokenizer, output_fh, minimum,
+                    maximum, jobs, **arguments)
+            else:
+                self._store.diff(catalogue, tokenizer, output_fh, minimum,
+                                 maximum, jobs, **arguments)
+        elif query == constants.QUERY_INTERSECT:
+            engine = parameters.get('engine',
+                                    constants.INTERSECT_ENGINE_NESTED)
+            self._store.intersection(catalogue, output_fh, minimum, maximum,
+                                     engine, jobs, **arguments)
+        elif query == constants.QUERY_SEARCH:
+            ngrams = parameters.get('ngrams', [])
+            self._store.search(catalogue, ngrams, output_fh, minimum,
+                               maximum, parameters.get('patterns', False),
+                               **arguments)
+        else:
+            raise MalformedQueryError(
+                constants.SERVER_UNKNOWN_QUERY_ERROR.format(query))
+
+    def _get_tokenizer(self, parameters):
+        name = parameters.get('tokenizer', constants.TOKENIZER_CHOICE_CBETA)
+        try:
+            return Tokenizer(*constants.TOKENIZERS[name])
+        except KeyError:
+            raise MalformedQueryError(
+                constants.SERVER_UNKNOWN_TOKENIZER_ERROR.format(name))
+
+
+class QueryRequestHandler (http.server.BaseHTTPRequestHandler):
+
+    """Handler for query requests made to a `QueryServer`.
+
+    A query is requested by POSTing its parameters as a JSON object
+    to the path naming the query. The results are streamed back as
+    CSV in chunks as they are generated; since no length is known in
+    advance, the end of the results is marked by the final, empty
+    chunk, which is not sent if the query fails part way through.
+
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    # Buffer the response, rather than sending each chunk of results
+    # in its own write to the socket.
+    wbufsize = 1024 * 1024
+
+    def do_POST(self):
+        # Handle one request per connection, so that an idle client
+        # cannot hold the server open.
+        self.close_connection = True
+        query = self.path.strip('/')
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            parameters = json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError:
+            self._send_error_message(
+                400, constants.SERVER_MALFORMED_REQUEST_ERROR)
+            return
+        output_fh = _ResponseWriter(self)
+        try:
+            self.server.run_query(query, parameters, output_fh)
+            output_fh.close()
+        except Exception as err:
+            # Any error, such as a witness missing from the corpus or
+            # a SQLite error, must end in a response rather than an
+            # unhandled exception that drops the connection.
+            if output_fh.started:
+                # The status has already been sent, so all that can
+                # be done is to cut the results short, without the
+                # final chunk, so that the client sees the response
+                # is incomplete.
+                self.server.logger.error(str(err))
+            elif isinstance(err, TACLError):
+                self._send_error_message(400, str(err))
+            else:
+                self.server.logger.exception(str(err))
+                self._send_error_message(
+                    500, constants.SERVER_QUERY_ERROR.format(err))
+
+    def log_message(self, format, *args):
+        self.server.logger.info(format, *args)
+
+    def _send_error_message(self, code, message):
+        body = message.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _ResponseWriter:
+
+    """File-like object that writes query results to the response of
+    a `QueryRequestHandler` using chunked transfer encoding, sending
+    the response headers only when the first results are written.
+
+    The response is complete only once `close` has been called."""
+
+    # Size of the chunks the results are sent in.
+    chunk_size = 64 * 1024
+
+    def __init__(self, handler):
+        self._handler = handler
+        self._buffer = []
+        self._buffer_size = 0
+        self.started = False
+
+    def close(self):
+        """Sends any remaining results followed by the final chunk
+        that marks the end of the response."""
+        self._send_chunk()
+        self._handler.wfile.write(b'0\r\n\r\n')
+
+    def _send_chunk(self):
+        if not self.started:
+            self._handler.send_response(200)
+            self._handler.send_header('Content-Type',
+                                      'text/csv; charset=utf-8')
+            self._handler.send_header('Transfer-Encoding', 'chunked')
+            self._handler.send_header('Connection', 'close')
+            self._handler.end_headers()
+            self.started = True
+        if self._buffer_size:
+            data = b''.join(self._buffer)
+            self._handler.wfile.write(
+                '{:x}\r\n'.format(len(data)).encode('ascii') + data +
+                b'\r\n')
+            self._buffer = []
+            self._buffer_size = 0
+
+    def write(self, data):
+        data = data.encode('utf-8')
+        self._buffer.append(data)
+        self._buffer_size += len(data)
+        if self._buffer_size >= self.chunk_size:
+            self._send_chunk()
+
+
+class QueryClient:
+
+    """Client that forwards queries to a `QueryServer`."""
+
+    def __init__(self, url):
+        self._url = url.rstrip('/')
+
+    def query(self, query, db_name, catalogue, output_fh, **parameters):
+        """Runs `query` on the server, against the database at
+        `db_name`, writing the results to `output_fh`.
+
+        :param query: name of query to run
+        :type query: `str`
+        :param db_name: path to the database the server has open
+        :type db_name: `str`
+        :param catalogue: catalogue of works to query
+        :type catalogue: `Catalogue`
+        :param output_fh: file to write results to
+        :type output_fh: file object
+        :rtype: file object
+
+        """
+        parameters['db'] = os.path.abspath(db_name)
+        parameters['catalogue'] = dict(catalogue)
+        request = urllib.request.Request(
+            '{}/{}'.format(self._url, query),
+            data=json.dumps(parameters).encode('utf-8'),
+            headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request) as response:
+                results = io.TextIOWrapper(response, encoding='utf-8',
+                                           newline='')
+                shutil.copyfileobj(results, output_fh)
+        except urllib.error.HTTPError as err:
+            message = err.read().decode('utf-8')
+            err.close()
+            if err.code >= 500:
+                raise QueryServerError(message)
+            raise MalformedQueryError(message)
+        except urllib.error.URLError as err:
+            raise QueryServerError(constants.SERVER_CONNECTION_ERROR.format(
+                self._url, err.reason))
+        except (ConnectionError, http.client.HTTPException) as err:
+            # The server dropped the connection or cut the results
+            # short.
+            raise QueryServerError(constants.SERVER_RESPONSE_ERROR.format(
+                self._url, err))
+        return output_fh
@@ -0,0 +1,160 @@
+"""Module containing the NGramSketch class."""
+
+import math
+import zlib
+
+
+class NGramSketch:
+
+    """Class representing a Bloom filter over a set of n-grams.
+
+    A sketch may report that it contains an n-gram that was never
+    added to it, but never the reverse, so that sketches with no bits
+    in common are sure to share no n-grams.
+
+    The number of bits in a sketch is a power of two, chosen from the
+    number of n-grams it is expected to hold. Since each bit position
+    is a hash modulo the number of bits, a sketch can be folded in
+    half by combining its two halves, which allows sketches of
+    different sizes to be compared at the size of the smaller.
+
+    """
+
+    # Number of hash functions, and the number of bits to allow for
+    # each n-gram, giving a false positive rate of about 3%.
+    _HASHES = 3
+    _BITS_PER_NGRAM = 8
+    # Sketches are compared at the size of the smaller, so a sketch
+    # much smaller than this would make the sketches of larger
+    # witnesses too full to be of use.
+    _MINIMUM_BITS = 8192
+
+    def __init__(self, data):
+        self._data = bytearray(data)
+
+    def __len__(self):
+        """Returns the number of bits in this sketch."""
+        return len(self._data) * 8
+
+    def add(self, ngrams):
+        """Adds `ngrams` to this sketch.
+
+        :param ngrams: n-grams to add
+        :type ngrams: iterable of `str`
+
+        """
+        data = self._data
+        mask = len(self) - 1
+        for ngram in ngrams:
+            # Two cheap hashes are combined to give each bit position
+            # (double hashing); CRC-32 is stable across processes and
+            # platforms, unlike hash().
+            encoded = ngram.encode('utf-8')
+            first = zlib.crc32(encoded)
+            second = zlib.crc32(encoded[::-1]) | 1
+            for index in range(self._HASHES):
+                position = (first + index * second) & mask
+                data[position >> 3] |= 1 << (position & 7)
+
+    def count_bits(self):
+        """Returns the number of bits set in this sketch.
+
+        :rtype: `int`
+
+        """
+        return bin(self._to_int()).count('1')
+
+    def estimate_count(self):
+        """Returns an estimate of the number of distinct n-grams added
+        to this sketch.
+
+        :rtype: `int`
+
+        """
+        size = len(self)
+        bits = self.count_bits()
+        if bits == size:
+            # A saturated sketch gives no estimate; this is the most
+            # it can usefully hold.
+            return size // self._BITS_PER_NGRAM
+        return round(-size / self._HASHES * math.log(1 - bits / size))
+
+    def _fold(self, size):
+        """Returns the integer value of this sketch folded to `size`
+        bits.
+
+        :param size: number of bits
+        :type size: `int`
+        :rtype: `int`
+
+        """
+        value = self._to_int()
+        current = len(self)
+        mask = (1 << size) - 1
+        folded = 0
+        while current >= size:
+            folded |= value & mask
+            value >>= size
+            current -= size
+        return folded
+
+    @classmethod
+    def _from_int(cls, value, size):
+        return cls(value.to_bytes(size // 8, 'little'))
+
+    def intersection(self, other):
+        """Returns a sketch of the bits common to this sketch and
+        `other`, at the size of the smaller.
+
+        :param other: sketch to intersect with
+        :type other: `NGramSketch`
+        :rtype: `NGramSketch`
+
+        """
+        size = min(len(self), len(other))
+        return self._from_int(self._fold(size) & other._fold(size), size)
+
+    def is_empty(self):
+        """Returns True if no bits are set in this sketch.
+
+        :rtype: `bool`
+
+        """
+        return not any(self._data)
+
+    @classmethod
+    def new(cls, count):
+        """Returns an empty sketch sized for `count` n-grams.
+
+        :param count: expected number of n-grams
+        :type count: `int`
+        :rtype: `NGramSketch`
+
+        """
+        size = cls._MINIMUM_BITS
+        while size < count * cls._BITS_PER_NGRAM:
+            size *= 2
+        return cls(size // 8)
+
+    def _to_int(self):
+        return int.from_bytes(self._data, 'little')
+
+    def to_bytes(self):
+        """Returns this sketch as bytes.
+
+        :rtype: `bytes`
+
+        """
+        return bytes(self._data)
+
+    def union(self, other):
+        """Returns a sketch of the bits in either this sketch or
+        `other`, at the size of the smaller.
+
+        :param other: sketch to combine with
+        :type other: `NGramSketch`
+        :rtype: `NGramSketch`
+
+        """
+        size = min(len(self), len(other))
+        return self._from_int(self._fold(size) | other._fold(size), size)
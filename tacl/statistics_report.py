@@ -5,6 +5,7 @@ import re
 import pandas as pd
 
 from . import constants
+from .results_io import read_results
 from .text import Text
 
 
@@ -13,7 +14,7 @@ class StatisticsReport:
     def __init__(self, corpus, tokenizer, matches):
         self._corpus = corpus
         self._tokenizer = tokenizer
-        self._matches = pd.read_csv(matches, encoding='utf-8', na_filter=False)
+        self._matches = read_results(matches)
         self._stats = pd.DataFrame()
 
     def csv(self, fh):
@@ -0,0 +1,181 @@
+"""Module containing the SuffixArray class."""
+
+import array
+import sys
+
+
+class SuffixArray:
+
+    """Class representing the suffix array of a sequence of tokens,
+    together with its longest common prefix (LCP) array.
+
+    The suffix array lists the start position of every suffix of the
+    sequence, in sorted order; the LCP array gives, for each suffix in
+    that order, the number of tokens it has in common with the start
+    of the preceding suffix. Every occurrence of an n-gram is the
+    start of a suffix, and the suffixes starting with the same n-gram
+    are adjacent, so the n-grams of any size, and their counts, can
+    be read off the two arrays.
+
+    The tokens may be of any type that can be compared and hashed; the
+    order of the suffixes depends on the tokens, but the n-grams
+    derived from them do not.
+
+    """
+
+    # Type code of the arrays of integers stored as bytes.
+    _TYPECODE = 'i'
+
+    def __init__(self, tokens, suffixes=None, lcp=None):
+        self._tokens = tokens
+        if suffixes is None:
+            suffixes = self._generate_suffixes(tokens)
+        if lcp is None:
+            lcp = self._generate_lcp(tokens, suffixes)
+        self._suffixes = suffixes
+        self._lcp = lcp
+
+    @classmethod
+    def from_bytes(cls, tokens, suffixes, lcp):
+        """Returns a `SuffixArray` from the integer tokens, suffix
+        array and LCP array in `tokens`, `suffixes` and `lcp`, as
+        returned by `to_bytes`.
+
+        :param tokens: tokens as bytes
+        :type tokens: `bytes`
+        :param suffixes: suffix array as bytes
+        :type suffixes: `bytes`
+        :param lcp: LCP array as bytes
+        :type lcp: `bytes`
+        :rtype: `SuffixArray`
+
+        """
+        return cls(*[cls._from_bytes(data) for data in (tokens, suffixes,
+                                                          lcp)])
+
+    @classmethod
+    def _from_bytes(cls, data):
+        values = array.array(cls._TYPECODE)
+        values.frombytes(data)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values
+
+    @staticmethod
+    def _generate_lcp(tokens, suffixes):
+        """Returns the LCP array of `tokens`, using Kasai's algorithm.
+
+        :param tokens: tokens
+        :type tokens: `list`
+        :param suffixes: suffix array of `tokens`
+        :type suffixes: `list` of `int`
+        :rtype: `list` of `int`
+
+        """
+        length = len(tokens)
+        ranks = [0] * length
+        for rank, suffix in enumerate(suffixes):
+            ranks[suffix] = rank
+        lcp = [0] * length
+        common = 0
+        for position in range(length):
+            rank = ranks[position]
+            if rank == 0:
+                common = 0
+                continue
+            previous = suffixes[rank - 1]
+            while position + common < length and \
+                    previous + common < length and \
+                    tokens[position + common] == tokens[previous + common]:
+                common += 1
+            lcp[rank] = common
+            if common:
+                common -= 1
+        return lcp
+
+    @staticmethod
+    def _generate_suffixes(tokens):
+        """Returns the suffix array of `tokens`, by prefix doubling.
+
+        :param tokens: tokens
+        :type tokens: `list`
+        :rtype: `list` of `int`
+
+        """
+        length = len(tokens)
+        token_ranks = {token: rank for rank, token in
+                       enumerate(sorted(set(tokens)))}
+        ranks = [token_ranks[token] for token in tokens]
+        suffixes = list(range(length))
+        span = 1
+        while length > 1:
+            # Sort by the rank of the first `span` tokens of each
+            # suffix and then by that of the following `span` tokens,
+            # giving the order of the first 2 * `span` tokens.
+            keys = [(ranks[position], ranks[position + span]
+                     if position + span < length else -1)
+                    for position in range(length)]
+            suffixes.sort(key=keys.__getitem__)
+            new_ranks = [0] * length
+            for index in range(1, length):
+                new_ranks[suffixes[index]] = new_ranks[suffixes[index - 1]] + (
+                    keys[suffixes[index]] != keys[suffixes[index - 1]])
+            ranks = new_ranks
+            if ranks[suffixes[-1]] == length - 1:
+                break
+            span *= 2
+        return suffixes
+
+    def get_ngram_counts(self, size):
+        """Returns a generator supplying each distinct n-gram of `size`
+        tokens in the sequence.
+
+        Each iteration of the generator supplies a tuple consisting of
+        the position of an occurrence of the n-gram and the number of
+        its occurrences.
+
+        :param size: size of n-grams
+        :type size: `int`
+        :rtype: `generator`
+
+        """
+        length = len(self._tokens)
+        position = None
+        count = 0
+        for suffix, common in zip(self._suffixes, self._lcp):
+            if length - suffix < size:
+                continue
+            if count and common >= size:
+                count += 1
+                continue
+            if count:
+                yield position, count
+            position = suffix
+            count = 1
+        if count:
+            yield position, count
+
+    def get_tokens(self):
+        """Returns the tokens of this suffix array.
+
+        :rtype: sequence
+
+        """
+        return self._tokens
+
+    def to_bytes(self):
+        """Returns the tokens, suffix array and LCP array of this suffix
+        array as bytes.
+
+        The tokens must be non-negative integers.
+
+        :rtype: `tuple` of `bytes`
+
+        """
+        data = []
+        for values in (self._tokens, self._suffixes, self._lcp):
+            values = array.array(self._TYPECODE, values)
+            if sys.byteorder == 'big':
+                values.byteswap()
+            data.append(values.tobytes())
+        return tuple(data)
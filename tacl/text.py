@@ -2,6 +2,7 @@
 
 import collections
 import hashlib
+import itertools
 import os.path
 import re
 
@@ -47,6 +48,58 @@ class Text:
         """
         return self._content
 
+    def get_ngram_batches(self, minimum, maximum, skip_sizes, batch_size):
+        """Returns a generator supplying the n-grams (`minimum` <= n
+        <= `maximum`) for this text in batches, each of no more than
+        `batch_size` n-grams.
+
+        Unlike `get_ngrams`, the n-grams are not counted. Each batch
+        is a list of tuples consisting of the size of the n-gram, the
+        position of its first token in the text, and the n-gram. This
+        allows n-grams to be generated from a text of any length
+        without holding all of them in memory.
+
+        :param minimum: minimum n-gram size
+        :type minimum: `int`
+        :param maximum: maximum n-gram size
+        :type maximum: `int`
+        :param skip_sizes: sizes of n-grams not to supply
+        :type skip_sizes: `list` of `int`
+        :param batch_size: maximum number of n-grams in a batch
+        :type batch_size: `int`
+        :rtype: `generator`
+
+        """
+        sizes = [size for size in range(minimum, maximum + 1)
+                 if size not in skip_sizes]
+        if not sizes:
+            return
+        tokens = self.get_ngram_tokens()
+        # Each batch covers the n-grams of every size that start
+        # within a span of tokens.
+        span = max(1, batch_size // len(sizes))
+        for start in range(0, len(tokens), span):
+            window = tokens[start:start + span + sizes[-1] - 1]
+            batch = []
+            for size, ngrams in self._ngrams(window, sizes[0], sizes[-1]):
+                if size in sizes:
+                    batch.extend([(size, start + index, ngram) for index, ngram
+                                  in enumerate(ngrams[:span])])
+            if batch:
+                yield batch
+
+    def get_ngram_tokens(self):
+        """Returns a list of the tokens in this text, with any whitespace
+        within a token removed, as is required for n-grams.
+
+        :rtype: `list` of `str`
+
+        """
+        # Whitespace can occur within a CBETA token (eg,
+        # [(禾*尤)\n/上/日]).
+        joiner = self._tokenizer.joiner
+        return [joiner.join(token.split()) for token in self.get_tokens()]
+
     def get_ngrams(self, minimum, maximum, skip_sizes=None):
         """Returns a generator supplying the n-grams (`minimum` <= n
         <= `maximum`) for this text.
@@ -59,15 +112,20 @@ class Text:
         :type minimum: `int`
         :param maximum: maximum n-gram size
         :type maximum: `int`
+        :param skip_sizes: sizes of n-grams not to supply
+        :type skip_sizes: `list` of `int`
         :rtype: `generator`
 
         """
         skip_sizes = skip_sizes or []
-        tokens = self.get_tokens()
-        for size in range(minimum, maximum + 1):
-            if size not in skip_sizes:
-                ngrams = collections.Counter(self._ngrams(tokens, size))
-                yield (size, ngrams)
+        sizes = [size for size in range(minimum, maximum + 1)
+                 if size not in skip_sizes]
+        if not sizes:
+            return
+        tokens = self.get_ngram_tokens()
+        for size, ngrams in self._ngrams(tokens, sizes[0], sizes[-1]):
+            if size in sizes:
+                yield (size, collections.Counter(ngrams))
 
     def get_token_content(self):
         """Returns a string of the tokens in this text joined using the
@@ -86,40 +144,60 @@ class Text:
         """
         return self._tokenizer.tokenize(self._content)
 
-    def _ngrams(self, sequence, degree):
-        """Returns the n-grams generated from `sequence`.
+    def _ngrams(self, sequence, minimum, maximum):
+        """Returns a generator supplying the n-grams (`minimum` <= n
+        <= `maximum`) generated from `sequence`.
 
-        Based on the ngrams function from the Natural Language
-        Toolkit.
+        Each iteration of the generator supplies a tuple consisting of
+        the size of the n-grams and a list of the n-grams, in order of
+        their occurrence.
 
-        Each n-gram in the returned list is a string with whitespace
-        removed.
+        Each n-gram is made by extending the n-gram of one size
+        smaller at the same position by a single token, so no n-gram
+        is assembled from its tokens more than once.
 
-        :param sequence: the source data to be converted into n-grams
-        :type sequence: sequence
-        :param degree: the degree of the n-grams
-        :type degree: `int`
-        :rtype: `list` of `str`
+        :param sequence: tokens to be converted into n-grams
+        :type sequence: `list` of `str`
+        :param minimum: minimum n-gram size
+        :type minimum: `int`
+        :param maximum: maximum n-gram size
+        :type maximum: `int`
+        :rtype: `generator`
 
         """
-        count = max(0, len(sequence) - degree + 1)
-        # The extra split and join are due to having to handle
-        # whitespace within a CBETA token (eg, [(禾*尤)\n/上/日]).
-        return [self._tokenizer.joiner.join(
-            self._tokenizer.joiner.join(sequence[i:i+degree]).split())
-                for i in range(count)]
+        joiner = self._tokenizer.joiner
+        ngrams = sequence
+        for size in range(1, maximum + 1):
+            if size > 1:
+                tokens = itertools.islice(sequence, size - 1, None)
+                if joiner:
+                    ngrams = [ngram + joiner + token
+                              for ngram, token in zip(ngrams, tokens)]
+                else:
+                    ngrams = [ngram + token
+                              for ngram, token in zip(ngrams, tokens)]
+            if size >= minimum:
+                yield (size, ngrams)
 
 
 class WitnessText (Text):
 
     """Class for the text of a witness. A witness has a work name and a
-    siglum, and has a corresponding filename."""
+    siglum, and has a corresponding filename.
+
+    `file_stat` is the size and modification time of the file the
+    content was read from, as returned by
+    `Corpus.get_witness_file_stat`.
 
-    def __init__(self, name, siglum, content, tokenizer):
+    """
+
+    def __init__(self, name, siglum, content, tokenizer,
+                 file_stat=(None, None)):
         super().__init__(content, tokenizer)
         self._name = name
         self._siglum = siglum
         self._filename = self.assemble_filename(name, siglum)
+        self._file_stat = file_stat
 
     @staticmethod
     def assemble_filename(name, siglum):
@@ -133,6 +211,17 @@ class WitnessText (Text):
         """
         return hashlib.md5(self._content.encode('utf-8')).hexdigest()
 
+    def get_file_stat(self):
+        """Returns the size and modification time of the file this text
+        was read from.
+
+        Both values are None if the text was not read from a file.
+
+        :rtype: `tuple`
+
+        """
+        return self._file_stat
+
     def get_filename(self):
         """Returns the filename of this text.
 
@@ -186,13 +275,8 @@ class FilteredWitnessText (WitnessText):
         :rtype: `generator`
 
         """
-        tokens = self.get_tokens()
+        tokens = self.get_ngram_tokens()
         filter_pattern = self.get_filter_ngrams_pattern(filter_ngrams)
-        for size in range(minimum, maximum + 1):
-            ngrams = collections.Counter(
-                self._ngrams(tokens, size, filter_pattern))
-            yield (size, ngrams)
-
-    def _ngrams(self, sequence, degree, filter_ngrams):
-        return [ngram for ngram in super()._ngrams(sequence, degree)
-                if filter_ngrams.search(ngram)]
+        for size, ngrams in self._ngrams(tokens, minimum, maximum):
+            yield (size, collections.Counter(
+                [ngram for ngram in ngrams if filter_pattern.search(ngram)]))
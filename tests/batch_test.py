@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import json
+import os.path
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock, sentinel
+
+import tacl
+from tacl import constants
+from tacl.exceptions import MalformedManifestError, TACLError
+from .tacl_test_case import TaclTestCase
+
+
+class BatchQueryRunnerTestCase (TaclTestCase):
+
+    def setUp(self):
+        self._store = MagicMock(spec=tacl.DataStore)
+        self._store._read_only = False
+        self._store._results_format = tacl.constants.RESULTS_FORMAT_CSV
+        self._runner = tacl.BatchQueryRunner(self._store, sentinel.corpus,
+                                             sentinel.tokenizer)
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+        with open(os.path.join(self._dir, 'cat.txt'), 'w',
+                  encoding='utf-8') as fh:
+            fh.write('T1 A\nT2 B\n')
+        with open(os.path.join(self._dir, 'cat2.txt'), 'w',
+                  encoding='utf-8') as fh:
+            fh.write('T2 A\nT3 B\n')
+        with open(os.path.join(self._dir, 'ngrams.txt'), 'w',
+                  encoding='utf-8') as fh:
+            fh.write('a b\nc\n')
+
+    def _write_manifest(self, manifest):
+        path = os.path.join(self._dir, 'manifest.json')
+        with open(path, 'w', encoding='utf-8') as fh:
+            json.dump(manifest, fh)
+        return path
+
+    def test_load(self):
+        path = self._write_manifest([
+            {'type': 'intersect', 'catalogue': 'cat.txt',
+             'output': 'i.csv', 'min_size': 2},
+            {'type': 'search', 'catalogue': 'cat.txt',
+             'ngrams': 'ngrams.txt', 'output': 's.csv'},
+            {'type': 'sdiff', 'labels': ['A', 'B'],
+             'supplied': ['a.csv', 'b.csv'], 'output': 'd.csv'}])
+        queries = self._runner.load(path)
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(queries[0]['output'],
+                         os.path.join(self._dir, 'i.csv'))
+        self.assertEqual(queries[0]['catalogue'], {'T1': 'A', 'T2': 'B'})
+        self.assertEqual(queries[0]['min_size'], 2)
+        # Each catalogue is loaded only once.
+        self.assertIs(queries[0]['catalogue'], queries[1]['catalogue'])
+        self.assertEqual(queries[1]['ngrams'], ['a b', 'c'])
+        self.assertEqual(queries[2]['supplied'],
+                         [os.path.join(self._dir, 'a.csv'),
+                          os.path.join(self._dir, 'b.csv')])
+
+    def test_load_missing_argument(self):
+        path = self._write_manifest([
+            {'type': 'search', 'catalogue': 'cat.txt', 'output': 's.csv'}])
+        self.assertRaises(MalformedManifestError, self._runner.load, path)
+
+    def test_load_not_list(self):
+        path = self._write_manifest({'type': 'counts'})
+        self.assertRaises(MalformedManifestError, self._runner.load, path)
+
+    def test_load_unknown_argument(self):
+        for argument in ('add_label_count', 'min-works', 'engine'):
+            path = self._write_manifest([
+                {'type': 'diff', 'catalogue': 'cat.txt',
+                 'output': 'd.csv', argument: True}])
+            self.assertRaises(MalformedManifestError, self._runner.load,
+                              path)
+
+    def test_load_unknown_type(self):
+        path = self._write_manifest([
+            {'type': 'ngrams', 'catalogue': 'cat.txt', 'output': 'n.csv'}])
+        self.assertRaises(MalformedManifestError, self._runner.load, path)
+
+    def test_run(self):
+        path = self._write_manifest([
+            {'type': 'intersect', 'catalogue': 'cat.txt',
+             'output': 'i.csv', 'engine': 'grouped'},
+            {'type': 'diff', 'catalogue': 'cat2.txt', 'output': 'd.csv',
+             'asymmetric': 'A', 'max_size': 3},
+            {'type': 'counts', 'catalogue': 'cat.txt', 'output': 'c.csv'}])
+        queries = self._runner.load(path)
+        self._runner.run(queries)
+        # Every labelled work is validated, once.
+        self.assertEqual(self._store.validate.call_count, 1)
+        corpus, catalogue = self._store.validate.call_args[0]
+        self.assertEqual(corpus, sentinel.corpus)
+        self.assertEqual(set(catalogue), {'T1', 'T2', 'T3'})
+        self.assertEqual(self._store.intersection.call_args[0][0],
+                         {'T1': 'A', 'T2': 'B'})
+        self.assertEqual(self._store.intersection.call_args[0][2:],
+                         (None, None, constants.INTERSECT_ENGINE_GROUPED))
+        args = self._store.diff_asymmetric.call_args[0]
+        self.assertEqual(args[:3], ({'T2': 'A', 'T3': 'B'}, 'A',
+                                    sentinel.tokenizer))
+        self.assertEqual(args[4:], (None, 3))
+        self.assertEqual(self._store.counts.call_count, 1)
+        for name in ('i.csv', 'd.csv', 'c.csv'):
+            self.assertTrue(os.path.exists(os.path.join(self._dir, name)))
+
+    def test_run_jobs_not_read_only(self):
+        path = self._write_manifest([
+            {'type': 'counts', 'catalogue': 'cat.txt', 'output': 'c.csv'}])
+        queries = self._runner.load(path)
+        self.assertRaises(TACLError, self._runner.run, queries, True, 2)
+        self._store.validate.assert_not_called()
+
+    def test_run_no_validate(self):
+        path = self._write_manifest([
+            {'type': 'counts', 'catalogue': 'cat.txt', 'output': 'c.csv'}])
+        queries = self._runner.load(path)
+        self._runner.run(queries, False)
+        self._store.validate.assert_not_called()
+        self.assertEqual(self._store.counts.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,13 +21,18 @@ class CorpusTestCase (TaclTestCase):
         siglum = 'base'
         content = 'test content'
         filename = os.path.join(work, siglum + '.txt')
+        get_file_stat = self._create_patch(
+            'tacl.Corpus.get_witness_file_stat')
+        get_file_stat.return_value = (12, 1000)
         m = mock_open(read_data=content)
         with patch('builtins.open', m, create=True):
             corpus = tacl.Corpus(path, self._tokenizer)
             actual_text = corpus.get_witness(work, siglum)
         m.assert_called_once_with(os.path.join(path, filename),
                                   encoding='utf-8')
+        get_file_stat.assert_called_once_with(corpus, work, siglum)
         assert isinstance(actual_text, tacl.WitnessText)
+        self.assertEqual(actual_text.get_file_stat(), (12, 1000))
 
     def test_get_witness_specific_class(self):
         path = '/test'
@@ -35,6 +40,7 @@ class CorpusTestCase (TaclTestCase):
         siglum = 'base'
         content = 'test content'
         filename = os.path.join(work, siglum + '.txt')
+        self._create_patch('tacl.Corpus.get_witness_file_stat')
         m = mock_open(read_data=content)
         with patch('builtins.open', m, create=True):
             corpus = tacl.Corpus(path, self._tokenizer)
@@ -68,6 +74,32 @@ class CorpusTestCase (TaclTestCase):
                           call(corpus, name1, siglum2),
                           call(corpus, name2, siglum1)])
 
+    def test_get_witness_file_stat(self):
+        path = '/test'
+        stat = self._create_patch('os.stat')
+        stat.return_value = MagicMock(st_size=12, st_mtime_ns=1000)
+        corpus = tacl.Corpus(path, self._tokenizer)
+        actual_file_stat = corpus.get_witness_file_stat('T1', 'base')
+        stat.assert_called_once_with(os.path.join(path, 'T1', 'base.txt'))
+        self.assertEqual(actual_file_stat, (12, 1000))
+
+    def test_get_witness_names(self):
+        path = '/test'
+        glob = self._create_patch('glob.glob')
+        glob.return_value = [
+            os.path.join(path, 'T1', 'base.txt'),
+            os.path.join(path, 'T1', 'a.txt'),
+            os.path.join(path, 'T2', 'base.txt')]
+        isfile = self._create_patch('os.path.isfile')
+        isfile.return_value = True
+        get_witness = self._create_patch('tacl.Corpus.get_witness')
+        corpus = tacl.Corpus(path, self._tokenizer)
+        actual_names = list(corpus.get_witness_names('T*'))
+        glob.assert_called_once_with(os.path.join(path, 'T*/*.txt'))
+        self.assertEqual(actual_names,
+                         [('T1', 'base'), ('T1', 'a'), ('T2', 'base')])
+        get_witness.assert_not_called()
+
 
 if __name__ == '__main__':
     unittest.main()
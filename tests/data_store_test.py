@@ -6,10 +6,9 @@ import sqlite3
 import unittest
 from unittest.mock import call, MagicMock, sentinel
 
-import pandas as pd
 
 import tacl
-from tacl.exceptions import MalformedQueryError
+from tacl.exceptions import MalformedQueryError, OutdatedDataStoreError
 from .tacl_test_case import TaclTestCase
 
 
@@ -18,17 +17,34 @@ class DataStoreTestCase (TaclTestCase):
     """Unit tests of the DataStore class."""
 
     def test_add_indices(self):
+        get_setting = self._create_patch('tacl.DataStore._get_setting')
         store = tacl.DataStore(':memory:')
         store._conn = MagicMock(spec_set=sqlite3.Connection)
-        store._add_indices()
-        store._conn.execute.assert_called_once_with(
-            tacl.constants.CREATE_INDEX_TEXTNGRAM_SQL)
+        layout_indices = (
+            (tacl.constants.LAYOUT_HEAP,
+             [call(tacl.constants.CREATE_INDEX_TEXTNGRAM_SQL)]),
+            (tacl.constants.LAYOUT_COVERING,
+             [call(tacl.constants.CREATE_INDEX_TEXTNGRAM_COVERING_SQL)]),
+            (tacl.constants.LAYOUT_CLUSTERED, []))
+        for layout, expected_calls in layout_indices:
+            get_setting.return_value = layout
+            store._conn.reset_mock()
+            store._add_indices()
+            get_setting.assert_called_with(
+                store, tacl.constants.LAYOUT_SETTING)
+            self.assertEqual(store._conn.execute.mock_calls, expected_calls)
 
     def test_add_ngrams(self):
         add_indices = self._create_patch('tacl.DataStore._add_indices')
         add_text_ngrams = self._create_patch('tacl.DataStore._add_text_ngrams')
         analyse = self._create_patch('tacl.DataStore._analyse')
         initialise = self._create_patch('tacl.DataStore._initialise_database')
+        update_ngram_stats = self._create_patch(
+            'tacl.DataStore._update_ngram_stats')
+        get_setting = self._create_patch('tacl.DataStore._get_setting')
+        get_setting.side_effect = lambda store, name: {
+            tacl.constants.INDEX_SETTING: tacl.constants.INDEX_NGRAM}.get(
+                name)
         text1 = MagicMock(spec_set=tacl.WitnessText)
         text2 = MagicMock(spec_set=tacl.WitnessText)
         corpus = MagicMock(spec_set=tacl.Corpus)
@@ -36,11 +52,16 @@ class DataStoreTestCase (TaclTestCase):
         corpus.get_witnesses.return_value = iter([text1, text2])
         store = tacl.DataStore(':memory:')
         store.add_ngrams(corpus, 2, 3)
-        initialise.assert_called_once_with(store)
+        initialise.assert_called_once_with(store,
+                                           tacl.constants.LAYOUT_HEAP,
+                                           tacl.constants.INDEX_NGRAM)
         corpus.get_witnesses.assert_called_once_with()
+        batch_size = tacl.constants.NGRAMS_BATCH_SIZE
         self.assertEqual(add_text_ngrams.mock_calls,
-                         [call(store, text1, 2, 3), call(store, text2, 2, 3)])
+                         [call(store, text1, 2, 3, batch_size=batch_size),
+                          call(store, text2, 2, 3, batch_size=batch_size)])
         add_indices.assert_called_once_with(store)
+        update_ngram_stats.assert_called_once_with(store)
         analyse.assert_called_once_with(store)
 
     def test_add_ngrams_with_catalogue(self):
@@ -48,6 +69,12 @@ class DataStoreTestCase (TaclTestCase):
         add_text_ngrams = self._create_patch('tacl.DataStore._add_text_ngrams')
         analyse = self._create_patch('tacl.DataStore._analyse')
         initialise = self._create_patch('tacl.DataStore._initialise_database')
+        update_ngram_stats = self._create_patch(
+            'tacl.DataStore._update_ngram_stats')
+        get_setting = self._create_patch('tacl.DataStore._get_setting')
+        get_setting.side_effect = lambda store, name: {
+            tacl.constants.INDEX_SETTING: tacl.constants.INDEX_NGRAM}.get(
+                name)
         text1 = MagicMock(spec_set=tacl.WitnessText)
         text1.get_names = MagicMock(name='get_names')
         text1.get_names.return_value = ['T1', 'base']
@@ -61,12 +88,94 @@ class DataStoreTestCase (TaclTestCase):
         catalogue = tacl.Catalogue()
         catalogue['T1'] = 'A'
         store.add_ngrams(corpus, 2, 3, catalogue)
-        initialise.assert_called_once_with(store)
+        initialise.assert_called_once_with(store,
+                                           tacl.constants.LAYOUT_HEAP,
+                                           tacl.constants.INDEX_NGRAM)
         corpus.get_witnesses.assert_called_once_with()
         text1.get_names.assert_called_once_with()
         text2.get_names.assert_called_once_with()
-        add_text_ngrams.assert_called_once_with(store, text1, 2, 3)
+        add_text_ngrams.assert_called_once_with(
+            store, text1, 2, 3, batch_size=tacl.constants.NGRAMS_BATCH_SIZE)
+        add_indices.assert_called_once_with(store)
+        update_ngram_stats.assert_called_once_with(store)
+        analyse.assert_called_once_with(store)
+
+    def test_add_ngrams_parallel(self):
+        add_indices = self._create_patch('tacl.DataStore._add_indices')
+        add_ngrams_parallel = self._create_patch(
+            'tacl.DataStore._add_ngrams_parallel')
+        add_text_ngrams = self._create_patch('tacl.DataStore._add_text_ngrams')
+        analyse = self._create_patch('tacl.DataStore._analyse')
+        initialise = self._create_patch('tacl.DataStore._initialise_database')
+        update_ngram_stats = self._create_patch(
+            'tacl.DataStore._update_ngram_stats')
+        get_setting = self._create_patch('tacl.DataStore._get_setting')
+        get_setting.side_effect = lambda store, name: {
+            tacl.constants.INDEX_SETTING: tacl.constants.INDEX_NGRAM}.get(
+                name)
+        corpus = MagicMock(spec_set=tacl.Corpus)
+        store = tacl.DataStore(':memory:')
+        store.add_ngrams(corpus, 2, 3, sentinel.catalogue, 4,
+                         sentinel.batch_size, sentinel.layout, sentinel.index)
+        initialise.assert_called_once_with(store, sentinel.layout,
+                                           sentinel.index)
+        add_ngrams_parallel.assert_called_once_with(
+            store, corpus, 2, 3, sentinel.catalogue, 4, sentinel.batch_size)
+        add_text_ngrams.assert_not_called()
+        corpus.get_witnesses.assert_not_called()
+        add_indices.assert_called_once_with(store)
+        update_ngram_stats.assert_called_once_with(store)
+        analyse.assert_called_once_with(store)
+
+    def test_add_ngrams_pattern_index(self):
+        self._create_patch('tacl.DataStore._add_indices')
+        add_pattern_index = self._create_patch(
+            'tacl.DataStore._add_pattern_index')
+        self._create_patch('tacl.DataStore._add_text_ngrams')
+        self._create_patch('tacl.DataStore._analyse')
+        self._create_patch('tacl.DataStore._initialise_database')
+        self._create_patch('tacl.DataStore._update_ngram_stats')
+        get_setting = self._create_patch('tacl.DataStore._get_setting')
+        settings = {tacl.constants.INDEX_SETTING: tacl.constants.INDEX_NGRAM}
+        get_setting.side_effect = lambda store, name: settings.get(name)
+        corpus = MagicMock(spec_set=tacl.Corpus)
+        corpus.get_witnesses.return_value = iter([])
+        store = tacl.DataStore(':memory:')
+        store.add_ngrams(corpus, 2, 3, pattern_index=True)
+        add_pattern_index.assert_called_once_with(store)
+        # An existing pattern index is rebuilt.
+        add_pattern_index.reset_mock()
+        settings[tacl.constants.PATTERN_INDEX_SETTING] = '1'
+        store.add_ngrams(corpus, 2, 3)
+        add_pattern_index.assert_called_once_with(store)
+        # A suffix index has no pattern index.
+        add_pattern_index.reset_mock()
+        settings[tacl.constants.INDEX_SETTING] = tacl.constants.INDEX_SUFFIX
+        self._create_patch('tacl.DataStore._add_suffix_arrays')
+        store.add_ngrams(corpus, 2, 3, pattern_index=True)
+        add_pattern_index.assert_not_called()
+
+    def test_add_ngrams_suffix(self):
+        add_indices = self._create_patch('tacl.DataStore._add_indices')
+        add_suffix_arrays = self._create_patch(
+            'tacl.DataStore._add_suffix_arrays')
+        add_text_ngrams = self._create_patch('tacl.DataStore._add_text_ngrams')
+        analyse = self._create_patch('tacl.DataStore._analyse')
+        self._create_patch('tacl.DataStore._initialise_database')
+        update_ngram_stats = self._create_patch(
+            'tacl.DataStore._update_ngram_stats')
+        get_setting = self._create_patch('tacl.DataStore._get_setting')
+        get_setting.return_value = tacl.constants.INDEX_SUFFIX
+        corpus = MagicMock(spec_set=tacl.Corpus)
+        store = tacl.DataStore(':memory:')
+        store.add_ngrams(corpus, 2, 3, sentinel.catalogue, 4)
+        get_setting.assert_called_once_with(store,
+                                            tacl.constants.INDEX_SETTING)
+        add_suffix_arrays.assert_called_once_with(store, corpus, 2, 3,
+                                                  sentinel.catalogue)
+        add_text_ngrams.assert_not_called()
         add_indices.assert_called_once_with(store)
+        update_ngram_stats.assert_not_called()
         analyse.assert_called_once_with(store)
 
     def test_add_temporary_ngrams(self):
@@ -103,6 +212,12 @@ class DataStoreTestCase (TaclTestCase):
         has_ngrams.return_value = True
         add_text_size_ngrams = self._create_patch(
             'tacl.DataStore._add_text_size_ngrams')
+        get_text_sketch = self._create_patch(
+            'tacl.DataStore._get_text_sketch')
+        set_text_sketch = self._create_patch(
+            'tacl.DataStore._set_text_sketch')
+        delete_label_ngram_sets = self._create_patch(
+            'tacl.DataStore._delete_label_ngram_sets')
         text = MagicMock(spec_set=tacl.WitnessText)
         text.get_ngrams.return_value = [(2, sentinel.two_grams),
                                         (3, sentinel.three_grams)]
@@ -114,6 +229,9 @@ class DataStoreTestCase (TaclTestCase):
             call(store, sentinel.text_id, 3)])
         text.get_ngrams.assert_called_once_with(2, 3, [2, 3])
         add_text_size_ngrams.assert_has_calls([])
+        get_text_sketch.assert_not_called()
+        set_text_sketch.assert_not_called()
+        delete_label_ngram_sets.assert_not_called()
 
     def test_add_text_ngrams_not_existing(self):
         get_text_id = self._create_patch('tacl.DataStore._get_text_id')
@@ -122,19 +240,107 @@ class DataStoreTestCase (TaclTestCase):
         has_ngrams.return_value = False
         add_text_size_ngrams = self._create_patch(
             'tacl.DataStore._add_text_size_ngrams')
+        get_text_sketch = self._create_patch(
+            'tacl.DataStore._get_text_sketch')
+        set_text_sketch = self._create_patch(
+            'tacl.DataStore._set_text_sketch')
+        delete_label_ngram_sets = self._create_patch(
+            'tacl.DataStore._delete_label_ngram_sets')
         text = MagicMock(spec_set=tacl.WitnessText)
         text.get_ngrams.return_value = [(2, sentinel.two_grams),
                                         (3, sentinel.three_grams)]
         store = tacl.DataStore(':memory:')
+        store._conn = MagicMock(spec_set=sqlite3.Connection)
         store._add_text_ngrams(text, 2, 3)
         get_text_id.assert_called_once_with(store, text)
         has_ngrams.assert_has_calls([
             call(store, sentinel.text_id, 2),
             call(store, sentinel.text_id, 3)])
+        store._conn.executemany.assert_called_once_with(
+            tacl.constants.INSERT_NGRAM_STATS_PENDING_SQL,
+            [(sentinel.text_id, 2), (sentinel.text_id, 3)])
         text.get_ngrams.assert_called_once_with(2, 3, [])
         add_text_size_ngrams.assert_has_calls([
             call(store, sentinel.text_id, 2, sentinel.two_grams),
             call(store, sentinel.text_id, 3, sentinel.three_grams)])
+        get_text_sketch.assert_called_once_with(store, sentinel.text_id, 2)
+        sketch = get_text_sketch.return_value
+        self.assertEqual(sketch.add.mock_calls,
+                         [call(sentinel.two_grams),
+                          call(sentinel.three_grams)])
+        set_text_sketch.assert_called_once_with(store, sentinel.text_id,
+                                                sketch)
+        delete_label_ngram_sets.assert_called_once_with(store,
+                                                        sentinel.text_id)
+
+    def test_add_text_ngrams_supplied(self):
+        get_text_id = self._create_patch('tacl.DataStore._get_text_id')
+        get_text_id.return_value = sentinel.text_id
+        has_ngrams = self._create_patch('tacl.DataStore._has_ngrams')
+        has_ngrams.side_effect = [True, False]
+        add_text_size_ngrams = self._create_patch(
+            'tacl.DataStore._add_text_size_ngrams')
+        get_text_sketch = self._create_patch(
+            'tacl.DataStore._get_text_sketch')
+        set_text_sketch = self._create_patch(
+            'tacl.DataStore._set_text_sketch')
+        delete_label_ngram_sets = self._create_patch(
+            'tacl.DataStore._delete_label_ngram_sets')
+        text = MagicMock(spec_set=tacl.WitnessText)
+        ngrams = [(2, sentinel.two_grams), (3, sentinel.three_grams)]
+        store = tacl.DataStore(':memory:')
+        store._conn = MagicMock(spec_set=sqlite3.Connection)
+        store._add_text_ngrams(text, 2, 3, ngrams)
+        get_text_id.assert_called_once_with(store, text)
+        store._conn.executemany.assert_called_once_with(
+            tacl.constants.INSERT_NGRAM_STATS_PENDING_SQL,
+            [(sentinel.text_id, 3)])
+        text.get_ngrams.assert_not_called()
+        self.assertEqual(
+            add_text_size_ngrams.mock_calls,
+            [call(store, sentinel.text_id, 3, sentinel.three_grams)])
+        get_text_sketch.assert_called_once_with(store, sentinel.text_id, 1)
+        sketch = get_text_sketch.return_value
+        sketch.add.assert_called_once_with(sentinel.three_grams)
+        set_text_sketch.assert_called_once_with(store, sentinel.text_id,
+                                                sketch)
+        delete_label_ngram_sets.assert_called_once_with(store,
+                                                        sentinel.text_id)
+
+    def test_add_text_ngrams_staged(self):
+        get_text_id = self._create_patch('tacl.DataStore._get_text_id')
+        get_text_id.return_value = sentinel.text_id
+        has_ngrams = self._create_patch('tacl.DataStore._has_ngrams')
+        has_ngrams.side_effect = [True, False]
+        exceeds_batch_size = self._create_patch(
+            'tacl.DataStore._exceeds_batch_size')
+        exceeds_batch_size.return_value = True
+        add_text_staged_ngrams = self._create_patch(
+            'tacl.DataStore._add_text_staged_ngrams')
+        add_text_size_ngrams = self._create_patch(
+            'tacl.DataStore._add_text_size_ngrams')
+        get_text_sketch = self._create_patch(
+            'tacl.DataStore._get_text_sketch')
+        set_text_sketch = self._create_patch(
+            'tacl.DataStore._set_text_sketch')
+        delete_label_ngram_sets = self._create_patch(
+            'tacl.DataStore._delete_label_ngram_sets')
+        text = MagicMock(spec_set=tacl.WitnessText)
+        store = tacl.DataStore(':memory:')
+        store._conn = MagicMock(spec_set=sqlite3.Connection)
+        store._add_text_ngrams(text, 2, 3, batch_size=sentinel.batch_size)
+        exceeds_batch_size.assert_called_once_with(text, sentinel.batch_size)
+        get_text_sketch.assert_called_once_with(store, sentinel.text_id, 1)
+        sketch = get_text_sketch.return_value
+        add_text_staged_ngrams.assert_called_once_with(
+            store, sentinel.text_id, text, 2, 3, [2], sentinel.batch_size,
+            sketch)
+        set_text_sketch.assert_called_once_with(store, sentinel.text_id,
+                                                sketch)
+        delete_label_ngram_sets.assert_called_once_with(store,
+                                                        sentinel.text_id)
+        text.get_ngrams.assert_not_called()
+        add_text_size_ngrams.assert_not_called()
 
     def test_add_text_record(self):
         store = tacl.DataStore(':memory:')
@@ -143,6 +349,8 @@ class DataStoreTestCase (TaclTestCase):
         text.get_checksum.return_value = sentinel.checksum
         text.get_filename.return_value = sentinel.filename
         text.get_names.return_value = (sentinel.name, sentinel.siglum)
+        text.get_file_stat.return_value = (sentinel.file_size,
+                                           sentinel.mtime)
         tokens = [sentinel.token]
         text.get_tokens.return_value = tokens
         cursor = store._conn.execute.return_value
@@ -154,10 +362,12 @@ class DataStoreTestCase (TaclTestCase):
         store._conn.execute.assert_called_once_with(
             tacl.constants.INSERT_TEXT_SQL,
             [sentinel.name, sentinel.siglum, sentinel.checksum,
-             len(tokens), ''])
+             len(tokens), '', sentinel.file_size, sentinel.mtime])
         self.assertEqual(actual_text_id, sentinel.text_id)
 
     def test_add_text_size_ngrams(self):
+        get_setting = self._create_patch('tacl.DataStore._get_setting')
+        get_setting.return_value = tacl.constants.LAYOUT_HEAP
         store = tacl.DataStore(':memory:')
         store._conn = MagicMock(spec_set=sqlite3.Connection)
         size = 1
@@ -166,10 +376,37 @@ class DataStoreTestCase (TaclTestCase):
         store._conn.execute.assert_called_once_with(
             tacl.constants.INSERT_TEXT_HAS_NGRAM_SQL,
             [sentinel.text_id, size, len(ngrams)])
-        store._conn.executemany.assert_called_once_with(
-            tacl.constants.INSERT_NGRAM_SQL,
-            [[sentinel.text_id, 'a', size, 2],
-             [sentinel.text_id, 'b', size, 1]])
+        # The parameters are supplied to executemany as generators.
+        actual_calls = [(args[0], list(args[1])) for args, kwargs in
+                        store._conn.executemany.call_args_list]
+        expected_calls = [
+            (tacl.constants.INSERT_NGRAM_SQL, [['a', size], ['b', size]]),
+            (tacl.constants.INSERT_TEXT_NGRAM_SQL,
+             [[sentinel.text_id, 2, 'a'], [sentinel.text_id, 1, 'b']])]
+        self.assertEqual(actual_calls, expected_calls)
+
+    def test_add_text_size_ngrams_partitioned(self):
+        get_setting = self._create_patch('tacl.DataStore._get_setting')
+        get_setting.return_value = tacl.constants.LAYOUT_PARTITIONED
+        store = tacl.DataStore(':memory:')
+        store._conn = MagicMock(spec_set=sqlite3.Connection)
+        size = 2
+        ngrams = collections.OrderedDict([('ab', 1)])
+        store._add_text_size_ngrams(sentinel.text_id, size, ngrams)
+        self.assertEqual(
+            store._conn.execute.mock_calls,
+            [call(tacl.constants.CREATE_TABLE_TEXTNGRAM_PARTITION_SQL.format(
+                size)),
+             call(tacl.constants.INSERT_TEXT_HAS_NGRAM_SQL,
+                  [sentinel.text_id, size, len(ngrams)])])
+        actual_calls = [(args[0], list(args[1])) for args, kwargs in
+                        store._conn.executemany.call_args_list]
+        expected_calls = [
+            (tacl.constants.INSERT_NGRAM_SQL, [['ab', size]]),
+            ('INSERT INTO TextNGram2 (text, ngram, size, count) '
+             'SELECT ?, id, size, ? FROM NGram WHERE ngram = ?',
+             [[sentinel.text_id, 1, 'ab']])]
+        self.assertEqual(actual_calls, expected_calls)
 
     def test_analyse(self):
         store = tacl.DataStore(':memory:')
@@ -182,8 +419,21 @@ class DataStoreTestCase (TaclTestCase):
         store._conn.execute.assert_called_once_with(
             tacl.constants.ANALYSE_SQL.format(sentinel.table))
 
+    def test_check_jobs(self):
+        get_setting = self._create_patch('tacl.DataStore._get_setting')
+        get_setting.return_value = tacl.constants.INDEX_NGRAM
+        store = tacl.DataStore(':memory:')
+        self.assertEqual(store._check_jobs(1), 1)
+        self.assertRaises(MalformedQueryError, store._check_jobs, 2)
+        store._read_only = True
+        self.assertEqual(store._check_jobs(2), 2)
+        get_setting.return_value = tacl.constants.INDEX_SUFFIX
+        self.assertEqual(store._check_jobs(2), 1)
+
     def test_counts(self):
         labels = [sentinel.label]
+        check_version = self._create_patch(
+            'tacl.DataStore._check_database_version')
         set_labels = self._create_patch('tacl.DataStore._set_labels')
         set_labels.return_value = labels
         get_placeholders = self._create_patch(
@@ -196,7 +446,11 @@ class DataStoreTestCase (TaclTestCase):
         store = tacl.DataStore(':memory:')
         store._conn = MagicMock(spec_set=sqlite3.Connection)
         cursor = store._conn.execute.return_value
+        add_derived_ngrams = self._create_patch(
+            'tacl.DataStore._add_derived_ngrams')
         output_fh = store.counts(catalogue, input_fh)
+        check_version.assert_called_once_with(store)
+        add_derived_ngrams.assert_called_once_with(store)
         set_labels.assert_called_once_with(store, catalogue)
         get_placeholders.assert_called_once_with(labels)
         sql = tacl.constants.SELECT_COUNTS_SQL.format(sentinel.placeholders)
@@ -220,6 +474,8 @@ class DataStoreTestCase (TaclTestCase):
 
     def test_diff(self):
         labels = {sentinel.label: 2, sentinel.label2: 1}
+        check_version = self._create_patch(
+            'tacl.DataStore._check_database_version')
         set_labels = self._create_patch('tacl.DataStore._set_labels')
         set_labels.return_value = labels
         get_placeholders = self._create_patch(
@@ -229,27 +485,34 @@ class DataStoreTestCase (TaclTestCase):
                                             False)
         input_fh = MagicMock(name='fh')
         catalogue = MagicMock(name='catalogue')
+        get_setting = self._create_patch('tacl.DataStore._get_setting')
+        get_setting.return_value = tacl.constants.LAYOUT_HEAP
         store = tacl.DataStore(':memory:')
         store._conn = MagicMock(spec_set=sqlite3.Connection)
         tokenizer = tacl.Tokenizer(*tacl.constants.TOKENIZERS['cbeta'])
-        _diff = self._create_patch('tacl.DataStore._diff', False)
-        _diff.return_value = input_fh
+        reduce_diff_results = self._create_patch(
+            'tacl.DataStore._reduce_diff_results', False)
+        reduce_diff_results.return_value = input_fh
         output_fh = store.diff(catalogue, tokenizer, input_fh)
+        check_version.assert_called_once_with(store)
         set_labels.assert_called_once_with(store, catalogue)
         get_placeholders.assert_called_once_with(
             [sentinel.label, sentinel.label2])
         self.assertTrue(log_query_plan.called)
-        sql = tacl.constants.SELECT_DIFF_SQL.format(sentinel.placeholders,
-                                                    sentinel.placeholders)
+        sql = tacl.constants.SELECT_DIFF_SQL.format(
+            sentinel.placeholders, sentinel.placeholders) + \
+            tacl.constants.SELECT_WITNESS_SIZE_ORDER_SQL
         self.assertEqual(store._conn.mock_calls,
                          [call.execute(sql,
                                        [sentinel.label, sentinel.label2,
                                         sentinel.label, sentinel.label2])])
-        self.assertTrue(_diff.called)
+        self.assertTrue(reduce_diff_results.called)
         self.assertEqual(input_fh, output_fh)
 
     def test_diff_asymmetric(self):
         labels = {sentinel.label: 1, sentinel.prime_label: 1}
+        check_version = self._create_patch(
+            'tacl.DataStore._check_database_version')
         set_labels = self._create_patch('tacl.DataStore._set_labels')
         set_labels.return_value = labels
         get_placeholders = self._create_patch(
@@ -259,23 +522,28 @@ class DataStoreTestCase (TaclTestCase):
                                             False)
         input_fh = MagicMock(name='fh')
         catalogue = MagicMock(name='catalogue')
+        get_setting = self._create_patch('tacl.DataStore._get_setting')
+        get_setting.return_value = tacl.constants.LAYOUT_HEAP
         store = tacl.DataStore(':memory:')
         store._conn = MagicMock(spec_set=sqlite3.Connection)
         tokenizer = MagicMock(name='tokenizer')
-        _diff = self._create_patch('tacl.DataStore._diff', False)
-        _diff.return_value = input_fh
+        reduce_diff_results = self._create_patch(
+            'tacl.DataStore._reduce_diff_results', False)
+        reduce_diff_results.return_value = input_fh
         output_fh = store.diff_asymmetric(catalogue, sentinel.prime_label,
                                           tokenizer, input_fh)
+        check_version.assert_called_once_with(store)
         set_labels.assert_called_once_with(store, catalogue)
         get_placeholders.assert_called_once_with([sentinel.label])
         self.assertTrue(log_query_plan.called)
         sql = tacl.constants.SELECT_DIFF_ASYMMETRIC_SQL.format(
-            sentinel.placeholders)
+            sentinel.placeholders) + \
+            tacl.constants.SELECT_WITNESS_SIZE_ORDER_SQL
         self.assertEqual(store._conn.mock_calls,
                          [call.execute(sql, [sentinel.prime_label,
                                              sentinel.prime_label,
                                              sentinel.label])])
-        self.assertTrue(_diff.called)
+        self.assertTrue(reduce_diff_results.called)
         self.assertEqual(input_fh, output_fh)
 
     def test_diff_asymmetric_invalid_label(self):
@@ -301,6 +569,19 @@ class DataStoreTestCase (TaclTestCase):
         self.assertRaises(MalformedQueryError, store.diff_asymmetric,
                           catalogue, 'A', tokenizer, input_fh)
 
+    def test_diff_asymmetric_all_label_mismatch(self):
+        # Tests that the right error is raised when the supplied
+        # outputs are not for the labels in the catalogue.
+        catalogue = {'T1': 'A', 'T2': 'B'}
+        store = tacl.DataStore(':memory:')
+        tokenizer = tacl.Tokenizer(*tacl.constants.TOKENIZERS['cbeta'])
+        set_labels = self._create_patch('tacl.DataStore._set_labels')
+        set_labels.return_value = {'A': 1, 'B': 1}
+        for labels in (['A'], ['A', 'B', 'C']):
+            output_fhs = {label: MagicMock(name='fh') for label in labels}
+            self.assertRaises(MalformedQueryError, store.diff_asymmetric_all,
+                              catalogue, tokenizer, output_fhs)
+
     def test_diff_one_label(self):
         catalogue = {'T1': 'A', 'T2': 'A'}
         store = tacl.DataStore(':memory:')
@@ -320,12 +601,167 @@ class DataStoreTestCase (TaclTestCase):
         self.assertRaises(MalformedQueryError, store.diff_supplied, filenames,
                           labels, tokenizer, output_fh)
 
+    def test_create_hash_partition_views(self):
+        store = tacl.DataStore(':memory:')
+        store._conn = MagicMock(spec_set=sqlite3.Connection)
+        store._conn.execute.return_value = [{'name': 'TextNGram1'},
+                                            {'name': 'TextNGram2'}]
+        store._create_hash_partition_views(4, 1)
+        sql = tacl.constants.CREATE_TEMPORARY_TEXTNGRAM_HASH_VIEW_SQL
+        self.assertEqual(
+            store._conn.execute.mock_calls,
+            [call(tacl.constants.SELECT_TEXTNGRAM_TABLES_SQL),
+             call(sql.format('TextNGram1', 4, 1)),
+             call(sql.format('TextNGram2', 4, 1))])
+
     def test_drop_indices(self):
         store = tacl.DataStore(':memory:')
         store._conn = MagicMock(spec_set=sqlite3.Connection)
         store._drop_indices()
-        store._conn.execute.assert_called_once_with(
-            tacl.constants.DROP_TEXTNGRAM_INDEX_SQL)
+        self.assertEqual(
+            store._conn.execute.mock_calls,
+            [call(tacl.constants.DROP_TEXTNGRAM_INDEX_SQL),
+             call(tacl.constants.DROP_TEXTNGRAM_COVERING_INDEX_SQL)])
+
+    def test_exceeds_batch_size(self):
+        text = MagicMock(spec_set=tacl.WitnessText)
+        text.get_content.return_value = 'abc'
+        self.assertFalse(tacl.DataStore._exceeds_batch_size(text, 3))
+        text.get_tokens.assert_not_called()
+        text.get_tokens.return_value = ['ab', 'c']
+        self.assertFalse(tacl.DataStore._exceeds_batch_size(text, 2))
+        self.assertTrue(tacl.DataStore._exceeds_batch_size(text, 1))
+        self.assertFalse(tacl.DataStore._exceeds_batch_size(text, 4, 2))
+        self.assertTrue(tacl.DataStore._exceeds_batch_size(text, 3, 2))
+
+    def test_execute_ngram_query(self):
+        get_setting = self._create_patch('tacl.DataStore._get_setting')
+        get_setting.return_value = tacl.constants.LAYOUT_HEAP
+        log_query_plan = self._create_patch('tacl.DataStore._log_query_plan',
+                                            False)
+        store = tacl.DataStore(':memory:')
+        store._conn = MagicMock(spec_set=sqlite3.Connection)
+        query = 'SELECT * FROM TextNGram WHERE TextNGram.text = ?'
+        cursor = store._execute_ngram_query(query, [sentinel.text], 2, 4)
+        sql = query + ' AND TextNGram.size >= ? AND TextNGram.size <= ?'
+        parameters = [sentinel.text, 2, 4]
+        log_query_plan.assert_called_once_with(sql, parameters)
+        store._conn.execute.assert_called_once_with(sql, parameters)
+        self.assertEqual(cursor, store._conn.execute.return_value)
+        store._conn.reset_mock()
+        store._execute_ngram_query(query, [sentinel.text])
+        store._conn.execute.assert_called_once_with(query, [sentinel.text])
+
+    def test_execute_ngram_query_partitioned(self):
+        get_setting = self._create_patch('tacl.DataStore._get_setting')
+        get_setting.return_value = tacl.constants.LAYOUT_PARTITIONED
+        get_sizes = self._create_patch('tacl.DataStore._get_sizes')
+        get_sizes.return_value = [2, 3]
+        self._create_patch('tacl.DataStore._log_query_plan', False)
+        store = tacl.DataStore(':memory:')
+        store._conn = MagicMock(spec_set=sqlite3.Connection)
+        store._conn.execute.side_effect = [iter([sentinel.row1]),
+                                           iter([sentinel.row2])]
+        query = 'SELECT * FROM TextNGram WHERE TextNGram.text = ?'
+        rows = list(store._execute_ngram_query(query, [sentinel.text], 2, 4))
+        get_sizes.assert_called_once_with(store, 2, 4)
+        self.assertEqual(rows, [sentinel.row1, sentinel.row2])
+        self.assertEqual(
+            store._conn.execute.mock_calls,
+            [call('SELECT * FROM TextNGram2 WHERE TextNGram2.text = ?',
+                  [sentinel.text]),
+             call('SELECT * FROM TextNGram3 WHERE TextNGram3.text = ?',
+                  [sentinel.text])])
+
+    def test_execute_ngram_query_ordered(self):
+        get_setting = self._create_patch('tacl.DataStore._get_setting')
+        get_setting.return_value = tacl.constants.LAYOUT_HEAP
+        self._create_patch('tacl.DataStore._log_query_plan', False)
+        store = tacl.DataStore(':memory:')
+        store._conn = MagicMock(spec_set=sqlite3.Connection)
+        query = 'SELECT * FROM TextNGram WHERE TextNGram.text = ?'
+        store._execute_ngram_query(query, [sentinel.text], maximum=4,
+                                   ordered=True)
+        sql = query + ' AND TextNGram.size <= ?' + \
+            tacl.constants.SELECT_WITNESS_SIZE_ORDER_SQL
+        store._conn.execute.assert_called_once_with(sql, [sentinel.text, 4])
+
+    def test_execute_ngram_query_partitioned_ordered(self):
+        # The rows of each partition are merged so that the rows of
+        # each witness are together, ordered by size.
+        get_setting = self._create_patch('tacl.DataStore._get_setting')
+        get_setting.return_value = tacl.constants.LAYOUT_PARTITIONED
+        get_sizes = self._create_patch('tacl.DataStore._get_sizes')
+        get_sizes.return_value = [2, 3]
+        self._create_patch('tacl.DataStore._log_query_plan', False)
+        store = tacl.DataStore(':memory:')
+        store._conn = MagicMock(spec_set=sqlite3.Connection)
+        rows2 = [('AB', 2, 'a', 'base', 1, 'A'),
+                 ('AB', 2, 'b', 'base', 1, 'B')]
+        rows3 = [('ABC', 3, 'a', 'base', 1, 'A'),
+                 ('ABC', 3, 'b', 'base', 1, 'B')]
+        store._conn.execute.side_effect = [iter(rows2), iter(rows3)]
+        query = 'SELECT * FROM TextNGram WHERE TextNGram.text = ?'
+        rows = list(store._execute_ngram_query(query, [sentinel.text],
+                                               ordered=True))
+        self.assertEqual(rows, [rows2[0], rows3[0], rows2[1], rows3[1]])
+        order_sql = (' ORDER BY LabelledText.work, LabelledText.siglum, '
+                     'TextNGram{}.size')
+        self.assertEqual(
+            store._conn.execute.mock_calls,
+            [call('SELECT * FROM TextNGram2 WHERE TextNGram2.text = ?' +
+                  order_sql.format(2), [sentinel.text]),
+             call('SELECT * FROM TextNGram3 WHERE TextNGram3.text = ?' +
+                  order_sql.format(3), [sentinel.text])])
+
+    def test_generate_witness_ngrams(self):
+        # The n-grams of every size are generated together, so a
+        # witness is left to be staged if the n-grams of all of the
+        # sizes to be generated exceed the batch size.
+        exceeds_batch_size = self._create_patch(
+            'tacl.DataStore._exceeds_batch_size', False)
+        exceeds_batch_size.return_value = True
+        corpus = MagicMock(spec_set=tacl.Corpus)
+        witness = corpus.get_witness.return_value
+        witness.get_checksum.return_value = sentinel.checksum
+        actual = tacl.data_store._generate_witness_ngrams(
+            corpus, 'T1', 'base', 1, 3, sentinel.checksum, [2],
+            sentinel.batch_size)
+        self.assertEqual(actual, (witness, None))
+        exceeds_batch_size.assert_called_once_with(
+            witness, sentinel.batch_size, 2)
+        witness.get_ngrams.assert_not_called()
+        # All sizes of a changed witness are generated.
+        exceeds_batch_size.reset_mock()
+        exceeds_batch_size.return_value = False
+        witness.get_ngrams.return_value = iter([(1, sentinel.ngrams)])
+        actual = tacl.data_store._generate_witness_ngrams(
+            corpus, 'T1', 'base', 1, 3, sentinel.old_checksum, [2],
+            sentinel.batch_size)
+        self.assertEqual(actual, (witness, [(1, sentinel.ngrams)]))
+        exceeds_batch_size.assert_called_once_with(
+            witness, sentinel.batch_size, 3)
+        witness.get_ngrams.assert_called_once_with(1, 3, [])
+
+    def test_get_database_version(self):
+        store = tacl.DataStore(':memory:')
+        self.assertEqual(store._get_database_version(),
+                         tacl.constants.DATABASE_VERSION)
+        store._conn.execute(tacl.constants.CREATE_TABLE_TEXT_SQL)
+        self.assertEqual(store._get_database_version(), 0)
+        store._initialise_database()
+        self.assertEqual(store._get_database_version(),
+                         tacl.constants.DATABASE_VERSION)
+
+    def test_get_partition_sql(self):
+        store = tacl.DataStore(':memory:')
+        sql = ('INSERT INTO TextNGram (text) SELECT TextNGram.text '
+               'FROM TextNGram, TextNGramOther')
+        self.assertEqual(store._get_partition_sql(sql, None), sql)
+        self.assertEqual(store._get_partition_sql(sql, 12),
+                         'INSERT INTO TextNGram12 (text) '
+                         'SELECT TextNGram12.text '
+                         'FROM TextNGram12, TextNGramOther')
 
     def test_get_placeholders(self):
         store = tacl.DataStore(':memory:')
@@ -334,19 +770,46 @@ class DataStoreTestCase (TaclTestCase):
             actual_placeholders = store._get_placeholders(labels)
             self.assertEqual(actual_placeholders, expected_placeholders)
 
+    def test_get_setting(self):
+        store = tacl.DataStore(':memory:')
+        store._conn = MagicMock(spec_set=sqlite3.Connection)
+        cursor = store._conn.execute.return_value
+        cursor.fetchone.return_value = {'value': sentinel.value}
+        self.assertEqual(store._get_setting(sentinel.name), sentinel.value)
+        store._conn.execute.assert_called_once_with(
+            tacl.constants.SELECT_SETTING_SQL, [sentinel.name])
+        cursor.fetchone.return_value = None
+        self.assertEqual(store._get_setting(sentinel.name), None)
+
+    def test_get_sizes(self):
+        store = tacl.DataStore(':memory:')
+        store._conn = MagicMock(spec_set=sqlite3.Connection)
+        store._conn.execute.return_value = [{'size': size} for size in
+                                            (1, 2, 3, 4)]
+        self.assertEqual(store._get_sizes(), [1, 2, 3, 4])
+        store._conn.execute.assert_called_with(
+            tacl.constants.SELECT_SIZES_SQL)
+        self.assertEqual(store._get_sizes(2), [2, 3, 4])
+        self.assertEqual(store._get_sizes(maximum=2), [1, 2])
+        self.assertEqual(store._get_sizes(2, 3), [2, 3])
+
     def test_get_text_id(self):
         add_text = self._create_patch('tacl.DataStore._add_text_record')
         add_text.return_value = sentinel.new_text_id
         update_text = self._create_patch('tacl.DataStore._update_text_record')
+        update_file_stat = self._create_patch(
+            'tacl.DataStore._update_text_file_stat')
         delete_ngrams = self._create_patch(
             'tacl.DataStore._delete_text_ngrams')
         text = MagicMock(spec_set=tacl.WitnessText)
         text.get_checksum.return_value = sentinel.checksum
+        text.get_file_stat.return_value = (sentinel.file_size,
+                                           sentinel.mtime)
         text.get_filename.return_value = sentinel.filename
         text.get_names.return_value = (sentinel.name, sentinel.siglum)
-        # There are three paths this method can take, depending on
+        # There are four paths this method can take, depending on
         # whether a record already exists for the supplied text and,
-        # if it does, whether the checksums match.
+        # if it does, whether the checksums and file stats match.
         store = tacl.DataStore(':memory:')
         store._conn = MagicMock(spec_set=sqlite3.Connection)
         cursor = store._conn.execute.return_value
@@ -368,27 +831,46 @@ class DataStoreTestCase (TaclTestCase):
         text.reset_mock()
         add_text.reset_mock()
         update_text.reset_mock()
-        cursor.fetchone.return_value = {'checksum': sentinel.checksum,
-                                        'id': sentinel.old_text_id}
+        cursor.fetchone.return_value = {
+            'checksum': sentinel.checksum, 'file_size': sentinel.file_size,
+            'id': sentinel.old_text_id, 'mtime': sentinel.mtime}
         actual_text_id = store._get_text_id(text)
         self.assertEqual(store._conn.mock_calls,
                          [call.execute(tacl.constants.SELECT_TEXT_SQL,
                                        [sentinel.name, sentinel.siglum]),
                           call.execute().fetchone()])
         self.assertEqual(text.mock_calls,
-                         [call.get_names(), call.get_checksum()])
+                         [call.get_names(), call.get_checksum(),
+                          call.get_file_stat()])
         self.assertEqual(add_text.mock_calls, [])
         self.assertEqual(update_text.mock_calls, [])
+        self.assertEqual(update_file_stat.mock_calls, [])
         self.assertEqual(delete_ngrams.mock_calls, [])
         self.assertEqual(actual_text_id, sentinel.old_text_id)
-        # Path three: there is an existing record, with a different
+        # Path three: there is an existing record, with a matching
+        # checksum but a different file stat.
+        store._conn.reset_mock()
+        text.reset_mock()
+        cursor.fetchone.return_value = {
+            'checksum': sentinel.checksum, 'file_size': None,
+            'id': sentinel.old_text_id, 'mtime': None}
+        actual_text_id = store._get_text_id(text)
+        update_file_stat.assert_called_once_with(
+            store, sentinel.old_text_id, (sentinel.file_size, sentinel.mtime))
+        self.assertEqual(add_text.mock_calls, [])
+        self.assertEqual(update_text.mock_calls, [])
+        self.assertEqual(delete_ngrams.mock_calls, [])
+        self.assertEqual(actual_text_id, sentinel.old_text_id)
+        # Path four: there is an existing record, with a different
         # checksum.
         store._conn.reset_mock()
         text.reset_mock()
         add_text.reset_mock()
         update_text.reset_mock()
-        cursor.fetchone.return_value = {'checksum': sentinel.new_checksum,
-                                        'id': sentinel.old_text_id}
+        update_file_stat.reset_mock()
+        cursor.fetchone.return_value = {
+            'checksum': sentinel.new_checksum, 'file_size': sentinel.file_size,
+            'id': sentinel.old_text_id, 'mtime': sentinel.mtime}
         actual_text_id = store._get_text_id(text)
         self.assertEqual(store._conn.mock_calls,
                          [call.execute(tacl.constants.SELECT_TEXT_SQL,
@@ -400,6 +882,7 @@ class DataStoreTestCase (TaclTestCase):
         update_text.assert_called_once_with(store, text, sentinel.old_text_id)
         delete_ngrams.assert_called_once_with(store, sentinel.old_text_id)
         self.assertEqual(add_text.mock_calls, [])
+        self.assertEqual(update_file_stat.mock_calls, [])
         self.assertEqual(actual_text_id, sentinel.old_text_id)
 
     def test_has_ngrams(self):
@@ -431,6 +914,8 @@ class DataStoreTestCase (TaclTestCase):
 
     def test_intersection(self):
         labels = [sentinel.label1, sentinel.label2]
+        check_version = self._create_patch(
+            'tacl.DataStore._check_database_version')
         set_labels = self._create_patch('tacl.DataStore._set_labels')
         set_labels.return_value = {}
         sort_labels = self._create_patch('tacl.DataStore._sort_labels', False)
@@ -444,27 +929,115 @@ class DataStoreTestCase (TaclTestCase):
         csv = self._create_patch('tacl.DataStore._csv', False)
         csv.return_value = input_fh
         catalogue = MagicMock(name='catalogue')
+        get_setting = self._create_patch('tacl.DataStore._get_setting')
+        get_setting.return_value = tacl.constants.LAYOUT_HEAP
+        prune_intersection = self._create_patch(
+            'tacl.DataStore._prune_intersection')
+        prune_intersection.return_value = True
         store = tacl.DataStore(':memory:')
         store._conn = MagicMock(spec_set=sqlite3.Connection)
         cursor = store._conn.execute.return_value
         output_fh = store.intersection(catalogue, input_fh)
+        check_version.assert_called_once_with(store)
         set_labels.assert_called_once_with(store, catalogue)
+        prune_intersection.assert_called_once_with(store, labels)
         get_placeholders.assert_called_once_with(labels)
         self.assertTrue(log_query_plan.called)
         sql = (
-            'SELECT TextNGram.ngram, TextNGram.size, Text.work, Text.siglum, '
-            'TextNGram.count, Text.label FROM Text, TextNGram '
-            'WHERE Text.label IN (sentinel.placeholders) '
-            'AND Text.id = TextNGram.text '
+            'SELECT NGram.ngram, TextNGram.size, LabelledText.work, '
+            'LabelledText.siglum, TextNGram.count, LabelledText.label '
+            'FROM LabelledText, TextNGram, NGram '
+            'WHERE LabelledText.label IN (sentinel.placeholders) '
+            'AND LabelledText.id = TextNGram.text '
+            'AND NGram.id = TextNGram.ngram '
             'AND TextNGram.ngram IN '
-            '(SELECT TextNGram.ngram FROM Text, TextNGram '
-            'WHERE Text.label = ? AND Text.id = TextNGram.text '
+            '(SELECT TextNGram.ngram FROM LabelledText, TextNGram '
+            'WHERE LabelledText.label = ? '
+            'AND LabelledText.id = TextNGram.text '
             'AND TextNGram.ngram IN (SELECT TextNGram.ngram '
-            'FROM Text, TextNGram WHERE Text.label = ? '
-            'AND Text.id = TextNGram.text))')
+            'FROM LabelledText, TextNGram WHERE LabelledText.label = ? '
+            'AND LabelledText.id = TextNGram.text))')
         self.assertEqual(store._conn.mock_calls,
                          [call.execute(sql, labels * 2)])
         csv.assert_called_once_with(cursor, tacl.constants.QUERY_FIELDNAMES,
+                                    input_fh, False)
+        self.assertEqual(input_fh, output_fh)
+
+    def test_intersection_grouped(self):
+        labels = [sentinel.label1, sentinel.label2]
+        check_version = self._create_patch(
+            'tacl.DataStore._check_database_version')
+        set_labels = self._create_patch('tacl.DataStore._set_labels')
+        set_labels.return_value = {}
+        sort_labels = self._create_patch('tacl.DataStore._sort_labels', False)
+        sort_labels.return_value = labels
+        get_placeholders = self._create_patch(
+            'tacl.DataStore._get_placeholders', False)
+        get_placeholders.return_value = sentinel.placeholders
+        log_query_plan = self._create_patch('tacl.DataStore._log_query_plan',
+                                            False)
+        input_fh = MagicMock(name='fh')
+        csv = self._create_patch('tacl.DataStore._csv', False)
+        csv.return_value = input_fh
+        catalogue = MagicMock(name='catalogue')
+        get_setting = self._create_patch('tacl.DataStore._get_setting')
+        get_setting.return_value = tacl.constants.LAYOUT_HEAP
+        prune_intersection = self._create_patch(
+            'tacl.DataStore._prune_intersection')
+        prune_intersection.return_value = True
+        store = tacl.DataStore(':memory:')
+        store._conn = MagicMock(spec_set=sqlite3.Connection)
+        cursor = store._conn.execute.return_value
+        output_fh = store.intersection(
+            catalogue, input_fh,
+            engine=tacl.constants.INTERSECT_ENGINE_GROUPED)
+        check_version.assert_called_once_with(store)
+        set_labels.assert_called_once_with(store, catalogue)
+        prune_intersection.assert_called_once_with(store, labels)
+        get_placeholders.assert_has_calls([call(labels), call(labels)])
+        self.assertTrue(log_query_plan.called)
+        sql = (
+            'SELECT NGram.ngram, TextNGram.size, LabelledText.work, '
+            'LabelledText.siglum, TextNGram.count, LabelledText.label '
+            'FROM LabelledText, TextNGram, NGram '
+            'WHERE LabelledText.label IN (sentinel.placeholders) '
+            'AND LabelledText.id = TextNGram.text '
+            'AND NGram.id = TextNGram.ngram '
+            'AND TextNGram.ngram IN '
+            '(SELECT TextNGram.ngram FROM LabelledText, TextNGram '
+            'WHERE LabelledText.id = TextNGram.text '
+            'AND LabelledText.label IN (sentinel.placeholders) '
+            'GROUP BY TextNGram.ngram '
+            'HAVING COUNT(DISTINCT LabelledText.label) = ?)')
+        self.assertEqual(store._conn.mock_calls,
+                         [call.execute(sql, labels * 2 + [2])])
+        csv.assert_called_once_with(cursor, tacl.constants.QUERY_FIELDNAMES,
+                                    input_fh, False)
+        self.assertEqual(input_fh, output_fh)
+
+    def test_intersection_pruned(self):
+        labels = [sentinel.label1, sentinel.label2]
+        self._create_patch('tacl.DataStore._check_database_version')
+        set_labels = self._create_patch('tacl.DataStore._set_labels')
+        set_labels.return_value = {}
+        sort_labels = self._create_patch('tacl.DataStore._sort_labels', False)
+        sort_labels.return_value = labels
+        prune_intersection = self._create_patch(
+            'tacl.DataStore._prune_intersection')
+        prune_intersection.return_value = False
+        add_derived_ngrams = self._create_patch(
+            'tacl.DataStore._add_derived_ngrams')
+        input_fh = MagicMock(name='fh')
+        csv = self._create_patch('tacl.DataStore._csv', False)
+        csv.return_value = input_fh
+        catalogue = MagicMock(name='catalogue')
+        store = tacl.DataStore(':memory:')
+        store._conn = MagicMock(spec_set=sqlite3.Connection)
+        output_fh = store.intersection(catalogue, input_fh)
+        prune_intersection.assert_called_once_with(store, labels)
+        add_derived_ngrams.assert_not_called()
+        store._conn.execute.assert_not_called()
+        csv.assert_called_once_with([], tacl.constants.QUERY_FIELDNAMES,
                                     input_fh)
         self.assertEqual(input_fh, output_fh)
 
@@ -488,40 +1061,66 @@ class DataStoreTestCase (TaclTestCase):
         self.assertRaises(MalformedQueryError, store.intersection_supplied,
                           filenames, labels, output_fh)
 
-    def test_check_diff_result(self):
+    def test_check_database_version(self):
+        get_version = self._create_patch(
+            'tacl.DataStore._get_database_version')
+        get_version.return_value = tacl.constants.DATABASE_VERSION
+        store = tacl.DataStore(':memory:')
+        store._check_database_version()
+        get_version.assert_called_once_with(store)
+        get_version.return_value = tacl.constants.DATABASE_VERSION - 1
+        self.assertRaises(OutdatedDataStoreError,
+                          store._check_database_version)
+
+    def test_check_diff_results(self):
         # Test the various possibilities that
         # DataStore._reduce_diff_results must handle.
-        store = tacl.DataStore(':memory:')
         tokenizer = tacl.Tokenizer(*tacl.constants.TOKENIZERS['cbeta'])
-        tokenize = tokenizer.tokenize
-        join = tokenizer.joiner.join
-        row = pd.Series(['ABC', 3, 'a', 'base', 1, 'A'],
-                        index=tacl.constants.QUERY_FIELDNAMES)
+        check = tacl.DataStore._check_diff_results
         # N-gram is not composed of any existing (n-1)-gram.
         matches = {'CD': 1}
-        actual_row = store._check_diff_result(row, matches, tokenize, join)
-        self.assertEqual(actual_row['count'], 1)
+        self.assertEqual(check(['ABC'], [1], 3, matches, tokenizer), [1])
         # N-gram is composed entirely of existing (n-1)-grams.
         matches = {'AB': 1, 'BC': 1, 'CD': 1}
-        actual_row = store._check_diff_result(row, matches, tokenize, join)
-        self.assertEqual(actual_row['count'], 1)
+        self.assertEqual(check(['ABC'], [1], 3, matches, tokenizer), [1])
         # N-gram is composed partly by existing (n-1)-grams.
         matches = {'AB': 1, 'CD': 1}
-        actual_row = store._check_diff_result(row, matches, tokenize, join)
-        self.assertEqual(actual_row['count'], 0)
+        self.assertEqual(check(['ABC'], [1], 3, matches, tokenizer), [0])
         matches = {'BC': 1, 'CD': 1}
-        actual_row = store._check_diff_result(row, matches, tokenize, join)
-        self.assertEqual(actual_row['count'], 0)
+        self.assertEqual(check(['ABC'], [1], 3, matches, tokenizer), [0])
         # N-gram is composed of one or more n-grams with count 0.
         matches = {'AB': 0, 'BC': 1, 'CD': 1}
-        actual_row = store._check_diff_result(row, matches, tokenize, join)
-        self.assertEqual(actual_row['count'], 0)
+        self.assertEqual(check(['ABC'], [1], 3, matches, tokenizer), [0])
         matches = {'AB': 1, 'BC': 0, 'CD': 1}
-        actual_row = store._check_diff_result(row, matches, tokenize, join)
-        self.assertEqual(actual_row['count'], 0)
+        self.assertEqual(check(['ABC'], [1], 3, matches, tokenizer), [0])
         matches = {'AB': 0, 'BC': 0, 'CD': 1}
-        actual_row = store._check_diff_result(row, matches, tokenize, join)
-        self.assertEqual(actual_row['count'], 0)
+        self.assertEqual(check(['ABC'], [1], 3, matches, tokenizer), [0])
+
+    def test_check_diff_results_multiple(self):
+        # The n-grams of a size are checked together, with multi-character
+        # tokens kept whole.
+        tokenizer = tacl.Tokenizer(*tacl.constants.TOKENIZERS['cbeta'])
+        matches = {'A[B]': 2, '[B]C': 1, 'CD': 0, 'DE': 1, 'EF': 1}
+        ngrams = ['A[B]C', '[B]CD', 'DEF', 'XYZ', 'EFG']
+        actual = tacl.DataStore._check_diff_results(
+            ngrams, [3, 4, 5, 6, 7], 3, matches, tokenizer)
+        self.assertEqual(actual, [3, 0, 5, 6, 0])
+        tokenizer = tacl.Tokenizer(*tacl.constants.TOKENIZERS['latin'])
+        matches = {'in the': 1, 'the beginning': 1, 'was the': 1}
+        ngrams = ['in the beginning', 'the beginning was']
+        actual = tacl.DataStore._check_diff_results(
+            ngrams, [1, 2], 3, matches, tokenizer)
+        self.assertEqual(actual, [1, 0])
+
+    def test_check_diff_results_newline_token(self):
+        # A tokenizer whose tokens may include a newline has each
+        # n-gram tokenized separately.
+        tokenizer = tacl.Tokenizer(r'.', '')
+        matches = {'AB': 1, 'BC': 1, 'YZ': 1}
+        actual = tacl.DataStore._check_diff_results(
+            ['ABC', 'ABX', 'XYZ', 'PQR'], [1, 2, 3, 4], 3, matches,
+            tokenizer)
+        self.assertEqual(actual, [1, 0, 0, 4])
 
     def test_reduce_diff_results_composed(self):
         # Consider the diff between a text "abcdefg" and
@@ -690,11 +1289,33 @@ class DataStoreTestCase (TaclTestCase):
         actual_rows = self._reduce_diff(store, input_data, tokenizer)
         self.assertEqual(set(actual_rows), set(expected_rows))
 
-    def _reduce_diff(self, store, input_data, tokenizer):
-        in_fh = self._create_csv(input_data)
+    def test_reduce_diff_minimum(self):
+        # N-grams smaller than the minimum are used in reducing the
+        # larger n-grams, but are not output.
+        store = tacl.DataStore(':memory:')
+        tokenizer = tacl.Tokenizer(*tacl.constants.TOKENIZERS['cbeta'])
+        input_data = (
+            ['ef', '2', 'a', 'base', '1', 'A'],
+            ['abd', '3', 'a', 'base', '1', 'A'],
+            ['def', '3', 'a', 'base', '1', 'A'],
+            ['abde', '4', 'a', 'base', '1', 'A'],
+            ['bdef', '4', 'a', 'base', '1', 'A'])
+        expected_rows = [
+            tacl.constants.QUERY_FIELDNAMES,
+            ('abd', '3', 'a', 'base', '1', 'A')
+        ]
+        actual_rows = self._reduce_diff(store, input_data, tokenizer, 3)
+        self.assertEqual(actual_rows, expected_rows)
+
+    def _reduce_diff(self, store, input_data, tokenizer, minimum=None):
+        # Diff results are reduced as they are read from a cursor
+        # ordered by witness and size.
+        rows = sorted([(row[0], int(row[1]), row[2], row[3], int(row[4]),
+                        row[5]) for row in input_data],
+                      key=lambda row: (row[2], row[3], row[1]))
         out_fh = io.StringIO(newline='')
         return self._get_rows_from_csv(store._reduce_diff_results(
-            in_fh, tokenizer, out_fh))
+            rows, tokenizer, out_fh, minimum))
 
     def test_set_labels(self):
         catalogue = collections.OrderedDict(
@@ -704,28 +1325,32 @@ class DataStoreTestCase (TaclTestCase):
         store = tacl.DataStore(':memory:')
         store._conn = MagicMock(spec_set=sqlite3.Connection)
         cursor = store._conn.execute.return_value
-        store._conn.execute.return_value = cursor
-        cursor.fetchone.return_value = {'token_count': 10}
+        cursor.__iter__.return_value = iter([
+            {'label': sentinel.label1, 'token_count': 20},
+            {'label': sentinel.label2, 'token_count': 10}])
         actual_labels = store._set_labels(catalogue)
         expected_labels = {sentinel.label1: 20, sentinel.label2: 10}
-        connection_calls = [
-            call.execute(tacl.constants.UPDATE_LABELS_SQL, ['']),
-            call.execute(tacl.constants.UPDATE_LABEL_SQL,
-                         [sentinel.label1, sentinel.text1]),
-            call.execute(tacl.constants.SELECT_TEXT_TOKEN_COUNT_SQL,
-                         [sentinel.text1]),
-            call.execute(tacl.constants.UPDATE_LABEL_SQL,
-                         [sentinel.label2, sentinel.text2]),
-            call.execute(tacl.constants.SELECT_TEXT_TOKEN_COUNT_SQL,
-                         [sentinel.text2]),
-            call.execute(tacl.constants.UPDATE_LABEL_SQL,
-                         [sentinel.label1, sentinel.text3]),
-            call.execute(tacl.constants.SELECT_TEXT_TOKEN_COUNT_SQL,
-                         [sentinel.text3]),
-        ]
-        for connection_call in connection_calls:
-            self.assertIn(connection_call, store._conn.mock_calls)
         self.assertEqual(actual_labels, expected_labels)
+        store._conn.executemany.assert_called_once_with(
+            tacl.constants.INSERT_TEMPORARY_CATALOGUE_SQL, catalogue.items())
+        # Only temporary tables are written to.
+        executed = [mock_call[1][0] for mock_call in
+                    store._conn.execute.mock_calls if mock_call[0] == '']
+        self.assertEqual(executed, [
+            tacl.constants.DROP_TEMPORARY_CATALOGUE_TABLE_SQL,
+            tacl.constants.DROP_TEMPORARY_LABELLED_TEXT_TABLE_SQL,
+            tacl.constants.CREATE_TEMPORARY_CATALOGUE_TABLE_SQL,
+            tacl.constants.CREATE_TEMPORARY_LABELLED_TEXT_TABLE_SQL,
+            tacl.constants.CREATE_INDEX_TEMPORARY_LABELLED_TEXT_SQL,
+            tacl.constants.INSERT_TEMPORARY_LABELLED_TEXTS_SQL,
+            tacl.constants.SELECT_TEMPORARY_LABEL_TOKEN_COUNTS_SQL])
+
+    def test_set_setting(self):
+        store = tacl.DataStore(':memory:')
+        store._conn = MagicMock(spec_set=sqlite3.Connection)
+        store._set_setting(sentinel.name, sentinel.value)
+        store._conn.execute.assert_called_once_with(
+            tacl.constants.INSERT_SETTING_SQL, [sentinel.name, sentinel.value])
 
     def test_sort_labels(self):
         store = tacl.DataStore(':memory:')
@@ -735,26 +1360,56 @@ class DataStoreTestCase (TaclTestCase):
         expected_labels = [sentinel.label2, sentinel.label1, sentinel.label3]
         self.assertEqual(actual_labels, expected_labels)
 
+    def test_update_text_file_stat(self):
+        store = tacl.DataStore(':memory:')
+        store._conn = MagicMock(spec_set=sqlite3.Connection)
+        store._update_text_file_stat(sentinel.text_id,
+                                     (sentinel.file_size, sentinel.mtime))
+        store._conn.execute.assert_called_once_with(
+            tacl.constants.UPDATE_TEXT_FILE_STAT_SQL,
+            [sentinel.file_size, sentinel.mtime, sentinel.text_id])
+
+    def test_update_text_file_stat_read_only(self):
+        store = tacl.DataStore(':memory:')
+        store._conn = MagicMock(spec_set=sqlite3.Connection)
+        store._read_only = True
+        store._update_text_file_stat(sentinel.text_id,
+                                     (sentinel.file_size, sentinel.mtime))
+        store._conn.execute.assert_not_called()
+
     def test_update_text_record(self):
         store = tacl.DataStore(':memory:')
         store._conn = MagicMock(spec_set=sqlite3.Connection)
         text = MagicMock(spec_set=tacl.WitnessText)
         text.get_checksum.return_value = sentinel.checksum
+        text.get_file_stat.return_value = (sentinel.file_size,
+                                           sentinel.mtime)
         tokens = [sentinel.token]
         text.get_tokens.return_value = tokens
         store._update_text_record(text, sentinel.text_id)
         self.assertEqual(text.mock_calls,
-                         [call.get_checksum(), call.get_tokens()])
+                         [call.get_checksum(), call.get_tokens(),
+                          call.get_file_stat()])
         store._conn.execute.assert_called_once_with(
             tacl.constants.UPDATE_TEXT_SQL,
-            [sentinel.checksum, len(tokens), sentinel.text_id])
+            [sentinel.checksum, len(tokens), sentinel.file_size,
+             sentinel.mtime, sentinel.text_id])
+
+    def test_uses_pattern_index(self):
+        uses = tacl.DataStore._uses_pattern_index
+        self.assertTrue(uses('*ABC*'))
+        self.assertTrue(uses('?AB[CD]EFG'))
+        self.assertFalse(uses('AB*'))
+        self.assertFalse(uses('ABC*D'))
+        self.assertFalse(uses('*AB*CD'))
+        self.assertFalse(uses('[AB]CD'))
 
     def test_validate_true(self):
+        validate_witness = self._create_patch(
+            'tacl.DataStore._validate_witness')
+        validate_witness.return_value = True
         corpus = MagicMock(spec_set=tacl.Corpus)
-        text = MagicMock(spec_set=tacl.WitnessText)
-        text.get_checksum.return_value = sentinel.checksum
-        text.get_names.return_value = (sentinel.name, sentinel.siglum)
-        corpus.get_witnesses.return_value = (text,)
+        corpus.get_witness_names.return_value = (('T1', 'base'),)
         catalogue = collections.OrderedDict(
             [(sentinel.text1, sentinel.label1),
              (sentinel.text2, sentinel.label2),
@@ -762,60 +1417,105 @@ class DataStoreTestCase (TaclTestCase):
         store = tacl.DataStore(':memory:')
         store._conn = MagicMock(spec_set=sqlite3.Connection)
         cursor = store._conn.execute.return_value
-        cursor.fetchone.return_value = {'checksum': sentinel.checksum}
+        cursor.fetchone.return_value = sentinel.row
         actual_result = store.validate(corpus, catalogue)
-        corpus.get_witnesses.assert_has_calls([
+        corpus.get_witness_names.assert_has_calls([
             call(sentinel.text1), call(sentinel.text2), call(sentinel.text3)])
         self.assertEqual(store._conn.mock_calls,
                          [call.execute(tacl.constants.SELECT_TEXT_SQL,
-                                       [sentinel.name, sentinel.siglum]),
+                                       ['T1', 'base']),
                           call.execute().fetchone(),
                           call.execute(tacl.constants.SELECT_TEXT_SQL,
-                                       [sentinel.name, sentinel.siglum]),
+                                       ['T1', 'base']),
                           call.execute().fetchone(),
                           call.execute(tacl.constants.SELECT_TEXT_SQL,
-                                       [sentinel.name, sentinel.siglum]),
+                                       ['T1', 'base']),
                           call.execute().fetchone()])
+        self.assertEqual(validate_witness.mock_calls,
+                         [call(store, corpus, 'T1', 'base', sentinel.row)] * 3)
         self.assertEqual(actual_result, True)
 
     def test_validate_missing_record(self):
+        validate_witness = self._create_patch(
+            'tacl.DataStore._validate_witness')
         corpus = MagicMock(spec_set=tacl.Corpus)
-        text = MagicMock(spec_set=tacl.WitnessText)
-        text.get_checksum.return_value = sentinel.checksum
-        text.get_names.return_value = (sentinel.name, sentinel.siglum)
-        corpus.get_witnesses.return_value = (text,)
+        corpus.get_witness_names.return_value = (('T1', 'base'),)
         catalogue = {sentinel.text1: sentinel.label1}
         store = tacl.DataStore(':memory:')
         store._conn = MagicMock(spec_set=sqlite3.Connection)
         cursor = store._conn.execute.return_value
         cursor.fetchone.return_value = None
         actual_result = store.validate(corpus, catalogue)
-        corpus.get_witnesses.assert_has_calls([call(sentinel.text1)])
+        corpus.get_witness_names.assert_has_calls([call(sentinel.text1)])
         self.assertEqual(store._conn.mock_calls,
                          [call.execute(tacl.constants.SELECT_TEXT_SQL,
-                                       [sentinel.name, sentinel.siglum]),
+                                       ['T1', 'base']),
                           call.execute().fetchone()])
+        validate_witness.assert_not_called()
         self.assertEqual(actual_result, False)
 
-    def test_validate_mismatched_checksums(self):
+    def test_validate_mismatched_witness(self):
+        validate_witness = self._create_patch(
+            'tacl.DataStore._validate_witness')
+        validate_witness.return_value = False
         corpus = MagicMock(spec_set=tacl.Corpus)
-        text = MagicMock(spec_set=tacl.WitnessText)
-        text.get_checksum.return_value = sentinel.checksum
-        text.get_names.return_value = (sentinel.name, sentinel.siglum)
-        corpus.get_witnesses.return_value = (text,)
+        corpus.get_witness_names.return_value = (('T1', 'base'),)
         catalogue = {sentinel.text1: sentinel.label1}
         store = tacl.DataStore(':memory:')
         store._conn = MagicMock(spec_set=sqlite3.Connection)
         cursor = store._conn.execute.return_value
-        cursor.fetchone.return_value = {'checksum': sentinel.checksum2}
+        cursor.fetchone.return_value = sentinel.row
         actual_result = store.validate(corpus, catalogue)
-        corpus.get_witnesses.assert_has_calls([call(sentinel.text1)])
-        self.assertEqual(store._conn.mock_calls,
-                         [call.execute(tacl.constants.SELECT_TEXT_SQL,
-                                       [sentinel.name, sentinel.siglum]),
-                          call.execute().fetchone()])
+        validate_witness.assert_called_once_with(
+            store, corpus, 'T1', 'base', sentinel.row)
         self.assertEqual(actual_result, False)
 
+    def test_validate_witness_matching_file_stat(self):
+        update_file_stat = self._create_patch(
+            'tacl.DataStore._update_text_file_stat')
+        corpus = MagicMock(spec_set=tacl.Corpus)
+        corpus.get_witness_file_stat.return_value = (12, 1000)
+        row = {'checksum': sentinel.checksum, 'file_size': 12,
+               'id': sentinel.text_id, 'mtime': 1000}
+        store = tacl.DataStore(':memory:')
+        actual_result = store._validate_witness(corpus, 'T1', 'base', row)
+        corpus.get_witness_file_stat.assert_called_once_with('T1', 'base')
+        # The file is not read when its stat matches.
+        corpus.get_witness.assert_not_called()
+        update_file_stat.assert_not_called()
+        self.assertEqual(actual_result, True)
+
+    def test_validate_witness_matching_checksums(self):
+        update_file_stat = self._create_patch(
+            'tacl.DataStore._update_text_file_stat')
+        corpus = MagicMock(spec_set=tacl.Corpus)
+        corpus.get_witness_file_stat.return_value = (12, 2000)
+        text = corpus.get_witness.return_value
+        text.get_checksum.return_value = sentinel.checksum
+        text.get_file_stat.return_value = (12, 2000)
+        row = {'checksum': sentinel.checksum, 'file_size': 12,
+               'id': sentinel.text_id, 'mtime': 1000}
+        store = tacl.DataStore(':memory:')
+        actual_result = store._validate_witness(corpus, 'T1', 'base', row)
+        corpus.get_witness.assert_called_once_with('T1', 'base')
+        update_file_stat.assert_called_once_with(store, sentinel.text_id,
+                                                 (12, 2000))
+        self.assertEqual(actual_result, True)
+
+    def test_validate_witness_mismatched_checksums(self):
+        update_file_stat = self._create_patch(
+            'tacl.DataStore._update_text_file_stat')
+        corpus = MagicMock(spec_set=tacl.Corpus)
+        corpus.get_witness_file_stat.return_value = (13, 2000)
+        text = corpus.get_witness.return_value
+        text.get_checksum.return_value = sentinel.checksum2
+        row = {'checksum': sentinel.checksum, 'file_size': 12,
+               'id': sentinel.text_id, 'mtime': 1000}
+        store = tacl.DataStore(':memory:')
+        actual_result = store._validate_witness(corpus, 'T1', 'base', row)
+        corpus.get_witness.assert_called_once_with('T1', 'base')
+        update_file_stat.assert_not_called()
+        self.assertEqual(actual_result, False)
 
 if __name__ == '__main__':
     unittest.main()
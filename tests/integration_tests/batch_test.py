@@ -0,0 +1,70 @@
+import io
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import tacl
+from ..tacl_test_case import TaclTestCase
+
+
+class BatchQueryRunnerIntegrationTestCase (TaclTestCase):
+
+    def setUp(self):
+        self._tokenizer = tacl.Tokenizer(
+            tacl.constants.TOKENIZER_PATTERN_CBETA,
+            tacl.constants.TOKENIZER_JOINER_CBETA)
+        self._data_dir = os.path.join(os.path.dirname(__file__), 'data')
+        self._corpus = tacl.Corpus(os.path.join(self._data_dir, 'stripped'),
+                                   self._tokenizer)
+        self._catalogue_path = os.path.join(self._data_dir, 'catalogue.txt')
+        self._catalogue = tacl.Catalogue()
+        self._catalogue.load(self._catalogue_path)
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+        self._db_name = os.path.join(self._dir, 'test.db')
+        store = tacl.DataStore(self._db_name, False)
+        store.add_ngrams(self._corpus, 1, 3)
+        self._expected = {
+            'counts': self._get_rows_from_csv(store.counts(
+                self._catalogue, io.StringIO(newline=''))),
+            'diff': self._get_rows_from_csv(store.diff(
+                self._catalogue, self._tokenizer, io.StringIO(newline=''))),
+            'intersect': self._get_rows_from_csv(store.intersection(
+                self._catalogue, io.StringIO(newline=''), 2)),
+        }
+        store._conn.close()
+        self._manifest_path = os.path.join(self._dir, 'manifest.json')
+        with open(self._manifest_path, 'w', encoding='utf-8') as fh:
+            json.dump([
+                {'type': 'counts', 'catalogue': self._catalogue_path,
+                 'output': 'counts.csv'},
+                {'type': 'diff', 'catalogue': self._catalogue_path,
+                 'output': 'diff.csv'},
+                {'type': 'intersect', 'catalogue': self._catalogue_path,
+                 'output': 'intersect.csv', 'min_size': 2}], fh)
+
+    def _check_outputs(self):
+        for name, expected_rows in self._expected.items():
+            path = os.path.join(self._dir, '{}.csv'.format(name))
+            with open(path, encoding='utf-8', newline='') as fh:
+                actual_rows = self._get_rows_from_csv(fh)
+            self.assertEqual(set(actual_rows), set(expected_rows))
+
+    def test_run(self):
+        store = tacl.DataStore(self._db_name, False)
+        runner = tacl.BatchQueryRunner(store, self._corpus, self._tokenizer)
+        runner.run(runner.load(self._manifest_path))
+        self._check_outputs()
+
+    def test_run_jobs(self):
+        store = tacl.DataStore(self._db_name, False, read_only=True)
+        runner = tacl.BatchQueryRunner(store, self._corpus, self._tokenizer)
+        runner.run(runner.load(self._manifest_path), jobs=2)
+        self._check_outputs()
+
+
+if __name__ == '__main__':
+    unittest.main()
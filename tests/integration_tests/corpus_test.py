@@ -28,6 +28,14 @@ class CorpusIntegrationTestCase (unittest.TestCase):
                          expected_text.get_checksum())
         self.assertEqual(actual_text.get_filename(),
                          expected_text.get_filename())
+        self.assertEqual(actual_text.get_file_stat(),
+                         corpus.get_witness_file_stat('T1', 'base'))
+
+    def test_get_witness_file_stat(self):
+        corpus = tacl.Corpus(self._data_dir, self._tokenizer)
+        stat = os.stat(os.path.join(self._data_dir, 'T1', 'base.txt'))
+        self.assertEqual(corpus.get_witness_file_stat('T1', 'base'),
+                         (stat.st_size, stat.st_mtime_ns))
 
     def test_get_witnesses(self):
         corpus = tacl.Corpus(self._data_dir, self._tokenizer)
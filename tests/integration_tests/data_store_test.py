@@ -1,9 +1,18 @@
+import fnmatch
+import importlib.util
 import io
+import json
+import os
 import os.path
+import shutil
+import sqlite3
+import tempfile
 import unittest
+from unittest.mock import MagicMock, patch
 
 import tacl
-from tacl.exceptions import MalformedQueryError
+from tacl.exceptions import MalformedQueryError, OutdatedDataStoreError, \
+    TACLError
 from ..tacl_test_case import TaclTestCase
 
 
@@ -25,8 +34,9 @@ class DataStoreIntegrationTestCase (TaclTestCase):
         self._store._conn.row_factory = None
         actual_rows = self._store._conn.execute(
             'SELECT Text.work, Text.siglum, Text.checksum, Text.label, '
-            'TextNGram.ngram, TextNGram.size, TextNGram.count '
-            'FROM Text, TextNGram WHERE Text.id = TextNGram.text').fetchall()
+            'NGram.ngram, TextNGram.size, TextNGram.count '
+            'FROM Text, TextNGram, NGram WHERE Text.id = TextNGram.text '
+            'AND NGram.id = TextNGram.ngram').fetchall()
         expected_rows = [
             ('T1', 'base', '705c89d665a5300516fe7314f84ebce0', '', 't', 1, 2),
             ('T1', 'base', '705c89d665a5300516fe7314f84ebce0', '', 'h', 1, 1),
@@ -152,6 +162,321 @@ class DataStoreIntegrationTestCase (TaclTestCase):
             ]
         self.assertEqual(set(actual_rows), set(expected_rows))
 
+    def test_add_ngrams_parallel(self):
+        queries = ('SELECT * FROM Text ORDER BY id',
+                   'SELECT * FROM TextHasNGram ORDER BY rowid',
+                   'SELECT * FROM TextNGram ORDER BY rowid')
+        expected_store = tacl.DataStore(':memory:')
+        expected_store.add_ngrams(self._corpus, 1, 3)
+        actual_store = tacl.DataStore(':memory:')
+        actual_store.add_ngrams(self._corpus, 1, 2, jobs=2)
+        # Rerunning with a larger range must only add the new sizes.
+        actual_store.add_ngrams(self._corpus, 1, 3, jobs=2)
+        serial_store = tacl.DataStore(':memory:')
+        serial_store.add_ngrams(self._corpus, 1, 2)
+        serial_store.add_ngrams(self._corpus, 1, 3)
+        for query in queries:
+            expected_rows = [tuple(row) for row in
+                             serial_store._conn.execute(query)]
+            actual_rows = [tuple(row) for row in
+                           actual_store._conn.execute(query)]
+            self.assertEqual(actual_rows, expected_rows)
+        fresh_store = tacl.DataStore(':memory:')
+        fresh_store.add_ngrams(self._corpus, 1, 3, jobs=3)
+        for query in queries:
+            expected_rows = [tuple(row) for row in
+                             expected_store._conn.execute(query)]
+            actual_rows = [tuple(row) for row in
+                           fresh_store._conn.execute(query)]
+            self.assertEqual(actual_rows, expected_rows)
+
+    def test_add_ngrams_staged(self):
+        # Staging the n-grams of every witness must result in the same
+        # database, whether the batches are smaller or larger than the
+        # number of sizes.
+        queries = ('SELECT * FROM Text ORDER BY id',
+                   'SELECT * FROM NGram ORDER BY id',
+                   'SELECT * FROM TextHasNGram ORDER BY rowid',
+                   'SELECT * FROM TextNGram ORDER BY rowid')
+        for batch_size, jobs in ((1, 1), (5, 1), (5, 2)):
+            store = tacl.DataStore(':memory:')
+            store.add_ngrams(self._corpus, 1, 2, jobs=jobs,
+                             batch_size=batch_size)
+            store.add_ngrams(self._corpus, 1, 3, jobs=jobs,
+                             batch_size=batch_size)
+            expected_store = tacl.DataStore(':memory:')
+            expected_store.add_ngrams(self._corpus, 1, 2)
+            expected_store.add_ngrams(self._corpus, 1, 3)
+            for query in queries:
+                expected_rows = [tuple(row) for row in
+                                 expected_store._conn.execute(query)]
+                actual_rows = [tuple(row) for row in
+                               store._conn.execute(query)]
+                self.assertEqual(actual_rows, expected_rows)
+
+    def test_add_ngrams_layouts(self):
+        tokenizer = tacl.Tokenizer(tacl.constants.TOKENIZER_PATTERN_CBETA,
+                                   tacl.constants.TOKENIZER_JOINER_CBETA)
+        queries = (
+            lambda store: store.counts(self._catalogue,
+                                       io.StringIO(newline='')),
+            lambda store: store.diff(self._catalogue, tokenizer,
+                                     io.StringIO(newline='')),
+            lambda store: store.intersection(self._catalogue,
+                                             io.StringIO(newline='')),
+            lambda store: store.search(self._catalogue, ['the', 'we'],
+                                       io.StringIO(newline='')))
+        for layout in tacl.constants.LAYOUT_CHOICES:
+            store = tacl.DataStore(':memory:')
+            store.add_ngrams(self._corpus, 1, 2, layout=layout)
+            # The layout of an existing database is kept.
+            store.add_ngrams(self._corpus, 1, 3,
+                             layout=tacl.constants.LAYOUT_HEAP)
+            self.assertEqual(
+                store._get_setting(tacl.constants.LAYOUT_SETTING), layout)
+            table_names = [row['name'] for row in store._conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' "
+                "AND name LIKE 'TextNGram%' ORDER BY name")]
+            if layout == tacl.constants.LAYOUT_PARTITIONED:
+                self.assertEqual(table_names, ['TextNGram1', 'TextNGram2',
+                                               'TextNGram3'])
+            else:
+                self.assertEqual(table_names, ['TextNGram'])
+                table_sql = store._conn.execute(
+                    "SELECT sql FROM sqlite_master WHERE name = 'TextNGram'"
+                ).fetchone()['sql']
+                self.assertEqual('WITHOUT ROWID' in table_sql,
+                                 layout == tacl.constants.LAYOUT_CLUSTERED)
+            for query in queries:
+                expected_rows = self._get_rows_from_csv(query(self._store))
+                actual_rows = self._get_rows_from_csv(query(store))
+                self.assertEqual(set(actual_rows), set(expected_rows))
+
+    def test_add_ngrams_suffix_index(self):
+        tokenizer = tacl.Tokenizer(tacl.constants.TOKENIZER_PATTERN_CBETA,
+                                   tacl.constants.TOKENIZER_JOINER_CBETA)
+        queries = (
+            lambda store, *sizes: store.diff(
+                self._catalogue, tokenizer, io.StringIO(newline=''), *sizes),
+            lambda store, *sizes: store.diff_asymmetric(
+                self._catalogue, 'A', tokenizer, io.StringIO(newline=''),
+                *sizes),
+            lambda store, *sizes: store.intersection(
+                self._catalogue, io.StringIO(newline=''), *sizes),
+            lambda store, *sizes: store.search(
+                self._catalogue, ['t', 'the', 'we'], io.StringIO(newline=''),
+                *sizes))
+        store = tacl.DataStore(':memory:')
+        store.add_ngrams(self._corpus, 2, 3,
+                         index=tacl.constants.INDEX_SUFFIX)
+        store.add_ngrams(self._corpus, 1, 2)
+        table_names = [row['name'] for row in store._conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")]
+        self.assertNotIn('TextNGram', table_names)
+        self.assertNotIn('NGram', table_names)
+        self.assertIn('TextSuffixArray', table_names)
+        # The default sizes are those of the n-grams in self._store.
+        for query in queries + (lambda store: store.counts(
+                self._catalogue, io.StringIO(newline='')),):
+            expected_rows = self._get_rows_from_csv(query(self._store))
+            actual_rows = self._get_rows_from_csv(query(store))
+            self.assertEqual(actual_rows[0], expected_rows[0])
+            self.assertEqual(sorted(actual_rows), sorted(expected_rows))
+        # Sizes outside of those given to add_ngrams can be queried.
+        expected_store = tacl.DataStore(':memory:')
+        expected_store.add_ngrams(self._corpus, 1, 5)
+        for query in queries:
+            expected_rows = self._get_rows_from_csv(
+                query(expected_store, 2, 5))
+            actual_rows = self._get_rows_from_csv(query(store, 2, 5))
+            self.assertEqual(sorted(actual_rows), sorted(expected_rows))
+
+    def test_add_ngrams_suffix_index_derived(self):
+        store = tacl.DataStore(':memory:')
+        store.add_ngrams(self._corpus, 1, 3,
+                         index=tacl.constants.INDEX_SUFFIX)
+        catalogue = tacl.Catalogue(
+            {work: label for work, label in self._catalogue.items()
+             if label != 'C'})
+        queries = (
+            lambda store: store.search(
+                self._catalogue, ['th', 'the', 'we'],
+                io.StringIO(newline='')),
+            lambda store: store.intersection(
+                self._catalogue, io.StringIO(newline='')),
+            lambda store: store.intersection(
+                self._catalogue, io.StringIO(newline='')),
+            lambda store: store.intersection(
+                catalogue, io.StringIO(newline='')))
+        # The sizes of the n-grams derived by each query: only those
+        # of the n-grams searched for, then only the missing size,
+        # then none, as the derived n-grams are kept; and then every
+        # size, since a query on fewer witnesses rebuilds the tables.
+        expected_sizes = ({2, 3}, {1}, set(), {1, 2, 3})
+        for query, sizes in zip(queries, expected_sizes):
+            with patch.object(
+                    tacl.DataStore, '_add_text_size_ngrams', autospec=True,
+                    side_effect=tacl.DataStore._add_text_size_ngrams) \
+                    as derive:
+                actual_rows = self._get_rows_from_csv(query(store))
+            expected_rows = self._get_rows_from_csv(query(self._store))
+            self.assertEqual(sorted(actual_rows), sorted(expected_rows))
+            self.assertEqual({args[2] for args, kwargs in
+                              derive.call_args_list}, sizes)
+        labelled_texts = {row['id'] for row in store._conn.execute(
+            'SELECT id FROM temp.LabelledText')}
+        derived_texts = {row['text'] for row in store._conn.execute(
+            'SELECT DISTINCT text FROM temp.TextNGram')}
+        self.assertEqual(derived_texts, labelled_texts)
+
+    def test_label_cache(self):
+        corpus_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, corpus_dir)
+        corpus_dir = os.path.join(corpus_dir, 'stripped')
+        shutil.copytree(os.path.join(self._data_dir, 'stripped'), corpus_dir)
+        corpus = tacl.Corpus(corpus_dir, self._tokenizer)
+        store = tacl.DataStore(':memory:', cache=True)
+        store.add_ngrams(corpus, 1, 3)
+        queries = (
+            lambda store: store.diff(
+                self._catalogue, self._tokenizer, io.StringIO(newline='')),
+            lambda store: store.diff_asymmetric(
+                self._catalogue, 'A', self._tokenizer,
+                io.StringIO(newline='')),
+            lambda store: store.intersection(
+                self._catalogue, io.StringIO(newline='')),
+            lambda store: store.intersection(
+                self._catalogue, io.StringIO(newline=''),
+                engine=tacl.constants.INTERSECT_ENGINE_GROUPED))
+        count_sql = 'SELECT COUNT(*) FROM LabelNGramSet'
+        for query in queries:
+            expected_rows = self._get_rows_from_csv(query(self._store))
+            actual_rows = self._get_rows_from_csv(query(store))
+            self.assertEqual(set(actual_rows), set(expected_rows))
+            # Each query uses the cached n-grams of the same labels.
+            self.assertEqual(store._conn.execute(count_sql).fetchone()[0],
+                             3)
+        # Changing a witness discards the cached n-grams of its label.
+        with open(os.path.join(corpus_dir, 'T1', 'base.txt'), 'w',
+                  encoding='utf-8') as fh:
+            fh.write('then we sent\n')
+        store.add_ngrams(corpus, 1, 3)
+        self.assertEqual(store._conn.execute(count_sql).fetchone()[0], 2)
+        expected_store = tacl.DataStore(':memory:')
+        expected_store.add_ngrams(corpus, 1, 3)
+        for query in queries:
+            expected_rows = self._get_rows_from_csv(query(expected_store))
+            actual_rows = self._get_rows_from_csv(query(store))
+            self.assertEqual(set(actual_rows), set(expected_rows))
+
+    def test_label_counts(self):
+        # Label counts added by the query are the same as those added
+        # to the results.
+        supplied_dir = os.path.join(self._data_dir, 'supplied_input')
+        queries = (
+            lambda store, **options: store.diff(
+                self._catalogue, self._tokenizer, io.StringIO(newline=''),
+                **options),
+            lambda store, **options: store.diff_asymmetric(
+                self._catalogue, 'A', self._tokenizer,
+                io.StringIO(newline=''), **options),
+            lambda store, **options: store.intersection(
+                self._catalogue, io.StringIO(newline=''), **options),
+            lambda store, **options: store.search(
+                self._catalogue, ['t', 'th', 'the', 'we', 'wen'],
+                io.StringIO(newline=''), **options),
+            lambda store, **options: store.diff_supplied(
+                [os.path.join(supplied_dir, 'diff_input_{}.csv'.format(
+                    number)) for number in (1, 2, 3)],
+                ['A', 'B', 'C'], self._tokenizer, io.StringIO(newline=''),
+                **options),
+            lambda store, **options: store.intersection_supplied(
+                [os.path.join(supplied_dir, 'intersect_input_{}.csv'.format(
+                    number)) for number in (1, 2, 3)],
+                ['A', 'B', 'C'], io.StringIO(newline=''), **options))
+        all_options = (
+            {'label_count': True}, {'label_work_count': True},
+            {'label_count': True, 'label_work_count': True},
+            {'label_count': True, 'label_work_count': True, 'min_works': 2})
+        partitioned_store = tacl.DataStore(':memory:')
+        partitioned_store.add_ngrams(
+            self._corpus, 1, 3, layout=tacl.constants.LAYOUT_PARTITIONED)
+        for query in queries:
+            for options in all_options:
+                output = query(self._store,
+                               min_works=options.get('min_works'))
+                output.seek(0)
+                results = tacl.Results(output, self._tokenizer)
+                if options.get('label_count'):
+                    results.add_label_count()
+                if options.get('label_work_count'):
+                    results.add_label_work_count()
+                expected_rows = self._get_rows_from_results(results)
+                for store in (self._store, partitioned_store):
+                    actual_rows = self._get_rows_from_csv(
+                        query(store, **options))
+                    self.assertEqual(actual_rows[0], expected_rows[0])
+                    self.assertEqual(sorted(actual_rows[1:]),
+                                     sorted(expected_rows[1:]))
+
+    def test_profile(self):
+        self.assertIsNone(self._store.get_profile())
+        store = tacl.DataStore(':memory:', profile=True)
+        store.add_ngrams(self._corpus, 1, 3)
+        self.assertTrue(store.validate(self._corpus, self._catalogue))
+        intersect_rows = self._get_rows_from_csv(store.intersection(
+            self._catalogue, io.StringIO(newline='')))
+        diff_rows = self._get_rows_from_csv(store.diff(
+            self._catalogue, self._tokenizer, io.StringIO(newline='')))
+        supplied_dir = os.path.join(self._data_dir, 'supplied_input')
+        results = [os.path.join(supplied_dir, 'diff_input_1.csv'),
+                   os.path.join(supplied_dir, 'diff_input_2.csv')]
+        store.diff_supplied(results, ['A', 'B'], self._tokenizer,
+                            io.StringIO(newline=''))
+        profile = store.get_profile()
+        self.assertEqual(
+            [phase['name'] for phase in profile['phases']],
+            ['validate', 'labels', 'query', 'output', 'labels', 'query',
+             'reduce', 'results', 'query', 'reduce'])
+        self.assertEqual(profile['phases'][3]['rows'],
+                         len(intersect_rows) - 1)
+        self.assertEqual(profile['phases'][6]['rows'], len(diff_rows) - 1)
+        self.assertEqual(len(profile['query_plans']), 3)
+        self.assertGreater(profile['peak_rss'], 0)
+        # The profile can be written as JSON.
+        json.dumps(profile)
+
+    def test_query_sizes(self):
+        tokenizer = tacl.Tokenizer(tacl.constants.TOKENIZER_PATTERN_CBETA,
+                                   tacl.constants.TOKENIZER_JOINER_CBETA)
+        queries = (
+            lambda store, *sizes: store.diff(
+                self._catalogue, tokenizer, io.StringIO(newline=''), *sizes),
+            lambda store, *sizes: store.diff_asymmetric(
+                self._catalogue, 'A', tokenizer, io.StringIO(newline=''),
+                *sizes),
+            lambda store, *sizes: store.intersection(
+                self._catalogue, io.StringIO(newline=''), *sizes),
+            lambda store, *sizes: store.search(
+                self._catalogue, ['t', 'the', 'we'], io.StringIO(newline=''),
+                *sizes))
+        for layout in (tacl.constants.LAYOUT_HEAP,
+                       tacl.constants.LAYOUT_PARTITIONED):
+            store = tacl.DataStore(':memory:')
+            store.add_ngrams(self._corpus, 1, 3, layout=layout)
+            for query in queries:
+                all_rows = self._get_rows_from_csv(query(self._store))
+                for minimum, maximum in ((2, None), (None, 2), (2, 3)):
+                    expected_rows = [
+                        row for row in all_rows[1:]
+                        if (minimum is None or int(row[1]) >= minimum) and
+                        (maximum is None or int(row[1]) <= maximum)]
+                    actual_rows = self._get_rows_from_csv(
+                        query(store, minimum, maximum))
+                    self.assertEqual(actual_rows[0], all_rows[0])
+                    self.assertEqual(set(actual_rows[1:]), set(expected_rows))
+                    self.assertEqual(len(actual_rows) - 1, len(expected_rows))
+
     def test_counts(self):
         actual_rows = self._get_rows_from_csv(self._store.counts(
                 self._catalogue, io.StringIO(newline='')))
@@ -215,6 +540,35 @@ class DataStoreIntegrationTestCase (TaclTestCase):
         ]
         self.assertEqual(set(actual_rows), set(expected_rows))
 
+    def test_diff_asymmetric_all(self):
+        # The results for each label are those of an asymmetric diff
+        # for that label.
+        partitioned_store = tacl.DataStore(':memory:')
+        partitioned_store.add_ngrams(
+            self._corpus, 1, 3, layout=tacl.constants.LAYOUT_PARTITIONED)
+        all_options = ({}, {'sort': True}, {'minimum': 2},
+                       {'label_count': True, 'label_work_count': True},
+                       {'min_works': 2, 'sort': True})
+        for store in (self._store, partitioned_store):
+            for options in all_options:
+                output_fhs = {label: io.StringIO(newline='')
+                              for label in self._catalogue.labels}
+                store.diff_asymmetric_all(self._catalogue, self._tokenizer,
+                                          output_fhs, **options)
+                for label, output_fh in output_fhs.items():
+                    expected_rows = self._get_rows_from_csv(
+                        store.diff_asymmetric(
+                            self._catalogue, label, self._tokenizer,
+                            io.StringIO(newline=''), **options))
+                    actual_rows = self._get_rows_from_csv(output_fh)
+                    if not options.get('sort'):
+                        # Only sorted results have a defined order.
+                        expected_rows = [expected_rows[0]] + sorted(
+                            expected_rows[1:])
+                        actual_rows = [actual_rows[0]] + sorted(
+                            actual_rows[1:])
+                    self.assertEqual(actual_rows, expected_rows)
+
     def test_diff_supplied(self):
         tokenizer = tacl.Tokenizer(*tacl.constants.TOKENIZERS['cbeta'])
         supplied_dir = os.path.join(self._data_dir, 'supplied_input')
@@ -274,6 +628,39 @@ class DataStoreIntegrationTestCase (TaclTestCase):
             ('th', '2', 'T2', 'a', '1', 'B'),
             ('th', '2', 'T3', 'base', '1', 'C')]
         self.assertEqual(set(actual_rows), set(expected_rows))
+        actual_rows = self._get_rows_from_csv(self._store.intersection(
+            self._catalogue, io.StringIO(newline=''),
+            engine=tacl.constants.INTERSECT_ENGINE_GROUPED))
+        self.assertEqual(set(actual_rows), set(expected_rows))
+
+    def test_intersection_pruned(self):
+        corpus_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, corpus_dir)
+        corpus_dir = os.path.join(corpus_dir, 'stripped')
+        shutil.copytree(os.path.join(self._data_dir, 'stripped'), corpus_dir)
+        os.mkdir(os.path.join(corpus_dir, 'T6'))
+        with open(os.path.join(corpus_dir, 'T6', 'base.txt'), 'w',
+                  encoding='utf-8') as fh:
+            fh.write('xyz\n')
+        corpus = tacl.Corpus(corpus_dir, self._tokenizer)
+        store = tacl.DataStore(':memory:')
+        store.add_ngrams(corpus, 1, 3)
+        self.assertEqual(
+            store._conn.execute(
+                'SELECT COUNT(*) FROM TextSketch').fetchone()[0], 8)
+        expected_rows = self._get_rows_from_csv(self._store.intersection(
+            self._catalogue, io.StringIO(newline='')))
+        # T6 shares no n-grams with any other work, so is not queried.
+        self._catalogue['T6'] = 'A'
+        actual_rows = self._get_rows_from_csv(store.intersection(
+            self._catalogue, io.StringIO(newline='')))
+        self.assertEqual(set(actual_rows), set(expected_rows))
+        self.assertEqual(store._conn.execute(
+            "SELECT label FROM Text WHERE work = 'T6'").fetchone()[0], '')
+        catalogue = tacl.Catalogue({'T1': 'A', 'T6': 'B'})
+        actual_rows = self._get_rows_from_csv(store.intersection(
+            catalogue, io.StringIO(newline='')))
+        self.assertEqual(actual_rows, [tuple(tacl.constants.QUERY_FIELDNAMES)])
 
     def test_intersection_supplied(self):
         supplied_dir = os.path.join(self._data_dir, 'supplied_input')
@@ -309,6 +696,260 @@ class DataStoreIntegrationTestCase (TaclTestCase):
             MalformedQueryError, self._store.intersection_supplied,
             results, labels, io.StringIO(newline=''))
 
+    def test_ngram_limits(self):
+        # Limiting the works and total count of the n-grams in the
+        # query gives the same results as pruning the results.
+        supplied_dir = os.path.join(self._data_dir, 'supplied_input')
+        queries = (
+            lambda store, **limits: store.diff(
+                self._catalogue, self._tokenizer, io.StringIO(newline=''),
+                **limits),
+            lambda store, **limits: store.diff_asymmetric(
+                self._catalogue, 'A', self._tokenizer,
+                io.StringIO(newline=''), **limits),
+            lambda store, **limits: store.intersection(
+                self._catalogue, io.StringIO(newline=''), **limits),
+            lambda store, **limits: store.search(
+                self._catalogue, ['t', 'th', 'the', 'we', 'wen'],
+                io.StringIO(newline=''), **limits),
+            lambda store, **limits: store.diff_supplied(
+                [os.path.join(supplied_dir, 'diff_input_{}.csv'.format(
+                    number)) for number in (1, 2, 3)],
+                ['A', 'B', 'C'], self._tokenizer, io.StringIO(newline=''),
+                **limits),
+            lambda store, **limits: store.intersection_supplied(
+                [os.path.join(supplied_dir, 'intersect_input_{}.csv'.format(
+                    number)) for number in (1, 2, 3)],
+                ['A', 'B', 'C'], io.StringIO(newline=''), **limits))
+        all_limits = (
+            {'min_works': 2}, {'max_works': 1}, {'min_count': 4},
+            {'max_count': 2}, {'min_works': 2, 'max_works': 3,
+                               'min_count': 3, 'max_count': 8})
+        partitioned_store = tacl.DataStore(':memory:')
+        partitioned_store.add_ngrams(
+            self._corpus, 1, 3, layout=tacl.constants.LAYOUT_PARTITIONED)
+        for query in queries:
+            for limits in all_limits:
+                output = query(self._store)
+                output.seek(0)
+                results = tacl.Results(output, self._tokenizer)
+                results.prune_by_work_count(limits.get('min_works'),
+                                            limits.get('max_works'))
+                results.prune_by_ngram_count(limits.get('min_count'),
+                                             limits.get('max_count'))
+                expected_rows = self._get_rows_from_results(results)
+                for store in (self._store, partitioned_store):
+                    actual_rows = self._get_rows_from_csv(
+                        query(store, **limits))
+                    self.assertEqual(sorted(actual_rows),
+                                     sorted(expected_rows))
+
+    def test_ngram_stats_pending(self):
+        # N-grams are not limited by statistics that undercount them,
+        # as when add_ngrams is interrupted before updating them.
+        catalogue = tacl.Catalogue({'T1': 'A', 'T2': 'B'})
+        store = tacl.DataStore(':memory:')
+        store.add_ngrams(self._corpus, 1, 3,
+                         catalogue=tacl.Catalogue({'T1': 'A'}))
+        with patch.object(tacl.DataStore, '_update_ngram_stats'):
+            store.add_ngrams(self._corpus, 1, 3, catalogue=catalogue)
+        expected_rows = self._get_rows_from_csv(self._store.intersection(
+            catalogue, io.StringIO(newline=''), min_works=2))
+        self.assertGreater(len(expected_rows), 1)
+        actual_rows = self._get_rows_from_csv(store.intersection(
+            catalogue, io.StringIO(newline=''), min_works=2))
+        self.assertEqual(sorted(actual_rows), sorted(expected_rows))
+
+    def test_ngram_stats(self):
+        def get_expected_rows(store):
+            stats = {}
+            for row in store._conn.execute(
+                    'SELECT NGram.ngram, NGram.size, Text.work, '
+                    'TextNGram.count FROM Text, TextNGram, NGram '
+                    'WHERE Text.id = TextNGram.text '
+                    'AND NGram.id = TextNGram.ngram'):
+                works, witnesses, count = stats.setdefault(
+                    (row['ngram'], row['size']), (set(), 0, 0))
+                works.add(row['work'])
+                stats[(row['ngram'], row['size'])] = (
+                    works, witnesses + 1, count + row['count'])
+            return sorted(
+                (ngram, str(size), str(len(works)), str(witnesses),
+                 str(count))
+                for (ngram, size), (works, witnesses, count)
+                in stats.items())
+
+        def get_actual_rows(store, *sizes):
+            return sorted(self._get_rows_from_csv(store.ngram_stats(
+                io.StringIO(newline=''), *sizes))[1:])
+
+        expected_rows = get_expected_rows(self._store)
+        self.assertEqual(get_actual_rows(self._store), expected_rows)
+        self.assertEqual(
+            get_actual_rows(self._store, 2, 2),
+            [row for row in expected_rows if row[1] == '2'])
+        # The statistics are updated as n-grams of further sizes are
+        # added, however they are added.
+        for layout in tacl.constants.LAYOUT_CHOICES:
+            for batch_size, jobs in ((1, 1), (5, 2),
+                                     (tacl.constants.NGRAMS_BATCH_SIZE, 1)):
+                store = tacl.DataStore(':memory:')
+                store.add_ngrams(self._corpus, 2, 2, jobs=jobs,
+                                 batch_size=batch_size, layout=layout)
+                store.add_ngrams(self._corpus, 1, 3, jobs=jobs,
+                                 batch_size=batch_size)
+                self.assertEqual(get_actual_rows(store), expected_rows)
+        # Changing a witness replaces its n-grams in the statistics.
+        corpus_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, corpus_dir)
+        corpus_dir = os.path.join(corpus_dir, 'stripped')
+        shutil.copytree(os.path.join(self._data_dir, 'stripped'), corpus_dir)
+        corpus = tacl.Corpus(corpus_dir, self._tokenizer)
+        with open(os.path.join(corpus_dir, 'T1', 'base.txt'), 'w',
+                  encoding='utf-8') as fh:
+            fh.write('then we sent\n')
+        for layout in tacl.constants.LAYOUT_CHOICES:
+            store = tacl.DataStore(':memory:')
+            store.add_ngrams(self._corpus, 1, 3, layout=layout)
+            store.add_ngrams(corpus, 1, 3)
+            expected_store = tacl.DataStore(':memory:')
+            expected_store.add_ngrams(corpus, 1, 3)
+            self.assertEqual(get_actual_rows(store),
+                             get_expected_rows(expected_store))
+        # A database with a suffix index has no statistics.
+        store = tacl.DataStore(':memory:')
+        store.add_ngrams(self._corpus, 1, 3,
+                         index=tacl.constants.INDEX_SUFFIX)
+        self.assertRaises(TACLError, store.ngram_stats,
+                          io.StringIO(newline=''))
+
+    def test_parallel_queries(self):
+        # Queries run in multiple processes give the same results as
+        # when run in one, and diff results are still in order of
+        # witness and size.
+        db_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, db_dir)
+        queries = (
+            lambda store, jobs: store.diff(
+                self._catalogue, self._tokenizer, io.StringIO(newline=''),
+                jobs=jobs),
+            lambda store, jobs: store.diff_asymmetric(
+                self._catalogue, 'A', self._tokenizer,
+                io.StringIO(newline=''), jobs=jobs),
+            lambda store, jobs: store.intersection(
+                self._catalogue, io.StringIO(newline=''), 2, jobs=jobs),
+            lambda store, jobs: store.intersection(
+                self._catalogue, io.StringIO(newline=''),
+                engine=tacl.constants.INTERSECT_ENGINE_GROUPED, jobs=jobs),
+            lambda store, jobs: store.intersection(
+                self._catalogue, io.StringIO(newline=''), jobs=jobs,
+                min_works=3, max_count=6, label_count=True,
+                label_work_count=True))
+        for layout in (tacl.constants.LAYOUT_HEAP,
+                       tacl.constants.LAYOUT_PARTITIONED):
+            db_path = os.path.join(db_dir, '{}.db'.format(layout))
+            store = tacl.DataStore(db_path)
+            store.add_ngrams(self._corpus, 1, 3, layout=layout)
+            store._conn.close()
+            store = tacl.DataStore(db_path, read_only=True)
+            for query in queries:
+                expected_rows = self._get_rows_from_csv(query(store, 1))
+                actual_rows = self._get_rows_from_csv(query(store, 3))
+                self.assertEqual(actual_rows[0], expected_rows[0])
+                self.assertEqual(sorted(actual_rows[1:]),
+                                 sorted(expected_rows[1:]))
+            rows = self._get_rows_from_csv(queries[0](store, 3))[1:]
+            keys = [(row[2], row[3], int(row[1])) for row in rows]
+            self.assertEqual(keys, sorted(keys))
+        self.assertRaises(MalformedQueryError, queries[0], self._store, 2)
+
+    def test_read_only(self):
+        # A read-only database can be queried, including by more than
+        # one store at once, without labelling witnesses in it.
+        db_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, db_dir)
+        db_path = os.path.join(db_dir, 'test.db')
+        store = tacl.DataStore(db_path)
+        store.add_ngrams(self._corpus, 1, 3)
+        store._conn.close()
+        queries = (
+            lambda store: store.counts(
+                self._catalogue, io.StringIO(newline='')),
+            lambda store: store.diff(
+                self._catalogue, self._tokenizer, io.StringIO(newline='')),
+            lambda store: store.diff_asymmetric(
+                self._catalogue, 'A', self._tokenizer,
+                io.StringIO(newline='')),
+            lambda store: store.intersection(
+                self._catalogue, io.StringIO(newline='')),
+            lambda store: store.search(
+                self._catalogue, ['t', 'the', 'we'], io.StringIO(newline='')))
+        stores = [tacl.DataStore(db_path, read_only=True, cache=True)
+                  for i in range(2)]
+        for query in queries:
+            expected_rows = self._get_rows_from_csv(query(self._store))
+            for store in stores:
+                actual_rows = self._get_rows_from_csv(query(store))
+                self.assertEqual(set(actual_rows), set(expected_rows))
+        labels = stores[0]._conn.execute(
+            'SELECT DISTINCT label FROM Text').fetchall()
+        self.assertEqual([row[0] for row in labels], [''])
+        self.assertFalse(stores[0]._uses_label_cache())
+        self.assertRaises(sqlite3.OperationalError, stores[0].add_ngrams,
+                          self._corpus, 1, 3)
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'),
+                         'requires pyarrow')
+    def test_results_formats(self):
+        # Results output in a binary format hold the same data as CSV
+        # results, and can be used as the input to supplied queries.
+        results_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, results_dir)
+        queries = (
+            lambda store, fh: store.counts(self._catalogue, fh),
+            lambda store, fh: store.diff(self._catalogue, self._tokenizer,
+                                         fh),
+            lambda store, fh: store.intersection(self._catalogue, fh),
+            lambda store, fh: store.search(self._catalogue, ['th', 'we'],
+                                           fh))
+        for results_format in (tacl.constants.RESULTS_FORMAT_PARQUET,
+                               tacl.constants.RESULTS_FORMAT_FEATHER):
+            store = tacl.DataStore(':memory:', results_format=results_format)
+            store.add_ngrams(self._corpus, 1, 3)
+            for query in queries:
+                expected_rows = self._get_rows_from_csv(
+                    query(self._store, io.StringIO(newline='')))
+                output_fh = query(store, io.BytesIO())
+                output_fh.seek(0)
+                self.assertEqual(tacl.results_io.detect_format(output_fh),
+                                 results_format)
+                matches = tacl.results_io.read_results(output_fh)
+                actual_rows = [tuple(matches.columns)] + [
+                    tuple(row) for row in
+                    matches.astype(str).itertuples(index=False)]
+                self.assertEqual(actual_rows[0], expected_rows[0])
+                self.assertEqual(set(actual_rows), set(expected_rows))
+            supplied = []
+            csv_supplied = []
+            for number, query in enumerate(queries[2:]):
+                path = os.path.join(results_dir, '{}-{}'.format(
+                    results_format, number))
+                with open(path, 'wb') as fh:
+                    query(store, fh)
+                supplied.append(path)
+                csv_path = path + '.csv'
+                with open(csv_path, 'w', encoding='utf-8', newline='') as fh:
+                    query(self._store, fh)
+                csv_supplied.append(csv_path)
+            expected_rows = self._get_rows_from_csv(
+                self._store.intersection_supplied(
+                    csv_supplied, ['A', 'B'], io.StringIO(newline='')))
+            actual_rows = self._get_rows_from_csv(
+                self._store.intersection_supplied(
+                    supplied, ['A', 'B'], io.StringIO(newline='')))
+            self.assertTrue(len(expected_rows) > 1)
+            self.assertEqual(set(actual_rows), set(expected_rows))
+
     def test_search(self):
         ngrams = ['the', 'seh', 'we']
         actual_rows = self._get_rows_from_csv(
@@ -327,6 +968,178 @@ class DataStoreIntegrationTestCase (TaclTestCase):
         ]
         self.assertEqual(set(actual_rows), set(expected_rows))
 
+    def test_search_duplicate_ngrams(self):
+        expected_rows = self._get_rows_from_csv(self._store.search(
+            self._catalogue, ['the', 'we'], io.StringIO(newline='')))
+        actual_rows = self._get_rows_from_csv(self._store.search(
+            self._catalogue, ['we', 'the', 'we'], io.StringIO(newline='')))
+        self.assertEqual(sorted(actual_rows), sorted(expected_rows))
+
+    def test_search_patterns(self):
+        patterns = ['*wen*', 'th?', '[sw]e*', '*e?t']
+        all_ngrams = [row['ngram'] for row in self._store._conn.execute(
+            'SELECT ngram FROM NGram')]
+        ngrams = [ngram for ngram in all_ngrams if any(
+            fnmatch.fnmatchcase(ngram, pattern) for pattern in patterns)]
+        expected_rows = self._get_rows_from_csv(self._store.search(
+            self._catalogue, ngrams, io.StringIO(newline='')))
+        self.assertTrue(len(expected_rows) > 1)
+        pattern_store = tacl.DataStore(':memory:')
+        pattern_store.add_ngrams(self._corpus, 1, 3, pattern_index=True)
+        self.assertEqual(pattern_store._get_setting(
+            tacl.constants.PATTERN_INDEX_SETTING), '1')
+        suffix_store = tacl.DataStore(':memory:')
+        suffix_store.add_ngrams(self._corpus, 1, 3,
+                                index=tacl.constants.INDEX_SUFFIX,
+                                pattern_index=True)
+        for store in (self._store, pattern_store, suffix_store):
+            actual_rows = self._get_rows_from_csv(store.search(
+                self._catalogue, patterns, io.StringIO(newline=''),
+                patterns=True))
+            self.assertEqual(sorted(actual_rows), sorted(expected_rows))
+        # Patterns matching no n-grams give no results.
+        actual_rows = self._get_rows_from_csv(pattern_store.search(
+            self._catalogue, ['*zzz*'], io.StringIO(newline=''),
+            patterns=True))
+        self.assertEqual(actual_rows, [tacl.constants.QUERY_FIELDNAMES])
+
+    def test_sorted_queries(self):
+        # Sorted query results are in the same order as sorted
+        # results.
+        supplied_dir = os.path.join(self._data_dir, 'supplied_input')
+        queries = (
+            lambda store, sort: store.diff(
+                self._catalogue, self._tokenizer, io.StringIO(newline=''),
+                sort=sort),
+            lambda store, sort: store.diff_asymmetric(
+                self._catalogue, 'A', self._tokenizer,
+                io.StringIO(newline=''), sort=sort),
+            lambda store, sort: store.intersection(
+                self._catalogue, io.StringIO(newline=''), sort=sort),
+            lambda store, sort: store.search(
+                self._catalogue, ['t', 'th', 'the', 'we', 'wen'],
+                io.StringIO(newline=''), sort=sort),
+            lambda store, sort: store.diff_supplied(
+                [os.path.join(supplied_dir, 'diff_input_{}.csv'.format(
+                    number)) for number in (1, 2, 3)],
+                ['A', 'B', 'C'], self._tokenizer, io.StringIO(newline=''),
+                sort=sort),
+            lambda store, sort: store.intersection_supplied(
+                [os.path.join(supplied_dir, 'intersect_input_{}.csv'.format(
+                    number)) for number in (1, 2, 3)],
+                ['A', 'B', 'C'], io.StringIO(newline=''), sort=sort))
+        partitioned_store = tacl.DataStore(':memory:')
+        partitioned_store.add_ngrams(
+            self._corpus, 1, 3, layout=tacl.constants.LAYOUT_PARTITIONED)
+        for query in queries:
+            for store in (self._store, partitioned_store):
+                output = query(store, False)
+                output.seek(0)
+                results = tacl.Results(output, self._tokenizer)
+                results.sort()
+                expected_rows = self._get_rows_from_results(results)
+                actual_rows = self._get_rows_from_csv(query(store, True))
+                self.assertEqual(actual_rows, expected_rows)
+
+    def test_upgrade(self):
+        # Create a database with the unversioned schema, holding the
+        # same data as the test database.
+        store = tacl.DataStore(':memory:')
+        store._conn.execute(
+            'CREATE TABLE Text (id INTEGER PRIMARY KEY ASC, '
+            'work TEXT NOT NULL, siglum TEXT NOT NULL, '
+            'checksum TEXT NOT NULL, token_count INTEGER NOT NULL, '
+            'label TEXT NOT NULL, UNIQUE (work, siglum))')
+        store._conn.execute(
+            'CREATE TABLE TextNGram (text INTEGER NOT NULL REFERENCES '
+            'Text (id), ngram TEXT NOT NULL, size INTEGER NOT NULL, '
+            'count INTEGER NOT NULL)')
+        store._conn.execute(tacl.constants.CREATE_TABLE_TEXTHASNGRAM_SQL)
+        store._conn.execute(tacl.constants.CREATE_INDEX_TEXTNGRAM_SQL)
+        store._conn.executemany(
+            'INSERT INTO Text VALUES (?, ?, ?, ?, ?, ?)',
+            self._store._conn.execute(
+                'SELECT id, work, siglum, checksum, token_count, label '
+                'FROM Text'))
+        store._conn.executemany(
+            'INSERT INTO TextNGram VALUES (?, ?, ?, ?)',
+            self._store._conn.execute(
+                'SELECT TextNGram.text, NGram.ngram, TextNGram.size, '
+                'TextNGram.count FROM TextNGram, NGram '
+                'WHERE NGram.id = TextNGram.ngram'))
+        store._conn.executemany(
+            'INSERT INTO TextHasNGram VALUES (?, ?, ?)',
+            self._store._conn.execute('SELECT * FROM TextHasNGram'))
+        self.assertEqual(store._get_database_version(), 0)
+        self.assertRaises(OutdatedDataStoreError, store.intersection,
+                          self._catalogue, io.StringIO(newline=''))
+        self.assertRaises(OutdatedDataStoreError, store.add_ngrams,
+                          self._corpus, 1, 3)
+        store.upgrade()
+        self.assertEqual(store._get_database_version(),
+                         tacl.constants.DATABASE_VERSION)
+        self.assertEqual(store._get_setting(tacl.constants.LAYOUT_SETTING),
+                         tacl.constants.LAYOUT_HEAP)
+        self.assertEqual(
+            store._conn.execute(
+                'SELECT COUNT(*) FROM TextSketch').fetchone()[0], 7)
+        self.assertEqual(
+            self._get_rows_from_csv(store.ngram_stats(
+                io.StringIO(newline=''))),
+            self._get_rows_from_csv(self._store.ngram_stats(
+                io.StringIO(newline=''))))
+        expected_rows = self._get_rows_from_csv(self._store.intersection(
+            self._catalogue, io.StringIO(newline='')))
+        actual_rows = self._get_rows_from_csv(store.intersection(
+            self._catalogue, io.StringIO(newline='')))
+        self.assertEqual(set(actual_rows), set(expected_rows))
+        tokenizer = tacl.Tokenizer(tacl.constants.TOKENIZER_PATTERN_CBETA,
+                                   tacl.constants.TOKENIZER_JOINER_CBETA)
+        expected_rows = self._get_rows_from_csv(self._store.diff(
+            self._catalogue, tokenizer, io.StringIO(newline='')))
+        actual_rows = self._get_rows_from_csv(store.diff(
+            self._catalogue, tokenizer, io.StringIO(newline='')))
+        self.assertEqual(set(actual_rows), set(expected_rows))
+        # The file stats of the witnesses are not known until they
+        # are validated.
+        query = 'SELECT work FROM Text WHERE file_size IS NOT NULL'
+        self.assertEqual(store._conn.execute(query).fetchall(), [])
+        self.assertTrue(store.validate(self._corpus, self._catalogue))
+        self.assertEqual(
+            sorted(row['work'] for row in store._conn.execute(query)),
+            ['T1', 'T1', 'T2', 'T2', 'T3', 'T5'])
+        # Upgrading an up to date database does nothing.
+        store.upgrade()
+        self.assertEqual(store._get_database_version(),
+                         tacl.constants.DATABASE_VERSION)
+
+    def test_validate_changed_file(self):
+        corpus_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, corpus_dir)
+        corpus_dir = os.path.join(corpus_dir, 'stripped')
+        shutil.copytree(os.path.join(self._data_dir, 'stripped'), corpus_dir)
+        corpus = tacl.Corpus(corpus_dir, self._tokenizer)
+        store = tacl.DataStore(':memory:')
+        store.add_ngrams(corpus, 1, 3)
+        corpus.get_witness = MagicMock(wraps=corpus.get_witness)
+        # No file is read when none has changed.
+        self.assertTrue(store.validate(corpus, self._catalogue))
+        corpus.get_witness.assert_not_called()
+        path = os.path.join(corpus_dir, 'T1', 'base.txt')
+        stat = os.stat(path)
+        # Changing the modification time but not the content is
+        # valid, and is recorded.
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertTrue(store.validate(corpus, self._catalogue))
+        corpus.get_witness.assert_called_once_with('T1', 'base')
+        corpus.get_witness.reset_mock()
+        self.assertTrue(store.validate(corpus, self._catalogue))
+        corpus.get_witness.assert_not_called()
+        # Changing the content is not.
+        with open(path, 'w', encoding='utf-8') as fh:
+            fh.write('then we sent\n')
+        self.assertFalse(store.validate(corpus, self._catalogue))
+
     def test_validate_missing_text(self):
         self._catalogue['missing'] = 'A'
         with self.assertRaises(FileNotFoundError):
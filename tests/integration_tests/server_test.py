@@ -0,0 +1,111 @@
+import io
+import os
+import os.path
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+import tacl
+from tacl.exceptions import MalformedQueryError, QueryServerError
+from ..tacl_test_case import TaclTestCase
+
+
+class QueryServerIntegrationTestCase (TaclTestCase):
+
+    def setUp(self):
+        self._tokenizer = tacl.Tokenizer(
+            tacl.constants.TOKENIZER_PATTERN_CBETA,
+            tacl.constants.TOKENIZER_JOINER_CBETA)
+        self._data_dir = os.path.join(os.path.dirname(__file__), 'data')
+        self._corpus = tacl.Corpus(os.path.join(self._data_dir, 'stripped'),
+                                   self._tokenizer)
+        self._catalogue = tacl.Catalogue()
+        self._catalogue.load(os.path.join(self._data_dir, 'catalogue.txt'))
+        db_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, db_dir)
+        self._db_name = os.path.join(db_dir, 'test.db')
+        store = tacl.DataStore(self._db_name, False)
+        store.add_ngrams(self._corpus, 1, 3)
+        self._expected = self._get_rows_from_csv(store.intersection(
+            self._catalogue, io.StringIO(newline='')))
+        store._conn.close()
+        self._start_server()
+
+    def _start_server(self):
+        # The server must open the database on the thread that it
+        # serves requests from.
+        started = threading.Event()
+
+        def serve():
+            store = tacl.DataStore(self._db_name, False, read_only=True)
+            self._server = tacl.QueryServer(('localhost', 0), store,
+                                            self._corpus)
+            started.set()
+            self._server.serve_forever()
+            self._server.server_close()
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+        started.wait()
+        self.addCleanup(thread.join)
+        self.addCleanup(self._server.shutdown)
+        self._client = tacl.QueryClient('http://localhost:{}/'.format(
+            self._server.server_address[1]))
+
+    def test_query_intersect(self):
+        for i in range(2):
+            actual_rows = self._get_rows_from_csv(self._client.query(
+                tacl.constants.QUERY_INTERSECT, self._db_name,
+                self._catalogue, io.StringIO(newline=''), validate=True))
+            self.assertEqual(set(actual_rows), set(self._expected))
+
+    def test_query_error(self):
+        self._catalogue = tacl.Catalogue({'T1': 'A'})
+        self.assertRaises(MalformedQueryError, self._client.query,
+                          tacl.constants.QUERY_INTERSECT,
+                          self._db_name, self._catalogue,
+                          io.StringIO(newline=''))
+
+    def test_query_missing_work(self):
+        # A catalogue naming a work that is not in the corpus fails
+        # validation on the server with an error that is not a
+        # TACLError, which is still reported to the client.
+        catalogue = tacl.Catalogue({'T1': 'A', 'T9': 'B'})
+        self.assertRaises(QueryServerError, self._client.query,
+                          tacl.constants.QUERY_INTERSECT, self._db_name,
+                          catalogue, io.StringIO(newline=''), validate=True)
+        # The server carries on serving queries.
+        actual_rows = self._get_rows_from_csv(self._client.query(
+            tacl.constants.QUERY_INTERSECT, self._db_name, self._catalogue,
+            io.StringIO(newline='')))
+        self.assertEqual(set(actual_rows), set(self._expected))
+
+    def test_query_truncated(self):
+        # An error after some of the results have been sent cuts the
+        # response short, which the client reports rather than
+        # returning the partial results.
+        def intersection(catalogue, output_fh, *args, **kwargs):
+            output_fh.write('ngram,size\r\n')
+            row = '{},1\r\n'.format('A' * 1024)
+            for i in range(2 * tacl.server._ResponseWriter.chunk_size //
+                           len(row)):
+                output_fh.write(row)
+            raise Exception('Query failed')
+
+        output_fh = io.StringIO(newline='')
+        with patch.object(self._server._store, 'intersection',
+                          side_effect=intersection):
+            self.assertRaises(QueryServerError, self._client.query,
+                              tacl.constants.QUERY_INTERSECT, self._db_name,
+                              self._catalogue, output_fh)
+        # The server carries on serving queries.
+        actual_rows = self._get_rows_from_csv(self._client.query(
+            tacl.constants.QUERY_INTERSECT, self._db_name, self._catalogue,
+            io.StringIO(newline='')))
+        self.assertEqual(set(actual_rows), set(self._expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
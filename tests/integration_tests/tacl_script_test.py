@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import json
 import os
 import shlex
 import sqlite3
@@ -49,8 +50,9 @@ class TaclScriptIntegrationTestCase (TaclTestCase):
         conn = sqlite3.connect(self._db_path)
         actual_rows = conn.execute(
             'SELECT Text.work, Text.siglum, Text.checksum, Text.label, '
-            'TextNGram.ngram, TextNGram.size, TextNGram.count '
-            'FROM Text, TextNGram WHERE Text.id = TextNGram.text').fetchall()
+            'NGram.ngram, TextNGram.size, TextNGram.count '
+            'FROM Text, TextNGram, NGram WHERE Text.id = TextNGram.text '
+            'AND NGram.id = TextNGram.ngram').fetchall()
         expected_rows = [
             ('T1', 'base', '705c89d665a5300516fe7314f84ebce0', '', 't', 1, 2),
             ('T1', 'base', '705c89d665a5300516fe7314f84ebce0', '', 'h', 1, 1),
@@ -183,8 +185,9 @@ class TaclScriptIntegrationTestCase (TaclTestCase):
         conn = sqlite3.connect(self._db_path)
         actual_rows = conn.execute(
             'SELECT Text.work, Text.siglum, Text.checksum, Text.label, '
-            'TextNGram.ngram, TextNGram.size, TextNGram.count '
-            'FROM Text, TextNGram WHERE Text.id = TextNGram.text').fetchall()
+            'NGram.ngram, TextNGram.size, TextNGram.count '
+            'FROM Text, TextNGram, NGram WHERE Text.id = TextNGram.text '
+            'AND NGram.id = TextNGram.ngram').fetchall()
         expected_rows = [
             ('T1', 'base', '705c89d665a5300516fe7314f84ebce0', '',
              'then', 1, 1),
@@ -387,6 +390,20 @@ class TaclScriptIntegrationTestCase (TaclTestCase):
             ('th', '2', 'T3', 'base', '1', 'C')]
         self.assertEqual(set(actual_rows), set(expected_rows))
 
+    def test_intersection_profile(self):
+        subprocess.call(self._ngrams_command_args)
+        with tempfile.TemporaryDirectory() as profile_dir:
+            profile_path = os.path.join(profile_dir, 'profile.json')
+            command = 'tacl intersect --profile {} {} {} {}'.format(
+                profile_path, self._db_path, self._corpus_dir,
+                self._catalogue_path)
+            actual_rows = self._get_rows_from_command(command)
+            with open(profile_path, encoding='utf-8') as fh:
+                profile = json.load(fh)
+        self.assertEqual([phase['name'] for phase in profile['phases']],
+                         ['validate', 'labels', 'query', 'output'])
+        self.assertEqual(profile['phases'][-1]['rows'], len(actual_rows) - 1)
+
     def test_intersection_supplied(self):
         supplied_dir = os.path.join(self._data_dir, 'supplied_input')
         results1 = os.path.join(supplied_dir, 'intersect_input_1.csv')
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import sqlite3
+import unittest
+from unittest.mock import patch
+
+import tacl
+from tacl.profiler import _get_db_status_function
+
+
+class QueryProfilerTestCase (unittest.TestCase):
+
+    def setUp(self):
+        self._conn = sqlite3.connect(':memory:')
+        self._conn.execute('CREATE TABLE Item (id INTEGER PRIMARY KEY)')
+        self._profiler = tacl.QueryProfiler(self._conn)
+
+    def test_add_plan(self):
+        query = 'SELECT id FROM Item WHERE id = ?'
+        plan = self._conn.execute('EXPLAIN QUERY PLAN ' + query,
+                                  [1]).fetchall()
+        self._profiler.add_plan(query, [1], plan)
+        plans = self._profiler.get_report()['query_plans']
+        self.assertEqual(len(plans), 1)
+        self.assertEqual(plans[0]['query'], query)
+        self.assertEqual(plans[0]['parameters'], ['1'])
+        self.assertEqual([row['detail'] for row in plans[0]['plan']],
+                         [row[3] for row in plan])
+
+    def test_get_report(self):
+        self._profiler.start_phase('first')
+        self._conn.execute('SELECT * FROM Item WHERE id = 1').fetchall()
+        self._conn.execute('SELECT * FROM Item WHERE id = 2').fetchall()
+        self._profiler.add_rows(2)
+        self._profiler.start_phase('second')
+        self._conn.execute('SELECT * FROM Item').fetchall()
+        self._profiler.add_rows(3)
+        report = self._profiler.get_report()
+        phases = report['phases']
+        self.assertEqual([phase['name'] for phase in phases],
+                         ['first', 'second'])
+        self.assertEqual([phase['rows'] for phase in phases], [2, 3])
+        self.assertEqual([phase['statements'] for phase in phases], [2, 1])
+        for phase in phases:
+            self.assertGreaterEqual(phase['wall_time'], 0)
+        self.assertEqual(report['sqlite_version'], sqlite3.sqlite_version)
+        self.assertGreaterEqual(report['wall_time'],
+                                sum(phase['wall_time'] for phase in phases))
+
+    def test_get_report_ended_phase(self):
+        # Rows added outside of a phase are not counted.
+        self._profiler.start_phase('first')
+        self._profiler.end_phase()
+        self._profiler.add_rows(2)
+        self._profiler.end_phase()
+        phases = self._profiler.get_report()['phases']
+        self.assertEqual(len(phases), 1)
+        self.assertEqual(phases[0]['rows'], 0)
+
+    def test_get_db_status_function_unchecked_version(self):
+        # The connection's layout is not relied upon in versions of
+        # CPython in which it has not been checked.
+        earliest, latest = \
+            tacl.constants.SQLITE_CONNECTION_LAYOUT_VERSIONS
+        for version in ((earliest[0], earliest[1] - 1), latest):
+            with patch('sys.version_info', version + (0, 'final', 0)):
+                self.assertIsNone(_get_db_status_function(self._conn))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+import importlib.util
+import io
+import sys
+import unittest
+from unittest.mock import patch
+
+import tacl
+from tacl.exceptions import TACLError
+from tacl.results_io import (ArrowResultsWriter, CSVResultsWriter,
+                             SortedResultsWriter, detect_format,
+                             get_label_results_writer, get_results_writer,
+                             read_results)
+from .tacl_test_case import TaclTestCase
+
+
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+
+class ResultsIOTestCase (TaclTestCase):
+
+    def setUp(self):
+        self._rows = [('AB', 2, 'T1', 'base', 4, 'A'),
+                      ('AB', 2, 'T2', 'a', 1, 'B'),
+                      ('ABC', 3, 'T1', 'base', 2, 'A')]
+
+    def _write(self, results_format, rows, **kwargs):
+        fh = io.BytesIO()
+        writer = ArrowResultsWriter(fh, tacl.constants.QUERY_FIELDNAMES,
+                                    results_format, **kwargs)
+        writer.writerows(rows)
+        writer.close()
+        fh.seek(0)
+        return fh
+
+    def test_detect_format_csv(self):
+        fh = self._create_csv(self._rows)
+        self.assertEqual(detect_format(fh), tacl.constants.RESULTS_FORMAT_CSV)
+        fh = io.BytesIO(fh.getvalue().encode('utf-8'))
+        self.assertEqual(detect_format(fh), tacl.constants.RESULTS_FORMAT_CSV)
+        self.assertEqual(fh.tell(), 0)
+
+    @unittest.skipUnless(HAS_PYARROW, 'requires pyarrow')
+    def test_detect_format_binary(self):
+        for results_format in (tacl.constants.RESULTS_FORMAT_FEATHER,
+                               tacl.constants.RESULTS_FORMAT_PARQUET):
+            fh = self._write(results_format, self._rows)
+            self.assertEqual(detect_format(fh), results_format)
+            self.assertEqual(fh.tell(), 0)
+            # A buffered stream that cannot seek is peeked at.
+            stream = io.BufferedReader(_UnseekableStream(fh.getvalue()))
+            self.assertEqual(detect_format(stream), results_format)
+
+    def test_get_results_writer_csv(self):
+        fh = io.StringIO(newline='')
+        writer = get_results_writer(fh, tacl.constants.QUERY_FIELDNAMES,
+                                    tacl.constants.RESULTS_FORMAT_CSV)
+        writer.writerow(self._rows[0])
+        writer.writerows(self._rows[1:])
+        writer.close()
+        expected_rows = [tuple(tacl.constants.QUERY_FIELDNAMES)] + [
+            tuple(str(item) for item in row) for row in self._rows]
+        self.assertEqual(self._get_rows_from_csv(fh), expected_rows)
+
+    def test_get_label_results_writer(self):
+        rows = self._rows + [('B', 1, 'T3', 'base', 7, 'C'),
+                             ('ABC', 3, 'T2', 'base', 2, 'A')]
+        for sort in (False, True):
+            fhs = {label: io.StringIO(newline='') for label in 'ABCD'}
+            writer = get_label_results_writer(
+                fhs, tacl.constants.QUERY_FIELDNAMES,
+                tacl.constants.RESULTS_FORMAT_CSV, sort)
+            writer.writerow(rows[0])
+            writer.writerows(rows[1:])
+            writer.close()
+            for label, fh in fhs.items():
+                label_rows = [row for row in rows if row[5] == label]
+                if sort:
+                    label_rows.sort(key=lambda row: (-row[1], row[0]))
+                expected_rows = [tuple(tacl.constants.QUERY_FIELDNAMES)] + [
+                    tuple(str(item) for item in row) for row in label_rows]
+                self.assertEqual(self._get_rows_from_csv(fh), expected_rows)
+
+    @unittest.skipUnless(HAS_PYARROW, 'requires pyarrow')
+    def test_read_results(self):
+        for results_format in (tacl.constants.RESULTS_FORMAT_FEATHER,
+                               tacl.constants.RESULTS_FORMAT_PARQUET):
+            # Batches smaller than the number of rows.
+            fh = self._write(results_format, self._rows, batch_size=2)
+            stream = io.BufferedReader(_UnseekableStream(fh.getvalue()))
+            matches = read_results(stream)
+            self.assertEqual(tuple(matches.columns),
+                             tacl.constants.QUERY_FIELDNAMES)
+            self.assertEqual(
+                [tuple(row) for row in matches.itertuples(index=False)],
+                self._rows)
+
+    @unittest.skipUnless(HAS_PYARROW, 'requires pyarrow')
+    def test_read_results_empty(self):
+        for results_format in (tacl.constants.RESULTS_FORMAT_FEATHER,
+                               tacl.constants.RESULTS_FORMAT_PARQUET):
+            matches = read_results(self._write(results_format, []))
+            self.assertTrue(matches.empty)
+            self.assertEqual(tuple(matches.columns),
+                             tacl.constants.QUERY_FIELDNAMES)
+
+    def test_pyarrow_missing(self):
+        with patch.dict(sys.modules, {'pyarrow': None}):
+            self.assertRaises(
+                TACLError, get_results_writer, io.BytesIO(),
+                tacl.constants.QUERY_FIELDNAMES,
+                tacl.constants.RESULTS_FORMAT_PARQUET)
+
+    @unittest.skipUnless(HAS_PYARROW, 'requires pyarrow')
+    def test_results_write(self):
+        tokenizer = tacl.Tokenizer(*tacl.constants.TOKENIZERS['cbeta'])
+        expected_rows = self._get_rows_from_results(
+            tacl.Results(self._create_csv(self._rows), tokenizer))
+        for results_format in (tacl.constants.RESULTS_FORMAT_FEATHER,
+                               tacl.constants.RESULTS_FORMAT_PARQUET):
+            results = tacl.Results(self._create_csv(self._rows), tokenizer)
+            fh = results.write(io.BytesIO(), results_format)
+            fh.seek(0)
+            actual_rows = self._get_rows_from_results(
+                tacl.Results(fh, tokenizer))
+            self.assertEqual(actual_rows, expected_rows)
+
+    def test_sorted_results_writer(self):
+        rows = self._rows + [('AB', 2, 'T1', 'a', 4, 'A'),
+                             ('B', 1, 'T3', 'base', 7, 'C'),
+                             ('ABC', 3, 'T2', 'base', 2, 'A'),
+                             ('ABC', 3, 'T1', 'base', 2, 'B')]
+        expected_rows = [tuple(tacl.constants.QUERY_FIELDNAMES)] + [
+            tuple(str(item) for item in row) for row in (
+                ('ABC', 3, 'T1', 'base', 2, 'A'),
+                ('ABC', 3, 'T2', 'base', 2, 'A'),
+                ('ABC', 3, 'T1', 'base', 2, 'B'),
+                ('AB', 2, 'T1', 'a', 4, 'A'),
+                ('AB', 2, 'T1', 'base', 4, 'A'),
+                ('AB', 2, 'T2', 'a', 1, 'B'),
+                ('B', 1, 'T3', 'base', 7, 'C'))]
+        # Both with all of the rows held in memory, and with runs of
+        # them spilled to temporary files.
+        for buffer_size in (100, 3, 1):
+            fh = io.StringIO(newline='')
+            writer = SortedResultsWriter(
+                CSVResultsWriter(fh, tacl.constants.QUERY_FIELDNAMES),
+                buffer_size)
+            writer.writerow(rows[0])
+            writer.writerows(rows[1:])
+            writer.close()
+            self.assertEqual(self._get_rows_from_csv(fh), expected_rows)
+
+    def test_sorted_results_writer_matches_results_sort(self):
+        tokenizer = tacl.Tokenizer(*tacl.constants.TOKENIZERS['cbeta'])
+        results = tacl.Results(self._create_csv(self._rows), tokenizer)
+        results.sort()
+        expected_rows = self._get_rows_from_results(results)
+        fh = io.StringIO(newline='')
+        writer = get_results_writer(fh, tacl.constants.QUERY_FIELDNAMES,
+                                    tacl.constants.RESULTS_FORMAT_CSV,
+                                    sort=True)
+        writer.writerows(self._rows)
+        writer.close()
+        self.assertEqual(self._get_rows_from_csv(fh), expected_rows)
+
+
+class _UnseekableStream (io.RawIOBase):
+
+    """Raw stream over `data` that, like a pipe, cannot seek."""
+
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._data.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+if __name__ == '__main__':
+    unittest.main()
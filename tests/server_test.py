@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+import http.client
+import io
+import unittest
+from unittest.mock import MagicMock, sentinel
+
+import tacl
+from tacl import constants
+from tacl.exceptions import MalformedQueryError, QueryServerError
+from .tacl_test_case import TaclTestCase
+
+
+class QueryServerTestCase (TaclTestCase):
+
+    def setUp(self):
+        self._store = MagicMock(spec=tacl.DataStore)
+        self._store._db_name = '/path/to/test.db'
+        self._corpus = MagicMock(spec_set=tacl.Corpus)
+        self._server = tacl.QueryServer(('localhost', 0), self._store,
+                                        self._corpus)
+        self.addCleanup(self._server.server_close)
+        self._parameters = {'db': '/path/to/test.db',
+                            'catalogue': {'T1': 'A', 'T2': 'B'}}
+
+    def test_run_query_database_mismatch(self):
+        self._parameters['db'] = '/path/to/other.db'
+        self.assertRaises(MalformedQueryError, self._server.run_query,
+                          constants.QUERY_COUNTS, self._parameters,
+                          sentinel.output_fh)
+        self._store.counts.assert_not_called()
+
+    def test_run_query_diff_asymmetric(self):
+        self._parameters.update({
+            'asymmetric': 'A', 'tokenizer': constants.TOKENIZER_CHOICE_LATIN,
+            'min_size': 2, 'max_size': 3})
+        self._server.run_query(constants.QUERY_DIFF, self._parameters,
+                               sentinel.output_fh)
+        self.assertEqual(self._store.diff_asymmetric.call_count, 1)
+        args = self._store.diff_asymmetric.call_args[0]
+        self.assertEqual(args[0], {'T1': 'A', 'T2': 'B'})
+        self.assertEqual(args[1], 'A')
+        self.assertEqual(args[2].joiner,
+                         constants.TOKENIZER_JOINER_LATIN)
+        self.assertEqual(args[3:], (sentinel.output_fh, 2, 3, 1))
+        self._store.diff.assert_not_called()
+
+    def test_run_query_intersect(self):
+        self._parameters['engine'] = constants.INTERSECT_ENGINE_GROUPED
+        self._parameters['jobs'] = 2
+        self._parameters['min_works'] = 2
+        self._parameters['sort'] = True
+        self._parameters['label_count'] = True
+        self._parameters['validate'] = True
+        self._server.run_query(constants.QUERY_INTERSECT,
+                               self._parameters, sentinel.output_fh)
+        self._store.validate.assert_called_once_with(
+            self._corpus, {'T1': 'A', 'T2': 'B'})
+        self._store.intersection.assert_called_once_with(
+            {'T1': 'A', 'T2': 'B'}, sentinel.output_fh, None, None,
+            constants.INTERSECT_ENGINE_GROUPED, 2, sort=True, min_works=2,
+            max_works=None, min_count=None, max_count=None, label_count=True,
+            label_work_count=False)
+
+    def test_run_query_missing_catalogue(self):
+        del self._parameters['catalogue']
+        self.assertRaises(MalformedQueryError, self._server.run_query,
+                          constants.QUERY_COUNTS, self._parameters,
+                          sentinel.output_fh)
+
+    def test_run_query_search(self):
+        self._parameters['ngrams'] = ['a b', 'c*']
+        self._parameters['patterns'] = True
+        self._server.run_query(constants.QUERY_SEARCH,
+                               self._parameters, sentinel.output_fh)
+        self._store.validate.assert_not_called()
+        self._store.search.assert_called_once_with(
+            {'T1': 'A', 'T2': 'B'}, ['a b', 'c*'], sentinel.output_fh, None,
+            None, True, sort=False, min_works=None, max_works=None,
+            min_count=None, max_count=None, label_count=False,
+            label_work_count=False)
+
+    def test_run_query_unknown(self):
+        self.assertRaises(MalformedQueryError, self._server.run_query,
+                          'upgrade', self._parameters, sentinel.output_fh)
+
+    def test_run_query_unknown_tokenizer(self):
+        self._parameters['tokenizer'] = 'klingon'
+        self.assertRaises(MalformedQueryError, self._server.run_query,
+                          constants.QUERY_DIFF, self._parameters,
+                          sentinel.output_fh)
+        self._store.diff.assert_not_called()
+
+
+class ResponseWriterTestCase (TaclTestCase):
+
+    def setUp(self):
+        self._handler = MagicMock()
+        self._handler.wfile = io.BytesIO()
+
+    def test_close(self):
+        output_fh = tacl.server._ResponseWriter(self._handler)
+        output_fh.write('a,b\r\n')
+        self.assertFalse(output_fh.started)
+        output_fh.close()
+        self._handler.send_response.assert_called_once_with(200)
+        self._handler.send_header.assert_any_call(
+            'Transfer-Encoding', 'chunked')
+        self.assertEqual(self._handler.wfile.getvalue(),
+                         b'5\r\na,b\r\n\r\n0\r\n\r\n')
+
+    def test_write_chunk(self):
+        output_fh = tacl.server._ResponseWriter(self._handler)
+        output_fh.chunk_size = 4
+        output_fh.write('ab')
+        self.assertEqual(self._handler.wfile.getvalue(), b'')
+        output_fh.write('c\u4e00')
+        self.assertTrue(output_fh.started)
+        self.assertEqual(self._handler.wfile.getvalue(),
+                         '6\r\nabc\u4e00\r\n'.encode('utf-8'))
+
+
+class _TruncatedResponse (io.BytesIO):
+
+    def read(self, *args):
+        raise http.client.IncompleteRead(b'a,b')
+
+    read1 = readinto = readinto1 = read
+
+
+class QueryClientTestCase (TaclTestCase):
+
+    def setUp(self):
+        self._urlopen = self._create_patch('urllib.request.urlopen')
+
+    def test_query(self):
+        self._urlopen.return_value = io.BytesIO('a,b\r\n'.encode('utf-8'))
+        client = tacl.QueryClient('http://localhost:1234/')
+        output_fh = io.StringIO(newline='')
+        catalogue = tacl.Catalogue({'T1': 'A'})
+        actual = client.query(constants.QUERY_INTERSECT, '/test.db',
+                              catalogue, output_fh, min_size=2)
+        self.assertEqual(actual, output_fh)
+        self.assertEqual(output_fh.getvalue(), 'a,b\r\n')
+        request = self._urlopen.call_args[0][0]
+        self.assertEqual(request.full_url, 'http://localhost:1234/intersect')
+
+    def test_query_disconnected(self):
+        self._urlopen.side_effect = http.client.RemoteDisconnected(
+            'Remote end closed connection without response')
+        client = tacl.QueryClient('http://localhost:1234/')
+        self.assertRaises(QueryServerError, client.query,
+                          constants.QUERY_INTERSECT, '/test.db',
+                          tacl.Catalogue({'T1': 'A'}),
+                          io.StringIO(newline=''))
+
+    def test_query_truncated(self):
+        self._urlopen.return_value = _TruncatedResponse()
+        client = tacl.QueryClient('http://localhost:1234/')
+        self.assertRaises(QueryServerError, client.query,
+                          constants.QUERY_INTERSECT, '/test.db',
+                          tacl.Catalogue({'T1': 'A'}),
+                          io.StringIO(newline=''))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import tacl
+
+
+class NGramSketchTestCase (unittest.TestCase):
+
+    def test_bytes(self):
+        sketch = tacl.NGramSketch.new(10)
+        sketch.add(['ab', 'bc'])
+        copy = tacl.NGramSketch(sketch.to_bytes())
+        self.assertEqual(copy.to_bytes(), sketch.to_bytes())
+        self.assertEqual(len(copy), len(sketch))
+
+    def test_estimate_count(self):
+        sketch = tacl.NGramSketch.new(1000)
+        sketch.add('{} {}'.format(number, number * 7)
+                   for number in range(1000))
+        self.assertAlmostEqual(sketch.estimate_count(), 1000, delta=100)
+
+    def test_intersection(self):
+        first = tacl.NGramSketch.new(10)
+        first.add(['ab', 'bc'])
+        second = tacl.NGramSketch.new(10)
+        second.add(['cd', 'de'])
+        self.assertTrue(first.intersection(second).is_empty())
+        second.add(['bc'])
+        self.assertFalse(first.intersection(second).is_empty())
+
+    def test_intersection_folded(self):
+        # Sketches of different sizes are compared at the smaller
+        # size, with the same result as sketches of that size.
+        small = tacl.NGramSketch.new(10)
+        small.add(['ab'])
+        large = tacl.NGramSketch.new(10000)
+        large.add(['ab', 'bc'])
+        self.assertGreater(len(large), len(small))
+        expected = tacl.NGramSketch.new(10)
+        expected.add(['ab', 'bc'])
+        self.assertEqual(large.intersection(small).to_bytes(),
+                         small.to_bytes())
+        self.assertEqual(small.union(large).to_bytes(), expected.to_bytes())
+
+    def test_new(self):
+        self.assertEqual(len(tacl.NGramSketch.new(0)), 8192)
+        self.assertEqual(len(tacl.NGramSketch.new(1025)), 16384)
+        self.assertTrue(tacl.NGramSketch.new(10).is_empty())
+
+
+if __name__ == '__main__':
+    unittest.main()
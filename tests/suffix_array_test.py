@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import collections
+import unittest
+
+import tacl
+
+
+class SuffixArrayTestCase (unittest.TestCase):
+
+    def _get_ngrams(self, tokens, size):
+        suffix_array = tacl.SuffixArray(tokens)
+        return collections.Counter({
+            tuple(tokens[position:position + size]): count
+            for position, count in suffix_array.get_ngram_counts(size)})
+
+    def test_bytes(self):
+        suffix_array = tacl.SuffixArray([3, 1, 2, 1, 2])
+        data = suffix_array.to_bytes()
+        copy = tacl.SuffixArray.from_bytes(*data)
+        self.assertEqual(list(copy.get_tokens()), [3, 1, 2, 1, 2])
+        self.assertEqual(list(copy.get_ngram_counts(2)),
+                         list(suffix_array.get_ngram_counts(2)))
+
+    def test_generate_lcp(self):
+        tokens = list('banana')
+        suffixes = [5, 3, 1, 0, 4, 2]
+        self.assertEqual(tacl.SuffixArray._generate_lcp(tokens, suffixes),
+                         [0, 1, 3, 0, 0, 2])
+
+    def test_generate_suffixes(self):
+        data = (
+            ([], []),
+            (['a'], [0]),
+            (list('banana'), [5, 3, 1, 0, 4, 2]),
+            (list('aaaa'), [3, 2, 1, 0]),
+            ([2, 1, 2, 1, 2], [3, 1, 4, 2, 0]),
+        )
+        for tokens, expected_suffixes in data:
+            actual_suffixes = tacl.SuffixArray._generate_suffixes(tokens)
+            self.assertEqual(actual_suffixes, expected_suffixes)
+
+    def test_get_ngram_counts(self):
+        tokens = list('thenwewentwe')
+        for size in range(1, len(tokens) + 2):
+            expected_ngrams = collections.Counter(
+                [tuple(tokens[index:index + size])
+                 for index in range(len(tokens) - size + 1)])
+            self.assertEqual(self._get_ngrams(tokens, size), expected_ngrams)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -40,6 +40,47 @@ class TextTestCase (TaclTestCase):
         actual_ngrams = list(text.get_ngrams(3, 4))
         self.assertEqual(actual_ngrams, expected_ngrams)
 
+    def test_get_ngram_batches(self):
+        content = '阿闍世[(禾*尤)\n/上/日]首'
+        text = tacl.Text(content, self._tokenizer)
+        expected_batches = [
+            [(2, 0, '阿闍'), (2, 1, '闍世'), (3, 0, '阿闍世'),
+             (3, 1, '闍世[(禾*尤)/上/日]')],
+            [(2, 2, '世[(禾*尤)/上/日]'), (2, 3, '[(禾*尤)/上/日]首'),
+             (3, 2, '世[(禾*尤)/上/日]首')]
+        ]
+        actual_batches = list(text.get_ngram_batches(1, 3, [1], 5))
+        self.assertEqual(actual_batches, expected_batches)
+
+    def test_get_ngrams_pagel(self):
+        content = "bka' stsal pa  | rigs kyi\nbu dag"
+        tokenizer = tacl.Tokenizer(tacl.constants.TOKENIZER_PATTERN_PAGEL,
+                                   tacl.constants.TOKENIZER_JOINER_PAGEL)
+        text = tacl.Text(content, tokenizer)
+        expected_ngrams = [
+            (1, collections.Counter(
+                ["bka'", 'stsal', 'pa', 'rigs', 'kyi', 'bu', 'dag'])),
+            (3, collections.Counter(
+                ["bka' stsal pa", 'stsal pa rigs', 'pa rigs kyi',
+                 'rigs kyi bu', 'kyi bu dag']))
+        ]
+        actual_ngrams = list(text.get_ngrams(1, 3, [2]))
+        self.assertEqual(actual_ngrams, expected_ngrams)
+
+    def test_get_ngrams_skip_sizes(self):
+        content = '阿闍世[(禾*尤)\n/上/日]首'
+        text = tacl.Text(content, self._tokenizer)
+        expected_ngrams = [
+            (2, collections.Counter(
+                ['阿闍', '闍世', '世[(禾*尤)/上/日]', '[(禾*尤)/上/日]首'])),
+            (4, collections.Counter(
+                ['阿闍世[(禾*尤)/上/日]', '闍世[(禾*尤)/上/日]首'])),
+            (6, collections.Counter())
+        ]
+        actual_ngrams = list(text.get_ngrams(1, 6, [1, 3, 5]))
+        self.assertEqual(actual_ngrams, expected_ngrams)
+        self.assertEqual(list(text.get_ngrams(2, 3, [2, 3])), [])
+
     def test_get_token_content_cbeta(self):
         content = '阿闍世[(禾*尤)\n/上/日]首佛足。敬強阿闍世耶。又'
         text = tacl.WitnessText('test', 'base', content, self._tokenizer)
@@ -94,6 +135,14 @@ class WitnessTextTestCase (TaclTestCase):
         expected_checksum = 'a94e3a20bc95a93710487611e65484d1'
         self.assertEqual(actual_checksum, expected_checksum)
 
+    def test_get_file_stat(self):
+        text = tacl.WitnessText('test', 'base', 'test content',
+                                self._tokenizer)
+        self.assertEqual(text.get_file_stat(), (None, None))
+        text = tacl.WitnessText('test', 'base', 'test content',
+                                self._tokenizer, file_stat=(12, 1000))
+        self.assertEqual(text.get_file_stat(), (12, 1000))
+
     def test_get_filename(self):
         text = tacl.WitnessText('test', 'base', 'test content',
                                 self._tokenizer)